@@ -0,0 +1,104 @@
+"""
+Аналитические сессии пользователей для user_actions.session_id.
+
+Сессия - последовательность действий пользователя без перерыва дольше
+ANALYTICS_SESSION_TIMEOUT_MIN минут. Состояние - ограниченный LRU словарь
+в памяти; при ANALYTICS_SESSIONS_PERSIST=True сессии дополнительно пишутся
+в хранилище состояний (state_store), чтобы переживать рестарт и быть общими
+для воркеров.
+
+ID сессии компактный и уникальный: "<user_id hex>-<начало сессии hex>".
+"""
+
+import os
+import time
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_SESSION_TIMEOUT_MIN = int(os.getenv('ANALYTICS_SESSION_TIMEOUT_MIN', '30'))
+ANALYTICS_SESSIONS_MAX_USERS = int(os.getenv('ANALYTICS_SESSIONS_MAX_USERS', '50000'))
+ANALYTICS_SESSIONS_PERSIST = os.getenv('ANALYTICS_SESSIONS_PERSIST', 'False') == 'True'
+
+# Пространство ключей в state_store
+ANALYTICS_SESSION = 'a'
+
+
+def make_session_id(user_id: int, started_at: float) -> str:
+    return f"{int(user_id):x}-{int(started_at):x}"
+
+
+class SessionTracker:
+    def __init__(self, timeout_sec: int = ANALYTICS_SESSION_TIMEOUT_MIN * 60,
+                 max_users: int = ANALYTICS_SESSIONS_MAX_USERS, store=None):
+        self.timeout_sec = timeout_sec
+        self.max_users = max_users
+        self.store = store
+        # user_id -> (session_id, время последнего действия)
+        self._sessions: "OrderedDict[int, tuple[str, float]]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def touch(self, user_id: int, now: Optional[float] = None) -> str:
+        """
+        Return the user's current session id, starting a new session after
+        an inactivity gap. Pure in-memory, no I/O.
+        """
+        now = time.time() if now is None else now
+        current = self._sessions.get(user_id)
+        if current is not None and now - current[1] < self.timeout_sec:
+            session_id = current[0]
+        else:
+            session_id = make_session_id(user_id, now)
+
+        self._sessions[user_id] = (session_id, now)
+        self._sessions.move_to_end(user_id)
+        if len(self._sessions) > self.max_users:
+            self._sessions.popitem(last=False)
+        return session_id
+
+    async def get_session_id(self, user_id: int) -> str:
+        """
+        Same as touch(), but with the optional shared store: a session started
+        on another worker or before a restart is continued instead of split.
+        """
+        if self.store is None:
+            return self.touch(user_id)
+
+        now = time.time()
+        if user_id not in self._sessions:
+            try:
+                saved = await self.store.get(ANALYTICS_SESSION, user_id)
+                if saved:
+                    self._sessions[user_id] = (saved[0], saved[1])
+            except Exception as e:
+                logger.debug(f"Не удалось прочитать сессию пользователя {user_id}: {e}")
+
+        session_id = self.touch(user_id, now)
+        try:
+            await self.store.set(ANALYTICS_SESSION, user_id, [session_id, now], ttl=self.timeout_sec)
+        except Exception as e:
+            logger.debug(f"Не удалось сохранить сессию пользователя {user_id}: {e}")
+        return session_id
+
+
+_tracker: Optional[SessionTracker] = None
+
+
+def get_session_tracker() -> SessionTracker:
+    global _tracker
+    if _tracker is None:
+        store = None
+        if ANALYTICS_SESSIONS_PERSIST:
+            from state_store import get_state_store
+            store = get_state_store()
+        _tracker = SessionTracker(store=store)
+    return _tracker
+
+
+async def get_session_id(user_id: int) -> str:
+    """Analytics session id for the user's current action"""
+    return await get_session_tracker().get_session_id(user_id)
@@ -0,0 +1 @@
+"""Бенчмарки бота: запускаются вручную через python -m benchmarks.<name>"""
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк обработки callback_data: поиск маршрута + сборка экрана.
+
+Сравнивает прежнюю схему (цепочка if/elif по query.data и сборка
+клавиатуры и текста на каждое нажатие, с циклом по get_admin_ids())
+с CallbackRouter и заранее собранными экранами из screens.py.
+Сеть не участвует: меряется только CPU на одно нажатие.
+
+    python -m benchmarks.bench_callback_router
+    python -m benchmarks.bench_callback_router --number 200000
+"""
+
+import os
+import json
+import timeit
+import argparse
+
+os.environ.setdefault('TELEGRAM_TOKEN', '123456:BENCHMARK')
+os.environ.setdefault('ADMIN_USER_IDS', '1,2,3')
+os.environ.setdefault('SUPPORT_LINK', 'https://t.me/support')
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import SUPPORT_LINK, get_admin_ids, is_test_mode, is_using_one_dollar_prices
+from screens import get_screen
+
+CHECKOUT_URL = 'https://checkout.stripe.com/c/pay/cs_test_benchmark'
+
+# Порядок веток прежнего button_handler
+LEGACY_CHAIN = (
+    ('plan_500',), ('admin__toggle_stripe_mode', 'admin__refresh_stripe_status'),
+    ('admin__toggle_live_prices', 'admin__refresh_live_prices'), ('plan_30',),
+    ('PAYMENT_RUSSIA_30',), ('PAYMENT_RUSSIA_500',), ('more_about_plan_30',),
+    ('back_to_start_from_plan_30',), ('back_to_start_from_plan_500',),
+    ('back_to_plan_30_from_russia_payment',), ('back_to_plan_30_from_details',),
+    ('back_to_plan_500_from_russia_payment',), ('to_start_from_admin_panel',), ('admin',),
+    'premium_users_page_', ('admin__stats',), ('admin__test_mode',), ('admin__live_prices',),
+)
+
+# callback_data -> экран, который он показывает
+SCENARIOS = {
+    'plan_30': 'plan_30',
+    'back_to_start_from_plan_30': 'start',
+    'to_start_from_admin_panel': 'start',
+    'back_to_plan_500_from_russia_payment': 'plan_500_back',
+    'premium_users_page_3': None,
+    'admin__stats': None,
+}
+
+
+def legacy_start_keyboard(user_id):
+    keyboard = [
+        [InlineKeyboardButton("План питания за 29$", callback_data="plan_30")],
+        [InlineKeyboardButton("Личное ведение за 490$", callback_data="plan_500")],
+        [InlineKeyboardButton("Связаться с менеджером", url=SUPPORT_LINK)],
+    ]
+    for admin_id in get_admin_ids():
+        if str(user_id) == str(admin_id):
+            keyboard.append([InlineKeyboardButton("⚙️ Админ панель", callback_data="admin")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+def legacy_plan_30(user_id):
+    if is_test_mode():
+        price_text = "<b>🧪 ТЕСТОВЫЙ РЕЖИМ - Обычная цена: $149. Сейчас — $29 для первых 100 клиентов.</b>\n\n"
+    elif is_using_one_dollar_prices():
+        price_text = "<b>🔥 ТЕСТ $1 - Обычная цена: $149. Сейчас — $1 для тестирования функций.</b>\n\n"
+    else:
+        price_text = "<b>Обычная цена: $149. Сейчас — $29 для первых 100 клиентов.</b>\n\n"
+    keyboard = [
+        [
+            InlineKeyboardButton("Подробнее", callback_data='more_about_plan_30'),
+            InlineKeyboardButton("🇪🇺🇺🇦🇧🇾 Оплата | Европа, Украина, Белорусь", url=CHECKOUT_URL),
+            InlineKeyboardButton("🇷🇺 Оплата | Россия", callback_data='PAYMENT_RUSSIA_30')],
+        [InlineKeyboardButton("Связаться с менеджером", url=SUPPORT_LINK)],
+        [InlineKeyboardButton("Назад", callback_data="back_to_start_from_plan_30")]
+    ]
+    text = price_text + "План питания на 30 дней под все ваши потребности + курс из 5 модулей по похудению."
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+def legacy_plan_500_back(user_id):
+    keyboard = [
+        [
+            InlineKeyboardButton("🇪🇺🇺🇦🇧🇾 Оплата | Европа, Украина, Белорусь", url=CHECKOUT_URL),
+            InlineKeyboardButton("🇷🇺 Оплата | Россия", callback_data='PAYMENT_RUSSIA_500')
+        ],
+        [InlineKeyboardButton("Связаться с менеджером", url=SUPPORT_LINK)],
+        [InlineKeyboardButton("Назад", callback_data="back_to_start_from_plan_500")]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+
+def legacy_back_keyboard(user_id):
+    return InlineKeyboardMarkup([[InlineKeyboardButton("Назад", callback_data="admin")]])
+
+
+LEGACY_RENDERERS = {
+    'plan_30': legacy_plan_30,
+    'back_to_start_from_plan_30': legacy_start_keyboard,
+    'to_start_from_admin_panel': legacy_start_keyboard,
+    'back_to_plan_500_from_russia_payment': legacy_plan_500_back,
+    'premium_users_page_': lambda user_id: None,
+    'admin__stats': legacy_back_keyboard,
+}
+
+
+def legacy_dispatch(data, user_id):
+    for branch in LEGACY_CHAIN:
+        if isinstance(branch, str):
+            if data.startswith(branch):
+                return LEGACY_RENDERERS[branch](user_id)
+        elif data in branch:
+            return LEGACY_RENDERERS[data](user_id)
+    return None
+
+
+def router_dispatch(router, data, user_id):
+    handler, arg = router.resolve(data)
+    name = SCENARIOS[data]
+    if name is None:
+        return handler
+    screen = get_screen(name, user_id)
+    return screen.render(CHECKOUT_URL) if screen.checkout_plan else screen.reply_markup
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Callback dispatch + render cost per button press")
+    parser.add_argument('--number', type=int, default=50000, help="Calls per scenario")
+    parser.add_argument('--json', action='store_true', help="Print the result as JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # Маршруты берём из настоящего бота
+    from telegram_bot import callback_router
+
+    user_id = 1
+    results = []
+    for data in SCENARIOS:
+        legacy = min(timeit.repeat(lambda: legacy_dispatch(data, user_id), number=args.number, repeat=3))
+        routed = min(timeit.repeat(lambda: router_dispatch(callback_router, data, user_id), number=args.number, repeat=3))
+        results.append({
+            'callback': data,
+            'legacy_us': round(legacy / args.number * 1e6, 2),
+            'router_us': round(routed / args.number * 1e6, 2),
+        })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'callback':<40}{'if/elif + build':>18}{'router + screens':>18}")
+        for result in results:
+            print(f"{result['callback']:<40}{result['legacy_us']:>15} us{result['router_us']:>15} us")
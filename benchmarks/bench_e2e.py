@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+Сквозной бенчмарк: настоящий main.app против фейковых Telegram, Stripe и PostgREST.
+
+Фейки (benchmarks/fakes.py) поднимаются в отдельном процессе, бот
+направляется на них через окружение (TELEGRAM_API_BASE_URL, SUPABASE_URL,
+STRIPE_API_BASE), после чего сценарии гоняются через /webhook и
+/stripe_webhook из нескольких потоков, как gunicorn --threads:
+
+    start_storm     /start от каждого пользователя
+    plan_browsing   plan_30 -> подробнее -> назад -> plan_500 -> назад
+    payments        подписанные вебхуки checkout.session.completed (выдача файлов)
+    admin_stats     админ открывает панель и статистику кликов
+
+Задержка обновления - от POST /webhook до конца обработки в event loop,
+платежа - время ответа /stripe_webhook. Для каждого сценария: пропускная
+способность, p50/p95/p99, ошибки в логе, исходящие вызовы по эндпоинтам и
+пиковый RSS процесса бота. Результат пишется в JSON, чтобы сравнивать прогоны:
+
+    python -m benchmarks.bench_e2e --users 200 --out before.json
+    python -m benchmarks.bench_e2e --users 200 --out after.json
+    python -m benchmarks.bench_e2e --compare before.json after.json
+"""
+
+import os
+import sys
+import hmac
+import json
+import time
+import socket
+import hashlib
+import logging
+import argparse
+import resource
+import tempfile
+import platform
+import subprocess
+import urllib.request
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from benchmarks.fakes import make_callback_update, make_message_update, start_in_process
+
+SCENARIOS = ('start_storm', 'plan_browsing', 'payments', 'admin_stats')
+
+BROWSING_PATH = [
+    'plan_30', 'more_about_plan_30', 'back_to_plan_30_from_details', 'back_to_start_from_plan_30',
+    'plan_500', 'back_to_start_from_plan_500',
+]
+
+ADMIN_ID = 999000001
+FIRST_USER_ID = 200000000
+PRICE_ID_30 = 'price_bench_30'
+WEBHOOK_SECRET = 'whsec_benchmark'
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _get_stats(port: int) -> dict:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/__stats", timeout=30) as response:
+        return json.loads(response.read())
+
+
+def _wait_ready(port: int, timeout: float = 60.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return _get_stats(port)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss в килобайтах на Linux и в байтах на macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+
+    return {'p50': rank(0.50), 'p95': rank(0.95), 'p99': rank(0.99), 'max': round(ordered[-1] * 1000, 1)}
+
+
+def _diff(after: Dict[str, int], before: Dict[str, int]) -> Dict[str, int]:
+    return {key: value - before.get(key, 0) for key, value in sorted(after.items()) if value - before.get(key, 0)}
+
+
+class ErrorCounter(logging.Handler):
+    """Counts ERROR records of the bot; processing errors never reach the HTTP response"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+        self.samples: List[str] = []
+
+    def emit(self, record: logging.LogRecord):
+        self.count += 1
+        if len(self.samples) < 5:
+            self.samples.append(f"{record.name}: {record.getMessage()[:200]}")
+
+
+class Outbound:
+    """Request counters of all fakes, diffed around a scenario"""
+
+    def __init__(self, ports: Dict[str, int]):
+        self.ports = ports
+        self.before: Dict[str, Dict[str, int]] = {}
+
+    def mark(self):
+        self.before = {name: _get_stats(port)['requests'] for name, port in self.ports.items()}
+
+    def since_mark(self) -> Dict[str, Dict[str, int]]:
+        return {name: _diff(_get_stats(port)['requests'], self.before.get(name, {}))
+                for name, port in self.ports.items()}
+
+
+def start_storm_payloads(users: int, update_ids) -> List[List[str]]:
+    return [
+        [json.dumps(make_message_update(next(update_ids), FIRST_USER_ID + i, '/start'))]
+        for i in range(users)
+    ]
+
+
+def plan_browsing_payloads(users: int, update_ids) -> List[List[str]]:
+    return [
+        [json.dumps(make_callback_update(next(update_ids), FIRST_USER_ID + i, data)) for data in BROWSING_PATH]
+        for i in range(users)
+    ]
+
+
+def admin_stats_payloads(repeats: int, update_ids) -> List[List[str]]:
+    return [[
+        json.dumps(make_callback_update(next(update_ids), ADMIN_ID, data))
+        for _ in range(repeats) for data in ('admin', 'admin__stats')
+    ]]
+
+
+def checkout_completed_event(index: int, user_id: int) -> Dict[str, Any]:
+    """checkout.session.completed without line_items: the bot fetches the price from (fake) Stripe"""
+    return {
+        'id': f"evt_bench_{index}",
+        'object': 'event',
+        'type': 'checkout.session.completed',
+        'livemode': False,
+        'data': {'object': {
+            'id': f"cs_test_event_{index}",
+            'object': 'checkout.session',
+            'livemode': False,
+            'amount_total': 2900,
+            'currency': 'usd',
+            'payment_status': 'paid',
+            'status': 'complete',
+            'payment_method_types': ['card'],
+            'customer_details': {'email': f"bench{index}@example.com", 'name': 'Bench User'},
+            'metadata': {'telegram_user_id': str(user_id), 'telegram_username': 'bench', 'plan_type': '30'},
+            'custom_fields': [],
+        }},
+    }
+
+
+def stripe_signature(payload: str, secret: str = WEBHOOK_SECRET) -> str:
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def run_webhook_scenario(web, name: str, sequences: List[List[str]], threads: int,
+                         timeout: float = 120.0) -> Dict[str, Any]:
+    """POST every sequence in order (one user per sequence) and wait until the loop has processed all"""
+    latencies: List[float] = []
+    original = web.process_telegram_update
+
+    def timed(data):
+        received = time.perf_counter()
+
+        async def run():
+            try:
+                await original(data)
+            finally:
+                latencies.append(time.perf_counter() - received)
+        return run()
+
+    total = sum(len(sequence) for sequence in sequences)
+    http_errors = []
+
+    def post(chunk: List[List[str]]):
+        client = web.app.test_client()
+        for sequence in chunk:
+            for payload in sequence:
+                response = client.post('/webhook', data=payload, content_type='application/json')
+                if response.status_code != 200:
+                    http_errors.append(response.status_code)
+
+    # dispatch_telegram_update берёт process_telegram_update из глобалов main
+    web.process_telegram_update = timed
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(post, [sequences[i::threads] for i in range(threads)]))
+        # Вебхук отвечает сразу - ждём конца обработки, пока счётчик растёт
+        done, last_change = 0, time.monotonic()
+        while len(latencies) < total and time.monotonic() - last_change < timeout:
+            time.sleep(0.02)
+            if len(latencies) != done:
+                done, last_change = len(latencies), time.monotonic()
+        elapsed = time.perf_counter() - started
+    finally:
+        web.process_telegram_update = original
+
+    return {
+        'scenario': name,
+        'requests': total,
+        'completed': len(latencies),
+        'http_errors': len(http_errors),
+        'wall_time_sec': round(elapsed, 2),
+        'throughput_per_sec': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'latency_ms': _percentiles(latencies),
+    }
+
+
+def run_payments_scenario(web, payments: int, threads: int) -> Dict[str, Any]:
+    events = [json.dumps(checkout_completed_event(i, FIRST_USER_ID + i)) for i in range(payments)]
+    latencies: List[float] = []
+    failed: List[int] = []
+
+    def post(chunk: List[str]):
+        client = web.app.test_client()
+        for payload in chunk:
+            started = time.perf_counter()
+            response = client.post('/stripe_webhook', data=payload, content_type='application/json',
+                                   headers={'Stripe-Signature': stripe_signature(payload)})
+            latencies.append(time.perf_counter() - started)
+            body = response.get_json(silent=True) or {}
+            if response.status_code != 200 or body.get('status') == 'error':
+                failed.append(response.status_code)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(post, [events[i::threads] for i in range(threads)]))
+    elapsed = time.perf_counter() - started
+    return {
+        'scenario': 'payments',
+        'requests': payments,
+        'completed': payments - len(failed),
+        'http_errors': len(failed),
+        'wall_time_sec': round(elapsed, 2),
+        'throughput_per_sec': round(payments / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': _percentiles(latencies),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of main.app against local fakes")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--payments', type=int, default=8, help="Each one sends the course files (~5 s of sleeps)")
+    parser.add_argument('--admin-repeats', type=int, default=20)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--threads', type=int, default=4, help="gunicorn --threads")
+    parser.add_argument('--telegram-latency-ms', type=float, default=30.0)
+    parser.add_argument('--postgrest-latency-ms', type=float, default=15.0)
+    parser.add_argument('--stripe-latency-ms', type=float, default=150.0)
+    parser.add_argument('--out', help="Write results to this JSON file")
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help="Compare two result files and exit")
+    parser.add_argument('--json', action='store_true', help="Print the result as JSON")
+    return parser.parse_args(argv)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def main(args) -> Dict[str, Any]:
+    scenarios = [name for name in args.scenarios.split(',') if name]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    ports = {'telegram': _free_port(), 'postgrest': _free_port(), 'stripe': _free_port()}
+    process = start_in_process(ports['telegram'], ports['postgrest'], {
+        'users': 0,
+        'telegram_latency_ms': args.telegram_latency_ms,
+        'postgrest_latency_ms': args.postgrest_latency_ms,
+        'stripe_latency_ms': args.stripe_latency_ms,
+        'stripe_price_id': PRICE_ID_30,
+    }, ports['stripe'])
+
+    try:
+        for port in ports.values():
+            _wait_ready(port)
+        os.environ.update({
+            'TELEGRAM_TOKEN': '123456:BENCHMARK',
+            'TELEGRAM_API_BASE_URL': f"http://127.0.0.1:{ports['telegram']}/bot",
+            'TELEGRAM_UPDATES_MODE': 'webhook',
+            'WORKER_PROCESSES': '1',
+            'SUPABASE_URL': f"http://127.0.0.1:{ports['postgrest']}",
+            'SUPABASE_ANON_KEY': 'benchmark',
+            'SUPABASE_SERVICE_ROLE': 'benchmark',
+            'STRIPE_API_BASE': f"http://127.0.0.1:{ports['stripe']}",
+            'STRIPE_IS_TEST_MODE_ON': 'True',
+            'STRIPE_TEST_API_KEY': 'sk_test_benchmark',
+            'STRIPE_TEST_WEBHOOK_SECRET': WEBHOOK_SECRET,
+            'PRICE_ID_TEST_29': PRICE_ID_30,
+            'PRICE_ID_TEST_490': 'price_bench_500',
+            'ADMIN_USER_IDS': str(ADMIN_ID),
+            # Видео уходит по file_id: start.mp4 в репозитории нет
+            'START_VIDEO_FILE_ID': 'bench-start-video',
+            'TRACE_FILE': os.path.join(tempfile.mkdtemp(prefix='e2e_bench_'), 'traces.jsonl'),
+        })
+        for name in ('SUPABASE_POSTGRES_URL', 'STATE_STORE_URL', 'HEROKU_API_KEY', 'HEROKU_APP_NAME'):
+            os.environ.pop(name, None)
+
+        # Импорт после настройки окружения: config и bot_instance читают его при импорте
+        import main as web
+        errors = ErrorCounter()
+        # Логи на каждое обновление исказили бы замер - остаются только ошибки, и те считаются
+        logging.getLogger().handlers[:] = [errors]
+        logging.disable(logging.WARNING)
+
+        outbound = Outbound(ports)
+        update_ids = iter(range(1, 10 ** 9))
+        results = []
+        for name in scenarios:
+            outbound.mark()
+            errors_before = errors.count
+            if name == 'payments':
+                result = run_payments_scenario(web, args.payments, args.threads)
+            else:
+                sequences = {
+                    'start_storm': lambda: start_storm_payloads(args.users, update_ids),
+                    'plan_browsing': lambda: plan_browsing_payloads(args.users, update_ids),
+                    'admin_stats': lambda: admin_stats_payloads(args.admin_repeats, update_ids),
+                }[name]()
+                result = run_webhook_scenario(web, name, sequences, args.threads)
+            result['logged_errors'] = errors.count - errors_before
+            result['outbound'] = outbound.since_mark()
+            result['peak_rss_mb'] = round(_peak_rss_mb(), 1)
+            results.append(result)
+        error_samples = errors.samples
+    finally:
+        process.terminate()
+        process.join(timeout=5)
+
+    return {
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'args': {key: value for key, value in vars(args).items() if key not in ('out', 'compare', 'json')},
+        'scenarios': results,
+        'error_samples': error_samples,
+    }
+
+
+def print_result(result: Dict[str, Any]):
+    print(f"commit {result['git_commit']}, python {result['python']}, {result['args']}")
+    for s in result['scenarios']:
+        latency = s['latency_ms']
+        print(f"\n{s['scenario']}: {s['completed']}/{s['requests']} in {s['wall_time_sec']} s, "
+              f"{s['throughput_per_sec']}/sec, p50 {latency['p50']} ms, p95 {latency['p95']} ms, "
+              f"p99 {latency['p99']} ms, errors: http {s['http_errors']}, log {s['logged_errors']}, "
+              f"peak RSS {s['peak_rss_mb']} MB")
+        for server, requests in s['outbound'].items():
+            if requests:
+                print(f"  {server}: " + ", ".join(f"{name} {count}" for name, count in requests.items()))
+    if result.get('error_samples'):
+        print("\nfirst errors:")
+        for sample in result['error_samples']:
+            print(f"  {sample}")
+
+
+def compare(before: Dict[str, Any], after: Dict[str, Any]):
+    """Per scenario: throughput and p95 before -> after"""
+    def delta(old: float, new: float) -> str:
+        return f"{(new - old) / old * 100:+.0f}%" if old else "n/a"
+
+    old_by_name = {s['scenario']: s for s in before['scenarios']}
+    print(f"{before.get('git_commit')} -> {after.get('git_commit')}")
+    print(f"{'scenario':<15}{'throughput/sec':>28}{'p95 ms':>28}{'outbound calls':>22}")
+    for new in after['scenarios']:
+        old = old_by_name.get(new['scenario'])
+        if old is None:
+            continue
+        calls_old = sum(sum(r.values()) for r in old['outbound'].values())
+        calls_new = sum(sum(r.values()) for r in new['outbound'].values())
+        print(f"{new['scenario']:<15}"
+              f"{old['throughput_per_sec']:>10} -> {new['throughput_per_sec']:<8}{delta(old['throughput_per_sec'], new['throughput_per_sec']):>6}"
+              f"{old['latency_ms']['p95']:>10} -> {new['latency_ms']['p95']:<8}{delta(old['latency_ms']['p95'], new['latency_ms']['p95']):>6}"
+              f"{calls_old:>10} -> {calls_new:<8}")
+
+
+def _load(path: str) -> Dict[str, Any]:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.compare:
+        compare(_load(args.compare[0]), _load(args.compare[1]))
+        sys.exit(0)
+    result = main(args)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    if args.json:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+    else:
+        print_result(result)
+    # Поток event loop и QueueListener не дают процессу выйти сами
+    os._exit(0)
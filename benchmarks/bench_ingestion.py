@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Пропускная способность приёма обновлений: вебхук против long polling.
+
+Поднимает фейковый Telegram Bot API (benchmarks/fakes.py) с очередью нажатий
+кнопок и прогоняет одинаковое число обновлений двумя путями через настоящий
+main.app и хендлеры бота:
+    webhook - POST /webhook из нескольких потоков, как gunicorn --threads 4
+    polling - PollingRunner: getUpdates по 100, обработка пачки, сдвиг офсета
+Обработанным считается обновление, на которое ушёл answerCallbackQuery.
+Ошибки обработчиков (записи лога уровня ERROR) и неудачные вызовы Bot API
+попадают в отчёт отдельно, вебхук на 503 повторяется, как это делает Telegram.
+
+    python -m benchmarks.bench_ingestion --updates 5000
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import logging
+import argparse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fakes import make_callback_update, start_in_process
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _get_stats(port: int) -> dict:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/__stats", timeout=30) as response:
+        return json.loads(response.read())
+
+
+def _wait_ready(port: int, timeout: float = 60.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return _get_stats(port)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def _answered(port: int) -> int:
+    return _get_stats(port)['requests'].get('answerCallbackQuery', 0)
+
+
+class ErrorLog(logging.Handler):
+    """Counts ERROR records of the handlers and keeps the first distinct messages"""
+
+    def __init__(self, keep: int = 3):
+        super().__init__(logging.ERROR)
+        self.count = 0
+        self.samples = []
+        self.keep = keep
+
+    def emit(self, record):
+        self.count += 1
+        message = record.getMessage()
+        if record.exc_info and record.exc_info[1] is not None:
+            message = f"{message}: {record.exc_info[1]!r}"
+        message = message[:200]
+        if len(self.samples) < self.keep and message not in self.samples:
+            self.samples.append(message)
+
+    def take(self) -> dict:
+        result = {'handler_errors': self.count, 'first_errors': self.samples}
+        self.count, self.samples = 0, []
+        return result
+
+
+def _api_errors() -> dict:
+    """Failed Bot API calls per method so far (telegram_api_seconds{outcome="error"})"""
+    from inline_reply import TELEGRAM_API_SECONDS
+
+    return {labels[0]: sum(child.snapshot()[0]) for labels, child in TELEGRAM_API_SECONDS._items()
+            if labels[1] == 'error'}
+
+
+def _api_errors_since(before: dict) -> dict:
+    return {method: count - before.get(method, 0) for method, count in _api_errors().items()
+            if count > before.get(method, 0)}
+
+
+def run_webhook(web, port: int, updates: int, chats: int, threads: int, errors: ErrorLog) -> dict:
+    before, api_before = _answered(port), _api_errors()
+    payloads = [
+        json.dumps(make_callback_update(1000000 + i, 100000000 + i % chats))
+        for i in range(updates)
+    ]
+
+    def post(chunk) -> int:
+        client = web.app.test_client()
+        rejected = 0
+        for payload in chunk:
+            # 503 - очередь вебхука полна: Telegram повторяет доставку, мы тоже
+            while client.post('/webhook', data=payload, content_type='application/json').status_code == 503:
+                rejected += 1
+                time.sleep(0.05)
+        return rejected
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        rejected = sum(pool.map(post, [payloads[i::threads] for i in range(threads)]))
+    # Вебхук отвечает сразу, обработка идёт в loop - ждём, пока очередь вебхука опустеет
+    asyncio.run_coroutine_threadsafe(web.webhook_executor.drain(), web.loop).result()
+    elapsed = time.perf_counter() - started
+    handled = _answered(port) - before
+    return {'path': 'webhook', 'updates': handled, 'wall_time_sec': round(elapsed, 2),
+            'updates_per_sec': round(handled / elapsed, 1), 'not_answered': updates - handled,
+            'rejected_503': rejected, 'api_errors': _api_errors_since(api_before), **errors.take()}
+
+
+def run_polling(loop, bot, port: int, updates: int, concurrency: int, errors: ErrorLog) -> dict:
+    from polling_runner import PollingRunner, IngestionStats, handle_update
+
+    before, api_before = _answered(port), _api_errors()
+    stats = IngestionStats('polling')
+    runner = PollingRunner(bot, handle_update, timeout=0, concurrency=concurrency,
+                           stats=stats, stop_when_idle=True)
+    started = time.perf_counter()
+    asyncio.run_coroutine_threadsafe(runner.run(), loop).result()
+    elapsed = time.perf_counter() - started
+    handled = _answered(port) - before
+    return {'path': 'polling', 'updates': handled, 'wall_time_sec': round(elapsed, 2),
+            'updates_per_sec': round(handled / elapsed, 1), 'not_answered': updates - handled,
+            'batches': stats.batches, 'left_pending': _get_stats(port)['pending_updates'],
+            'api_errors': _api_errors_since(api_before), **errors.take()}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Webhook vs long polling ingestion throughput")
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--chats', type=int, default=500)
+    parser.add_argument('--telegram-latency-ms', type=float, default=20.0)
+    parser.add_argument('--webhook-threads', type=int, default=4, help="gunicorn --threads")
+    parser.add_argument('--polling-concurrency', type=int, default=64)
+    parser.add_argument('--json', action='store_true', help="Print the result as JSON")
+    return parser.parse_args(argv)
+
+
+def main(args) -> list:
+    telegram_port, postgrest_port = _free_port(), _free_port()
+    process = start_in_process(telegram_port, postgrest_port, {
+        'users': 0,
+        'telegram_latency_ms': args.telegram_latency_ms,
+        'pending_updates': args.updates,
+        'chats': args.chats,
+    })
+    try:
+        _wait_ready(telegram_port)
+        os.environ.update({
+            'TELEGRAM_TOKEN': '123456:BENCHMARK',
+            'TELEGRAM_API_BASE_URL': f"http://127.0.0.1:{telegram_port}/bot",
+            'SUPABASE_URL': f"http://127.0.0.1:{postgrest_port}",
+            'SUPABASE_ANON_KEY': 'benchmark',
+            'SUPABASE_SERVICE_ROLE': 'benchmark',
+            'TELEGRAM_UPDATES_MODE': 'webhook',
+            'WORKER_PROCESSES': '1',
+        })
+        os.environ.pop('SUPABASE_POSTGRES_URL', None)
+
+        # Импорт после настройки окружения: config и bot_instance читают его при импорте
+        import main as web
+        # Логи хендлеров на каждое обновление исказили бы замер: остаются только ошибки, и те - в счётчик
+        logging.disable(logging.WARNING)
+        errors = ErrorLog()
+        logging.getLogger().handlers = [errors]
+
+        # Polling первым: хвост необработанных вебхуков не должен мешать его замеру
+        results = [
+            run_polling(web.loop, web.telegram_app.bot, telegram_port, args.updates, args.polling_concurrency, errors),
+            run_webhook(web, telegram_port, args.updates, args.chats, args.webhook_threads, errors),
+        ]
+    finally:
+        process.terminate()
+        process.join(timeout=5)
+    return results
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = main(args)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"updates: {args.updates}, chats: {args.chats}, telegram latency: {args.telegram_latency_ms} ms")
+        for result in results:
+            if 'batches' in result:
+                extra = f", batches: {result['batches']}, left pending: {result['left_pending']}"
+            else:
+                extra = f", rejected with 503: {result['rejected_503']}"
+            print(f"  {result['path']:<8} {result['updates_per_sec']:>9} updates/sec  "
+                  f"({result['updates']} in {result['wall_time_sec']} s, not answered: {result['not_answered']}{extra})")
+            if result['handler_errors'] or result['api_errors']:
+                print(f"           handler errors: {result['handler_errors']}, failed Bot API calls: {result['api_errors']}")
+                for message in result['first_errors']:
+                    print(f"             {message}")
+    if any(result['not_answered'] or result['handler_errors'] for result in results):
+        sys.exit(1)
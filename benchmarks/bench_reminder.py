@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк reminder_bot без реальных пользователей.
+
+Поднимает фейковые Telegram Bot API и PostgREST (benchmarks/fakes.py) в
+отдельном процессе, направляет на них бота через TELEGRAM_API_BASE_URL и
+SUPABASE_URL и прогоняет reminder_bot.main() целиком. В конце печатает
+время, sends/sec, пиковый RSS процесса бота и число запросов по эндпоинтам.
+
+    python -m benchmarks.bench_reminder --users 10000
+    python -m benchmarks.bench_reminder --users 100000 --telegram-latency-ms 50 --telegram-error-rate 0.001
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+import urllib.request
+
+from benchmarks.fakes import start_in_process
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _get_stats(port: int) -> dict:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/__stats", timeout=30) as response:
+        return json.loads(response.read())
+
+
+def _wait_ready(port: int, timeout: float = 120.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return _get_stats(port)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss в килобайтах на Linux и в байтах на macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark for reminder_bot")
+    parser.add_argument('--users', type=int, default=10000, help="Seeded users (≈half are reminder candidates)")
+    parser.add_argument('--telegram-latency-ms', type=float, default=30.0)
+    parser.add_argument('--telegram-error-rate', type=float, default=0.0, help="Share of 429 responses")
+    parser.add_argument('--retry-after', type=int, default=1, help="retry_after in injected 429s")
+    parser.add_argument('--postgrest-latency-ms', type=float, default=10.0)
+    parser.add_argument('--rate', type=float, default=0, help="REMINDER_RATE, 0 = no pacing")
+    parser.add_argument('--concurrency', type=int, default=8, help="REMINDER_CONCURRENCY")
+    parser.add_argument('--json', action='store_true', help="Print the result as JSON")
+    return parser.parse_args(argv)
+
+
+async def run_benchmark(args) -> dict:
+    telegram_port, postgrest_port = _free_port(), _free_port()
+    process = start_in_process(telegram_port, postgrest_port, {
+        'users': args.users,
+        'telegram_latency_ms': args.telegram_latency_ms,
+        'telegram_error_rate': args.telegram_error_rate,
+        'retry_after': args.retry_after,
+        'postgrest_latency_ms': args.postgrest_latency_ms,
+    })
+
+    try:
+        _wait_ready(telegram_port)
+        before = _wait_ready(postgrest_port)
+
+        journal_dir = tempfile.mkdtemp(prefix='reminder_bench_')
+        os.environ.update({
+            'TELEGRAM_TOKEN': '123456:BENCHMARK',
+            'TELEGRAM_API_BASE_URL': f"http://127.0.0.1:{telegram_port}/bot",
+            'SUPABASE_URL': f"http://127.0.0.1:{postgrest_port}",
+            'SUPABASE_SERVICE_ROLE': 'benchmark',
+            'REMINDER_RATE': str(args.rate),
+            'REMINDER_CONCURRENCY': str(args.concurrency),
+            'REMINDER_JOURNAL_DIR': journal_dir,
+        })
+
+        # Импорт только после настройки окружения: config читает его при импорте
+        import reminder_bot
+        logging.getLogger().setLevel(logging.WARNING)
+        for name in ('reminder_bot', 'reminder_sender', 'database_operations', 'httpx'):
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+        started = time.perf_counter()
+        reports = await reminder_bot.main()
+        wall_time = time.perf_counter() - started
+
+        telegram_stats = _get_stats(telegram_port)
+        postgrest_stats = _get_stats(postgrest_port)
+    finally:
+        process.terminate()
+        process.join(timeout=5)
+
+    sent = sum(report.get('sent', 0) for report in reports)
+    return {
+        'users': args.users,
+        'candidates': {
+            'unpaid_24h': before['pending_unpaid_reminders'],
+            'followup_30d': before['pending_followups'],
+        },
+        'wall_time_sec': round(wall_time, 2),
+        'sent': sent,
+        'sends_per_sec': round(sent / wall_time, 1) if wall_time else 0.0,
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+        'left_unacked': {
+            'unpaid_24h': postgrest_stats['pending_unpaid_reminders'],
+            'followup_30d': postgrest_stats['pending_followups'],
+        },
+        'duplicate_sends': telegram_stats['duplicate_sends'],
+        'telegram_requests': telegram_stats['requests'],
+        'telegram_429': telegram_stats['errors'],
+        'postgrest_requests': postgrest_stats['requests'],
+        'campaigns': reports,
+    }
+
+
+def print_result(result: dict):
+    print(f"users: {result['users']}, candidates: {result['candidates']}")
+    print(f"wall time: {result['wall_time_sec']} s, sent: {result['sent']}, "
+          f"{result['sends_per_sec']} sends/sec, peak RSS: {result['peak_rss_mb']} MB")
+    print(f"left unacked: {result['left_unacked']}, duplicate sends: {result['duplicate_sends']}")
+    print("requests per endpoint:")
+    for name, count in sorted({**result['telegram_requests'], **result['postgrest_requests']}.items()):
+        print(f"  {name:<40}{count:>8}")
+    if result['telegram_429']:
+        print(f"injected 429: {result['telegram_429']}")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    result = asyncio.run(run_benchmark(args))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_result(result)
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Сравнение старых и новых версий аналитических RPC функций на сгенерированных данных.
+
+Создаёт одноразовую базу на локальном Postgres (TEST_POSTGRES_URL), накатывает
+схему, миграции и rpc_functions.sql, ставит прежние версии функций в схему
+legacy и замеряет медиану времени вызова каждой пары.
+
+    TEST_POSTGRES_URL=postgresql://postgres@localhost/postgres python -m benchmarks.bench_rpc_functions
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import statistics
+from datetime import datetime, timedelta, timezone
+
+import asyncpg
+
+from migrate import apply_migrations
+from test_query_plans import BASE_SCHEMA, SEED_SQL, TEST_POSTGRES_URL
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BENCH_ROWS = int(os.getenv('BENCH_ROWS', '200000'))
+BENCH_REPEATS = int(os.getenv('BENCH_REPEATS', '5'))
+
+# Версии функций до переписывания на GROUPING SETS и оконные функции
+LEGACY_FUNCTIONS = """
+CREATE SCHEMA IF NOT EXISTS legacy;
+
+-- Get payment summary statistics
+CREATE OR REPLACE FUNCTION legacy.get_payment_summary(
+    start_date TIMESTAMPTZ DEFAULT (NOW() - INTERVAL '30 days'),
+    end_date TIMESTAMPTZ DEFAULT NOW()
+)
+RETURNS JSONB
+LANGUAGE SQL
+AS $$
+    SELECT jsonb_build_object(
+        'total_revenue', COALESCE(SUM(amount), 0),
+        'total_payments', COUNT(*),
+        'avg_payment', COALESCE(AVG(amount), 0),
+        'successful_payments', COUNT(*) FILTER (WHERE status = 'completed'),
+        'failed_payments', COUNT(*) FILTER (WHERE status = 'failed'),
+        'refunded_payments', COUNT(*) FILTER (WHERE status = 'refunded'),
+        'revenue_by_plan', (
+            SELECT jsonb_object_agg(plan_key, plan_stats)
+            FROM (
+                SELECT
+                    COALESCE(plan_id::TEXT, 'unknown') AS plan_key,
+                    jsonb_build_object(
+                        'count', COUNT(*),
+                        'revenue', SUM(amount),
+                        'avg_amount', AVG(amount)
+                    ) AS plan_stats
+                FROM payments
+                WHERE created_at BETWEEN start_date AND end_date
+                GROUP BY plan_id
+            ) by_plan
+        ),
+        'revenue_by_currency', (
+            SELECT jsonb_object_agg(currency_key, currency_stats)
+            FROM (
+                SELECT
+                    COALESCE(currency, 'USD') AS currency_key,
+                    jsonb_build_object(
+                        'count', COUNT(*),
+                        'revenue', SUM(amount),
+                        'avg_amount', AVG(amount)
+                    ) AS currency_stats
+                FROM payments
+                WHERE created_at BETWEEN start_date AND end_date
+                GROUP BY currency
+            ) by_currency
+        )
+    )
+    FROM payments
+    WHERE created_at BETWEEN start_date AND end_date;
+$$;
+
+
+CREATE OR REPLACE FUNCTION legacy.get_payment_methods_distribution()
+RETURNS JSONB
+LANGUAGE SQL
+AS $$
+    SELECT 
+        jsonb_build_object(
+            'by_type', (
+                SELECT jsonb_object_agg(type_key, type_stats)
+                FROM (
+                    SELECT
+                        COALESCE(payment_type, 'unknown') AS type_key,
+                        jsonb_build_object(
+                            'count', COUNT(*),
+                            'revenue', COALESCE(SUM(amount), 0),
+                            'avg_amount', COALESCE(AVG(amount), 0)
+                        ) AS type_stats
+                    FROM payments
+                    GROUP BY payment_type
+                ) by_type
+            ),
+            'by_status', (
+                SELECT jsonb_object_agg(status_key, status_stats)
+                FROM (
+                    SELECT
+                        COALESCE(status, 'unknown') AS status_key,
+                        jsonb_build_object(
+                            'count', COUNT(*),
+                            'revenue', COALESCE(SUM(amount), 0)
+                        ) AS status_stats
+                    FROM payments
+                    GROUP BY status
+                ) by_status
+            )
+        );
+$$;
+
+-- Get user statistics
+CREATE OR REPLACE FUNCTION legacy.get_user_statistics(
+    start_date TIMESTAMPTZ DEFAULT (NOW() - INTERVAL '30 days'),
+    end_date TIMESTAMPTZ DEFAULT NOW()
+)
+RETURNS JSONB
+LANGUAGE SQL
+AS $$
+    WITH user_stats AS (
+        SELECT
+            COUNT(*) AS total_users,
+            COUNT(*) FILTER (WHERE created_at >= NOW() - INTERVAL '7 days') AS new_users_7d,
+            COUNT(*) FILTER (WHERE created_at >= NOW() - INTERVAL '30 days') AS new_users_30d,
+            COUNT(*) FILTER (WHERE last_activity >= NOW() - INTERVAL '1 day') AS active_users_1d,
+            COUNT(*) FILTER (WHERE last_activity >= NOW() - INTERVAL '7 days') AS active_users_7d,
+            COUNT(*) FILTER (WHERE last_activity >= NOW() - INTERVAL '30 days') AS active_users_30d,
+            COUNT(*) FILTER (WHERE created_at <= NOW() - INTERVAL '30 days') AS users_older_30d
+        FROM users
+    ),
+    user_growth AS (
+        SELECT
+            days.date,
+            COUNT(u.created_at) AS new_users
+        FROM generate_series(
+            DATE_TRUNC('day', start_date),
+            DATE_TRUNC('day', end_date),
+            INTERVAL '1 day'
+        ) AS days(date)
+        LEFT JOIN users u
+            ON u.created_at >= days.date
+           AND u.created_at < days.date + INTERVAL '1 day'
+           AND u.created_at BETWEEN start_date AND end_date
+        GROUP BY days.date
+    )
+    SELECT jsonb_build_object(
+        'total_users', total_users,
+        'new_users', jsonb_build_object(
+            '7d', new_users_7d,
+            '30d', new_users_30d
+        ),
+        'active_users', jsonb_build_object(
+            '1d', active_users_1d,
+            '7d', active_users_7d,
+            '30d', active_users_30d
+        ),
+        'retention_rate', ROUND(
+            (active_users_30d::FLOAT / NULLIF(users_older_30d, 0) * 100)::NUMERIC,
+            2
+        ),
+        'user_growth', (
+            SELECT jsonb_agg(
+                jsonb_build_object(
+                    'date', date,
+                    'new_users', COALESCE(new_users, 0),
+                    'cumulative_users', (
+                        SELECT COUNT(*)
+                        FROM users
+                        WHERE created_at <= date
+                    )
+                )
+                ORDER BY date
+            )
+            FROM user_growth
+        )
+    )
+    FROM user_stats;
+$$;
+
+"""
+
+# (функция, аргументы новой версии, аргументы legacy версии)
+BENCH_CALLS = [
+    ('get_payment_summary', ['start', 'end'], ['start', 'end']),
+    ('get_payment_methods_distribution', ['start', 'end'], []),
+    ('get_user_statistics', ['start', 'end'], ['start', 'end']),
+]
+
+
+def _resolve_args(args, start, end):
+    named = {'start': start, 'end': end}
+    return [named[a] for a in args]
+
+
+async def _time_call(conn, schema, function_name, args):
+    placeholders = ', '.join(f'${i}' for i in range(1, len(args) + 1))
+    query = f"SELECT {schema}.{function_name}({placeholders})"
+
+    timings = []
+    result = None
+    for _ in range(BENCH_REPEATS):
+        started = time.perf_counter()
+        result = await conn.fetchval(query, *args)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), json.loads(result) if isinstance(result, str) else result
+
+
+def _normalize(value):
+    """Round numbers: rollups compute averages as SUM / COUNT instead of AVG"""
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return round(float(value), 6)
+    return value
+
+
+def _compare_results(function_name, new, old):
+    """Check that the rewrite returns the same numbers as the legacy version"""
+    new, old = _normalize(new), _normalize(old)
+    if function_name == 'get_payment_summary':
+        return new == old
+    if function_name == 'get_user_statistics':
+        # cumulative_users теперь включает пользователей самого дня, сравниваем остальное
+        strip = lambda data: {k: v for k, v in data.items() if k != 'user_growth'}
+        new_daily = [(d['date'], d['new_users']) for d in new.get('user_growth') or []]
+        old_daily = [(d['date'], d['new_users']) for d in old.get('user_growth') or []]
+        return strip(new) == strip(old) and new_daily == old_daily
+    # legacy get_payment_methods_distribution считает всю историю, сравнивать нечего
+    return None
+
+
+async def run_benchmark(database: str) -> bool:
+    conn = await asyncpg.connect(TEST_POSTGRES_URL, database=database)
+    try:
+        await conn.execute(BASE_SCHEMA)
+        await apply_migrations(conn)
+        await conn.execute(LEGACY_FUNCTIONS)
+
+        logger.info(f"🌱 Заполняем таблицы: {BENCH_ROWS} строк в каждой")
+        for statement in SEED_SQL.split(';'):
+            if not statement.strip():
+                continue
+            if '$1' in statement:
+                await conn.execute(statement, BENCH_ROWS)
+            else:
+                await conn.execute(statement)
+        # Новые функции читают rollup таблицы, как на проде после refresh_rollups
+        await conn.execute("SELECT public.refresh_rollups()")
+
+        end = datetime.now(timezone.utc)
+        start = end - timedelta(days=30)
+
+        ok = True
+        print(f"{'function':<36}{'legacy, ms':>12}{'new, ms':>12}{'speedup':>10}  same result")
+        for function_name, new_args, legacy_args in BENCH_CALLS:
+            legacy_time, legacy_result = await _time_call(
+                conn, 'legacy', function_name, _resolve_args(legacy_args, start, end)
+            )
+            new_time, new_result = await _time_call(
+                conn, 'public', function_name, _resolve_args(new_args, start, end)
+            )
+            same = _compare_results(function_name, new_result, legacy_result)
+            if same is False:
+                ok = False
+                logger.error(f"❌ {function_name}: результаты расходятся\nnew={new_result}\nold={legacy_result}")
+
+            speedup = legacy_time / new_time if new_time else float('inf')
+            same_text = {True: 'yes', False: 'NO', None: '-'}[same]
+            print(f"{function_name:<36}{legacy_time * 1000:>12.1f}{new_time * 1000:>12.1f}{speedup:>9.1f}x  {same_text}")
+
+        return ok
+    finally:
+        await conn.close()
+
+
+async def main() -> bool:
+    database = f"rpc_bench_{os.getpid()}"
+    admin_conn = await asyncpg.connect(TEST_POSTGRES_URL)
+    try:
+        await admin_conn.execute(f'CREATE DATABASE "{database}"')
+    finally:
+        await admin_conn.close()
+
+    try:
+        return await run_benchmark(database)
+    finally:
+        admin_conn = await asyncpg.connect(TEST_POSTGRES_URL)
+        try:
+            await admin_conn.execute(f'DROP DATABASE IF EXISTS "{database}" WITH (FORCE)')
+        finally:
+            await admin_conn.close()
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    sys.exit(0 if success else 1)
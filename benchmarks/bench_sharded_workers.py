@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк многопроцессного режима (sharded_workers.py).
+
+Гоняет синтетические вебхук-обновления через ShardedUpdateDispatcher при
+разном числе воркеров. Обработчик разбирает telegram.Update и держит CPU
+заданное время (как рендер меню и логирование в настоящих хендлерах), так
+что в одном процессе всё упирается в GIL. Дополнительно проверяется, что
+обновления каждого чата обработаны строго по порядку.
+
+    python -m benchmarks.bench_sharded_workers
+    python -m benchmarks.bench_sharded_workers --workers 1 2 4 8 --updates 20000 --work-ms 1
+"""
+
+import os
+import json
+import time
+import asyncio
+import argparse
+from typing import Dict, List
+
+from sharded_workers import ShardedUpdateDispatcher, consume_updates
+
+
+def make_update(update_id: int, chat_id: int, message_id: int) -> bytes:
+    return json.dumps({
+        'update_id': update_id,
+        'message': {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'},
+            'text': '/start',
+        },
+    }).encode()
+
+
+def bench_worker(index: int, update_queue, results, work_ms: float):
+    """Worker target: same queue/ordering code as the bot, CPU-bound handler"""
+    from telegram import Update
+
+    work = work_ms / 1000.0
+    last_seen: Dict[int, int] = {}
+    stats = {'worker': index, 'out_of_order': 0, 'chats': 0}
+
+    async def handle(data):
+        update = Update.de_json(data, None)
+        chat_id = update.effective_chat.id
+        if update.message.message_id <= last_seen.get(chat_id, 0):
+            stats['out_of_order'] += 1
+        last_seen[chat_id] = update.message.message_id
+        # Отдаём управление loop, чтобы обновления разных чатов перемешивались
+        await asyncio.sleep(0)
+        deadline = time.perf_counter() + work
+        while time.perf_counter() < deadline:
+            pass
+
+    async def main():
+        results.put(('ready', index))
+        stats['handled'] = await consume_updates(update_queue, handle)
+        stats['chats'] = len(last_seen)
+        results.put(('done', stats))
+
+    asyncio.run(main())
+
+
+def run_once(processes: int, updates: List[bytes], work_ms: float) -> dict:
+    dispatcher = ShardedUpdateDispatcher(processes, target=bench_worker, queue_size=len(updates) + 1)
+    results = dispatcher._context.Queue()
+    dispatcher.start(results, work_ms)
+
+    # Старт процессов и импорт telegram не входят в замер
+    for _ in range(processes):
+        results.get(timeout=120)
+
+    started = time.perf_counter()
+    for raw in updates:
+        dispatcher.dispatch(raw)
+    for update_queue in dispatcher.queues:
+        update_queue.put(None)
+
+    worker_stats = [results.get(timeout=600)[1] for _ in range(processes)]
+    elapsed = time.perf_counter() - started
+    dispatcher.stop()
+
+    handled = sum(s['handled'] for s in worker_stats)
+    return {
+        'workers': processes,
+        'updates': handled,
+        'wall_time_sec': round(elapsed, 3),
+        'updates_per_sec': round(handled / elapsed, 1) if elapsed else 0.0,
+        'out_of_order': sum(s['out_of_order'] for s in worker_stats),
+        'per_worker': [s['handled'] for s in sorted(worker_stats, key=lambda s: s['worker'])],
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput of sharded update workers vs worker count")
+    parser.add_argument('--workers', type=int, nargs='+', default=None,
+                        help="Worker counts to try (default: 1, 2, 4 ... up to CPU count)")
+    parser.add_argument('--updates', type=int, default=10000)
+    parser.add_argument('--chats', type=int, default=1000)
+    parser.add_argument('--work-ms', type=float, default=1.0, help="CPU time per update in the handler")
+    parser.add_argument('--json', action='store_true', help="Print the result as JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    worker_counts = args.workers
+    if not worker_counts:
+        cpus = os.cpu_count() or 1
+        worker_counts = [1]
+        while worker_counts[-1] * 2 <= cpus:
+            worker_counts.append(worker_counts[-1] * 2)
+
+    # Сообщения в чате нумеруются по порядку - так воркер видит нарушения порядка
+    message_ids: Dict[int, int] = {}
+    updates = []
+    for update_id in range(1, args.updates + 1):
+        chat_id = 100000000 + (update_id * 7919) % args.chats
+        message_ids[chat_id] = message_ids.get(chat_id, 0) + 1
+        updates.append(make_update(update_id, chat_id, message_ids[chat_id]))
+
+    results = [run_once(processes, updates, args.work_ms) for processes in worker_counts]
+    if args.json:
+        print(json.dumps({'cpu_count': os.cpu_count(), 'work_ms': args.work_ms, 'runs': results}, indent=2))
+    else:
+        print(f"cpu count: {os.cpu_count()}, updates: {args.updates}, chats: {args.chats}, work: {args.work_ms} ms")
+        baseline = results[0]['updates_per_sec'] or 1
+        for result in results:
+            print(f"  workers={result['workers']:<3} {result['updates_per_sec']:>10} updates/sec  "
+                  f"x{result['updates_per_sec'] / baseline:.2f}  out of order: {result['out_of_order']}  "
+                  f"per worker: {result['per_worker']}")
@@ -0,0 +1,610 @@
+"""
+Фейковые Telegram Bot API, PostgREST (Supabase) и Stripe серверы для бенчмарков.
+
+Все серверы - aiohttp приложения с настраиваемой задержкой и долей ответов
+с ошибкой, данные PostgREST живут в памяти. Счётчики запросов по эндпоинтам
+доступны через GET /__stats на каждом сервере.
+
+    python -m benchmarks.fakes --users 10000   # поднять серверы вручную
+"""
+
+import time
+import random
+import asyncio
+import argparse
+import bisect
+import multiprocessing
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+
+class FakeServerBase:
+    def __init__(self, latency_ms: float = 0.0, error_rate: float = 0.0, retry_after: int = 1, seed: int = 42):
+        self.latency = latency_ms / 1000.0
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.requests = Counter()
+        self.errors = Counter()
+
+    async def _delay(self):
+        if self.latency:
+            # ±50% вокруг заданной задержки, как у реальной сети
+            await asyncio.sleep(self.latency * self.random.uniform(0.5, 1.5))
+
+    def _should_fail(self) -> bool:
+        return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'requests': dict(self.requests),
+            'errors': dict(self.errors),
+            **self.extra_stats(),
+        })
+
+    def extra_stats(self) -> Dict[str, Any]:
+        return {}
+
+
+def make_callback_update(update_id: int, chat_id: int, data: str = 'bench_noop') -> Dict[str, Any]:
+    """Callback query update as Telegram sends it"""
+    user = {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'}
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': str(chat_id),
+            'data': data,
+            'from': user,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': {'id': 1, 'is_bot': True, 'first_name': 'Fake'},
+                'text': 'menu',
+            },
+        },
+    }
+
+
+def make_message_update(update_id: int, chat_id: int, text: str = '/start') -> Dict[str, Any]:
+    """Text message update; a leading /command gets its bot_command entity"""
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+class FakeTelegram(FakeServerBase):
+    """
+    POST /bot<token>/<method>: sendMessage и прочие методы отвечают успехом,
+    send*/edit* - сообщением, как настоящий API. getUpdates отдаёт заранее
+    сгенерированные pending_updates обновлений (нажатия кнопок в chats чатах)
+    с учётом offset и limit.
+    """
+
+    def __init__(self, pending_updates: int = 0, chats: int = 100, **kwargs):
+        super().__init__(**kwargs)
+        self.message_id = 0
+        self.recipients = Counter()
+        self.pending = [
+            make_callback_update(update_id, 100000000 + update_id % chats)
+            for update_id in range(1, pending_updates + 1)
+        ]
+        self.pending_ids = [update['update_id'] for update in self.pending]
+        self.confirmed = 0
+        self.uploaded_bytes = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.requests[method] += 1
+        await self._delay()
+
+        if self._should_fail():
+            self.errors[method] += 1
+            return web.json_response({
+                'ok': False,
+                'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after},
+            }, status=429)
+
+        if request.content_type == 'application/json':
+            payload = await request.json()
+        else:
+            if request.content_type == 'multipart/form-data':
+                self.uploaded_bytes += request.content_length or 0
+            payload = dict(await request.post())
+
+        if method == 'getUpdates':
+            offset = int(payload.get('offset') or 0)
+            limit = int(payload.get('limit') or 100)
+            # Всё до offset подтверждено и больше не отдаётся
+            self.confirmed = max(self.confirmed, bisect.bisect_left(self.pending_ids, offset))
+            return web.json_response({'ok': True, 'result': self.pending[self.confirmed:self.confirmed + limit]})
+
+        if method == 'getMe':
+            return web.json_response({'ok': True, 'result': {
+                'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot',
+            }})
+
+        if method == 'sendMessage':
+            chat_id = int(payload.get('chat_id'))
+            self.recipients[chat_id] += 1
+            self.message_id += 1
+            return web.json_response({'ok': True, 'result': {
+                'message_id': self.message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': payload.get('text', ''),
+            }})
+
+        if method == 'sendVideo':
+            chat_id = int(payload.get('chat_id'))
+            self.message_id += 1
+            video = payload.get('video')
+            # Загруженный файл получает новый file_id, отправка по file_id - тот же
+            file_id = video if isinstance(video, str) and not video.startswith('attach://') else f"fake-video-{self.message_id}"
+            return web.json_response({'ok': True, 'result': {
+                'message_id': self.message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'video': {'file_id': file_id, 'file_unique_id': file_id, 'width': 720, 'height': 1280, 'duration': 10},
+            }})
+
+        if method.startswith(('send', 'edit')) and payload.get('chat_id') is not None:
+            # sendDocument, editMessageText и т.п.: боту нужен объект Message
+            self.message_id += 1
+            return web.json_response({'ok': True, 'result': {
+                'message_id': int(payload.get('message_id') or self.message_id),
+                'date': int(time.time()),
+                'chat': {'id': int(payload['chat_id']), 'type': 'private'},
+                'text': payload.get('text', ''),
+            }})
+
+        return web.json_response({'ok': True, 'result': True})
+
+    def extra_stats(self) -> Dict[str, Any]:
+        return {
+            'uploaded_bytes': self.uploaded_bytes,
+            'messages_sent': sum(self.recipients.values()),
+            'unique_recipients': len(self.recipients),
+            'duplicate_sends': sum(count - 1 for count in self.recipients.values() if count > 1),
+            'pending_updates': len(self.pending) - self.confirmed,
+        }
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/__stats', self.stats)
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        return app
+
+
+def _parse_in(value: str) -> List[str]:
+    return [item.strip().strip('"') for item in value[len('in.('):-1].split(',') if item.strip()]
+
+
+class FakePostgREST(FakeServerBase):
+    """
+    Минимальный PostgREST для выборок reminder_bot: users с фильтрами
+    eq./neq./lt./lte./gt./gte./in./not.is.true, order по ключу, limit, PATCH с in.(...)
+    и RPC get_payments_for_30d_followup. Для сквозного бенчмарка - GET и POST
+    в любую таблицу (user_actions, payments, ...), RPC статистики админки
+    get_action_counts / get_unique_users по вставленным user_actions и пустые
+    ответы остальных RPC.
+    """
+
+    def __init__(self, users: int = 10000, candidate_share: float = 0.5, payment_share: float = 0.2, **kwargs):
+        super().__init__(**kwargs)
+        now = datetime.now(timezone.utc)
+        self.users: List[Dict[str, Any]] = []
+        self.payments: List[Dict[str, Any]] = []
+
+        for i in range(users):
+            user_id = 100000000 + i
+            is_candidate = self.random.random() < candidate_share
+            self.users.append({
+                'user_id': user_id,
+                'payment_status': 'unpaid' if is_candidate or self.random.random() < 0.5 else 'paid',
+                'last_activity': now - (timedelta(days=2) if is_candidate else timedelta(hours=1)),
+                'did_user_get_notification_after_24h_without_payment': False if is_candidate else None,
+            })
+            # Платежи только у оплативших, чтобы получатели двух рассылок не пересекались
+            if not is_candidate and self.random.random() < payment_share:
+                self.payments.append({
+                    'id': len(self.payments) + 1,
+                    'telegram_user_id': str(user_id),
+                    'status': 'paid',
+                    'payment_method': 'card',
+                    'notified_after_30d': False,
+                    'created_at': now - timedelta(days=self.random.randint(1, 90)),
+                    'metadata': {'plan': self.random.choice(['30', 'basic', '500'])},
+                })
+
+        self.user_keys = [user['user_id'] for user in self.users]
+        self.users_by_id = {user['user_id']: user for user in self.users}
+        self.payment_keys = [payment['id'] for payment in self.payments]
+        self.payments_by_id = {payment['id']: payment for payment in self.payments}
+        # Остальные таблицы (user_actions, button_clicks, ...) заполняет сам бот
+        self.tables: Dict[str, List[Dict[str, Any]]] = {'users': self.users, 'payments': self.payments}
+
+    def _unpaid_candidates(self) -> int:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=1)
+        return sum(
+            1 for user in self.users
+            if user.get('payment_status') == 'unpaid'
+            and user.get('did_user_get_notification_after_24h_without_payment') is not True
+            and user.get('last_activity', cutoff) < cutoff
+        )
+
+    def _followup_candidates(self) -> int:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=30)
+        return sum(1 for payment in self.payments if self._is_followup_candidate(payment, cutoff))
+
+    @staticmethod
+    def _is_followup_candidate(payment: Dict[str, Any], cutoff: datetime) -> bool:
+        # Строки, вставленные ботом, могут быть без части колонок
+        return (
+            payment.get('status') == 'paid'
+            and payment.get('payment_method') == 'card'
+            and payment.get('notified_after_30d') is False
+            and payment.get('created_at', cutoff) <= cutoff
+            and (payment.get('metadata') or {}).get('plan') in ('30', 'basic')
+        )
+
+    @staticmethod
+    def _matches(row: Dict[str, Any], column: str, condition: str) -> bool:
+        value = row.get(column)
+        if condition == 'not.is.true':
+            return value is not True
+        if condition == 'is.null':
+            return value is None
+        operator, _, operand = condition.partition('.')
+        if operator == 'in':
+            return str(value) in _parse_in(condition)
+        if isinstance(value, datetime):
+            operand = datetime.fromisoformat(operand.replace('Z', '+00:00'))
+        elif isinstance(value, int) and not isinstance(value, bool):
+            operand = int(operand)
+        elif isinstance(value, bool):
+            operand = operand == 'true'
+        if operator == 'eq':
+            return value == operand
+        if operator == 'neq':
+            return value != operand
+        if operator == 'lt':
+            return value is not None and value < operand
+        if operator == 'lte':
+            return value is not None and value <= operand
+        if operator == 'gt':
+            return value is not None and value > operand
+        if operator == 'gte':
+            return value is not None and value >= operand
+        raise ValueError(f"Unsupported filter {column}={condition}")
+
+    @staticmethod
+    def _serialize(row: Dict[str, Any], select: Optional[str]) -> Dict[str, Any]:
+        columns = [c.strip() for c in select.split(',')] if select and select != '*' else list(row)
+        return {c: row[c].isoformat() if isinstance(row.get(c), datetime) else row.get(c) for c in columns}
+
+    async def get_users(self, request: web.Request) -> web.Response:
+        self.requests['GET users'] += 1
+        await self._delay()
+
+        params = dict(request.query)
+        select = params.pop('select', None)
+        params.pop('order', None)  # данные уже отсортированы по user_id
+        limit = int(params.pop('limit', len(self.users)))
+
+        start = 0
+        key_filter = params.get('user_id', '')
+        if key_filter.startswith('gt.'):
+            start = bisect.bisect_right(self.user_keys, int(key_filter[3:]))
+            params.pop('user_id')
+
+        result = []
+        for user in self.users[start:]:
+            if all(self._matches(user, column, condition) for column, condition in params.items()):
+                result.append(self._serialize(user, select))
+                if len(result) >= limit:
+                    break
+        return web.json_response(result)
+
+    @staticmethod
+    def _coerce(row: Dict[str, Any]) -> Dict[str, Any]:
+        if isinstance(row.get('user_id'), str) and row['user_id'].isdigit():
+            row['user_id'] = int(row['user_id'])
+        # Бот присылает даты строками ISO, фильтры сравнивают datetime
+        for column in ('last_activity', 'created_at', 'updated_at', 'timestamp'):
+            if isinstance(row.get(column), str):
+                try:
+                    row[column] = datetime.fromisoformat(row[column].replace('Z', '+00:00'))
+                except ValueError:
+                    pass
+            if isinstance(row.get(column), datetime) and row[column].tzinfo is None:
+                row[column] = row[column].replace(tzinfo=timezone.utc)
+        return row
+
+    async def get_table(self, request: web.Request) -> web.Response:
+        table = request.match_info['table']
+        self.requests[f"GET {table}"] += 1
+        await self._delay()
+
+        params = dict(request.query)
+        select = params.pop('select', None)
+        params.pop('order', None)
+        params.pop('offset', None)
+        limit = int(params.pop('limit', 1000))
+        rows = self.tables.get(table, [])
+        result = [
+            self._serialize(row, select) for row in rows
+            if all(self._matches(row, column, condition) for column, condition in params.items())
+        ]
+        return web.json_response(result[:limit])
+
+    async def insert_rows(self, request: web.Request) -> web.Response:
+        table = request.match_info['table']
+        self.requests[f"POST {table}"] += 1
+        await self._delay()
+
+        if self._should_fail():
+            self.errors[f"POST {table}"] += 1
+            return web.json_response({'message': 'fake error'}, status=503)
+
+        body = await request.json()
+        rows = self.tables.setdefault(table, [])
+        inserted = []
+        for row in body if isinstance(body, list) else [body]:
+            row = self._coerce(dict(row))
+            if table == 'users':
+                if row.get('user_id') in self.users_by_id:
+                    return web.json_response({'message': 'duplicate key value'}, status=409)
+                position = bisect.bisect_left(self.user_keys, row['user_id'])
+                self.user_keys.insert(position, row['user_id'])
+                self.users.insert(position, row)
+                self.users_by_id[row['user_id']] = row
+            else:
+                row.setdefault('id', len(rows) + 1)
+                rows.append(row)
+                if table == 'payments':
+                    self.payment_keys.append(row['id'])
+                    self.payments_by_id[row['id']] = row
+            inserted.append(row)
+
+        if 'return=representation' in request.headers.get('Prefer', ''):
+            return web.json_response([self._serialize(row, None) for row in inserted], status=201)
+        return web.Response(status=201)
+
+    async def rpc_generic(self, request: web.Request) -> web.Response:
+        name = request.match_info['name']
+        self.requests[f"RPC {name}"] += 1
+        await self._delay()
+        return web.json_response([])
+
+    def _actions_between(self, params: Dict[str, str]) -> List[Dict[str, Any]]:
+        start = params.get('start_date', '-infinity')
+        start = None if start == '-infinity' else datetime.fromisoformat(start.replace('Z', '+00:00'))
+        end = datetime.fromisoformat(params['end_date'].replace('Z', '+00:00')) if 'end_date' in params else None
+        return [
+            row for row in self.tables.get('user_actions', [])
+            if not isinstance(row.get('timestamp'), datetime)
+            or ((start is None or row['timestamp'] >= start) and (end is None or row['timestamp'] <= end))
+        ]
+
+    async def rpc_action_counts(self, request: web.Request) -> web.Response:
+        self.requests['RPC get_action_counts'] += 1
+        await self._delay()
+        return web.json_response(dict(Counter(
+            row['action'] for row in self._actions_between(dict(request.query)) if row.get('action')
+        )))
+
+    async def rpc_unique_users(self, request: web.Request) -> web.Response:
+        self.requests['RPC get_unique_users'] += 1
+        await self._delay()
+        return web.json_response(len({
+            row['user_id'] for row in self._actions_between(dict(request.query)) if row.get('user_id')
+        }))
+
+    async def patch_table(self, request: web.Request) -> web.Response:
+        table = request.match_info['table']
+        self.requests[f"PATCH {table}"] += 1
+        await self._delay()
+
+        if self._should_fail():
+            self.errors[f"PATCH {table}"] += 1
+            return web.json_response({'message': 'fake error'}, status=503)
+
+        fields = await request.json()
+        rows_by_key, key_column = (
+            (self.users_by_id, 'user_id') if table == 'users' else (self.payments_by_id, 'id')
+        )
+        condition = request.query.get(key_column, '')
+        keys = _parse_in(condition) if condition.startswith('in.') else [condition.partition('.')[2]]
+        for key in keys:
+            row = rows_by_key.get(int(key))
+            if row is not None:
+                row.update(fields)
+                self._coerce(row)
+        if 'return=representation' in request.headers.get('Prefer', ''):
+            rows = [rows_by_key[int(key)] for key in keys if int(key) in rows_by_key]
+            return web.json_response([self._serialize(row, None) for row in rows])
+        return web.Response(status=204)
+
+    async def rpc_followup(self, request: web.Request) -> web.Response:
+        self.requests['RPC get_payments_for_30d_followup'] += 1
+        await self._delay()
+
+        cutoff = datetime.fromisoformat(request.query['cutoff'].replace('Z', '+00:00'))
+        page_size = int(request.query.get('page_size', 500))
+        after_id = request.query.get('after_id')
+        start = bisect.bisect_right(self.payment_keys, int(after_id)) if after_id else 0
+
+        result = []
+        for payment in self.payments[start:]:
+            if self._is_followup_candidate(payment, cutoff):
+                result.append({
+                    'payment_id': payment['id'],
+                    'user_id': payment['telegram_user_id'],
+                    'metadata': payment['metadata'],
+                })
+                if len(result) >= page_size:
+                    break
+        return web.json_response(result)
+
+    def extra_stats(self) -> Dict[str, Any]:
+        return {
+            'pending_unpaid_reminders': self._unpaid_candidates(),
+            'pending_followups': self._followup_candidates(),
+        }
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/__stats', self.stats)
+        app.router.add_get('/rest/v1/users', self.get_users)
+        app.router.add_get('/rest/v1/rpc/get_payments_for_30d_followup', self.rpc_followup)
+        app.router.add_get('/rest/v1/rpc/get_action_counts', self.rpc_action_counts)
+        app.router.add_get('/rest/v1/rpc/get_unique_users', self.rpc_unique_users)
+        app.router.add_route('*', '/rest/v1/rpc/{name}', self.rpc_generic)
+        app.router.add_get('/rest/v1/{table}', self.get_table)
+        app.router.add_post('/rest/v1/{table}', self.insert_rows)
+        app.router.add_patch('/rest/v1/{table}', self.patch_table)
+        return app
+
+
+class FakeStripe(FakeServerBase):
+    """
+    Stripe API для оплаты: POST /v1/checkout/sessions и GET /v1/checkout/sessions/<id>
+    (line_items с Price ID, с которым сессия создана, иначе price_id по умолчанию).
+    """
+
+    def __init__(self, price_id: str = 'price_bench_30', **kwargs):
+        super().__init__(**kwargs)
+        self.price_id = price_id
+        self.sessions: Dict[str, str] = {}
+
+    def _fail(self, name: str) -> Optional[web.Response]:
+        if not self._should_fail():
+            return None
+        self.errors[name] += 1
+        return web.json_response({'error': {'type': 'api_error', 'message': 'fake error'}}, status=500)
+
+    async def create_session(self, request: web.Request) -> web.Response:
+        self.requests['POST checkout.sessions'] += 1
+        await self._delay()
+        failed = self._fail('POST checkout.sessions')
+        if failed is not None:
+            return failed
+
+        form = await request.post()
+        session_id = f"cs_test_bench_{len(self.sessions) + 1}"
+        self.sessions[session_id] = form.get('line_items[0][price]', self.price_id)
+        return web.json_response({
+            'id': session_id,
+            'object': 'checkout.session',
+            'livemode': False,
+            'url': f"https://checkout.stripe.com/c/pay/{session_id}",
+        })
+
+    async def get_session(self, request: web.Request) -> web.Response:
+        self.requests['GET checkout.sessions'] += 1
+        await self._delay()
+        failed = self._fail('GET checkout.sessions')
+        if failed is not None:
+            return failed
+
+        session_id = request.match_info['session_id']
+        price_id = self.sessions.get(session_id, self.price_id)
+        return web.json_response({
+            'id': session_id,
+            'object': 'checkout.session',
+            'livemode': False,
+            'line_items': {
+                'object': 'list',
+                'data': [{'id': 'li_bench', 'object': 'item', 'price': {'id': price_id, 'object': 'price'}}],
+            },
+        })
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/__stats', self.stats)
+        app.router.add_post('/v1/checkout/sessions', self.create_session)
+        app.router.add_get('/v1/checkout/sessions/{session_id}', self.get_session)
+        return app
+
+
+async def _serve(telegram_port: int, postgrest_port: int, options: Dict[str, Any],
+                 stripe_port: Optional[int] = None):
+    telegram = FakeTelegram(
+        latency_ms=options.get('telegram_latency_ms', 0.0),
+        error_rate=options.get('telegram_error_rate', 0.0),
+        retry_after=options.get('retry_after', 1),
+        pending_updates=options.get('pending_updates', 0),
+        chats=options.get('chats', 100),
+    )
+    postgrest = FakePostgREST(
+        users=options.get('users', 10000),
+        latency_ms=options.get('postgrest_latency_ms', 0.0),
+        error_rate=options.get('postgrest_error_rate', 0.0),
+    )
+
+    servers = [(telegram.build_app(), telegram_port), (postgrest.build_app(), postgrest_port)]
+    if stripe_port:
+        stripe = FakeStripe(
+            price_id=options.get('stripe_price_id', 'price_bench_30'),
+            latency_ms=options.get('stripe_latency_ms', 0.0),
+            error_rate=options.get('stripe_error_rate', 0.0),
+        )
+        servers.append((stripe.build_app(), stripe_port))
+
+    runners = []
+    for app, port in servers:
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        runners.append(runner)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def serve_forever(telegram_port: int, postgrest_port: int, options: Dict[str, Any],
+                  stripe_port: Optional[int] = None):
+    asyncio.run(_serve(telegram_port, postgrest_port, options, stripe_port))
+
+
+def start_in_process(telegram_port: int, postgrest_port: int, options: Dict[str, Any],
+                     stripe_port: Optional[int] = None) -> multiprocessing.Process:
+    """Start the fakes in a child process so they don't affect the benchmark's RSS"""
+    process = multiprocessing.Process(
+        target=serve_forever, args=(telegram_port, postgrest_port, options, stripe_port), daemon=True
+    )
+    process.start()
+    return process
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API and PostgREST servers")
+    parser.add_argument('--telegram-port', type=int, default=8081)
+    parser.add_argument('--postgrest-port', type=int, default=8082)
+    parser.add_argument('--stripe-port', type=int, default=8083)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--telegram-latency-ms', type=float, default=30.0)
+    parser.add_argument('--telegram-error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    serve_forever(args.telegram_port, args.postgrest_port, {
+        'users': args.users,
+        'telegram_latency_ms': args.telegram_latency_ms,
+        'telegram_error_rate': args.telegram_error_rate,
+    }, args.stripe_port)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Воспроизведение записанного трафика (traffic_capture.py) против запущенного бота.
+
+Запросы уходят с теми же интервалами, что и в записи, ускоренными в --speed
+раз (--speed 0 - без пауз, так быстро, как отвечает сервер). Каждый запрос -
+отдельная задача, поэтому медленный ответ не сдвигает расписание следующих;
+насколько реплеер всё же отставал от расписания, видно в schedule_lag_ms.
+
+Подпись Stripe в записи не сохраняется (тело после обезличивания другое):
+с --stripe-secret вебхуки подписываются заново секретом целевого окружения,
+без него /stripe_webhook ответит 400 на каждый запрос.
+
+    python -m benchmarks.replay capture.jsonl.gz --target http://127.0.0.1:5000 --speed 5
+
+Задержка /webhook - время HTTP-ответа: обработка обновления идёт в event
+loop после ответа (кроме WEBHOOK_INLINE_REPLY).
+"""
+
+import sys
+import gzip
+import hmac
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+
+def load_capture(paths: List[str], routes: Optional[List[str]] = None, limit: int = 0) -> List[Dict[str, Any]]:
+    """Captured records from one or more files, ordered by arrival time"""
+    records = []
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Последняя строка могла оборваться, если запись ещё идёт
+                        continue
+                    if routes is None or record['route'] in routes:
+                        records.append(record)
+            except EOFError:
+                # Файл ещё пишется: gzip-поток без завершающего блока, всё до него читается
+                pass
+    records.sort(key=lambda record: record['t'])
+    return records[:limit] if limit else records
+
+
+def stripe_signature(payload: str, secret: str) -> str:
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {'p50': 0.0, 'p90': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+
+    return {'p50': rank(0.50), 'p90': rank(0.90), 'p95': rank(0.95), 'p99': rank(0.99),
+            'max': round(ordered[-1] * 1000, 1)}
+
+
+class RouteStats:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.statuses: Dict[str, int] = {}
+        self.errors = 0
+
+    def add(self, latency: float, status: str, ok: bool):
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if not ok:
+            self.errors += 1
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'requests': len(self.latencies),
+            'errors': self.errors,
+            'statuses': dict(sorted(self.statuses.items())),
+            'latency_ms': _percentiles(self.latencies),
+        }
+
+
+async def replay(records: List[Dict[str, Any]], target: str, speed: float = 1.0, concurrency: int = 256,
+                 stripe_secret: Optional[str] = None, timeout: float = 30.0) -> Dict[str, Any]:
+    """Send the records keeping their inter-arrival times divided by speed (0 = no pauses)"""
+    stats: Dict[str, RouteStats] = {}
+    lags: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def send(session: aiohttp.ClientSession, record: Dict[str, Any], due: float):
+        async with semaphore:
+            lags.append(max(0.0, loop.time() - due))
+            route = record['route']
+            payload = json.dumps(record['body'], ensure_ascii=False)
+            headers = {'Content-Type': 'application/json'}
+            if route == 'stripe_webhook' and stripe_secret:
+                headers['Stripe-Signature'] = stripe_signature(payload, stripe_secret)
+            started = time.perf_counter()
+            try:
+                async with session.post(f"{target.rstrip('/')}/{route}", data=payload.encode(),
+                                        headers=headers) as response:
+                    await response.read()
+                    status, ok = str(response.status), response.status < 400
+            except Exception as e:
+                status, ok = type(e).__name__, False
+            stats.setdefault(route, RouteStats()).add(time.perf_counter() - started, status, ok)
+
+    first = records[0]['t'] if records else 0.0
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        tasks = []
+        started = loop.time()
+        for record in records:
+            due = started + ((record['t'] - first) / speed if speed > 0 else 0.0)
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(session, record, due)))
+        await asyncio.gather(*tasks)
+        elapsed = loop.time() - started
+
+    captured_span = records[-1]['t'] - first if records else 0.0
+    return {
+        'target': target,
+        'speed': speed if speed > 0 else 'max',
+        'requests': len(records),
+        'captured_span_sec': round(captured_span, 2),
+        'wall_time_sec': round(elapsed, 2),
+        'rate_per_sec': round(len(records) / elapsed, 1) if elapsed else 0.0,
+        'errors': sum(route.errors for route in stats.values()),
+        'schedule_lag_ms': _percentiles(lags),
+        'routes': {route: route_stats.summary() for route, route_stats in sorted(stats.items())},
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured webhook traffic against a running bot")
+    parser.add_argument('files', nargs='+', help="Capture files (.jsonl or .jsonl.gz)")
+    parser.add_argument('--target', default='http://127.0.0.1:5000')
+    parser.add_argument('--speed', type=float, default=1.0, help="Time multiplier; 0 = as fast as possible")
+    parser.add_argument('--concurrency', type=int, default=256, help="Max requests in flight")
+    parser.add_argument('--routes', help="Comma-separated subset, e.g. webhook")
+    parser.add_argument('--limit', type=int, default=0, help="Replay only the first N records")
+    parser.add_argument('--stripe-secret', help="Webhook secret of the target to re-sign Stripe events")
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--out', help="Write the report to this JSON file")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    return parser.parse_args(argv)
+
+
+def print_result(result: Dict[str, Any]):
+    lag = result['schedule_lag_ms']
+    print(f"{result['requests']} requests to {result['target']} at speed {result['speed']}: "
+          f"{result['wall_time_sec']} s (captured {result['captured_span_sec']} s), "
+          f"{result['rate_per_sec']}/sec, errors {result['errors']}, schedule lag p99 {lag['p99']} ms")
+    for route, summary in result['routes'].items():
+        latency = summary['latency_ms']
+        print(f"  /{route}: {summary['requests']} requests, errors {summary['errors']}, "
+              f"p50 {latency['p50']} ms, p90 {latency['p90']} ms, p95 {latency['p95']} ms, "
+              f"p99 {latency['p99']} ms, max {latency['max']} ms, statuses {summary['statuses']}")
+
+
+def main(args) -> Dict[str, Any]:
+    routes = args.routes.split(',') if args.routes else None
+    records = load_capture(args.files, routes, args.limit)
+    if not records:
+        raise SystemExit("No records to replay")
+    return asyncio.run(replay(records, args.target, args.speed, args.concurrency, args.stripe_secret, args.timeout))
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    result = main(args)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    if args.json:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+    else:
+        print_result(result)
+    sys.exit(1 if result['errors'] else 0)
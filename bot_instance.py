@@ -1,7 +1,16 @@
 from telegram import Bot
 from telegram.ext import Application
-from config import TELEGRAM_TOKEN
+from config import TELEGRAM_TOKEN, TELEGRAM_API_BASE_URL
 from telegram.request import HTTPXRequest
+from inline_reply import InlineReplyRequest
 
-bot = Bot(token=TELEGRAM_TOKEN)
-telegram_app = Application.builder().token(TELEGRAM_TOKEN).build()
+# InlineReplyRequest работает как обычный HTTPXRequest, пока вебхук не открыл слот для ответа,
+# и пишет время каждого вызова Bot API в метрики (telegram_api_seconds)
+bot = Bot(token=TELEGRAM_TOKEN, base_url=TELEGRAM_API_BASE_URL, request=InlineReplyRequest())
+telegram_app = (
+    Application.builder()
+    .token(TELEGRAM_TOKEN)
+    .base_url(TELEGRAM_API_BASE_URL)
+    .request(InlineReplyRequest(connection_pool_size=256))
+    .build()
+)
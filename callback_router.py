@@ -0,0 +1,74 @@
+"""
+Маршрутизация callback_data инлайн-кнопок.
+
+Точные совпадения ищутся в словаре за O(1), префиксные маршруты
+(например premium_users_page_<N>) - в короткой таблице префиксов, которая
+проверяется только если точного маршрута нет.
+
+    router = CallbackRouter()
+
+    @router.exact('plan_30')
+    async def show_plan_30(query, user, arg): ...
+
+    @router.prefix('premium_users_page_')
+    async def show_page(query, user, arg): ...   # arg - часть после префикса
+"""
+
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CallbackHandler = Callable[..., Awaitable[None]]
+
+
+class CallbackRouter:
+    def __init__(self):
+        self._exact: Dict[str, CallbackHandler] = {}
+        self._prefixes: List[Tuple[str, CallbackHandler]] = []
+
+    def exact(self, *callback_data: str):
+        """Register a handler for one or more exact callback_data values"""
+        def decorator(handler: CallbackHandler) -> CallbackHandler:
+            for data in callback_data:
+                if data in self._exact:
+                    raise ValueError(f"Callback '{data}' is already routed to {self._exact[data].__name__}")
+                self._exact[data] = handler
+            return handler
+        return decorator
+
+    def prefix(self, prefix: str):
+        """Register a handler for callback_data starting with prefix; longer prefixes win"""
+        def decorator(handler: CallbackHandler) -> CallbackHandler:
+            self._prefixes.append((prefix, handler))
+            self._prefixes.sort(key=lambda item: len(item[0]), reverse=True)
+            return handler
+        return decorator
+
+    def resolve(self, data: str) -> Tuple[Optional[CallbackHandler], str]:
+        """
+        Find the handler for callback_data
+
+        Returns:
+            (handler, arg): arg - остаток после префикса, '' для точного маршрута;
+            (None, '') если маршрута нет
+        """
+        handler = self._exact.get(data)
+        if handler is not None:
+            return handler, ''
+        for prefix, handler in self._prefixes:
+            if data.startswith(prefix):
+                return handler, data[len(prefix):]
+        return None, ''
+
+    async def dispatch(self, data: str, *args) -> bool:
+        """Call the handler as handler(*args, arg); False if nothing matched"""
+        handler, arg = self.resolve(data)
+        if handler is None:
+            logger.warning(f"⚠️ Неизвестный callback: {data}")
+            return False
+        await handler(*args, arg)
+        return True
+
+    def routes(self) -> List[str]:
+        return list(self._exact) + [f"{prefix}*" for prefix, _ in self._prefixes]
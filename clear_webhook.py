@@ -2,30 +2,30 @@
 """
 Temporary script to clear webhook and reset it.
 Run this once to clear pending updates.
+
+URL берётся из WEBHOOK_URL (или HEROKU_APP_NAME) - тот же /webhook, что ставит /set_webhook.
 """
-import os
 import asyncio
 from telegram import Bot
 import logging
+from config import TELEGRAM_TOKEN, TELEGRAM_API_BASE_URL
+from polling_runner import switch_to_webhook
 
 logger = logging.getLogger(__name__)
 
 async def clear_and_reset_webhook():
-    token = os.getenv('TELEGRAM_TOKEN')
-    if not token:
+    if not TELEGRAM_TOKEN:
         logger.error("TELEGRAM_TOKEN not found")
         return
     
-    bot = Bot(token=token)
+    bot = Bot(token=TELEGRAM_TOKEN, base_url=TELEGRAM_API_BASE_URL)
     
     # Delete webhook to clear pending updates
     logger.info("Deleting webhook...")
     await bot.delete_webhook(drop_pending_updates=True)
     
     # Set new webhook
-    webhook_url = f"https://minys40kg-tg-bot-90475322074f.herokuapp.com/webhook/{token}"
-    logger.info(f"Setting webhook to: {webhook_url}")
-    await bot.set_webhook(url=webhook_url)
+    await switch_to_webhook(bot)
     
     logger.info("Webhook reset successfully!")
 
@@ -1,5 +1,8 @@
 import os
 import stripe
+import threading
+from types import MappingProxyType
+from typing import Callable, List, Optional
 from dotenv import load_dotenv
 import logging
 
@@ -10,40 +13,151 @@ load_dotenv()
 
 # Telegram Bot Configuration
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
+# Можно направить бота на локальный Bot API сервер или фейковый сервер бенчмарка
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL', 'https://api.telegram.org/bot')
 WEBHOOK_URL = os.getenv('WEBHOOK_URL') or f"https://{os.getenv('HEROKU_APP_NAME')}.herokuapp.com"
 """ ADMIN_ID = os.getenv('ADMIN_USER_ID', '') """
 ADMIN_IDS = os.getenv('ADMIN_USER_IDS', '')
+# Токен служебных HTTP эндпоинтов (/admin/...): Authorization: Bearer <token>
+ADMIN_API_TOKEN = os.getenv('ADMIN_API_TOKEN')
 
 # Stripe Configuration
+# Переменные окружения с Price ID по режимам цен: {режим: {план: переменная}}
+PRICE_ID_ENV_VARS = {
+    'test': {'30': 'PRICE_ID_TEST_29', '500': 'PRICE_ID_TEST_490'},  # Test Price IDs for 29$ / 490$ plans
+    'live_real': {'30': 'PRICE_ID_LIVE_30', '500': 'PRICE_ID_LIVE_500'},  # Live Price IDs for 29$ / 490$ plans
+    'live_one_dollar': {'30': 'PRICE_ID_LIVE_1_DOLLAR_30', '500': 'PRICE_ID_LIVE_1_DOLLAR_500'},  # $1 versions
+}
+
+PRICING_MODE_DESCRIPTIONS = {
+    'test': "Test mode (no real money)",
+    'live_one_dollar': "Live mode with $1 prices",
+    'live_real': "Live mode with real prices",
+}
+
+
+def parse_admin_ids(raw: str) -> frozenset:
+    return frozenset(int(i.strip()) for i in (raw or '').split(',') if i.strip().isdigit())
+
+
+class ConfigSnapshot:
+    """
+    Неизменяемый снимок настроек, собранный из окружения один раз.
+
+    Горячие пути (кнопки, add_or_update_user, обработка платежа) читают
+    готовые значения отсюда, а не парсят os.environ заново. При reload_config()
+    собирается новый снимок и подменяется одной операцией присваивания, так что
+    читатель всегда видит целиком либо старые, либо новые настройки.
+    """
+
+    __slots__ = (
+        'admin_ids', 'test_mode', 'one_dollar_prices', 'pricing_mode',
+        'price_ids', 'current_price_ids', 'plan_by_price_id', 'stripe_keys',
+        'stripe_api_key', 'stripe_webhook_secret', 'support_link', 'join_group_link',
+    )
+
+    def __init__(self, env=None, test_mode: Optional[bool] = None, one_dollar_prices: Optional[bool] = None):
+        """
+        Args:
+            env: Источник значений, по умолчанию os.environ
+            test_mode, one_dollar_prices: Режим цен, выбранный на лету (pricing_mode.py);
+                None - берётся из STRIPE_IS_TEST_MODE_ON / USE_ONE_DOLLAR_PRICES
+        """
+        env = os.environ if env is None else env
+        if test_mode is None:
+            test_mode = env.get('STRIPE_IS_TEST_MODE_ON') == 'True'
+        if one_dollar_prices is None:
+            one_dollar_prices = env.get('USE_ONE_DOLLAR_PRICES', 'False') == 'True'
+        if test_mode:
+            pricing_mode = 'test'
+        elif one_dollar_prices:
+            pricing_mode = 'live_one_dollar'
+        else:
+            pricing_mode = 'live_real'
+
+        price_ids = MappingProxyType({
+            mode: MappingProxyType({plan: env.get(var) for plan, var in plans.items()})
+            for mode, plans in PRICE_ID_ENV_VARS.items()
+        })
+        # Обратный индекс для вебхука Stripe: Price ID -> план, по всем режимам
+        plan_by_price_id = {}
+        for plans in price_ids.values():
+            for plan, price_id in plans.items():
+                if price_id:
+                    plan_by_price_id.setdefault(price_id, plan)
+
+        # Оба набора ключей Stripe: режим переключается без рестарта, а вебхуки
+        # от сессий, созданных до переключения, подписаны секретом прежнего режима
+        stripe_keys = MappingProxyType({
+            stripe_mode: MappingProxyType({
+                'api_key': env.get(f'STRIPE_{stripe_mode.upper()}_API_KEY'),
+                'webhook_secret': env.get(f'STRIPE_{stripe_mode.upper()}_WEBHOOK_SECRET'),
+            })
+            for stripe_mode in ('test', 'live')
+        })
+        active_keys = stripe_keys['test' if test_mode else 'live']
+        values = {
+            'admin_ids': parse_admin_ids(env.get('ADMIN_USER_IDS', '')),
+            'test_mode': test_mode,
+            'one_dollar_prices': one_dollar_prices,
+            'pricing_mode': pricing_mode,
+            'price_ids': price_ids,
+            'current_price_ids': price_ids[pricing_mode],
+            'plan_by_price_id': MappingProxyType(plan_by_price_id),
+            'stripe_keys': stripe_keys,
+            'stripe_api_key': active_keys['api_key'],
+            'stripe_webhook_secret': active_keys['webhook_secret'],
+            'support_link': env.get('ACCOUNT_OF_SUPPORT'),
+            'join_group_link': env.get('JOIN_GROUP_LINK'),
+        }
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ConfigSnapshot is immutable, use reload_config()")
+
+    def __delattr__(self, name):
+        raise AttributeError("ConfigSnapshot is immutable, use reload_config()")
+
+    def is_admin(self, user_id: int) -> bool:
+        return user_id in self.admin_ids
+
+    @property
+    def pricing_mode_description(self) -> str:
+        return PRICING_MODE_DESCRIPTIONS[self.pricing_mode]
+
+    def price_id_for(self, plan: str) -> Optional[str]:
+        return self.current_price_ids.get(plan)
+
+    def webhook_secrets(self) -> List[str]:
+        """Active mode's webhook secret first, then the other mode's one"""
+        secrets = [self.stripe_webhook_secret]
+        secrets.extend(keys['webhook_secret'] for keys in self.stripe_keys.values())
+        return [secret for i, secret in enumerate(secrets) if secret and secret not in secrets[:i]]
+
+
+_snapshot = ConfigSnapshot()
+_reload_lock = threading.Lock()
+_reload_env = None
+# Режим цен, выбранный на лету: {'test_mode': bool, 'one_dollar_prices': bool}
+_pricing_override: dict = {}
+_reload_listeners: List[Callable[[ConfigSnapshot], None]] = []
+
+stripe.api_key = _snapshot.stripe_api_key
+# Можно направить Stripe API на фейковый сервер бенчмарка
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE')
+if STRIPE_API_BASE:
+    stripe.api_base = STRIPE_API_BASE
+logger.info(f'Stripe pricing mode: {_snapshot.pricing_mode_description}. '
+            f'PRICE_ID_30={_snapshot.price_id_for("30")}, PRICE_ID_500={_snapshot.price_id_for("500")}')
+
+# Значения на момент импорта - для старого кода; новый код читает get_config()
 STRIPE_IS_TEST_MODE_ON = os.getenv('STRIPE_IS_TEST_MODE_ON')
 USE_ONE_DOLLAR_PRICES = os.getenv('USE_ONE_DOLLAR_PRICES', 'False')
-
-# Price ID configuration for different modes
-if STRIPE_IS_TEST_MODE_ON == 'True':
-    # Test mode - using test Price IDs
-    STRIPE_API_KEY = os.getenv('STRIPE_TEST_API_KEY')
-    STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_TEST_WEBHOOK_SECRET')
-    PRICE_ID_30 = os.getenv('PRICE_ID_TEST_29')  # Test Price ID for 29$ plan
-    PRICE_ID_500 = os.getenv('PRICE_ID_TEST_490')  # Test Price ID for 490$ plan
-    stripe.api_key = STRIPE_API_KEY
-    logger.info(f'Stripe test mode is chosen. Price IDs: 30=${PRICE_ID_30}, 500=${PRICE_ID_500}', exc_info=True)
-else:
-    # Live mode
-    STRIPE_API_KEY = os.getenv('STRIPE_LIVE_API_KEY')
-    STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_LIVE_WEBHOOK_SECRET')
-    
-    if USE_ONE_DOLLAR_PRICES == 'True':
-        # Live mode with $1 prices for testing
-        PRICE_ID_30 = os.getenv('PRICE_ID_LIVE_1_DOLLAR_30')  # $1 version of 29$ plan
-        PRICE_ID_500 = os.getenv('PRICE_ID_LIVE_1_DOLLAR_500')  # $1 version of 490$ plan
-        logger.info(f'✅ Stripe live mode with $1 prices is chosen. PRICE_ID_30={PRICE_ID_30}, PRICE_ID_500={PRICE_ID_500}', exc_info=True)
-    else:
-        # Live mode with real prices
-        PRICE_ID_30 = os.getenv('PRICE_ID_LIVE_30')  # Live Price ID for 29$ plan  
-        PRICE_ID_500 = os.getenv('PRICE_ID_LIVE_500')  # Live Price ID for 490$ plan
-        logger.info(f'Stripe live mode with real prices is chosen. PRICE_ID_30={PRICE_ID_30}, PRICE_ID_500={PRICE_ID_500}', exc_info=True)
-    
-    stripe.api_key = STRIPE_API_KEY
+STRIPE_API_KEY = _snapshot.stripe_api_key
+STRIPE_WEBHOOK_SECRET = _snapshot.stripe_webhook_secret
+PRICE_ID_30 = _snapshot.price_id_for('30')
+PRICE_ID_500 = _snapshot.price_id_for('500')
 
 # Supabase Configuration
 SUPABASE_URL = os.getenv('SUPABASE_URL')
@@ -64,11 +178,74 @@ PRICE_ID_LIVE_1_DOLLAR_500 = os.getenv('PRICE_ID_LIVE_1_DOLLAR_500')
 
 
 
-def get_admin_ids() -> set[int]:
-    return {int(i.strip()) for i in ADMIN_IDS.split(',') if i.strip().isdigit()}
+def get_config() -> ConfigSnapshot:
+    """Current config snapshot; keep the reference for the whole operation"""
+    return _snapshot
+
+
+def on_config_reload(listener: Callable[[ConfigSnapshot], None]):
+    """Call listener(snapshot) after every reload_config()"""
+    _reload_listeners.append(listener)
+    return listener
+
+
+def _swap_snapshot(snapshot: ConfigSnapshot) -> List[Callable[[ConfigSnapshot], None]]:
+    global _snapshot
+    stripe.api_key = snapshot.stripe_api_key
+    _snapshot = snapshot
+    return list(_reload_listeners)
+
+
+def _notify_listeners(snapshot: ConfigSnapshot, listeners):
+    for listener in listeners:
+        try:
+            listener(snapshot)
+        except Exception as e:
+            logger.error(f"❌ Ошибка в обработчике перезагрузки конфигурации {listener}: {e}", exc_info=True)
+
+
+def reload_config(env=None) -> ConfigSnapshot:
+    """
+    Build a new snapshot and swap it in atomically
+
+    Args:
+        env: Источник значений, по умолчанию os.environ (с перечитанным .env)
+    """
+    global _reload_env
+    with _reload_lock:
+        if env is None:
+            load_dotenv(override=True)
+        _reload_env = env
+        snapshot = ConfigSnapshot(env, **_pricing_override)
+        listeners = _swap_snapshot(snapshot)
+    logger.info(f"🔄 Конфигурация перечитана: {snapshot.pricing_mode_description}, админов: {len(snapshot.admin_ids)}")
+    _notify_listeners(snapshot, listeners)
+    return snapshot
+
+
+def set_pricing_flags(test_mode: bool, one_dollar_prices: bool) -> ConfigSnapshot:
+    """
+    Switch the pricing mode in this process without touching the environment
+
+    Survives reload_config(); used by pricing_mode.py
+    """
+    global _pricing_override
+    with _reload_lock:
+        _pricing_override = {'test_mode': test_mode, 'one_dollar_prices': one_dollar_prices}
+        if _snapshot.test_mode == test_mode and _snapshot.one_dollar_prices == one_dollar_prices:
+            return _snapshot
+        snapshot = ConfigSnapshot(_reload_env, **_pricing_override)
+        listeners = _swap_snapshot(snapshot)
+    logger.info(f"💱 Режим цен переключён: {snapshot.pricing_mode_description}")
+    _notify_listeners(snapshot, listeners)
+    return snapshot
+
+
+def get_admin_ids() -> frozenset:
+    return _snapshot.admin_ids
 
 def is_admin(user_id: int) -> bool:
-    return user_id in get_admin_ids()
+    return user_id in _snapshot.admin_ids
 
 def is_test_mode() -> bool:
     """
@@ -77,7 +254,7 @@ def is_test_mode() -> bool:
     Returns:
         bool: True if test mode is enabled, False for live mode
     """
-    return STRIPE_IS_TEST_MODE_ON == 'True'
+    return _snapshot.test_mode
 
 def is_using_one_dollar_prices() -> bool:
     """
@@ -86,7 +263,7 @@ def is_using_one_dollar_prices() -> bool:
     Returns:
         bool: True if using $1 prices in live mode, False for real prices
     """
-    return USE_ONE_DOLLAR_PRICES == 'True'
+    return _snapshot.one_dollar_prices
 
 def get_current_pricing_mode() -> str:
     """
@@ -95,12 +272,7 @@ def get_current_pricing_mode() -> str:
     Returns:
         str: Description of current pricing mode
     """
-    if is_test_mode():
-        return "Test mode (no real money)"
-    elif is_using_one_dollar_prices():
-        return "Live mode with $1 prices"
-    else:
-        return "Live mode with real prices"
+    return _snapshot.pricing_mode_description
 
 def get_all_price_ids() -> dict:
     """
@@ -109,31 +281,17 @@ def get_all_price_ids() -> dict:
     Returns:
         dict: Dictionary with all price IDs
     """
-    return {
-        'test': {
-            '30': os.getenv('PRICE_ID_TEST_29'),  # Test Price ID for 29$ plan
-            '500': os.getenv('PRICE_ID_TEST_490')  # Test Price ID for 490$ plan
-        },
-        'live_real': {
-            '30': os.getenv('PRICE_ID_LIVE_30'),  # Live Price ID for 29$ plan
-            '500': os.getenv('PRICE_ID_LIVE_500')  # Live Price ID for 490$ plan
-        },
-        'live_one_dollar': {
-            '30': os.getenv('PRICE_ID_LIVE_1_DOLLAR_30'),  # $1 version of 29$ plan
-            '500': os.getenv('PRICE_ID_LIVE_1_DOLLAR_500')  # $1 version of 490$ plan
-        },
-        'current': {
-            '30': PRICE_ID_30,
-            '500': PRICE_ID_500
-        }
-    }
+    snapshot = _snapshot
+    return {**snapshot.price_ids, 'current': snapshot.current_price_ids}
 
     """ "ADMIN_ID", """
 __all__ = [
     # Telegram
     "TELEGRAM_TOKEN",
+    "TELEGRAM_API_BASE_URL",
     "WEBHOOK_URL",
     "ADMIN_IDS",
+    "ADMIN_API_TOKEN",
     
     # Stripe
     "STRIPE_API_KEY",
@@ -157,6 +315,13 @@ __all__ = [
     "HEROKU_APP_NAME",
     "HEROKU_API_KEY",
     
+    # Snapshot
+    "ConfigSnapshot",
+    "get_config",
+    "reload_config",
+    "on_config_reload",
+    "set_pricing_flags",
+    
     # Functions
     "get_admin_ids",
     "is_admin",
@@ -0,0 +1,32 @@
+-- migrate:no-transaction
+-- Индексы под запросы, которые бот и админка выполняют постоянно.
+-- CREATE INDEX CONCURRENTLY не блокирует запись в таблицы на проде,
+-- но не может выполняться внутри транзакции, поэтому миграция без транзакции.
+
+-- users?user_id=eq.X (add_or_update_user, log_user_action, PATCH из reminder_bot)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_user_id
+    ON public.users (user_id);
+
+-- users по payment_status + last_activity (reminder_bot, активные пользователи)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_payment_status_last_activity
+    ON public.users (payment_status, last_activity);
+
+-- user_actions за период (get_button_stats, get_user_engagement)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_actions_timestamp
+    ON public.user_actions ("timestamp");
+
+-- user_actions по action за период (get_conversion_funnel, get_time_based_stats)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_actions_action_timestamp
+    ON public.user_actions (action, "timestamp");
+
+-- действия одного пользователя, свежие сверху (get_user_actions)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_actions_user_id_timestamp
+    ON public.user_actions (user_id, "timestamp" DESC);
+
+-- payments по статусу за период (get_monthly_revenue, статистика платежей)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_payments_status_created_at
+    ON public.payments (status, created_at);
+
+-- payments за период без фильтра по статусу (get_payment_summary)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_payments_created_at
+    ON public.payments (created_at);
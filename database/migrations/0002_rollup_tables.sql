@@ -0,0 +1,41 @@
+-- Rollup таблицы для статистики админки.
+-- Заполняются функцией public.refresh_rollups() (rpc_functions.sql): она
+-- пересчитывает бакеты от прошлого watermark до текущего момента. Всё, что
+-- новее watermark, статистические функции дочитывают из сырых таблиц.
+
+-- Количество действий по часам (get_time_based_stats, get_action_counts)
+CREATE TABLE IF NOT EXISTS public.user_actions_hourly (
+    bucket TIMESTAMPTZ NOT NULL,
+    action TEXT NOT NULL,
+    action_count BIGINT NOT NULL,
+    PRIMARY KEY (bucket, action)
+);
+
+-- Уникальные пользователи по дням и действию (воронка считает DISTINCT user_id)
+CREATE TABLE IF NOT EXISTS public.user_action_users_daily (
+    bucket TIMESTAMPTZ NOT NULL,
+    action TEXT NOT NULL,
+    user_id BIGINT NOT NULL,
+    PRIMARY KEY (bucket, action, user_id)
+);
+
+-- Платежи по дням в разрезе план x статус x валюта
+-- (get_payment_summary, get_monthly_revenue). NULL хранится как 'unknown'/'USD',
+-- так же, как его показывают статистические функции.
+CREATE TABLE IF NOT EXISTS public.payments_daily (
+    bucket TIMESTAMPTZ NOT NULL,
+    plan_key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    currency_key TEXT NOT NULL,
+    payment_count BIGINT NOT NULL,
+    amount_count BIGINT NOT NULL,
+    revenue NUMERIC,
+    PRIMARY KEY (bucket, plan_key, status, currency_key)
+);
+
+-- До какого момента (не включительно) каждая rollup таблица посчитана
+CREATE TABLE IF NOT EXISTS public.rollup_watermarks (
+    rollup_name TEXT PRIMARY KEY,
+    rolled_up_to TIMESTAMPTZ NOT NULL,
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
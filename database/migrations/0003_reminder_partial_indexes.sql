@@ -0,0 +1,17 @@
+-- migrate:no-transaction
+-- Частичные индексы под выборки reminder_bot: в индекс попадают только
+-- кандидаты на уведомление, поэтому он остаётся маленьким, а выборка идёт
+-- страницами по ключу (user_id / id) без сортировки.
+
+-- Неоплатившие пользователи, которым ещё не отправляли напоминание через сутки
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_unpaid_not_notified
+    ON public.users (user_id) INCLUDE (last_activity)
+    WHERE payment_status = 'unpaid'
+      AND did_user_get_notification_after_24h_without_payment IS NOT TRUE;
+
+-- Оплаченные картой платежи без follow-up через 30 дней
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_payments_30d_followup_pending
+    ON public.payments (id) INCLUDE (created_at)
+    WHERE status = 'paid'
+      AND payment_method = 'card'
+      AND notified_after_30d = FALSE;
@@ -0,0 +1,11 @@
+-- Последний запуск фоновых задач планировщика (scheduler.py).
+-- По last_run_at каждая реплика понимает, когда задача запускалась в
+-- последний раз, даже после рестарта dyno.
+CREATE TABLE IF NOT EXISTS public.job_runs (
+    job_name TEXT PRIMARY KEY,
+    last_run_at TIMESTAMPTZ NOT NULL,
+    last_status TEXT NOT NULL,
+    last_result JSONB,
+    last_duration_ms INTEGER,
+    run_by TEXT
+);
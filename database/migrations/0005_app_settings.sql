@@ -0,0 +1,26 @@
+-- Настройки приложения, которые меняются на лету без рестарта dyno.
+-- pricing_mode.py хранит здесь режим цен Stripe ({"test_mode": bool,
+-- "one_dollar_prices": bool}). Триггер шлёт NOTIFY app_settings с ключом
+-- изменённой настройки: остальные процессы и dyno подхватывают её сразу,
+-- в том числе при ручном UPDATE из SQL редактора Supabase.
+CREATE TABLE IF NOT EXISTS public.app_settings (
+    key TEXT PRIMARY KEY,
+    value JSONB NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_by TEXT
+);
+
+CREATE OR REPLACE FUNCTION public.notify_app_settings_changed()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM pg_notify('app_settings', NEW.key);
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS app_settings_notify ON public.app_settings;
+CREATE TRIGGER app_settings_notify
+    AFTER INSERT OR UPDATE ON public.app_settings
+    FOR EACH ROW EXECUTE FUNCTION public.notify_app_settings_changed();
@@ -0,0 +1,11 @@
+-- Журнал рассылок reminder_sender.py: получатель записывается сразу после
+-- отправки (acked = FALSE) и отмечается после пакетного PATCH в Supabase.
+-- Диск dyno очищается при рестарте, поэтому журнал живёт в базе: после
+-- падения между отправкой и отметкой получатель не получит сообщение повторно.
+CREATE TABLE IF NOT EXISTS public.reminder_journal (
+    campaign TEXT NOT NULL,
+    recipient_key TEXT NOT NULL,
+    acked BOOLEAN NOT NULL DEFAULT FALSE,
+    sent_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (campaign, recipient_key)
+);
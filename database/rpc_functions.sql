@@ -1,47 +1,334 @@
+-- =====================================================================
+-- Rollups: бакеты из таблиц миграции 0002 + сырые строки новее watermark
+-- =====================================================================
+
+-- Пересчитать rollup таблицы от прошлого watermark до текущего момента.
+-- Последний бакет перед watermark пересчитывается заново, чтобы подхватить
+-- строки, вставленные с опозданием. Вызывается по расписанию (pg_cron или
+-- планировщик бота) и безопасна при параллельном запуске.
+CREATE OR REPLACE FUNCTION public.refresh_rollups(
+    settle_interval INTERVAL DEFAULT INTERVAL '5 minutes'
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    hourly_from TIMESTAMPTZ;
+    hourly_to TIMESTAMPTZ := DATE_TRUNC('hour', NOW() - settle_interval);
+    daily_from TIMESTAMPTZ;
+    daily_to TIMESTAMPTZ := DATE_TRUNC('day', NOW() - settle_interval);
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('refresh_rollups'));
+
+    -- user_actions_hourly
+    SELECT rolled_up_to - INTERVAL '1 hour' INTO hourly_from
+    FROM public.rollup_watermarks WHERE rollup_name = 'user_actions_hourly';
+    hourly_from := COALESCE(hourly_from, '-infinity');
+
+    DELETE FROM public.user_actions_hourly
+    WHERE bucket >= hourly_from AND bucket < hourly_to;
+
+    INSERT INTO public.user_actions_hourly (bucket, action, action_count)
+    SELECT DATE_TRUNC('hour', "timestamp"), action, COUNT(*)
+    FROM public.user_actions
+    WHERE "timestamp" >= hourly_from
+      AND "timestamp" < hourly_to
+      AND action IS NOT NULL
+    GROUP BY 1, 2;
+
+    -- user_action_users_daily
+    SELECT rolled_up_to - INTERVAL '1 day' INTO daily_from
+    FROM public.rollup_watermarks WHERE rollup_name = 'user_action_users_daily';
+    daily_from := COALESCE(daily_from, '-infinity');
+
+    DELETE FROM public.user_action_users_daily
+    WHERE bucket >= daily_from AND bucket < daily_to;
+
+    INSERT INTO public.user_action_users_daily (bucket, action, user_id)
+    SELECT DISTINCT DATE_TRUNC('day', "timestamp"), action, user_id
+    FROM public.user_actions
+    WHERE "timestamp" >= daily_from
+      AND "timestamp" < daily_to
+      AND action IS NOT NULL
+      AND user_id IS NOT NULL;
+
+    -- payments_daily
+    SELECT rolled_up_to - INTERVAL '1 day' INTO daily_from
+    FROM public.rollup_watermarks WHERE rollup_name = 'payments_daily';
+    daily_from := COALESCE(daily_from, '-infinity');
+
+    DELETE FROM public.payments_daily
+    WHERE bucket >= daily_from AND bucket < daily_to;
+
+    INSERT INTO public.payments_daily (bucket, plan_key, status, currency_key,
+                                       payment_count, amount_count, revenue)
+    SELECT
+        DATE_TRUNC('day', created_at),
+        COALESCE(plan_id::TEXT, 'unknown'),
+        COALESCE(status, 'unknown'),
+        COALESCE(currency, 'USD'),
+        COUNT(*),
+        COUNT(amount),
+        SUM(amount)
+    FROM public.payments
+    WHERE created_at >= daily_from
+      AND created_at < daily_to
+    GROUP BY 1, 2, 3, 4;
+
+    INSERT INTO public.rollup_watermarks (rollup_name, rolled_up_to, refreshed_at)
+    VALUES
+        ('user_actions_hourly', hourly_to, NOW()),
+        ('user_action_users_daily', daily_to, NOW()),
+        ('payments_daily', daily_to, NOW())
+    ON CONFLICT (rollup_name) DO UPDATE
+    SET rolled_up_to = EXCLUDED.rolled_up_to,
+        refreshed_at = EXCLUDED.refreshed_at;
+
+    RETURN (
+        SELECT jsonb_object_agg(rollup_name, rolled_up_to)
+        FROM public.rollup_watermarks
+    );
+END;
+$$;
+
+-- Границы чтения: целые бакеты внутри [start_date, end_date] до watermark
+-- берутся из rollup таблицы, голова [start_date, full_from) и хвост
+-- [full_to, end_date] - из сырых строк. Без watermark всё читается из сырых.
+CREATE OR REPLACE FUNCTION public.rollup_bounds(
+    rollup TEXT,
+    bucket_size TEXT,
+    start_date TIMESTAMPTZ,
+    end_date TIMESTAMPTZ,
+    OUT full_from TIMESTAMPTZ,
+    OUT full_to TIMESTAMPTZ
+)
+LANGUAGE SQL
+STABLE
+AS $$
+    WITH aligned AS (
+        SELECT CASE
+            WHEN DATE_TRUNC(bucket_size, start_date) = start_date THEN start_date
+            ELSE DATE_TRUNC(bucket_size, start_date) + ('1 ' || bucket_size)::INTERVAL
+        END AS full_from
+    )
+    SELECT
+        aligned.full_from,
+        GREATEST(
+            aligned.full_from,
+            LEAST(
+                DATE_TRUNC(bucket_size, end_date),
+                COALESCE(
+                    (SELECT rolled_up_to FROM public.rollup_watermarks WHERE rollup_name = rollup),
+                    '-infinity'
+                )
+            )
+        )
+    FROM aligned;
+$$;
+
+-- Количество действий за период
+CREATE OR REPLACE FUNCTION public.user_action_counts_range(
+    start_date TIMESTAMPTZ,
+    end_date TIMESTAMPTZ
+)
+RETURNS TABLE (action TEXT, action_count BIGINT)
+LANGUAGE SQL
+STABLE
+AS $$
+    WITH bounds AS (
+        SELECT * FROM public.rollup_bounds('user_actions_hourly', 'hour', start_date, end_date)
+    ),
+    parts AS (
+        SELECT h.action, h.action_count
+        FROM public.user_actions_hourly h
+        WHERE h.bucket >= (SELECT full_from FROM bounds)
+          AND h.bucket < (SELECT full_to FROM bounds)
+        UNION ALL
+        SELECT a.action, COUNT(*)
+        FROM public.user_actions a
+        WHERE a."timestamp" >= start_date
+          AND a."timestamp" < (SELECT full_from FROM bounds)
+          AND a."timestamp" <= end_date
+          AND a.action IS NOT NULL
+        GROUP BY a.action
+        UNION ALL
+        SELECT a.action, COUNT(*)
+        FROM public.user_actions a
+        WHERE a."timestamp" >= (SELECT full_to FROM bounds)
+          AND a."timestamp" <= end_date
+          AND a.action IS NOT NULL
+        GROUP BY a.action
+    )
+    SELECT parts.action, SUM(parts.action_count)::BIGINT
+    FROM parts
+    GROUP BY parts.action;
+$$;
+
+-- Пары (действие, пользователь) за период, без повторов
+CREATE OR REPLACE FUNCTION public.user_action_users_range(
+    start_date TIMESTAMPTZ,
+    end_date TIMESTAMPTZ
+)
+RETURNS TABLE (action TEXT, user_id BIGINT)
+LANGUAGE SQL
+STABLE
+AS $$
+    WITH bounds AS (
+        SELECT * FROM public.rollup_bounds('user_action_users_daily', 'day', start_date, end_date)
+    )
+    SELECT d.action, d.user_id
+    FROM public.user_action_users_daily d
+    WHERE d.bucket >= (SELECT full_from FROM bounds)
+      AND d.bucket < (SELECT full_to FROM bounds)
+    UNION
+    SELECT a.action, a.user_id
+    FROM public.user_actions a
+    WHERE a."timestamp" >= start_date
+      AND a."timestamp" < (SELECT full_from FROM bounds)
+      AND a."timestamp" <= end_date
+      AND a.action IS NOT NULL
+      AND a.user_id IS NOT NULL
+    UNION
+    SELECT a.action, a.user_id
+    FROM public.user_actions a
+    WHERE a."timestamp" >= (SELECT full_to FROM bounds)
+      AND a."timestamp" <= end_date
+      AND a.action IS NOT NULL
+      AND a.user_id IS NOT NULL;
+$$;
+
+-- Платежи за период по дням в разрезе план x статус x валюта
+CREATE OR REPLACE FUNCTION public.payments_daily_range(
+    start_date TIMESTAMPTZ,
+    end_date TIMESTAMPTZ
+)
+RETURNS TABLE (
+    bucket TIMESTAMPTZ,
+    plan_key TEXT,
+    status TEXT,
+    currency_key TEXT,
+    payment_count BIGINT,
+    amount_count BIGINT,
+    revenue NUMERIC
+)
+LANGUAGE SQL
+STABLE
+AS $$
+    WITH bounds AS (
+        SELECT * FROM public.rollup_bounds('payments_daily', 'day', start_date, end_date)
+    )
+    SELECT d.bucket, d.plan_key, d.status, d.currency_key,
+           d.payment_count, d.amount_count, d.revenue
+    FROM public.payments_daily d
+    WHERE d.bucket >= (SELECT full_from FROM bounds)
+      AND d.bucket < (SELECT full_to FROM bounds)
+    UNION ALL
+    SELECT
+        DATE_TRUNC('day', p.created_at),
+        COALESCE(p.plan_id::TEXT, 'unknown'),
+        COALESCE(p.status, 'unknown'),
+        COALESCE(p.currency, 'USD'),
+        COUNT(*),
+        COUNT(p.amount),
+        SUM(p.amount)
+    FROM public.payments p
+    WHERE (
+            p.created_at >= start_date
+        AND p.created_at < (SELECT full_from FROM bounds)
+        AND p.created_at <= end_date
+    ) OR (
+            p.created_at >= (SELECT full_to FROM bounds)
+        AND p.created_at <= end_date
+    )
+    GROUP BY 1, 2, 3, 4;
+$$;
+
+-- Количество действий за период: {"start_bot": 120, ...}
+CREATE OR REPLACE FUNCTION public.get_action_counts(
+    start_date TIMESTAMPTZ DEFAULT (NOW() - INTERVAL '1 day'),
+    end_date TIMESTAMPTZ DEFAULT NOW()
+)
+RETURNS JSONB
+LANGUAGE SQL
+STABLE
+AS $$
+    SELECT COALESCE(jsonb_object_agg(action, action_count), '{}'::JSONB)
+    FROM public.user_action_counts_range(start_date, end_date);
+$$;
+
+-- Уникальные пользователи с хотя бы одним действием за период
+CREATE OR REPLACE FUNCTION public.get_unique_users(
+    start_date TIMESTAMPTZ DEFAULT (NOW() - INTERVAL '30 days'),
+    end_date TIMESTAMPTZ DEFAULT NOW()
+)
+RETURNS BIGINT
+LANGUAGE SQL
+STABLE
+AS $$
+    SELECT COUNT(DISTINCT user_id)
+    FROM public.user_action_users_range(start_date, end_date);
+$$;
+
+-- Планировать обновление rollups через pg_cron, если расширение установлено
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+        PERFORM cron.schedule('refresh-rollups', '*/5 * * * *', 'SELECT public.refresh_rollups()');
+    END IF;
+END;
+$$;
+
 -- Get payment summary statistics
+-- Один проход по дневным бакетам payments_daily_range: GROUPING SETS считает
+-- общий итог, разбивку по плану и разбивку по валюте в одном агрегате.
 CREATE OR REPLACE FUNCTION public.get_payment_summary(
     start_date TIMESTAMPTZ DEFAULT (NOW() - INTERVAL '30 days'),
     end_date TIMESTAMPTZ DEFAULT NOW()
 )
 RETURNS JSONB
 LANGUAGE SQL
+STABLE
 AS $$
+    WITH grouped AS (
+        SELECT
+            -- 3 = общий итог, 1 = по плану, 2 = по валюте
+            GROUPING(plan_key, currency_key) AS grouping_level,
+            plan_key,
+            currency_key,
+            SUM(payment_count) AS payment_count,
+            SUM(revenue) AS revenue,
+            SUM(revenue) / NULLIF(SUM(amount_count), 0) AS avg_amount,
+            SUM(payment_count) FILTER (WHERE status = 'completed') AS successful_payments,
+            SUM(payment_count) FILTER (WHERE status = 'failed') AS failed_payments,
+            SUM(payment_count) FILTER (WHERE status = 'refunded') AS refunded_payments
+        FROM public.payments_daily_range(start_date, end_date)
+        GROUP BY GROUPING SETS ((), (plan_key), (currency_key))
+    )
     SELECT jsonb_build_object(
-        'total_revenue', COALESCE(SUM(amount), 0),
-        'total_payments', COUNT(*),
-        'avg_payment', COALESCE(AVG(amount), 0),
-        'successful_payments', COUNT(*) FILTER (WHERE status = 'completed'),
-        'failed_payments', COUNT(*) FILTER (WHERE status = 'failed'),
-        'refunded_payments', COUNT(*) FILTER (WHERE status = 'refunded'),
-        'revenue_by_plan', (
-            SELECT jsonb_object_agg(
-                COALESCE(plan_id::TEXT, 'unknown'), 
-                jsonb_build_object(
-                    'count', COUNT(*),
-                    'revenue', SUM(amount),
-                    'avg_amount', AVG(amount)
-                )
+        'total_revenue', COALESCE(MAX(revenue) FILTER (WHERE grouping_level = 3), 0),
+        'total_payments', COALESCE(MAX(payment_count) FILTER (WHERE grouping_level = 3), 0),
+        'avg_payment', COALESCE(MAX(avg_amount) FILTER (WHERE grouping_level = 3), 0),
+        'successful_payments', COALESCE(MAX(successful_payments) FILTER (WHERE grouping_level = 3), 0),
+        'failed_payments', COALESCE(MAX(failed_payments) FILTER (WHERE grouping_level = 3), 0),
+        'refunded_payments', COALESCE(MAX(refunded_payments) FILTER (WHERE grouping_level = 3), 0),
+        'revenue_by_plan', jsonb_object_agg(
+            plan_key,
+            jsonb_build_object(
+                'count', payment_count,
+                'revenue', revenue,
+                'avg_amount', avg_amount
             )
-            FROM payments
-            WHERE created_at BETWEEN start_date AND end_date
-            GROUP BY plan_id
-        ),
-        'revenue_by_currency', (
-            SELECT jsonb_object_agg(
-                COALESCE(currency, 'USD'), 
-                jsonb_build_object(
-                    'count', COUNT(*),
-                    'revenue', SUM(amount),
-                    'avg_amount', AVG(amount)
-                )
+        ) FILTER (WHERE grouping_level = 1),
+        'revenue_by_currency', jsonb_object_agg(
+            currency_key,
+            jsonb_build_object(
+                'count', payment_count,
+                'revenue', revenue,
+                'avg_amount', avg_amount
             )
-            FROM payments
-            WHERE created_at BETWEEN start_date AND end_date
-            GROUP BY currency
-        )
+        ) FILTER (WHERE grouping_level = 2)
     )
-    FROM payments
-    WHERE created_at BETWEEN start_date AND end_date;
+    FROM grouped;
 $$;
 
 -- Get monthly revenue trend
@@ -53,83 +340,120 @@ RETURNS TABLE (
     avg_amount NUMERIC
 )
 LANGUAGE SQL
+STABLE
 AS $$
     SELECT 
-        DATE_TRUNC('month', created_at) AS month_date,
-        COALESCE(SUM(amount), 0) AS total_amount,
-        COUNT(*) AS payment_count,
-        COALESCE(AVG(amount), 0) AS avg_amount
-    FROM payments
+        DATE_TRUNC('month', bucket)::DATE AS month_date,
+        COALESCE(SUM(revenue), 0) AS total_amount,
+        SUM(payment_count)::BIGINT AS payment_count,
+        COALESCE(SUM(revenue) / NULLIF(SUM(amount_count), 0), 0) AS avg_amount
+    FROM public.payments_daily_range('-infinity', NOW())
     WHERE status = 'completed'
-    GROUP BY DATE_TRUNC('month', created_at)
+    GROUP BY DATE_TRUNC('month', bucket)
     ORDER BY month_date DESC;
 $$;
 
 -- Get payment methods distribution
-CREATE OR REPLACE FUNCTION public.get_payment_methods_distribution()
+-- Раньше функция сканировала всю историю дважды; теперь один проход по периоду.
+DROP FUNCTION IF EXISTS public.get_payment_methods_distribution();
+
+CREATE OR REPLACE FUNCTION public.get_payment_methods_distribution(
+    start_date TIMESTAMPTZ DEFAULT (NOW() - INTERVAL '30 days'),
+    end_date TIMESTAMPTZ DEFAULT NOW()
+)
 RETURNS JSONB
 LANGUAGE SQL
+STABLE
 AS $$
-    SELECT 
-        jsonb_build_object(
-            'by_type', (
-                SELECT jsonb_object_agg(
-                    COALESCE(payment_type, 'unknown'),
-                    jsonb_build_object(
-                        'count', COUNT(*),
-                        'revenue', COALESCE(SUM(amount), 0),
-                        'avg_amount', COALESCE(AVG(amount), 0)
-                    )
-                )
-                FROM payments
-                GROUP BY payment_type
-            ),
-            'by_status', (
-                SELECT jsonb_object_agg(
-                    COALESCE(status, 'unknown'),
-                    jsonb_build_object(
-                        'count', COUNT(*),
-                        'revenue', COALESCE(SUM(amount), 0)
-                    )
-                )
-                FROM payments
-                GROUP BY status
+    WITH grouped AS (
+        SELECT
+            -- 1 = по типу платежа, 2 = по статусу
+            GROUPING(payment_type, status) AS grouping_level,
+            COALESCE(payment_type, 'unknown') AS type_key,
+            COALESCE(status, 'unknown') AS status_key,
+            COUNT(*) AS payment_count,
+            COALESCE(SUM(amount), 0) AS revenue,
+            COALESCE(AVG(amount), 0) AS avg_amount
+        FROM payments
+        WHERE created_at BETWEEN start_date AND end_date
+        GROUP BY GROUPING SETS ((payment_type), (status))
+    )
+    SELECT jsonb_build_object(
+        'by_type', jsonb_object_agg(
+            type_key,
+            jsonb_build_object(
+                'count', payment_count,
+                'revenue', revenue,
+                'avg_amount', avg_amount
             )
-        );
+        ) FILTER (WHERE grouping_level = 1),
+        'by_status', jsonb_object_agg(
+            status_key,
+            jsonb_build_object(
+                'count', payment_count,
+                'revenue', revenue
+            )
+        ) FILTER (WHERE grouping_level = 2)
+    )
+    FROM grouped;
 $$;
 
 -- Get user statistics
+-- Один проход по users: итоги и новые пользователи по дням считаются одним
+-- GROUPING SETS, а cumulative_users - оконной суммой вместо подзапроса на каждый день.
 CREATE OR REPLACE FUNCTION public.get_user_statistics(
     start_date TIMESTAMPTZ DEFAULT (NOW() - INTERVAL '30 days'),
     end_date TIMESTAMPTZ DEFAULT NOW()
 )
 RETURNS JSONB
 LANGUAGE SQL
+STABLE
 AS $$
-    WITH user_stats AS (
+    WITH grouped AS (
         SELECT
-            COUNT(*) AS total_users,
+            -- 1 = итог по всем пользователям, 0 = новые пользователи за день периода
+            GROUPING(created_day) AS grouping_level,
+            created_day,
+            COUNT(*) AS users_count,
+            COUNT(*) FILTER (WHERE created_at < start_date) AS users_before_period,
             COUNT(*) FILTER (WHERE created_at >= NOW() - INTERVAL '7 days') AS new_users_7d,
             COUNT(*) FILTER (WHERE created_at >= NOW() - INTERVAL '30 days') AS new_users_30d,
             COUNT(*) FILTER (WHERE last_activity >= NOW() - INTERVAL '1 day') AS active_users_1d,
             COUNT(*) FILTER (WHERE last_activity >= NOW() - INTERVAL '7 days') AS active_users_7d,
-            COUNT(*) FILTER (WHERE last_activity >= NOW() - INTERVAL '30 days') AS active_users_30d
-        FROM users
+            COUNT(*) FILTER (WHERE last_activity >= NOW() - INTERVAL '30 days') AS active_users_30d,
+            COUNT(*) FILTER (WHERE created_at <= NOW() - INTERVAL '30 days') AS users_older_30d
+        FROM (
+            SELECT
+                created_at,
+                last_activity,
+                CASE
+                    WHEN created_at BETWEEN start_date AND end_date
+                    THEN DATE_TRUNC('day', created_at)
+                END AS created_day
+            FROM users
+        ) u
+        GROUP BY GROUPING SETS ((), (created_day))
+    ),
+    totals AS (
+        SELECT * FROM grouped WHERE grouping_level = 1
     ),
     user_growth AS (
         SELECT
-            DATE_TRUNC('day', generate_series(
-                start_date,
-                end_date,
-                INTERVAL '1 day'
-            )) AS date,
-            COUNT(*) AS new_users
-        FROM users
-        WHERE created_at BETWEEN start_date AND end_date
-        GROUP BY DATE_TRUNC('day', created_at)
+            days.date,
+            COALESCE(g.users_count, 0) AS new_users,
+            (SELECT users_before_period FROM totals)
+                + SUM(COALESCE(g.users_count, 0)) OVER (ORDER BY days.date) AS cumulative_users
+        FROM generate_series(
+            DATE_TRUNC('day', start_date),
+            DATE_TRUNC('day', end_date),
+            INTERVAL '1 day'
+        ) AS days(date)
+        LEFT JOIN grouped g
+            ON g.grouping_level = 0
+           AND g.created_day = days.date
     )
     SELECT jsonb_build_object(
-        'total_users', total_users,
+        'total_users', users_count,
         'new_users', jsonb_build_object(
             '7d', new_users_7d,
             '30d', new_users_30d
@@ -140,26 +464,22 @@ AS $$
             '30d', active_users_30d
         ),
         'retention_rate', ROUND(
-            (active_users_30d::FLOAT / NULLIF(COUNT(*) FILTER (WHERE created_at <= NOW() - INTERVAL '30 days'), 0) * 100)::NUMERIC,
+            (active_users_30d::FLOAT / NULLIF(users_older_30d, 0) * 100)::NUMERIC,
             2
         ),
         'user_growth', (
             SELECT jsonb_agg(
                 jsonb_build_object(
                     'date', date,
-                    'new_users', COALESCE(new_users, 0),
-                    'cumulative_users', (
-                        SELECT COUNT(*)
-                        FROM users
-                        WHERE created_at <= date
-                    )
+                    'new_users', new_users,
+                    'cumulative_users', cumulative_users
                 )
                 ORDER BY date
             )
             FROM user_growth
         )
     )
-    FROM user_stats;
+    FROM totals;
 $$;
 
 -- Get user engagement metrics
@@ -211,16 +531,17 @@ $$;
 CREATE OR REPLACE FUNCTION public.get_conversion_funnel()
 RETURNS JSONB
 LANGUAGE SQL
+STABLE
 AS $$
     WITH funnel AS (
         SELECT
-            COUNT(DISTINCT user_id) FILTER (WHERE action = 'start_bot') AS started_bot,
-            COUNT(DISTINCT user_id) FILTER (WHERE action = 'view_plans') AS viewed_plans,
-            COUNT(DISTINCT user_id) FILTER (WHERE action = 'start_checkout') AS started_checkout,
-            COUNT(DISTINCT user_id) FILTER (WHERE action = 'complete_payment') AS completed_payment,
-            COUNT(DISTINCT user_id) FILTER (WHERE action = 'activate_plan') AS activated_plan
-        FROM user_actions
-        WHERE timestamp >= NOW() - INTERVAL '30 days'
+            COUNT(*) FILTER (WHERE action = 'start_bot') AS started_bot,
+            COUNT(*) FILTER (WHERE action = 'view_plans') AS viewed_plans,
+            COUNT(*) FILTER (WHERE action = 'start_checkout') AS started_checkout,
+            COUNT(*) FILTER (WHERE action = 'complete_payment') AS completed_payment,
+            COUNT(*) FILTER (WHERE action = 'activate_plan') AS activated_plan
+        FROM public.user_action_users_range(NOW() - INTERVAL '30 days', NOW())
+        WHERE action IN ('start_bot', 'view_plans', 'start_checkout', 'complete_payment', 'activate_plan')
     )
     SELECT jsonb_build_object(
         'steps', jsonb_build_array(
@@ -253,3 +574,38 @@ AS $$
     )
     FROM funnel;
 $$;
+
+-- Платежи для follow-up через 30 дней после оплаты плана 30/basic, страницами по id.
+-- metadata пишется через json.dumps, поэтому может лежать JSON-строкой внутри jsonb.
+CREATE OR REPLACE FUNCTION public.get_payments_for_30d_followup(
+    cutoff TIMESTAMPTZ DEFAULT (NOW() - INTERVAL '30 days'),
+    after_id public.payments.id%TYPE DEFAULT NULL,
+    page_size INTEGER DEFAULT 500
+)
+RETURNS TABLE (
+    payment_id public.payments.id%TYPE,
+    user_id TEXT,
+    metadata JSONB
+)
+LANGUAGE SQL
+STABLE
+AS $$
+    SELECT p.id, p.telegram_user_id::TEXT, m.metadata
+    FROM public.payments p
+    CROSS JOIN LATERAL (
+        SELECT CASE
+            WHEN jsonb_typeof(p.metadata) = 'string' AND LEFT(p.metadata #>> '{}', 1) = '{'
+            THEN (p.metadata #>> '{}')::JSONB
+            ELSE p.metadata
+        END AS metadata
+    ) m
+    WHERE p.status = 'paid'
+      AND p.payment_method = 'card'
+      AND p.notified_after_30d = FALSE
+      AND (after_id IS NULL OR p.id > after_id)
+      AND p.created_at <= cutoff
+      AND p.telegram_user_id IS NOT NULL
+      AND m.metadata ->> 'plan' IN ('30', 'basic')
+    ORDER BY p.id
+    LIMIT page_size;
+$$;
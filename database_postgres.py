@@ -6,21 +6,15 @@ import aiohttp
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional, Union
 from config import SUPABASE_URL, SUPABASE_KEY, SUPABASE_SERVICE_KEY
+from logging_setup import lazy_json
 import asyncio
+import time
+from urllib.parse import urlsplit
+import metrics
+from tracing import span, traced
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('database_operations.log')
-    ]
-)
-
+# Обработчики и уровни логов задаёт logging_setup.py (LOG_LEVELS=database_operations=...)
 logger = logging.getLogger('database_operations')
-# Enable debug logging for aiohttp if needed
-logging.getLogger('aiohttp').setLevel(logging.WARNING)
 
 # Headers for Supabase REST API - using service key for all operations to bypass RLS
 HEADERS = {
@@ -36,6 +30,73 @@ ADMIN_HEADERS = {
     "Content-Type": "application/json"
 }
 
+# Время каждого запроса к Supabase REST по таблице/RPC - и через requests, и через aiohttp
+SUPABASE_SECONDS = metrics.histogram(
+    'supabase_request_seconds', 'Запросы к Supabase REST по таблице или RPC', ['target', 'method', 'outcome']
+)
+
+
+def supabase_target(url) -> str:
+    """'.../rest/v1/payments?select=*' -> 'payments', '.../rest/v1/rpc/get_x' -> 'rpc/get_x'"""
+    parts = urlsplit(str(url)).path.partition('/rest/v1/')[2].split('/')
+    if parts[0] == 'rpc' and len(parts) > 1:
+        return f"rpc/{parts[1]}"
+    return parts[0] or 'unknown'
+
+
+def _observe_supabase(method: str, url, started: float, ok: bool):
+    SUPABASE_SECONDS.labels(supabase_target(url), method.upper(), 'ok' if ok else 'error') \
+        .observe(time.perf_counter() - started)
+
+
+def _supabase_span(method: str, url):
+    return span(f"supabase.{method.upper()} {supabase_target(url)}")
+
+
+class _SupabaseSession(requests.Session):
+    """requests.Session that times every call (and keeps connections alive between them)"""
+
+    def request(self, method, url, *args, **kwargs):
+        started = time.perf_counter()
+        ok = False
+        with _supabase_span(method, url) as request_span:
+            try:
+                response = super().request(method, url, *args, **kwargs)
+                ok = response.status_code < 400
+                request_span.set(status_code=response.status_code)
+                return response
+            finally:
+                _observe_supabase(method, url, started, ok)
+
+
+async def _on_request_start(session, context, params):
+    context.started = time.perf_counter()
+    # Лист трассы: хуки не могут обернуть запрос в with, span закрывается в on_request_end
+    context.span = _supabase_span(params.method, params.url)
+
+
+async def _on_request_end(session, context, params):
+    _observe_supabase(params.method, params.url, context.started, params.response.status < 400)
+    context.span.set(status_code=params.response.status)
+    context.span.end()
+
+
+async def _on_request_exception(session, context, params):
+    _observe_supabase(params.method, params.url, context.started, False)
+    context.span.end(params.exception)
+
+
+_supabase_trace = aiohttp.TraceConfig()
+_supabase_trace.on_request_start.append(_on_request_start)
+_supabase_trace.on_request_end.append(_on_request_end)
+_supabase_trace.on_request_exception.append(_on_request_exception)
+
+_http = _SupabaseSession()
+
+
+def _supabase_session() -> aiohttp.ClientSession:
+    return aiohttp.ClientSession(trace_configs=[_supabase_trace])
+
 # Constants for plan types
 PLAN_30 = '30'
 PLAN_500 = '500'
@@ -60,6 +121,50 @@ def format_username(username: str) -> str:
     # Add @ prefix if not present
     return f"@{username}" if not username.startswith('@') else username
 
+async def fetch_from_supabase(endpoint: str, params: dict = None):
+    # Use SUPABASE_SERVICE_ROLE instead of SUPABASE_SERVICE_KEY
+    service_key = os.getenv('SUPABASE_SERVICE_ROLE', '')
+    if not service_key:
+        logger.error("SUPABASE_SERVICE_ROLE environment variable is not set")
+        raise ValueError("SUPABASE_SERVICE_ROLE is not configured")
+
+    headers = {
+        "apikey": service_key,
+        "Authorization": f"Bearer {service_key}",
+        "Content-Type": "application/json",
+        "Accept": "application/json"
+    }
+    
+    headers = {k: v for k, v in headers.items() if v is not None}
+    params = params or {}
+    
+    clean_params = {}
+    for key, value in params.items():
+        if value is not None:
+            clean_params[key] = value
+
+    try:
+        async with _supabase_session() as session:
+            url = f"{SUPABASE_URL}/rest/v1/{endpoint}"
+            # Заголовки не логируем: в них service role ключ
+            logger.debug("Making request to: %s", url)
+            logger.debug("Params: %s", clean_params)
+            
+            async with session.get(
+                url,
+                headers=headers,
+                params=clean_params,
+                timeout=aiohttp.ClientTimeout(total=10)
+            ) as resp:
+                if resp.status != 200:
+                    text = await resp.text()
+                    logger.error(f"Supabase API error: {resp.status} - {text}")
+                    raise Exception(f"Supabase API error: {resp.status} - {text}")
+                return await resp.json()
+    except Exception as e:
+        logger.error(f"Error in fetch_from_supabase: {str(e)}", exc_info=True)
+        raise
+
 async def get_premium_users() -> List[Dict[str, Any]]:
     """
     Fetch all users who purchased the premium ($500) plan
@@ -79,7 +184,7 @@ async def get_premium_users() -> List[Dict[str, Any]]:
         }
         
         # Make the request
-        async with aiohttp.ClientSession() as session:
+        async with _supabase_session() as session:
             async with session.get(
                 payments_url,
                 headers=ADMIN_HEADERS,
@@ -179,9 +284,8 @@ def _make_request(method: str, endpoint: str, headers: dict = None, data: dict =
     request_id = f"req_{int(datetime.utcnow().timestamp())}"
     logger.info(f"[{request_id}] Starting {method} request to {endpoint}")
     logger.debug(f"[{request_id}] URL: {url}")
-    logger.debug(f"[{request_id}] Headers: {json.dumps(headers, default=str, indent=2)}")
     if data and method.upper() != 'GET':
-        logger.debug(f"[{request_id}] Payload: {json.dumps(data, default=str, indent=2)}")
+        logger.debug("[%s] Payload: %s", request_id, lazy_json(data, indent=2))
     
     try:
         start_time = datetime.utcnow()
@@ -189,13 +293,13 @@ def _make_request(method: str, endpoint: str, headers: dict = None, data: dict =
         # Make the request
         if method.upper() == 'GET':
             logger.debug(f"[{request_id}] Sending GET with params: {data}")
-            response = requests.get(url, headers=headers, params=data, timeout=10)
+            response = _http.get(url, headers=headers, params=data, timeout=10)
         elif method.upper() == 'POST':
             logger.debug(f"[{request_id}] Sending POST with data")
-            response = requests.post(url, headers=headers, json=data, timeout=10)
+            response = _http.post(url, headers=headers, json=data, timeout=10)
         elif method.upper() == 'PATCH':
             logger.debug(f"[{request_id}] Sending PATCH with data")
-            response = requests.patch(url, headers=headers, json=data, timeout=10)
+            response = _http.patch(url, headers=headers, json=data, timeout=10)
         else:
             error_msg = f"Unsupported HTTP method: {method}"
             logger.error(f"[{request_id}] {error_msg}")
@@ -209,7 +313,7 @@ def _make_request(method: str, endpoint: str, headers: dict = None, data: dict =
         
         try:
             response_json = response.json() if response.text else {}
-            logger.debug(f"[{request_id}] Response: {json.dumps(response_json, default=str, indent=2)}")
+            logger.debug("[%s] Response: %s", request_id, lazy_json(response_json, indent=2))
             return response_json
         except json.JSONDecodeError:
             logger.warning(f"[{request_id}] Non-JSON response received: {response.text[:500]}")
@@ -227,7 +331,7 @@ def _make_request(method: str, endpoint: str, headers: dict = None, data: dict =
         if hasattr(e, 'response') and e.response is not None:
             try:
                 error_content = e.response.json()
-                logger.error(f"[{request_id}] Error details: {json.dumps(error_content, indent=2)}")
+                logger.error("[%s] Error details: %s", request_id, lazy_json(error_content, indent=2))
             except:
                 error_text = e.response.text[:1000]  # Limit log size
                 logger.error(f"[{request_id}] Error response: {error_text}")
@@ -235,6 +339,7 @@ def _make_request(method: str, endpoint: str, headers: dict = None, data: dict =
         return None
 
 # --- USERS ---
+@traced()
 async def add_or_update_user(user_id, username=None, first_name=None, last_name=None, 
                           email=None, plan=None, payment_status=None):
     log_prefix = f"[User {user_id}]"
@@ -263,7 +368,7 @@ async def add_or_update_user(user_id, username=None, first_name=None, last_name=
         url = f"{SUPABASE_URL}/rest/v1/users?user_id=eq.{user_id}"
         logger.info(f"{log_prefix} Checking if user exists: {url}")
         
-        async with aiohttp.ClientSession() as session:
+        async with _supabase_session() as session:
             start_time = datetime.utcnow()
             try:
                 async with session.get(url, headers=ADMIN_HEADERS, timeout=10) as response:
@@ -273,7 +378,7 @@ async def add_or_update_user(user_id, username=None, first_name=None, last_name=
                     if response.status == 200:
                         user_data = await response.json()
                         user_exists = bool(user_data)
-                        logger.debug(f"{log_prefix} User exists: {user_exists}, Data: {json.dumps(user_data, default=str)}")
+                        logger.debug("%s User exists: %s, Data: %s", log_prefix, user_exists, lazy_json(user_data))
                     else:
                         error_text = await response.text()
                         logger.error(f"{log_prefix} Error checking user existence. Status: {response.status}, Response: {error_text}")
@@ -285,7 +390,7 @@ async def add_or_update_user(user_id, username=None, first_name=None, last_name=
                 logger.error(f"{log_prefix} Exception while checking user existence: {str(e)}", exc_info=True)
                 return None
         
-        async with aiohttp.ClientSession() as session:
+        async with _supabase_session() as session:
             if user_exists:
                 # Update existing user
                 patch_url = f"{SUPABASE_URL}/rest/v1/users?user_id=eq.{user_id}"
@@ -316,7 +421,7 @@ async def add_or_update_user(user_id, username=None, first_name=None, last_name=
                     update_fields.append("is_admin")
                 
                 logger.info(f"{log_prefix} Updating user with fields: {', '.join(update_fields) if update_fields else 'last_activity only'}")
-                logger.debug(f"{log_prefix} Update data: {json.dumps(data, default=str)}")
+                logger.debug("%s Update data: %s", log_prefix, lazy_json(data))
                 
                 try:
                     start_time = datetime.utcnow()
@@ -357,7 +462,7 @@ async def add_or_update_user(user_id, username=None, first_name=None, last_name=
                 }
                 
                 logger.info(f"{log_prefix} Creating new user")
-                logger.debug(f"{log_prefix} User data: {json.dumps(data, default=str)}")
+                logger.debug("%s User data: %s", log_prefix, lazy_json(data))
                 
                 try:
                     start_time = datetime.utcnow()
@@ -390,13 +495,13 @@ async def add_or_update_user(user_id, username=None, first_name=None, last_name=
                                         response_data = {}
 
                                 logger.info(f"{log_prefix} User created successfully with ID: {response_data.get('id')}")
-                                logger.debug(f"{log_prefix} Created user data: {json.dumps(response_data, default=str)}")
+                                logger.debug("%s Created user data: %s", log_prefix, lazy_json(response_data))
                                 return response_data
                             except aiohttp.ContentTypeError:
                                 logger.warning(f"{log_prefix} Response not JSON. Skipping parsing.")
                                 response_data = {"user_id": user_id}  # или просто return data
                             logger.info(f"{log_prefix} User created successfully with ID: {response_data.get('id')}")
-                            logger.debug(f"{log_prefix} Created user data: {json.dumps(response_data, default=str)}")
+                            logger.debug("%s Created user data: %s", log_prefix, lazy_json(response_data))
                             return response_data
                         except Exception as json_error:
                             logger.error(f"{log_prefix} Error parsing user creation response: {str(json_error)}")
@@ -417,7 +522,7 @@ def get_recent_users(limit=10):
         logger.error(f"Supabase config missing")
         return []
     url = f"{SUPABASE_URL}/rest/v1/users?order=first_seen.desc&limit={limit}"
-    r = requests.get(url, headers=HEADERS)
+    r = _http.get(url, headers=HEADERS)
     if not r.ok:
         return []
     users = r.json()
@@ -443,9 +548,10 @@ def log_button_click(user_id, button_type, button_data=None):
         "button_data": str(button_data) if button_data else None,
         "timestamp": datetime.utcnow().isoformat()
     }
-    requests.post(f"{SUPABASE_URL}/rest/v1/button_clicks", headers=HEADERS, json=data)
+    _http.post(f"{SUPABASE_URL}/rest/v1/button_clicks", headers=HEADERS, json=data)
 
 # --- PAYMENTS ---
+@traced()
 async def log_payment(
     user_id: Union[str, int],
     email: str,
@@ -497,13 +603,13 @@ async def log_payment(
 
     test_mode_flag = is_test_mode()
     logger.info(f"{log_prefix} Prepared payment data (test_mode: {test_mode_flag})")
-    logger.debug(f"{log_prefix} Payment details: {json.dumps(payment_data, default=str, indent=2)}")
+    logger.debug("%s Payment details: %s", log_prefix, lazy_json(payment_data, indent=2))
 
     try:
         logger.info(f"{log_prefix} Creating aiohttp session")
         start_time = datetime.utcnow()
 
-        async with aiohttp.ClientSession() as session:
+        async with _supabase_session() as session:
             logger.info(f"{log_prefix} Sending payment data to Supabase")
 
             try:
@@ -612,7 +718,7 @@ def get_payment_stats(days: int = 30):
             'end_date': end_date.isoformat()
         }
         
-        summary_resp = requests.post(
+        summary_resp = _http.post(
             summary_url,
             headers=ADMIN_HEADERS,
             json=summary_params
@@ -624,7 +730,7 @@ def get_payment_stats(days: int = 30):
         {SUPABASE_URL}/rest/v1/rpc/get_monthly_revenue
         """.strip()
         
-        trend_resp = requests.post(
+        trend_resp = _http.post(
             trend_url,
             headers=ADMIN_HEADERS,
             json={}
@@ -636,10 +742,10 @@ def get_payment_stats(days: int = 30):
         {SUPABASE_URL}/rest/v1/rpc/get_payment_methods_distribution
         """.strip()
         
-        methods_resp = requests.post(
+        methods_resp = _http.post(
             methods_url,
             headers=ADMIN_HEADERS,
-            json={}
+            json=summary_params
         )
         methods_resp.raise_for_status()
         
@@ -702,7 +808,7 @@ def log_user_action(user_id, action, details=None, session_id=None, action_type=
         username_with_at = None
         try:
             user_url = f"{SUPABASE_URL}/rest/v1/users?user_id=eq.{user_id}&select=username"
-            user_resp = requests.get(user_url, headers=HEADERS)
+            user_resp = _http.get(user_url, headers=HEADERS)
             if user_resp.ok:
                 user_data = user_resp.json()
                 if user_data and user_data[0].get('username'):
@@ -722,7 +828,7 @@ def log_user_action(user_id, action, details=None, session_id=None, action_type=
         }
         
         # Log to database
-        response = requests.post(
+        response = _http.post(
             f"{SUPABASE_URL}/rest/v1/user_actions", 
             headers=HEADERS, 
             json=data
@@ -763,7 +869,7 @@ def get_user_actions(user_id=None, action_type=None, limit=100, offset=0):
         # Add pagination
         url += f"&limit={limit}&offset={offset}"
         
-        response = requests.get(url, headers=HEADERS)
+        response = _http.get(url, headers=HEADERS)
         
         if response.ok:
             return response.json()
@@ -786,7 +892,7 @@ def update_payment_status(stripe_session_id, status):
         data['completed_at'] = datetime.utcnow().isoformat()
     elif status == 'failed':
         data['failed_at'] = datetime.utcnow().isoformat()
-    requests.patch(patch_url, headers=HEADERS, json=data)
+    _http.patch(patch_url, headers=HEADERS, json=data)
 
 # --- ADMIN PANEL STATS ---
 
@@ -827,22 +933,18 @@ def get_time_based_stats(time_period: str = '24h') -> Dict[str, Any]:
             &end_date={now.isoformat()}
         """.replace('\n', '').replace(' ', '')
         
-        payments_resp = requests.get(payments_url, headers=ADMIN_HEADERS)
+        payments_resp = _http.get(payments_url, headers=ADMIN_HEADERS)
         payment_stats = payments_resp.json() if payments_resp.ok else {}
         
-        # Get user actions for conversion funnel
-        funnel_url = f"""
-            {SUPABASE_URL}/rest/v1/user_actions
-            ?select=action,count(*)
-            &timestamp=gte.{time_ago_iso}
-            &group=action
-        """.replace('\n', '').replace(' ', '')
+        # Get user action counts for conversion funnel (rollups + tail since watermark)
+        funnel_url = f"{SUPABASE_URL}/rest/v1/rpc/get_action_counts"
         
-        funnel_resp = requests.get(funnel_url, headers=ADMIN_HEADERS)
-        funnel_data = {}
-        if funnel_resp.ok:
-            for item in funnel_resp.json():
-                funnel_data[item['action']] = item['count']
+        funnel_resp = _http.post(
+            funnel_url,
+            headers=ADMIN_HEADERS,
+            json={'start_date': time_ago_iso, 'end_date': now.isoformat()}
+        )
+        funnel_data = funnel_resp.json() if funnel_resp.ok and funnel_resp.text else {}
         
         # Get back button metrics (users who viewed plan but didn't pay)
         back_metrics = {
@@ -881,7 +983,7 @@ def get_conversion_funnel() -> Dict[str, Any]:
             {SUPABASE_URL}/rest/v1/rpc/get_conversion_funnel
         """.strip()
         
-        funnel_resp = requests.post(funnel_url, headers=ADMIN_HEADERS, json={})
+        funnel_resp = _http.post(funnel_url, headers=ADMIN_HEADERS, json={})
         
         if funnel_resp.ok:
             return funnel_resp.json()
@@ -902,6 +1004,32 @@ def get_conversion_funnel() -> Dict[str, Any]:
         logger.error(f"Error getting conversion funnel: {str(e)}")
         return {}
 
+def refresh_rollups() -> Dict[str, Any]:
+    """
+    Roll up new user_actions and payments rows into the hourly/daily tables
+    
+    Stats RPCs read full buckets from the rollups and only the rows newer
+    than the watermark from the raw tables, so this should run regularly.
+    
+    Returns:
+        Dict with the new watermark of each rollup table
+    """
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        logger.error("Supabase configuration is missing")
+        return {}
+    
+    try:
+        refresh_url = f"{SUPABASE_URL}/rest/v1/rpc/refresh_rollups"
+        refresh_resp = _http.post(refresh_url, headers=ADMIN_HEADERS, json={})
+        refresh_resp.raise_for_status()
+        watermarks = refresh_resp.json() if refresh_resp.text else {}
+        logger.info(f"✅ Rollups обновлены: {watermarks}")
+        return watermarks
+        
+    except Exception as e:
+        logger.error(f"Error refreshing rollups: {str(e)}")
+        return {}
+
 # --- ADMIN PANEL STATS ---
 async def get_admin_dashboard_stats() -> Dict[str, Any]:
     """
@@ -935,7 +1063,7 @@ async def get_admin_dashboard_stats() -> Dict[str, Any]:
     try:
         # Get total users
         users_url = f"{SUPABASE_URL}/rest/v1/users?select=user_id,first_seen,last_activity"
-        users_response = requests.get(users_url, headers=HEADERS)
+        users_response = _http.get(users_url, headers=HEADERS)
         users_response.raise_for_status()
         users = users_response.json()
         
@@ -952,7 +1080,7 @@ async def get_admin_dashboard_stats() -> Dict[str, Any]:
         
         # Get payment statistics
         payments_url = f"{SUPABASE_URL}/rest/v1/payments?select=status,amount,plan_id,created_at&order=created_at.desc&limit=100"
-        payments_response = requests.get(payments_url, headers=HEADERS)
+        payments_response = _http.get(payments_url, headers=HEADERS)
         payments_response.raise_for_status()
         payments = payments_response.json()
         
@@ -975,7 +1103,7 @@ async def get_admin_dashboard_stats() -> Dict[str, Any]:
         
         # Get recent user actions
         actions_url = f"{SUPABASE_URL}/rest/v1/user_actions?select=*,user:users(username,first_name,last_name)&order=timestamp.desc&limit=10"
-        actions_response = requests.get(actions_url, headers=HEADERS)
+        actions_response = _http.get(actions_url, headers=HEADERS)
         recent_actions = actions_response.json() if actions_response.ok else []
         
         # Format recent payments
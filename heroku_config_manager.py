@@ -1,3 +1,17 @@
+"""
+Config vars приложения на Heroku.
+
+HerokuConfigManager - синхронный клиент для скриптов. В event loop бота
+используется AsyncHerokuClient: одна keep-alive сессия, карта config vars
+кэшируется на HEROKU_CONFIG_CACHE_TTL секунд и перепроверяется по ETag
+(304 без тела), одновременные чтения сливаются в один запрос, а запись -
+один PATCH, ответ которого сразу становится новым кэшем.
+"""
+
+import os
+import time
+import asyncio
+import aiohttp
 import requests
 import logging
 from typing import Dict, Optional
@@ -5,6 +19,8 @@ from config import *
 
 logger = logging.getLogger(__name__)
 
+HEROKU_CONFIG_CACHE_TTL = float(os.getenv('HEROKU_CONFIG_CACHE_TTL', '30'))
+
 class HerokuConfigManager:
     def __init__(self):
         self.heroku_api_key = HEROKU_API_KEY
@@ -43,6 +59,19 @@ class HerokuConfigManager:
             logger.error(f"Error setting config var {var_name}: {e}")
             return False
     
+    def set_config_vars(self, values: Dict[str, str]) -> bool:
+        """Установить несколько переменных одним запросом (один рестарт dyno)"""
+        try:
+            url = f"{self.base_url}/apps/{self.heroku_app_name}/config-vars"
+            response = requests.patch(url, json=values, headers=self.headers)
+            response.raise_for_status()
+
+            logger.info(f"Successfully updated {', '.join(values)}")
+            return True
+        except Exception as e:
+            logger.error(f"Error setting config vars {list(values)}: {e}")
+            return False
+
     def get_all_config_vars(self) -> Dict[str, str]:
         """Получить все конфигурационные переменные"""
         try:
@@ -55,44 +84,125 @@ class HerokuConfigManager:
             logger.error(f"Error getting all config vars: {e}")
             return {}
 
-# Функции для управления Stripe режимом
-def get_current_stripe_mode() -> str:
-    """Получить текущий режим Stripe"""
-    config_manager = HerokuConfigManager()
-    current_value = config_manager.get_config_var('STRIPE_IS_TEST_MODE_ON')
-    return "TEST" if current_value == 'True' else "LIVE"
 
-def toggle_stripe_mode() -> tuple[bool, str]:
-    """Переключить режим Stripe и вернуть (успех, новый_режим)"""
-    config_manager = HerokuConfigManager()
-    
-    try:
-        current_value = config_manager.get_config_var('STRIPE_IS_TEST_MODE_ON')
-        new_value = 'False' if current_value == 'True' else 'True'
-        
-        success = config_manager.set_config_var('STRIPE_IS_TEST_MODE_ON', new_value)
-        if success:
-            new_mode = "TEST" if new_value == 'True' else "LIVE"
-            return True, new_mode
-        else:
-            return False, "ERROR"
-    except Exception as e:
-        logger.error(f"Error toggling Stripe mode: {e}")
-        return False, "ERROR"
-
-def set_stripe_mode(test_mode: bool) -> tuple[bool, str]:
-    """Установить конкретный режим Stripe"""
-    config_manager = HerokuConfigManager()
-    
-    try:
-        new_value = 'True' if test_mode else 'False'
-        success = config_manager.set_config_var('STRIPE_IS_TEST_MODE_ON', new_value)
-        
-        if success:
-            new_mode = "TEST" if test_mode else "LIVE"
-            return True, new_mode
-        else:
-            return False, "ERROR"
-    except Exception as e:
-        logger.error(f"Error setting Stripe mode: {e}")
-        return False, "ERROR"
\ No newline at end of file
+class AsyncHerokuClient:
+    """
+    Async config vars client for the bot's event loop
+
+    Args:
+        ttl: Сколько секунд карта config vars считается свежей
+        base_url: API Heroku (для тестов - фейковый сервер)
+    """
+
+    def __init__(self, api_key: Optional[str] = None, app_name: Optional[str] = None,
+                 ttl: float = HEROKU_CONFIG_CACHE_TTL, base_url: str = "https://api.heroku.com"):
+        self.api_key = api_key or HEROKU_API_KEY
+        self.app_name = app_name or HEROKU_APP_NAME
+        self.url = f"{base_url}/apps/{self.app_name}/config-vars"
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Accept": "application/vnd.heroku+json; version=3",
+            "Content-Type": "application/json"
+        }
+        self.ttl = ttl
+        self.requests = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._config_vars: Optional[Dict[str, str]] = None
+        self._etag: Optional[str] = None
+        self._fetched_at = 0.0
+        self._inflight: Optional[asyncio.Future] = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.app_name and self.api_key)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=4, keepalive_timeout=120),
+                timeout=aiohttp.ClientTimeout(total=10),
+                headers=self.headers
+            )
+        return self._session
+
+    def _is_fresh(self) -> bool:
+        return self._config_vars is not None and time.monotonic() - self._fetched_at < self.ttl
+
+    def _store(self, config_vars: Dict[str, str], etag: Optional[str]):
+        self._config_vars = config_vars
+        self._etag = etag
+        self._fetched_at = time.monotonic()
+
+    async def _fetch(self) -> Dict[str, str]:
+        headers = {"If-None-Match": self._etag} if self._etag and self._config_vars is not None else None
+        self.requests += 1
+        async with self._get_session().get(self.url, headers=headers) as response:
+            if response.status == 304:
+                # Не изменились - продлеваем кэш без тела ответа
+                self._fetched_at = time.monotonic()
+                return self._config_vars
+            response.raise_for_status()
+            self._store(await response.json(), response.headers.get("ETag"))
+            return self._config_vars
+
+    async def get_config_vars(self) -> Dict[str, str]:
+        """All config vars, from cache while fresh; concurrent callers share one request"""
+        if self._is_fresh():
+            return self._config_vars
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._fetch())
+            self._inflight.add_done_callback(self._clear_inflight)
+        # shield: отмена одного ожидающего не должна отменять общий запрос
+        return await asyncio.shield(self._inflight)
+
+    def _clear_inflight(self, future: asyncio.Future):
+        if self._inflight is future:
+            self._inflight = None
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Error getting Heroku config vars: {future.exception()}")
+
+    def cached_config_vars(self) -> Optional[Dict[str, str]]:
+        """
+        Cached map without waiting for the network (for admin screens)
+
+        Если кэш устарел, обновление запускается в фоне и пригодится при следующем показе.
+        """
+        if not self._is_fresh() and self.configured and self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._fetch())
+            self._inflight.add_done_callback(self._clear_inflight)
+        return self._config_vars
+
+    async def get_config_var(self, var_name: str) -> Optional[str]:
+        try:
+            return (await self.get_config_vars()).get(var_name)
+        except Exception as e:
+            logger.error(f"Error getting config var {var_name}: {e}")
+            return None
+
+    async def set_config_vars(self, values: Dict[str, str]) -> bool:
+        """One PATCH; Heroku returns the full updated map, it replaces the cache"""
+        try:
+            self.requests += 1
+            async with self._get_session().patch(self.url, json=values) as response:
+                response.raise_for_status()
+                # ETag ответа PATCH относится к новой карте - следующий GET может получить 304
+                self._store(await response.json(), response.headers.get("ETag"))
+            logger.info(f"Successfully updated {', '.join(values)}")
+            return True
+        except Exception as e:
+            logger.error(f"Error setting config vars {list(values)}: {e}")
+            return False
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+_client: Optional[AsyncHerokuClient] = None
+
+
+def get_heroku_client() -> AsyncHerokuClient:
+    global _client
+    if _client is None:
+        _client = AsyncHerokuClient()
+    return _client
@@ -0,0 +1,120 @@
+"""
+Ответ на вебхук вызовом Bot API (WEBHOOK_INLINE_REPLY=True).
+
+Telegram позволяет вернуть в HTTP-ответе на вебхук один вызов метода Bot API.
+Пока обновление обрабатывается, первый подходящий исходящий запрос бота
+(answerCallbackQuery и т.п.) не уходит в Telegram отдельным HTTPS запросом,
+а отдаётся в ответе на вебхук - если обработчик дошёл до него за
+WEBHOOK_INLINE_REPLY_TIMEOUT_MS. Иначе запрос уходит обычным путём.
+
+Подходят только методы, результат которых - просто True: результат вызова
+из ответа на вебхук боту неизвестен, поэтому sendMessage и другие методы,
+возвращающие Message, всегда идут отдельным запросом.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from typing import Any, Dict, Optional, Tuple
+
+from telegram.request import HTTPXRequest
+
+import metrics
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_INLINE_REPLY = os.getenv('WEBHOOK_INLINE_REPLY', 'False') == 'True'
+WEBHOOK_INLINE_REPLY_TIMEOUT_MS = int(os.getenv('WEBHOOK_INLINE_REPLY_TIMEOUT_MS', '200'))
+
+# Методы, которые возвращают True и не содержат файлов
+INLINE_REPLY_METHODS = frozenset({
+    'answerCallbackQuery',
+    'sendChatAction',
+    'deleteMessage',
+    'setMessageReaction',
+})
+
+TELEGRAM_API_SECONDS = metrics.histogram('telegram_api_seconds', 'Вызовы Bot API по методу', ['method', 'outcome'])
+TELEGRAM_INLINE_REPLIES = metrics.counter(
+    'telegram_inline_replies_total', 'Вызовы Bot API, отданные в ответе на вебхук', ['method']
+)
+
+_SUCCESS = json.dumps({'ok': True, 'result': True}).encode()
+
+_current_slot: contextvars.ContextVar[Optional["InlineReplySlot"]] = contextvars.ContextVar(
+    'inline_reply_slot', default=None
+)
+
+
+class InlineReplySlot:
+    """
+    Место под один вызов в ответе на вебхук.
+
+    Flask-поток ждёт в wait(), обработчик в event loop предлагает вызов через
+    offer(). Кто первым закрыл слот - тот и решил: либо вызов уходит в ответе,
+    либо вебхук отвечает {"ok": true} и вызов идёт отдельным запросом.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._payload: Optional[Dict[str, Any]] = None
+        self._closed = False
+
+    def offer(self, method: str, parameters: Dict[str, Any]) -> bool:
+        with self._lock:
+            if self._closed:
+                return False
+            self._payload = {'method': method, **parameters}
+            self._closed = True
+        self._done.set()
+        return True
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        self._done.set()
+
+    def wait(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """Payload for the webhook response, or None if there is nothing to inline"""
+        self._done.wait(timeout)
+        self.close()
+        return self._payload
+
+
+class InlineReplyRequest(HTTPXRequest):
+    """HTTPXRequest that times each Bot API call and hands the first eligible one to the open webhook slot"""
+
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs) -> Tuple[int, bytes]:
+        api_method = url.rsplit('/', 1)[-1]
+        slot = _current_slot.get()
+        if slot is not None and request_data is not None and not request_data.contains_files:
+            if api_method in INLINE_REPLY_METHODS and slot.offer(api_method, request_data.parameters):
+                logger.debug(f"↩️ {api_method} отправлен в ответе на вебхук")
+                TELEGRAM_INLINE_REPLIES.labels(api_method).inc()
+                span(f"telegram.{api_method}", inline_reply=True).end()
+                return 200, _SUCCESS
+        started = time.perf_counter()
+        outcome = 'error'
+        with span(f"telegram.{api_method}") as api_span:
+            try:
+                code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+                outcome = 'ok' if code == 200 else 'error'
+                api_span.set(status_code=code)
+                return code, payload
+            finally:
+                TELEGRAM_API_SECONDS.labels(api_method, outcome).observe(time.perf_counter() - started)
+
+
+async def process_with_inline_reply(process_update, data: Dict[str, Any], slot: InlineReplySlot):
+    """Run process_update(data) with the slot open for the bot's requests"""
+    token = _current_slot.set(slot)
+    try:
+        await process_update(data)
+    finally:
+        _current_slot.reset(token)
+        slot.close()
@@ -0,0 +1,226 @@
+"""
+Логирование через очередь: event loop и потоки Flask не ждут ввода-вывода логов.
+
+Корневой логгер получает один QueueHandler, который только кладёт запись в
+очередь - без форматирования: сообщение с аргументами ("%s") собирается уже
+в потоке QueueListener, там же идёт запись в stdout и (LOG_FILE) в файл с
+ротацией. Поэтому в горячих путях логируем лениво:
+
+    logger.info("📨 Файлы отправлены: user %s, plan %s", user_id, plan_type)
+    logger.debug("Payload: %s", lazy_json(data))    # json.dumps только если DEBUG включён
+
+Настройки:
+    LOG_LEVEL=INFO                             уровень корневого логгера
+    LOG_LEVELS=database_operations=WARNING,... уровни отдельных логгеров
+    LOG_FORMAT=text|json                       json - одна запись = один JSON объект
+    LOG_FILE=bot.log                           дополнительно писать в файл (RotatingFileHandler)
+    LOG_SAMPLE_BURST=50, LOG_SAMPLE_INTERVAL=10
+        не больше 50 записей INFO/DEBUG с одним шаблоном сообщения за 10 сек,
+        остальные отбрасываются со сводкой; WARNING и выше не отбрасываются никогда
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, Optional
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = os.getenv('LOG_LEVELS', '')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+LOG_FILE = os.getenv('LOG_FILE')
+LOG_SAMPLE_BURST = int(os.getenv('LOG_SAMPLE_BURST', '50'))
+LOG_SAMPLE_INTERVAL = float(os.getenv('LOG_SAMPLE_INTERVAL', '10'))
+
+# Шумные библиотеки: httpx пишет INFO на каждый запрос к Bot API
+DEFAULT_LOGGER_LEVELS = {
+    'httpx': 'WARNING',
+    'httpcore': 'WARNING',
+    'aiohttp': 'WARNING',
+    'urllib3': 'WARNING',
+    'hpack': 'WARNING',
+    'asyncio': 'WARNING',
+}
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s {tag}%(name)s: %(message)s'
+
+# Поля LogRecord, которые есть всегда; всё остальное пришло через extra=
+_RECORD_FIELDS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def parse_logger_levels(raw: str) -> Dict[str, str]:
+    """'a=DEBUG,b.c=WARNING' -> {'a': 'DEBUG', 'b.c': 'WARNING'}"""
+    levels = {}
+    for item in (raw or '').split(','):
+        name, _, level = item.partition('=')
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+class LazyJson:
+    """json.dumps deferred until the record is actually formatted"""
+
+    __slots__ = ('value', 'kwargs')
+
+    def __init__(self, value, **kwargs):
+        self.value = value
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return json.dumps(self.value, default=str, ensure_ascii=False, **self.kwargs)
+
+
+def lazy_json(value, **kwargs) -> LazyJson:
+    return LazyJson(value, **kwargs)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with extra= fields as top-level keys"""
+
+    def __init__(self, tag: Optional[str] = None):
+        super().__init__()
+        self.tag = tag
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if self.tag:
+            data['proc'] = self.tag
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS:
+                data[key] = value
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Drops INFO/DEBUG floods: at most `burst` records per message template per window
+
+    Ключ - (логгер, шаблон сообщения), поэтому работает для ленивых сообщений
+    с %s; f-строки всегда уникальны и не отбрасываются. Без блокировок:
+    под нагрузкой счёт может немного разойтись, это допустимо.
+    """
+
+    def __init__(self, burst: int = LOG_SAMPLE_BURST, interval: float = LOG_SAMPLE_INTERVAL,
+                 max_level: int = logging.INFO):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.max_level = max_level
+        self.suppressed_total = 0
+        self._counts: Dict[tuple, int] = {}
+        self._suppressed: Dict[tuple, int] = {}
+        self._window_start = time.monotonic()
+
+    def _rollover(self, now: float):
+        suppressed, self._suppressed = self._suppressed, {}
+        self._counts = {}
+        self._window_start = now
+        if suppressed:
+            top = sorted(suppressed.items(), key=lambda item: -item[1])[:3]
+            logging.getLogger(__name__).warning(
+                "🔇 За %g сек отброшено %d однотипных записей лога, чаще всего: %s",
+                self.interval, sum(suppressed.values()),
+                "; ".join(f"{name}: {str(msg)[:60]!r} x{count}" for (name, msg), count in top)
+            )
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.max_level:
+            return True
+        now = time.monotonic()
+        if now - self._window_start >= self.interval:
+            self._rollover(now)
+        msg = record.msg if isinstance(record.msg, str) else type(record.msg).__name__
+        key = (record.name, msg)
+        count = self._counts.get(key, 0) + 1
+        self._counts[key] = count
+        if count <= self.burst:
+            return True
+        self._suppressed[key] = self._suppressed.get(key, 0) + 1
+        self.suppressed_total += 1
+        return False
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that does not format on the caller's thread
+
+    Стандартный prepare() собирает сообщение и traceback до постановки в
+    очередь; очередь у нас внутри процесса, поэтому запись передаётся как есть,
+    а getMessage() вызовет уже поток QueueListener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+_listener: Optional[QueueListener] = None
+_queue: Optional[queue.SimpleQueue] = None
+_sampling: Optional[SamplingFilter] = None
+
+
+def setup_logging(tag: Optional[str] = None, level: str = LOG_LEVEL) -> QueueListener:
+    """
+    Route all logging of this process through the queue (idempotent)
+
+    Args:
+        tag: Метка процесса в каждой записи (например, 'w0' для воркера)
+        level: Уровень корневого логгера
+    """
+    global _listener, _queue, _sampling
+    if _listener is not None:
+        return _listener
+
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if LOG_FILE:
+        handlers.append(RotatingFileHandler(LOG_FILE, maxBytes=10 * 1024 * 1024, backupCount=3, encoding='utf-8'))
+    if LOG_FORMAT == 'json':
+        formatter = JsonFormatter(tag)
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT.format(tag=f"[{tag}] " if tag else ""))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    _queue = queue.SimpleQueue()
+    _sampling = SamplingFilter()
+    queue_handler = DeferredQueueHandler(_queue)
+    queue_handler.addFilter(_sampling)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    for name, logger_level in {**DEFAULT_LOGGER_LEVELS, **parse_logger_levels(LOG_LEVELS)}.items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    _listener = QueueListener(_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def logging_stats() -> Dict[str, int]:
+    return {
+        'queue_size': _queue.qsize() if _queue is not None else 0,
+        'suppressed': _sampling.suppressed_total if _sampling is not None else 0,
+    }
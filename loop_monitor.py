@@ -0,0 +1,273 @@
+"""
+Сторож event loop: задержка loop и поиск блокирующих вызовов.
+
+Синхронные requests, stripe и Heroku внутри async-обработчиков останавливают
+весь loop. Монитор меряет это постоянно: heartbeat-задача засыпает на
+LOOP_MONITOR_INTERVAL и смотрит, насколько позже проснулась - это и есть
+задержка loop (lag). Она уходит в метрики:
+
+    event_loop_lag_seconds{loop}                     гистограмма всех замеров
+    event_loop_lag_window_seconds{loop, quantile}    p50/p95/p99/max за последние ~5 минут
+    event_loop_stalls_total{loop}                    замеры дольше LOOP_SLOW_CALLBACK_MS
+
+В режиме LOOP_MONITOR_DEBUG дополнительно работает поток-сторож: он ставит в
+loop пробный колбэк и, если тот не выполнился за LOOP_SLOW_CALLBACK_MS,
+снимает стек потока loop - прямо во время блокировки. Стек сводится к месту
+вызова в коде бота (telegram_bot.py:412 in on_plan) и самому блокирующему
+вызову (ssl.py:1138 in read); самые дорогие места раз в
+LOOP_MONITOR_REPORT_INTERVAL уходят в лог или админам, текущая сводка -
+GET /admin/loop.
+
+Настройки:
+    LOOP_MONITOR=true
+    LOOP_MONITOR_INTERVAL=0.25           секунды между heartbeat
+    LOOP_MONITOR_DEBUG=false             снимать стеки блокировок
+    LOOP_SLOW_CALLBACK_MS=100
+    LOOP_MONITOR_REPORT_INTERVAL=3600    0 - без периодической сводки
+    LOOP_MONITOR_REPORT_TO=log           log | admins
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LOOP_MONITOR = os.getenv('LOOP_MONITOR', 'true').lower() == 'true'
+LOOP_MONITOR_INTERVAL = float(os.getenv('LOOP_MONITOR_INTERVAL', '0.25'))
+LOOP_MONITOR_DEBUG = os.getenv('LOOP_MONITOR_DEBUG', 'false').lower() == 'true'
+LOOP_SLOW_CALLBACK_MS = float(os.getenv('LOOP_SLOW_CALLBACK_MS', '100'))
+LOOP_MONITOR_REPORT_INTERVAL = float(os.getenv('LOOP_MONITOR_REPORT_INTERVAL', '3600'))
+LOOP_MONITOR_REPORT_TO = os.getenv('LOOP_MONITOR_REPORT_TO', 'log')
+
+# Замеров в окне для перцентилей: ~5 минут при интервале 0.25 сек
+LAG_WINDOW = 1200
+TOP_OFFENDERS = 5
+STACK_DEPTH = 12
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LAG_SECONDS = metrics.histogram('event_loop_lag_seconds', 'Опоздание heartbeat event loop', ['loop'],
+                                buckets=LAG_BUCKETS)
+LAG_WINDOW_SECONDS = metrics.gauge('event_loop_lag_window_seconds',
+                                   'Перцентили опоздания heartbeat за последние минуты', ['loop', 'quantile'])
+STALLS = metrics.counter('event_loop_stalls_total', 'Замеры опоздания дольше LOOP_SLOW_CALLBACK_MS', ['loop'])
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Обёртки, которые есть в каждом стеке и ничего не говорят о месте блокировки
+INFRA_MODULES = frozenset({'loop_monitor.py', 'metrics.py', 'tracing.py', 'logging_setup.py'})
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _frame_label(frame: traceback.FrameSummary) -> str:
+    path = frame.filename
+    if path.startswith(PROJECT_DIR + os.sep):
+        path = os.path.relpath(path, PROJECT_DIR)
+    else:
+        path = os.path.basename(path)
+    return f"{path}:{frame.lineno} in {frame.name}"
+
+
+def call_site(stack: List[traceback.FrameSummary]) -> Dict[str, str]:
+    """
+    Where the bot's own code called into the blocking operation, and the frame that was actually running
+
+    site - два самых глубоких кадра кода бота (обработчик → обёртка вроде
+    _SupabaseSession.request), без служебных модулей; leaf - то, что
+    выполнялось в момент снимка (обычно чтение сокета).
+    """
+    own = [
+        frame for frame in stack
+        if frame.filename.startswith(PROJECT_DIR + os.sep)
+        and os.sep + 'site-packages' + os.sep not in frame.filename
+        and os.path.basename(frame.filename) not in INFRA_MODULES
+    ]
+    return {
+        'site': ' → '.join(_frame_label(frame) for frame in own[-2:]) if own else 'unknown',
+        'leaf': _frame_label(stack[-1]) if stack else 'unknown',
+    }
+
+
+class LoopMonitor:
+    """Heartbeat lag measurement for one loop, plus the stall watchdog in debug mode"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, name: str = 'main', interval: float = LOOP_MONITOR_INTERVAL,
+                 threshold_ms: float = LOOP_SLOW_CALLBACK_MS, debug: bool = LOOP_MONITOR_DEBUG):
+        self.loop = loop
+        self.name = name
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self.debug = debug
+        self.lags: deque = deque(maxlen=LAG_WINDOW)
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.offenders: Dict[str, Dict[str, Any]] = {}
+        self.period_started = time.time()
+        self._lag_child = LAG_SECONDS.labels(name)
+        self._stalls_child = STALLS.labels(name)
+        self._loop_thread_id: Optional[int] = None
+        self._tasks: List[asyncio.Task] = []
+        self._stopped = threading.Event()
+        for label, q in (('0.5', 0.5), ('0.95', 0.95), ('0.99', 0.99), ('1', 1.0)):
+            LAG_WINDOW_SECONDS.labels(name, label).set_function(lambda q=q: _percentile(list(self.lags), q))
+
+    async def start(self):
+        """Must run inside the monitored loop"""
+        self._loop_thread_id = threading.get_ident()
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+        if LOOP_MONITOR_REPORT_INTERVAL > 0:
+            self._tasks.append(asyncio.create_task(self._report_periodically()))
+        if self.debug:
+            threading.Thread(target=self._watchdog, name=f'loop-watchdog-{self.name}', daemon=True).start()
+        logger.info(f"🩺 Монитор event loop {self.name}: heartbeat {self.interval:g} с, порог "
+                    f"{self.threshold * 1000:g} мс{', стеки блокировок включены' if self.debug else ''}")
+
+    def stop(self):
+        self._stopped.set()
+        for task in self._tasks:
+            task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            expected = self.loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, self.loop.time() - expected)
+            self.lags.append(lag)
+            self._lag_child.observe(lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
+            if lag >= self.threshold:
+                self.stalls += 1
+                self._stalls_child.inc()
+
+    def _watchdog(self):
+        """Runs in its own thread: a probe callback that does not run in time means the loop is blocked"""
+        while not self._stopped.is_set():
+            probe = threading.Event()
+            sent = time.monotonic()
+            try:
+                self.loop.call_soon_threadsafe(probe.set)
+            except RuntimeError:
+                # loop закрыт
+                return
+            if probe.wait(self.threshold):
+                self._stopped.wait(self.interval)
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = traceback.extract_stack(frame) if frame is not None else []
+            del frame
+            # Ждём конца блокировки, чтобы узнать её длительность
+            while not probe.wait(1.0):
+                if self._stopped.is_set():
+                    return
+            self._record_stall(stack, time.monotonic() - sent)
+
+    def _record_stall(self, stack: List[traceback.FrameSummary], duration: float):
+        where = call_site(stack)
+        duration_ms = duration * 1000
+        entry = self.offenders.get(where['site'])
+        if entry is None:
+            entry = self.offenders[where['site']] = {
+                'site': where['site'], 'leaf': where['leaf'], 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'stack': ''.join(traceback.format_list(stack[-STACK_DEPTH:])),
+            }
+        entry['count'] += 1
+        entry['total_ms'] += duration_ms
+        entry['max_ms'] = max(entry['max_ms'], duration_ms)
+        logger.warning("🐢 Event loop %s заблокирован на %.0f мс: %s → %s",
+                       self.name, duration_ms, where['site'], where['leaf'])
+
+    def top_offenders(self, limit: int = TOP_OFFENDERS) -> List[Dict[str, Any]]:
+        ranked = sorted(list(self.offenders.values()), key=lambda entry: -entry['total_ms'])[:limit]
+        return [{**entry, 'total_ms': round(entry['total_ms'], 1), 'max_ms': round(entry['max_ms'], 1)}
+                for entry in ranked]
+
+    def stats(self) -> Dict[str, Any]:
+        lags = list(self.lags)
+        return {
+            'loop': self.name,
+            'debug': self.debug,
+            'threshold_ms': self.threshold * 1000,
+            'lag_ms': {label: round(_percentile(lags, q) * 1000, 1)
+                       for label, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99), ('max', 1.0))},
+            'max_lag_ms': round(self.max_lag * 1000, 1),
+            'stalls': self.stalls,
+            'period_started': round(self.period_started, 3),
+            'offenders': self.top_offenders(),
+        }
+
+    def summary_text(self) -> str:
+        stats = self.stats()
+        lag = stats['lag_ms']
+        lines = [
+            f"🩺 Event loop {self.name}: lag p50 {lag['p50']} мс, p99 {lag['p99']} мс, "
+            f"максимум {stats['max_lag_ms']} мс, блокировок дольше {stats['threshold_ms']:g} мс: {stats['stalls']}"
+        ]
+        for i, entry in enumerate(stats['offenders'], 1):
+            lines.append(f"{i}. {entry['site']} → {entry['leaf']}: {entry['count']} раз, "
+                         f"всего {entry['total_ms']:.0f} мс, максимум {entry['max_ms']:.0f} мс")
+        if not self.debug and stats['stalls']:
+            lines.append("Места блокировок: включите LOOP_MONITOR_DEBUG=true")
+        return '\n'.join(lines)
+
+    def reset_period(self):
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.offenders = {}
+        self.period_started = time.time()
+
+    async def _report_periodically(self):
+        while True:
+            await asyncio.sleep(LOOP_MONITOR_REPORT_INTERVAL)
+            try:
+                await self.report()
+            except Exception as e:
+                logger.error(f"❌ Ошибка отправки сводки event loop: {e}")
+
+    async def report(self):
+        """Log the period summary (and send it to admins if configured), then start a new period"""
+        text = self.summary_text()
+        if self.stalls:
+            logger.warning(text)
+        else:
+            logger.info(text)
+        if LOOP_MONITOR_REPORT_TO == 'admins' and self.stalls:
+            from config import get_admin_ids
+            from bot_instance import telegram_app
+            for admin_id in get_admin_ids():
+                try:
+                    await telegram_app.bot.send_message(chat_id=admin_id, text=text)
+                except Exception as e:
+                    logger.warning(f"⚠️ Не удалось отправить сводку event loop админу {admin_id}: {e}")
+        self.reset_period()
+
+
+_monitor: Optional[LoopMonitor] = None
+
+
+def get_loop_monitor() -> Optional[LoopMonitor]:
+    return _monitor
+
+
+async def start_loop_monitor(name: str = 'main') -> Optional[LoopMonitor]:
+    """Monitor the current event loop (main.py, workers, polling); None if LOOP_MONITOR is off"""
+    global _monitor
+    if not LOOP_MONITOR:
+        return None
+    if _monitor is None:
+        _monitor = LoopMonitor(asyncio.get_running_loop(), name)
+        await _monitor.start()
+    return _monitor
@@ -2,19 +2,38 @@ import os
 import asyncio
 from dotenv import load_dotenv
 load_dotenv()
-from flask import request, jsonify, Flask
+# Логи через очередь - до импорта модулей, которые пишут в лог при импорте
+from logging_setup import setup_logging, logging_stats
+setup_logging()
+from tracing import setup_tracing, find_traces, load_trace, render_waterfall
+setup_tracing()
+from flask import request, jsonify, Flask, Response
 from config import *
 from telegram_bot import *
 from stripe_handlers import *
+from scheduler import start_scheduler
+from pricing_mode import broadcast_config_reload, start_pricing_mode_sync
+from sharded_workers import WORKER_PROCESSES, ChatSerialExecutor, ShardedUpdateDispatcher, update_chat_id
+from polling_runner import (
+    TELEGRAM_UPDATES_MODE, WEBHOOK_CONCURRENCY, WEBHOOK_MAX_PENDING, PollingRunner, handle_update,
+    polling_stats, switch_to_polling, webhook_stats
+)
+from inline_reply import (
+    WEBHOOK_INLINE_REPLY, WEBHOOK_INLINE_REPLY_TIMEOUT_MS, InlineReplySlot, process_with_inline_reply
+)
+import metrics
+from memory_diagnostics import get_memory_tracker, watch
+from profiler import PROFILE_DEFAULT_SECONDS, get_profile_job, profile_to_chats, profiling_active, start_profile
+from loop_monitor import get_loop_monitor, start_loop_monitor
+from traffic_capture import capture_request, capture_stats, start_capture, stop_capture
+from config import ADMIN_API_TOKEN
 from datetime import timedelta
+import atexit
+import hmac
+import time
 import logging
 import threading
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s %(levelname)s %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 # Создаем Flask приложение
@@ -57,6 +76,10 @@ def run_async_loop():
 
 # Запускаем event loop в отдельном потоке
 threading.Thread(target=run_async_loop, daemon=True).start()
+# Глубина очереди loop в /metrics: если ready растёт, loop не успевает за обновлениями
+metrics.track_event_loop(loop)
+metrics.gauge('log_queue_size', 'Записи лога, ждущие потока QueueListener') \
+    .set_function(lambda: logging_stats()['queue_size'])
 
 # Запускаем инициализацию telegram_app в глобальном loop и ждем завершения
 future = asyncio.run_coroutine_threadsafe(init_telegram_app(), loop)
@@ -67,14 +90,106 @@ except Exception as e:
     logger.error(f"Bot initialization failed: {e}")
     raise
 
+# Запускаем планировщик напоминаний и rollups в том же loop
+try:
+    asyncio.run_coroutine_threadsafe(start_scheduler(), loop).result(timeout=10)
+except Exception as e:
+    logger.error(f"Scheduler start failed: {e}", exc_info=True)
+
+# Heartbeat loop: задержка в /metrics, блокирующие вызовы - в лог (LOOP_MONITOR_DEBUG)
+try:
+    asyncio.run_coroutine_threadsafe(start_loop_monitor(), loop).result(timeout=10)
+except Exception as e:
+    logger.error(f"Loop monitor start failed: {e}", exc_info=True)
+
+# Режим цен из app_settings: переключается на лету во всех процессах
+try:
+    asyncio.run_coroutine_threadsafe(start_pricing_mode_sync(), loop).result(timeout=10)
+except Exception as e:
+    logger.error(f"Pricing mode sync start failed: {e}", exc_info=True)
+
+# Долгоживущие структуры, размер которых виден в /admin/memory
+watch('telegram_app.user_data', lambda: len(telegram_app.user_data))
+watch('telegram_app.chat_data', lambda: len(telegram_app.chat_data))
+# Размер хранилища состояний: COUNT в SQLite, DBSIZE в Redis - запрос идёт в loop, где живёт клиент
+watch('state_store', lambda: asyncio.run_coroutine_threadsafe(get_state_store().size(), loop).result(timeout=5))
+
+# Режим приёма обновлений: вебхук (по умолчанию) или long polling
+polling_runner = None
+# Ссылка на задачу цикла: без неё loop держит задачу слабо и её может собрать GC
+polling_task = None
+
+async def start_polling():
+    global polling_runner, polling_task
+    if polling_runner is not None and polling_runner.running:
+        return
+    await switch_to_polling(telegram_app.bot)
+    polling_runner = PollingRunner(telegram_app.bot, handle_update)
+    polling_task = asyncio.create_task(polling_runner.run(), name='polling')
+    polling_task.add_done_callback(_log_polling_exit)
+
+def _log_polling_exit(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"❌ Цикл polling завершился с ошибкой: {task.exception()}", exc_info=task.exception())
+
+async def stop_polling():
+    global polling_task
+    if polling_runner is not None and polling_runner.running:
+        await polling_runner.stop()
+    if polling_task is not None:
+        task, polling_task = polling_task, None
+        # Ошибку цикла уже записал _log_polling_exit
+        await asyncio.gather(task, return_exceptions=True)
+
+if TELEGRAM_UPDATES_MODE == 'polling':
+    asyncio.run_coroutine_threadsafe(start_polling(), loop).result(timeout=30)
+
+# Многопроцессный режим: обновления Telegram обрабатываются в воркерах по хешу chat_id
+update_dispatcher = None
+if WORKER_PROCESSES > 1:
+    update_dispatcher = ShardedUpdateDispatcher(WORKER_PROCESSES)
+    update_dispatcher.start()
+    atexit.register(update_dispatcher.stop)
+
+# Вебхуки в loop обрабатываются как в polling: не больше WEBHOOK_CONCURRENCY одновременно,
+# один чат - по порядку. Иначе всплеск занимает весь пул соединений Bot API и ответы падают по таймауту
+webhook_executor = ChatSerialExecutor(WEBHOOK_CONCURRENCY, WEBHOOK_MAX_PENDING)
+
+async def offer_webhook_update(data, handle, *args) -> bool:
+    return webhook_executor.try_submit(update_chat_id(data), handle, *args)
+
+def dispatch_telegram_update():
+    capture_request('webhook', request.get_data())
+    if update_dispatcher is not None:
+        # Отдаём сырой JSON воркеру, разбор Update происходит уже в нём
+        if not update_dispatcher.dispatch(request.get_data()):
+            return jsonify({"ok": False, "error": "worker is unavailable or its queue is full"}), 503
+        return jsonify({"ok": True})
+
+    data = request.get_json(force=True)
+    if WEBHOOK_INLINE_REPLY:
+        # Ждём немного: первый подходящий вызов бота уйдёт прямо в ответе на вебхук
+        slot = InlineReplySlot()
+        accepted = asyncio.run_coroutine_threadsafe(
+            offer_webhook_update(data, process_with_inline_reply, process_telegram_update, data, slot), loop
+        ).result(timeout=10)
+        if not accepted:
+            return jsonify({"ok": False, "error": "too many updates in flight"}), 503
+        payload = slot.wait(WEBHOOK_INLINE_REPLY_TIMEOUT_MS / 1000)
+        return jsonify(payload if payload else {"ok": True})
+
+    # Ставим в очередь и не ждём обработки; если очередь полна - 503, Telegram повторит доставку
+    accepted = asyncio.run_coroutine_threadsafe(
+        offer_webhook_update(data, process_telegram_update, data), loop
+    ).result(timeout=10)
+    if not accepted:
+        return jsonify({"ok": False, "error": "too many updates in flight"}), 503
+    return jsonify({"ok": True})
+
 @app.route('/webhook/<token>', methods=['POST'])
 def telegram_webhook_with_token(token=None):
     try:
-        data = request.get_json(force=True)
-        # Запускаем асинхронный обработчик в глобальном loop
-        future = asyncio.run_coroutine_threadsafe(process_telegram_update(data), loop)
-        # Не ждём, чтобы не блокировать Flask, просто запускаем
-        return jsonify({"ok": True})
+        return dispatch_telegram_update()
     except Exception as e:
         logger.error(f"Error in telegram_webhook: {e}", exc_info=True)
         return jsonify({"ok": False, "error": str(e)}), 500
@@ -82,11 +197,7 @@ def telegram_webhook_with_token(token=None):
 @app.route('/webhook', methods=['POST'])
 def telegram_webhook():
     try:
-        data = request.get_json(force=True)
-        # Запускаем асинхронный обработчик в глобальном loop
-        future = asyncio.run_coroutine_threadsafe(process_telegram_update(data), loop)
-        # Не ждём, чтобы не блокировать Flask, просто запускаем
-        return jsonify({"ok": True})
+        return dispatch_telegram_update()
     except Exception as e:
         logger.error(f"Error in telegram_webhook: {e}", exc_info=True)
         return jsonify({"ok": False, "error": str(e)}), 500
@@ -95,6 +206,8 @@ def telegram_webhook():
 def set_webhook():
     try:
         url = f"{WEBHOOK_URL.rstrip('/')}/webhook"
+        # Сначала останавливаем polling: getUpdates и вебхук не работают одновременно
+        asyncio.run_coroutine_threadsafe(stop_polling(), loop).result(timeout=60)
         # Ждём результат, чтобы точно знать что вебхук установлен
         asyncio.run_coroutine_threadsafe(telegram_app.bot.set_webhook(url=url), loop).result()
         logger.info(f"Webhook set to {url}")
@@ -103,6 +216,36 @@ def set_webhook():
         logger.error(f"Error setting webhook: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+@app.route('/start_polling', methods=['GET'])
+def start_polling_route():
+    # Снимает вебхук - только с ADMIN_API_TOKEN
+    if not admin_api_authorized():
+        return jsonify({"error": "unauthorized"}), 401
+    try:
+        asyncio.run_coroutine_threadsafe(start_polling(), loop).result(timeout=30)
+        return jsonify({"status": "polling started"})
+    except Exception as e:
+        logger.error(f"Error starting polling: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/reload_config', methods=['POST'])
+def reload_config_route():
+    if not admin_api_authorized():
+        return jsonify({"error": "unauthorized"}), 401
+    try:
+        snapshot = reload_config()
+        # Воркеры и другие dyno перечитывают конфигурацию по NOTIFY app_settings
+        propagated = asyncio.run_coroutine_threadsafe(broadcast_config_reload('api'), loop).result(timeout=10)
+        return jsonify({
+            "status": "config reloaded",
+            "pricing_mode": snapshot.pricing_mode,
+            "admins": len(snapshot.admin_ids),
+            "propagated": propagated
+        })
+    except Exception as e:
+        logger.error(f"Error reloading config: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/clear_webhook', methods=['GET'])
 def clear_webhook():
     try:
@@ -119,6 +262,7 @@ def stripe_webhook_route():
     try:
         # Не обрабатываем данные заранее, пусть stripe_handlers это делает
         logger.info("Received Stripe webhook")
+        capture_request('stripe_webhook', request.get_data())
         
         # Импортируем и вызываем обработчик
         from stripe_handlers import stripe_webhook as handle_stripe_webhook
@@ -131,6 +275,140 @@ def stripe_webhook_route():
         logger.error(f"Error in stripe_webhook: {str(e)}", exc_info=True)
         return jsonify({"status": "error", "message": str(e)}), 500
    
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    # METRICS_TOKEN задан - Prometheus должен прислать его как bearer_token
+    if metrics.METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {metrics.METRICS_TOKEN}":
+        return jsonify({"error": "unauthorized"}), 401
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def admin_api_authorized() -> bool:
+    """Bearer ADMIN_API_TOKEN, or ?token= for opening pages in a browser; without the token set everything is closed"""
+    if not ADMIN_API_TOKEN:
+        return False
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ') or request.args.get('token', '')
+    return hmac.compare_digest(supplied.encode(), ADMIN_API_TOKEN.encode())
+
+@app.route('/admin/traces', methods=['GET'])
+def admin_traces():
+    """Latest traces; any other query parameter filters by span attribute (?user_id=123)"""
+    if not admin_api_authorized():
+        return jsonify({"error": "unauthorized"}), 401
+    try:
+        filters = {k: v for k, v in request.args.items() if k not in ('token', 'limit')}
+        return jsonify(find_traces(limit=request.args.get('limit', 20, type=int), **filters))
+    except Exception as e:
+        logger.error(f"Error listing traces: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/admin/traces/<trace_id>', methods=['GET'])
+def admin_trace_waterfall(trace_id):
+    if not admin_api_authorized():
+        return jsonify({"error": "unauthorized"}), 401
+    try:
+        spans = load_trace(trace_id)
+        if request.args.get('format') == 'json':
+            return jsonify(spans)
+        return Response(render_waterfall(spans), content_type='text/plain; charset=utf-8',
+                        status=200 if spans else 404)
+    except Exception as e:
+        logger.error(f"Error rendering trace {trace_id}: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/admin/loop', methods=['GET'])
+def admin_loop():
+    """Event loop lag percentiles and the top blocking call sites of the current period"""
+    if not admin_api_authorized():
+        return jsonify({"error": "unauthorized"}), 401
+    monitor = get_loop_monitor()
+    if monitor is None:
+        return jsonify({"error": "LOOP_MONITOR is off"}), 404
+    return jsonify(monitor.stats())
+
+@app.route('/admin/profile', methods=['POST'])
+def admin_profile():
+    """Start sampling all threads for ?seconds=N in the background (202 + id), or telegram=1 to send it to admins"""
+    if not admin_api_authorized():
+        return jsonify({"error": "unauthorized"}), 401
+    try:
+        seconds = request.args.get('seconds', PROFILE_DEFAULT_SECONDS, type=float)
+        if profiling_active():
+            return jsonify({"error": "profiling is already running"}), 409
+        if request.args.get('telegram'):
+            asyncio.run_coroutine_threadsafe(profile_to_chats(telegram_app.bot, get_admin_ids(), seconds), loop)
+            return jsonify({"status": "profiling started", "seconds": seconds}), 202
+
+        # Не держим запрос: роутер Heroku обрывает его через 30 с (H12)
+        job = start_profile(seconds)
+        if job is None:
+            return jsonify({"error": "profiling is already running"}), 409
+        return jsonify({**job.status(), "url": f"/admin/profile/{job.id}"}), 202
+    except Exception as e:
+        logger.error(f"Error profiling: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/admin/profile/<profile_id>', methods=['GET'])
+def admin_profile_result(profile_id):
+    """Finished profile as format=collapsed|pstats|summary; 202 while it is still running"""
+    if not admin_api_authorized():
+        return jsonify({"error": "unauthorized"}), 401
+    job = get_profile_job(profile_id)
+    if job is None:
+        return jsonify({"error": "unknown profile id"}), 404
+    if not job.done.is_set():
+        return jsonify(job.status()), 202
+    if job.result is None:
+        return jsonify(job.status()), 500
+    result = job.result
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(job.started_at))
+    fmt = request.args.get('format', 'collapsed')
+    if fmt == 'pstats':
+        return Response(result.pstats_bytes(), content_type='application/octet-stream',
+                        headers={'Content-Disposition': f'attachment; filename=profile-{stamp}.pstats'})
+    if fmt == 'summary':
+        return Response(result.summary_text() + '\n', content_type='text/plain; charset=utf-8')
+    return Response(result.collapsed(), content_type='text/plain; charset=utf-8',
+                    headers={'Content-Disposition': f'attachment; filename=profile-{stamp}.collapsed.txt'})
+
+@app.route('/admin/memory', methods=['GET'])
+@app.route('/admin/memory/<action>', methods=['POST'])
+def admin_memory(action=None):
+    """Last memory report (?snapshot=1 takes one now); POST start|stop toggles tracemalloc snapshots"""
+    if not admin_api_authorized():
+        return jsonify({"error": "unauthorized"}), 401
+    try:
+        tracker = get_memory_tracker()
+        if action == 'start':
+            tracker.start()
+        elif action == 'stop':
+            tracker.stop()
+        elif action is not None:
+            return jsonify({"error": f"unknown action {action}"}), 404
+        elif request.args.get('snapshot'):
+            tracker.take()
+        return jsonify(tracker.status())
+    except Exception as e:
+        logger.error(f"Error in memory diagnostics: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/admin/capture', methods=['GET'])
+@app.route('/admin/capture/<action>', methods=['POST'])
+def admin_capture(action=None):
+    """Status of the webhook traffic recorder; POST start|stop toggles it"""
+    if not admin_api_authorized():
+        return jsonify({"error": "unauthorized"}), 401
+    try:
+        if action == 'start':
+            return jsonify(start_capture())
+        if action == 'stop':
+            return jsonify(stop_capture())
+        if action is not None:
+            return jsonify({"error": f"unknown action {action}"}), 404
+        return jsonify(capture_stats())
+    except Exception as e:
+        logger.error(f"Error controlling traffic capture: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/webhook_info', methods=['GET'])
 def webhook_info():
     try:
@@ -167,6 +445,18 @@ def bot_status():
                 "last_error_message": webhook_info_data.last_error_message
             },
             "handlers_count": len(telegram_app.handlers),
+            "pricing_mode": get_config().pricing_mode,
+            "logging": logging_stats(),
+            "updates_mode": "polling" if polling_runner is not None and polling_runner.running else "webhook",
+            "ingestion": {
+                "webhook": {**webhook_stats.as_dict(), "in_flight": webhook_executor.pending},
+                "polling": polling_stats.as_dict()
+            },
+            "worker_processes": {
+                "configured": WORKER_PROCESSES,
+                "alive": sum(w.is_alive() for w in update_dispatcher.workers) if update_dispatcher else 0,
+                "restarts": update_dispatcher.restarts if update_dispatcher else 0
+            },
             "expected_webhook_url": f"{WEBHOOK_URL.rstrip('/')}/webhook"
         })
     except Exception as e:
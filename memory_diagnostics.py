@@ -0,0 +1,268 @@
+"""
+Диагностика роста памяти долгоживущего процесса.
+
+При включении (MEMORY_DIAGNOSTICS=true или POST /admin/memory/start) запускается
+tracemalloc и поток, который раз в MEMORY_SNAPSHOT_INTERVAL секунд снимает:
+
+- снимок tracemalloc и его разницу с предыдущим и с первым снимком:
+  строки кода, на которых выделенная и не освобождённая память растёт сильнее всего;
+- число живых объектов по типам (gc) и его прирост - так видны, например,
+  незакрытые aiohttp.ClientSession или растущие dict;
+- RSS процесса: если между снимками он вырос больше MEMORY_RSS_GROWTH_WARN_MB,
+  в лог уходит предупреждение с главными местами роста;
+- размеры известных накопителей (watch()): хранилище состояний в памяти,
+  user_data / chat_data python-telegram-bot.
+
+Последний отчёт - GET /admin/memory (ADMIN_API_TOKEN), ?snapshot=1 - снять сейчас.
+Выключено - нет ни tracemalloc, ни потока; RSS в /metrics есть всегда.
+
+tracemalloc замедляет выделение памяти (заметно, в разы на горячих путях)
+и сам ест память на трассы, поэтому включается на время расследования.
+
+Настройки:
+    MEMORY_DIAGNOSTICS=false
+    MEMORY_SNAPSHOT_INTERVAL=600
+    MEMORY_TRACEMALLOC_FRAMES=1          глубина трассы каждого выделения
+    MEMORY_RSS_GROWTH_WARN_MB=50
+"""
+
+import gc
+import os
+import sys
+import time
+import logging
+import resource
+import threading
+import tracemalloc
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MEMORY_DIAGNOSTICS = os.getenv('MEMORY_DIAGNOSTICS', 'false').lower() == 'true'
+MEMORY_SNAPSHOT_INTERVAL = float(os.getenv('MEMORY_SNAPSHOT_INTERVAL', '600'))
+MEMORY_TRACEMALLOC_FRAMES = int(os.getenv('MEMORY_TRACEMALLOC_FRAMES', '1'))
+MEMORY_RSS_GROWTH_WARN_MB = float(os.getenv('MEMORY_RSS_GROWTH_WARN_MB', '50'))
+
+TOP_SITES = 20
+TOP_TYPES = 25
+MB = 1024 * 1024
+
+# Выделения самого tracemalloc, этого модуля и импорта модулей - шум
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+def rss_bytes() -> Optional[int]:
+    """Current resident set size from /proc (Linux, Heroku); None elsewhere"""
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss в килобайтах на Linux и в байтах на macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def object_counts() -> Counter:
+    """Live gc-tracked objects per type name (one pass over the heap, ~0.1-1 s on a big process)"""
+    counts: Counter = Counter()
+    for obj in gc.get_objects():
+        cls = type(obj)
+        counts[f"{cls.__module__}.{cls.__qualname__}" if cls.__module__ != 'builtins' else cls.__qualname__] += 1
+    return counts
+
+
+def _mb(value: Optional[float]) -> Optional[float]:
+    return round(value / MB, 1) if value is not None else None
+
+
+def _sites(diff: List[tracemalloc.StatisticDiff], limit: int, frames: int) -> List[Dict[str, Any]]:
+    return [{
+        'site': str(stat.traceback[-1]) if frames <= 1 else ' ← '.join(
+            str(frame) for frame in reversed(stat.traceback)),
+        'size_kb': round(stat.size / 1024, 1),
+        'growth_kb': round(stat.size_diff / 1024, 1),
+        'count': stat.count,
+        'count_growth': stat.count_diff,
+    } for stat in diff[:limit] if stat.size_diff > 0]
+
+
+# Размеры известных накопителей: имя -> функция без аргументов
+_watched: Dict[str, Callable[[], int]] = {}
+
+
+def watch(name: str, size: Callable[[], int]):
+    """Report len() of a long-lived structure in every snapshot"""
+    _watched[name] = size
+
+
+def watched_sizes() -> Dict[str, Optional[int]]:
+    sizes = {}
+    for name, size in list(_watched.items()):
+        try:
+            sizes[name] = int(size())
+        except Exception:
+            sizes[name] = None
+    return sizes
+
+
+class MemoryTracker:
+    """Periodic tracemalloc snapshots diffed against the previous and the first one"""
+
+    def __init__(self, interval: float = MEMORY_SNAPSHOT_INTERVAL, frames: int = MEMORY_TRACEMALLOC_FRAMES,
+                 rss_warn_mb: float = MEMORY_RSS_GROWTH_WARN_MB):
+        self.interval = interval
+        self.frames = frames
+        self.rss_warn_mb = rss_warn_mb
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        self.previous: Optional[tracemalloc.Snapshot] = None
+        self.previous_types: Optional[Counter] = None
+        self.previous_rss: Optional[int] = None
+        self.previous_taken: Optional[float] = None
+        self.snapshots = 0
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started_tracemalloc = False
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracemalloc = True
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='memory-diagnostics', daemon=True)
+        self._thread.start()
+        logger.info(f"🧠 Диагностика памяти: снимки каждые {self.interval:g} с, "
+                    f"порог роста RSS {self.rss_warn_mb:g} МБ")
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+        if self._started_tracemalloc:
+            # Снимки без tracemalloc бесполезны - сбрасываем вместе с ним
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+            self.baseline = self.previous = None
+        logger.info("🧠 Диагностика памяти выключена")
+
+    def _run(self):
+        # Первый снимок сразу - он же точка отсчёта
+        while True:
+            try:
+                self.take()
+            except Exception as e:
+                logger.error(f"❌ Ошибка снимка памяти: {e}", exc_info=True)
+            if self._stopped.wait(self.interval):
+                return
+
+    def take(self) -> Dict[str, Any]:
+        """Take a snapshot now, diff it and store the report"""
+        with self._lock:
+            started = time.monotonic()
+            report: Dict[str, Any] = {'taken_at': round(time.time(), 3), 'snapshot': self.snapshots + 1}
+
+            rss = rss_bytes()
+            report['rss_mb'] = _mb(rss)
+            report['peak_rss_mb'] = _mb(peak_rss_bytes())
+            report['rss_growth_mb'] = (
+                _mb(rss - self.previous_rss) if rss is not None and self.previous_rss is not None else None
+            )
+
+            if tracemalloc.is_tracing():
+                snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+                traced, traced_peak = tracemalloc.get_traced_memory()
+                report['traced_mb'] = _mb(traced)
+                report['traced_peak_mb'] = _mb(traced_peak)
+                report['tracemalloc_overhead_mb'] = _mb(tracemalloc.get_tracemalloc_memory())
+                key = 'lineno' if self.frames <= 1 else 'traceback'
+                if self.previous is not None:
+                    report['top_growth'] = _sites(snapshot.compare_to(self.previous, key), TOP_SITES, self.frames)
+                if self.baseline is not None:
+                    report['top_growth_since_start'] = _sites(snapshot.compare_to(self.baseline, key), TOP_SITES, self.frames)
+                if self.baseline is None:
+                    self.baseline = snapshot
+                self.previous = snapshot
+
+            types = object_counts()
+            previous_types = self.previous_types or Counter()
+            report['objects'] = [
+                {'type': name, 'count': count, 'growth': count - previous_types.get(name, 0)}
+                for name, count in types.most_common(TOP_TYPES)
+            ]
+            if self.previous_types is not None:
+                growth = Counter({name: count - previous_types.get(name, 0) for name, count in types.items()})
+                report['objects_growth'] = [
+                    {'type': name, 'count': types[name], 'growth': diff}
+                    for name, diff in growth.most_common(TOP_TYPES) if diff > 0
+                ]
+            self.previous_types = types
+            report['watched'] = watched_sizes()
+            report['duration_ms'] = round((time.monotonic() - started) * 1000, 1)
+
+            self.snapshots += 1
+            since_previous = time.monotonic() - self.previous_taken if self.previous_taken is not None else 0.0
+            self.previous_taken = time.monotonic()
+            self.previous_rss = rss
+            self.last_report = report
+
+        growth_mb = report['rss_growth_mb']
+        if growth_mb is not None and growth_mb >= self.rss_warn_mb:
+            sites = ', '.join(f"{site['site']} +{site['growth_kb']:.0f} КБ" for site in report.get('top_growth', [])[:3])
+            objects = ', '.join(f"{item['type']} +{item['growth']}" for item in report.get('objects_growth', [])[:3])
+            logger.warning(f"🧠 RSS вырос на {growth_mb} МБ за {since_previous:.0f} с (сейчас {report['rss_mb']} МБ). "
+                           f"Рост: {sites or 'tracemalloc выключен'}; объекты: {objects or '-'}")
+        else:
+            logger.info(f"🧠 Снимок памяти #{report['snapshot']}: RSS {report['rss_mb']} МБ, "
+                        f"за {report['duration_ms']:.0f} мс")
+        return report
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'running': self.running,
+            'tracemalloc': tracemalloc.is_tracing(),
+            'interval_sec': self.interval,
+            'snapshots': self.snapshots,
+            'rss_mb': _mb(rss_bytes()),
+            'last_report': self.last_report,
+        }
+
+
+_tracker: Optional[MemoryTracker] = None
+
+
+def get_memory_tracker() -> MemoryTracker:
+    global _tracker
+    if _tracker is None:
+        _tracker = MemoryTracker()
+    return _tracker
+
+
+metrics.gauge('process_resident_memory_bytes', 'RSS процесса').set_function(rss_bytes)
+metrics.gauge('tracemalloc_traced_bytes', 'Память, выделенная под наблюдением tracemalloc') \
+    .set_function(lambda: tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None)
+
+if MEMORY_DIAGNOSTICS:
+    get_memory_tracker().start()
@@ -0,0 +1,340 @@
+"""
+Метрики процесса в текстовом формате Prometheus (GET /metrics).
+
+Свой маленький реестр вместо prometheus_client: счётчики, gauge и
+гистограммы с фиксированными бакетами. Инкременты без блокировок - у
+каждого потока своя ячейка (event loop, потоки gunicorn), при выдаче
+/metrics ячейки суммируются. Блокировка берётся только при создании
+нового набора меток.
+
+    UPDATE_SECONDS = metrics.histogram('telegram_update_seconds', 'Обработка обновления',
+                                       ['type', 'route', 'outcome'])
+
+    with UPDATE_SECONDS.time('callback_query', 'on_plan'):   # outcome = ok | error
+        ...
+
+    metrics.gauge('event_loop_ready', 'Готовые к запуску колбэки').set_function(lambda: len(loop._ready))
+
+Метки - только из ограниченного набора значений (метод API, таблица, маршрут),
+никаких user_id: каждая комбинация меток живёт в памяти до рестарта.
+
+В режиме WORKER_PROCESSES > 1 /metrics показывает только веб-процесс
+(приём вебхуков, Stripe), обработка обновлений идёт в воркерах.
+"""
+
+import os
+import math
+import time
+import asyncio
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Секунды: от быстрых запросов к Bot API до загрузки видео
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class _Metric:
+    """Metric family: children per label values, each child keeps one cell per thread"""
+
+    type_name = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        self._default = self._new_child() if not self.labelnames else None
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Child for these label values (created on first use)"""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: ожидались метки {self.labelnames}, получено {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _items(self) -> List[Tuple[Tuple[str, ...], object]]:
+        if self._default is not None:
+            return [((), self._default)]
+        return sorted(self._children.items())
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class _CounterCell:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+
+class _CounterChild:
+    __slots__ = ('_cells',)
+
+    def __init__(self):
+        self._cells: Dict[int, _CounterCell] = {}
+
+    def inc(self, amount: float = 1):
+        # Ячейку пишет только свой поток: += без блокировки не теряет инкременты
+        cell = self._cells.get(threading.get_ident())
+        if cell is None:
+            cell = self._cells.setdefault(threading.get_ident(), _CounterCell())
+        cell.value += amount
+
+    def get(self) -> float:
+        return sum(cell.value for cell in list(self._cells.values()))
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._default.inc(amount)
+
+    def get(self) -> float:
+        return self._default.get()
+
+    def samples(self):
+        for values, child in self._items():
+            yield f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}'
+
+
+class _GaugeChild:
+    __slots__ = ('value', 'function')
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """Value is computed by function() at scrape time"""
+        self.function = function
+
+    def get(self) -> Optional[float]:
+        if self.function is None:
+            return self.value
+        try:
+            return float(self.function())
+        except Exception:
+            return None
+
+
+class Gauge(_Metric):
+    type_name = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._default.set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self._default.set_function(function)
+
+    def samples(self):
+        for values, child in self._items():
+            value = child.get()
+            if value is not None:
+                yield f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}'
+
+
+class _HistogramCell:
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+
+
+class _Timer:
+    __slots__ = ('histogram', 'values', 'started')
+
+    def __init__(self, histogram: "Histogram", values: Tuple):
+        self.histogram = histogram
+        self.values = values
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        values = self.values
+        if self.histogram.with_outcome:
+            values = values + ('error' if exc_type is not None else 'ok',)
+        self.histogram.labels(*values).observe(elapsed)
+        return False
+
+
+class _HistogramChild:
+    __slots__ = ('_bounds', '_cells')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self._bounds = bounds
+        self._cells: Dict[int, _HistogramCell] = {}
+
+    def observe(self, value: float):
+        cell = self._cells.get(threading.get_ident())
+        if cell is None:
+            cell = self._cells.setdefault(threading.get_ident(), _HistogramCell(len(self._bounds) + 1))
+        # bisect_left: значение, равное границе, попадает в её бакет (le = "меньше или равно")
+        cell.counts[bisect_left(self._bounds, value)] += 1
+        cell.sum += value
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        counts = [0] * (len(self._bounds) + 1)
+        total = 0.0
+        for cell in list(self._cells.values()):
+            for i, count in enumerate(cell.counts):
+                counts[i] += count
+            total += cell.sum
+        return counts, total
+
+
+class Histogram(_Metric):
+    """
+    Fixed-bucket histogram
+
+    Если последняя метка называется 'outcome', time() подставляет её сама:
+    'ok' или 'error', если блок завершился исключением.
+    """
+
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.bounds = tuple(sorted(float(b) for b in buckets if b != math.inf))
+        self.with_outcome = bool(labelnames) and labelnames[-1] == 'outcome'
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def time(self, *values) -> _Timer:
+        """Context manager observing the elapsed seconds of the block"""
+        return _Timer(self, tuple(str(value) for value in values))
+
+    def samples(self):
+        for values, child in self._items():
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip(self.bounds + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames + ('le',), values + (_format_value(bound),))
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, values)
+            yield f'{self.name}_sum{labels} {_format_value(total)}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Метрика {name} уже зарегистрирована как {metric.type_name}")
+            # Повторная регистрация (модуль импортирован дважды) возвращает ту же метрику
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.counter(name, documentation, labelnames)
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.gauge(name, documentation, labelnames)
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.histogram(name, documentation, labelnames, buckets)
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+def track_event_loop(loop, name: str = 'main'):
+    """
+    Export the loop's queue depth, read from any thread at scrape time
+
+    ready - колбэки, готовые к запуску прямо сейчас: если их много, loop не
+    успевает; scheduled - таймеры (sleep, таймауты); tasks - живые задачи.
+    """
+    gauge('event_loop_ready', 'Колбэки в очереди event loop, готовые к запуску', ['loop']) \
+        .labels(name).set_function(lambda: len(loop._ready))
+    gauge('event_loop_scheduled', 'Отложенные колбэки (таймеры) event loop', ['loop']) \
+        .labels(name).set_function(lambda: len(loop._scheduled))
+    # Если набор задач меняется во время чтения, точка просто пропускается в этой выдаче
+    gauge('event_loop_tasks', 'Незавершённые задачи event loop', ['loop']) \
+        .labels(name).set_function(lambda: len(asyncio.all_tasks(loop)))
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Применяет версионированные миграции из database/migrations к базе Supabase.
+
+Каждая миграция - файл вида NNNN_description.sql, применяется один раз и
+записывается в таблицу public.schema_migrations. После миграций заново
+применяется database/rpc_functions.sql (там только CREATE OR REPLACE).
+
+Миграция, первая строка которой "-- migrate:no-transaction", выполняется
+вне транзакции по одному оператору (нужно для CREATE INDEX CONCURRENTLY).
+
+    python migrate.py           # применить новые миграции и RPC функции
+    python migrate.py --status  # показать применённые и ожидающие миграции
+"""
+
+import os
+import re
+import sys
+import asyncio
+import hashlib
+import logging
+from typing import List, Optional, Tuple
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MIGRATIONS_DIR = os.path.join(BASE_DIR, 'database', 'migrations')
+RPC_FUNCTIONS_PATH = os.path.join(BASE_DIR, 'database', 'rpc_functions.sql')
+
+NO_TRANSACTION_MARKER = '-- migrate:no-transaction'
+MIGRATION_FILE_RE = re.compile(r'^(\d{4})_[a-z0-9_]+\.sql$')
+
+# Ключ advisory lock, чтобы два процесса не накатывали миграции одновременно
+MIGRATIONS_LOCK_KEY = 'schema_migrations'
+
+
+def list_migrations() -> List[Tuple[str, str, str]]:
+    """
+    Find migration files in database/migrations
+
+    Returns:
+        List of (version, file name, full path) sorted by version
+    """
+    migrations = []
+    for file_name in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = MIGRATION_FILE_RE.match(file_name)
+        if not match:
+            continue
+        migrations.append((match.group(1), file_name, os.path.join(MIGRATIONS_DIR, file_name)))
+    return migrations
+
+
+def _split_statements(sql: str) -> List[str]:
+    """
+    Split a no-transaction migration into single statements.
+
+    Only meant for plain DDL (indexes etc.): statements end with ';' at the end
+    of a line, function bodies with $$ are not supported here.
+    """
+    statements = []
+    current = []
+    for line in sql.splitlines():
+        stripped = line.strip()
+        if not current and (not stripped or stripped.startswith('--')):
+            continue
+        current.append(line)
+        if stripped.endswith(';'):
+            statements.append('\n'.join(current))
+            current = []
+    if current and '\n'.join(current).strip():
+        statements.append('\n'.join(current))
+    return statements
+
+
+async def ensure_migrations_table(conn: asyncpg.Connection):
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS public.schema_migrations (
+            version TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            checksum TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+    """)
+
+
+async def get_applied_migrations(conn: asyncpg.Connection) -> dict:
+    rows = await conn.fetch("SELECT version, name, checksum FROM public.schema_migrations")
+    return {row['version']: row for row in rows}
+
+
+async def apply_migration(conn: asyncpg.Connection, version: str, name: str, sql: str):
+    checksum = hashlib.sha256(sql.encode('utf-8')).hexdigest()
+
+    if sql.lstrip().startswith(NO_TRANSACTION_MARKER):
+        for statement in _split_statements(sql):
+            await conn.execute(statement)
+        await conn.execute(
+            "INSERT INTO public.schema_migrations (version, name, checksum) VALUES ($1, $2, $3)",
+            version, name, checksum
+        )
+    else:
+        async with conn.transaction():
+            await conn.execute(sql)
+            await conn.execute(
+                "INSERT INTO public.schema_migrations (version, name, checksum) VALUES ($1, $2, $3)",
+                version, name, checksum
+            )
+
+
+async def apply_migrations(conn: asyncpg.Connection, include_rpc_functions: bool = True) -> List[str]:
+    """
+    Apply all pending migrations and (optionally) re-apply rpc_functions.sql
+
+    Args:
+        conn: Open asyncpg connection (session mode, advisory locks must work)
+        include_rpc_functions: Re-create RPC functions after migrations
+
+    Returns:
+        List of applied migration file names
+    """
+    applied_now = []
+    await conn.execute("SELECT pg_advisory_lock(hashtext($1))", MIGRATIONS_LOCK_KEY)
+    try:
+        await ensure_migrations_table(conn)
+        applied = await get_applied_migrations(conn)
+
+        for version, name, path in list_migrations():
+            with open(path, encoding='utf-8') as f:
+                sql = f.read()
+
+            if version in applied:
+                checksum = hashlib.sha256(sql.encode('utf-8')).hexdigest()
+                if applied[version]['checksum'] != checksum:
+                    logger.warning(f"⚠️ Миграция {name} изменена после применения (checksum не совпадает)")
+                continue
+
+            logger.info(f"🔄 Применяем миграцию {name}")
+            await apply_migration(conn, version, name, sql)
+            applied_now.append(name)
+            logger.info(f"✅ Миграция {name} применена")
+
+        if include_rpc_functions:
+            with open(RPC_FUNCTIONS_PATH, encoding='utf-8') as f:
+                await conn.execute(f.read())
+            logger.info("✅ RPC функции из rpc_functions.sql обновлены")
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock(hashtext($1))", MIGRATIONS_LOCK_KEY)
+
+    return applied_now
+
+
+async def print_status(conn: asyncpg.Connection):
+    await ensure_migrations_table(conn)
+    applied = await get_applied_migrations(conn)
+    for version, name, _ in list_migrations():
+        status = "✅ applied" if version in applied else "⏳ pending"
+        print(f"{status}  {name}")
+
+
+async def main(dsn: Optional[str] = None, status_only: bool = False) -> bool:
+    from config import SUPABASE_POSTGRES_URL
+
+    dsn = dsn or SUPABASE_POSTGRES_URL
+    if not dsn:
+        logger.error("❌ SUPABASE_POSTGRES_URL не задан")
+        return False
+
+    conn = await asyncpg.connect(dsn)
+    try:
+        if status_only:
+            await print_status(conn)
+            return True
+        applied = await apply_migrations(conn)
+        logger.info(f"📦 Применено новых миграций: {len(applied)}")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Ошибка при применении миграций: {e}", exc_info=True)
+        return False
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+    success = asyncio.run(main(status_only='--status' in sys.argv))
+    sys.exit(0 if success else 1)
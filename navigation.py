@@ -0,0 +1,135 @@
+"""
+Навигация по экранам без пересоздания сообщений.
+
+В чате живут два сообщения бота: видео start.mp4 и меню под ним. Переход
+между экранами - одно редактирование меню (editMessageText, а если текст
+не меняется - editMessageReplyMarkup); видео остаётся на месте и повторно
+не загружается. Новые сообщения отправляются только на /start и когда
+видео над меню уже нет (удалено, старше 48 часов и т.п.).
+
+Видео отправляется по закэшированному file_id: файл загружается в Telegram
+один раз, дальше отправка без загрузки (START_VIDEO_FILE_ID задаёт его заранее).
+"""
+
+import os
+import asyncio
+import logging
+from typing import Optional
+
+from telegram.error import BadRequest
+
+from bot_instance import bot
+from screens import Screen, get_screen
+from stripe_handlers import get_checkout_session_url
+from state_store import get_state_store, FILE_ID, START_VIDEO
+
+logger = logging.getLogger(__name__)
+
+START_VIDEO_PATH = "files_30/start.mp4"
+START_VIDEO_FILE_ID = os.getenv('START_VIDEO_FILE_ID')
+
+state_store = get_state_store()
+
+
+def _checkout_url(screen: Screen, user) -> Optional[str]:
+    return get_checkout_session_url(user, screen.checkout_plan) if screen.checkout_plan else None
+
+
+def _is_not_modified(error: BadRequest) -> bool:
+    return "message is not modified" in str(error).lower()
+
+
+async def send_start_video(chat_id: int):
+    """Send start.mp4 by cached file_id, uploading it only the first time"""
+    file_id = START_VIDEO_FILE_ID or await state_store.get(FILE_ID, START_VIDEO_PATH)
+    if file_id:
+        try:
+            return await bot.send_video(chat_id=chat_id, video=file_id, supports_streaming=True)
+        except BadRequest as e:
+            # file_id от другого бота или устарел - загружаем файл заново
+            logger.warning(f"⚠️ file_id стартового видео не принят: {e}")
+
+    with open(START_VIDEO_PATH, "rb") as video:
+        message = await bot.send_video(chat_id=chat_id, video=video, supports_streaming=True)
+    if message.video:
+        await state_store.set(FILE_ID, START_VIDEO_PATH, message.video.file_id)
+        logger.info(f"🎬 file_id стартового видео сохранён: {message.video.file_id}")
+    return message
+
+
+async def delete_start_video_if_exists(user_id, chat_id):
+    """Удаляет видео start.mp4 для пользователя, если оно существует"""
+    # Забираем ID из хранилища в любом случае, даже если удалить не получится
+    video_message_id = await state_store.pop(START_VIDEO, user_id)
+    if video_message_id:
+        try:
+            await bot.delete_message(chat_id=chat_id, message_id=video_message_id)
+            logger.info(f"Видео start.mp4 удалено для пользователя {user_id}")
+        except Exception as e:
+            # Видео могло быть уже удалено или не существует
+            logger.debug(f"Не удалось удалить видео start.mp4 для пользователя {user_id}: {e}")
+
+
+async def send_start_screen(chat_id: int, user_id: int):
+    """Fresh start.mp4 + start menu at the bottom of the chat (the /start command)"""
+    # Удаляем старое видео, если оно существует
+    await delete_start_video_if_exists(user_id, chat_id)
+
+    video_message = await send_start_video(chat_id)
+    # Сохраняем ID сообщения с видео
+    await state_store.set(START_VIDEO, user_id, video_message.message_id)
+
+    # Задержка 300мс
+    await asyncio.sleep(0.3)
+
+    screen = get_screen('start', user_id)
+    await bot.send_message(chat_id=chat_id, text=screen.text, reply_markup=screen.reply_markup)
+
+
+async def show_screen(query, user, name: str):
+    """
+    Turn the message with the pressed button into the given screen.
+
+    One editMessageText call (editMessageReplyMarkup if only the keyboard
+    changes); if the message can't be edited, the screen is sent as a new one.
+    """
+    screen = get_screen(name, user.id)
+    reply_markup = screen.render(_checkout_url(screen, user))
+    message = query.message
+
+    try:
+        if message.text == screen.text and message.text is not None:
+            await query.edit_message_reply_markup(reply_markup=reply_markup)
+        else:
+            await query.edit_message_text(
+                text=screen.text,
+                reply_markup=reply_markup,
+                parse_mode=screen.parse_mode
+            )
+        return
+    except BadRequest as e:
+        if _is_not_modified(e):
+            return
+        # Сообщение с медиа, удалено или слишком старое - отправляем новое
+        logger.debug(f"Не удалось отредактировать сообщение {message.message_id}: {e}")
+
+    await bot.send_message(
+        chat_id=message.chat_id,
+        text=screen.text,
+        reply_markup=reply_markup,
+        parse_mode=screen.parse_mode
+    )
+
+
+async def show_start(query, user):
+    """Back to the start menu: edit in place if the start video is still above it"""
+    if await state_store.get(START_VIDEO, user.id):
+        await show_screen(query, user, 'start')
+        return
+
+    # Видео над меню уже нет - показываем стартовый экран заново, файл не загружается
+    try:
+        await query.message.delete()
+    except Exception as e:
+        logger.debug(f"Не удалось удалить меню для пользователя {user.id}: {e}")
+    await send_start_screen(query.message.chat_id, user.id)
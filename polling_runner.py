@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Приём обновлений через long polling (getUpdates) вместо вебхука.
+
+Нужен для локальной нагрузки и как запасной вариант, когда вебхук недоступен.
+Обновления забираются пачками до 100 штук и проходят через те же хендлеры
+telegram_app: разные чаты обрабатываются параллельно (POLLING_CONCURRENCY),
+один чат - строго по порядку. Офсет сдвигается только после того, как вся
+пачка обработана, поэтому при падении необработанные обновления придут снова.
+
+    python polling_runner.py                     # снять вебхук и слушать getUpdates
+    python polling_runner.py --restore-webhook   # при остановке вернуть вебхук
+
+В приложении режим задаёт TELEGRAM_UPDATES_MODE=webhook|polling, переключение -
+эндпоинты /start_polling и /set_webhook.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import argparse
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from telegram import Update
+from telegram.error import Conflict, NetworkError, RetryAfter, TimedOut
+
+from config import WEBHOOK_URL
+from sharded_workers import ChatSerialExecutor
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_UPDATES_MODE = os.getenv('TELEGRAM_UPDATES_MODE', 'webhook')
+# Больше 100 Telegram не отдаёт за один getUpdates
+POLLING_LIMIT = 100
+POLLING_TIMEOUT = int(os.getenv('POLLING_TIMEOUT', '30'))
+POLLING_CONCURRENCY = int(os.getenv('POLLING_CONCURRENCY', '64'))
+# Вебхук: обновлений в обработке одновременно (меньше пула соединений Bot API, 256)
+# и всего принятых, но не обработанных - сверх этого вебхук отвечает 503, Telegram повторит
+WEBHOOK_CONCURRENCY = int(os.getenv('WEBHOOK_CONCURRENCY', '64'))
+WEBHOOK_MAX_PENDING = int(os.getenv('WEBHOOK_MAX_PENDING', '1000'))
+
+
+class IngestionStats:
+    """Счётчики приёма обновлений для /bot_status: сколько, какими пачками, как быстро"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.updates = 0
+        self.batches = 0
+        self.processing_sec = 0.0
+        self.first_at: Optional[float] = None
+        self.last_at: Optional[float] = None
+        self.last_batch_size = 0
+
+    def record(self, updates: int, seconds: float):
+        now = time.time()
+        if self.first_at is None:
+            self.first_at = now - seconds
+        self.last_at = now
+        self.updates += updates
+        self.batches += 1
+        self.processing_sec += seconds
+        self.last_batch_size = updates
+
+    def as_dict(self) -> Dict[str, Any]:
+        elapsed = (self.last_at - self.first_at) if self.first_at is not None else 0.0
+        return {
+            'mode': self.name,
+            'updates': self.updates,
+            'batches': self.batches,
+            'avg_batch_size': round(self.updates / self.batches, 1) if self.batches else 0,
+            'last_batch_size': self.last_batch_size,
+            'avg_processing_ms': round(self.processing_sec / self.updates * 1000, 2) if self.updates else 0,
+            'updates_per_sec': round(self.updates / elapsed, 1) if elapsed > 0 else 0.0,
+        }
+
+
+webhook_stats = IngestionStats('webhook')
+polling_stats = IngestionStats('polling')
+
+
+def webhook_url() -> str:
+    return f"{WEBHOOK_URL.rstrip('/')}/webhook"
+
+
+def _chat_id(update: Update) -> Optional[int]:
+    if update.effective_chat:
+        return update.effective_chat.id
+    return update.effective_user.id if update.effective_user else None
+
+
+class PollingRunner:
+    """
+    Цикл getUpdates -> обработка пачки -> сдвиг офсета
+
+    Args:
+        bot: Бот, которым забираем обновления
+        process_update: Корутина обработки одного Update (обычно telegram_app.process_update)
+        stop_when_idle: Остановиться, когда очередь обновлений пуста (для бенчмарков)
+    """
+
+    def __init__(self, bot, process_update: Callable[[Update], Awaitable[None]],
+                 limit: int = POLLING_LIMIT, timeout: int = POLLING_TIMEOUT,
+                 concurrency: int = POLLING_CONCURRENCY, stats: IngestionStats = polling_stats,
+                 stop_when_idle: bool = False):
+        self.bot = bot
+        self.process_update = process_update
+        self.limit = min(limit, POLLING_LIMIT)
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.stats = stats
+        self.stop_when_idle = stop_when_idle
+        self.offset: Optional[int] = None
+        self._stopping = asyncio.Event()
+        self._finished = asyncio.Event()
+
+    @property
+    def running(self) -> bool:
+        return not self._finished.is_set() and not self._stopping.is_set()
+
+    async def _get_updates(self):
+        get_updates = asyncio.ensure_future(self.bot.get_updates(
+            offset=self.offset, limit=self.limit, timeout=self.timeout,
+            read_timeout=self.timeout + 10
+        ))
+        stopping = asyncio.ensure_future(self._stopping.wait())
+        done, _ = await asyncio.wait({get_updates, stopping}, return_when=asyncio.FIRST_COMPLETED)
+        if get_updates not in done:
+            # Остановка во время ожидания: необработанных обновлений нет, офсет не меняется
+            get_updates.cancel()
+            return []
+        stopping.cancel()
+        return get_updates.result()
+
+    async def _process_batch(self, updates):
+        started = time.perf_counter()
+        executor = ChatSerialExecutor(self.concurrency)
+        for update in updates:
+            await executor.submit(_chat_id(update), self.process_update, update)
+        await executor.drain()
+
+        # Telegram считает обновления подтверждёнными при следующем getUpdates с этим офсетом
+        self.offset = updates[-1].update_id + 1
+        self.stats.record(len(updates), time.perf_counter() - started)
+
+    async def run(self):
+        logger.info(f"📥 Polling запущен: limit={self.limit}, timeout={self.timeout}s, concurrency={self.concurrency}")
+        backoff = 1
+        try:
+            while not self._stopping.is_set():
+                try:
+                    updates = await self._get_updates()
+                except RetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+                    continue
+                except Conflict as e:
+                    logger.error(f"❌ getUpdates конфликтует с вебхуком или другим polling: {e}")
+                    break
+                except (NetworkError, TimedOut) as e:
+                    logger.warning(f"⚠️ Ошибка сети в getUpdates: {e}, повтор через {backoff} сек")
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, 30)
+                    continue
+
+                backoff = 1
+                if not updates:
+                    if self.stop_when_idle:
+                        break
+                    continue
+                await self._process_batch(updates)
+
+            await self._commit_offset()
+        finally:
+            self._finished.set()
+            logger.info(f"📥 Polling остановлен: {self.stats.as_dict()}")
+
+    async def _commit_offset(self):
+        """Confirm the last processed batch so it is not delivered again"""
+        if self.offset is None:
+            return
+        try:
+            await self.bot.get_updates(offset=self.offset, limit=1, timeout=0)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось подтвердить офсет {self.offset}: {e}")
+
+    async def stop(self):
+        """Finish the current batch, commit the offset and return"""
+        self._stopping.set()
+        await self._finished.wait()
+
+
+async def handle_update(update: Update):
+    # Тот же путь, что у вебхука: с метриками по типу обновления и маршруту
+    from telegram_bot import process_update
+    try:
+        await process_update(update)
+    except Exception as e:
+        logger.error(f"Error processing update: {e}", exc_info=True)
+
+
+async def switch_to_polling(bot):
+    # Pending обновления не сбрасываем: их заберёт polling
+    await bot.delete_webhook(drop_pending_updates=False)
+    logger.info("🔀 Вебхук снят, обновления принимаются через getUpdates")
+
+
+async def switch_to_webhook(bot, url: Optional[str] = None):
+    url = url or webhook_url()
+    await bot.set_webhook(url=url)
+    logger.info(f"🔀 Вебхук установлен: {url}")
+
+
+async def main(restore_webhook: bool = False):
+    # Регистрация хендлеров
+    import telegram_bot  # noqa: F401
+    from bot_instance import telegram_app
+    from loop_monitor import start_loop_monitor
+
+    await start_loop_monitor()
+    await telegram_app.initialize()
+    await telegram_app.start()
+    await switch_to_polling(telegram_app.bot)
+
+    runner = PollingRunner(telegram_app.bot, handle_update)
+    try:
+        await runner.run()
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        await runner.stop()
+    finally:
+        if restore_webhook:
+            await switch_to_webhook(telegram_app.bot)
+        await telegram_app.stop()
+        await telegram_app.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Receive Telegram updates with long polling")
+    parser.add_argument('--restore-webhook', action='store_true', help="Set the webhook back on exit")
+    args = parser.parse_args()
+    from logging_setup import setup_logging
+    from tracing import setup_tracing
+    setup_logging()
+    setup_tracing()
+    try:
+        asyncio.run(main(args.restore_webhook))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,237 @@
+"""
+Режим цен Stripe на лету, без рестарта dyno.
+
+Раньше переключение тестового режима и $1 цен меняло config var на Heroku,
+что перезапускало приложение (~30 сек простоя, терялись вебхуки и отправка
+файлов), а config.py подхватывал режим только при импорте. Теперь:
+
+    - config.ConfigSnapshot держит оба набора ключей Stripe и Price ID всех
+      режимов, активный режим переключается config.set_pricing_flags();
+    - выбор сохраняется в public.app_settings (ключ 'pricing_mode'), триггер
+      на таблице шлёт NOTIFY app_settings - остальные процессы (воркеры,
+      другие dyno) слушают канал и применяют режим сразу; на случай потери
+      соединения значение ещё и перечитывается раз в PRICING_MODE_POLL_SEC;
+    - POST /reload_config пишет в app_settings ключ 'config_reload': по тому
+      же NOTIFY остальные процессы вызывают config.reload_config();
+    - config var на Heroku - только зеркало для следующего старта
+      (PRICING_MODE_HEROKU_MIRROR=True). Запись в него перезапускает dyno,
+      поэтому по умолчанию зеркало выключено: при старте режим всё равно
+      берётся из app_settings.
+
+Для LISTEN нужен session mode (SUPABASE_POSTGRES_URL через порт 5432), как и для scheduler.py.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Optional
+
+import asyncpg
+
+from config import SUPABASE_POSTGRES_URL, ConfigSnapshot, get_config, reload_config, set_pricing_flags
+
+logger = logging.getLogger(__name__)
+
+PRICING_MODE_KEY = 'pricing_mode'
+CONFIG_RELOAD_KEY = 'config_reload'
+NOTIFY_CHANNEL = 'app_settings'
+PRICING_MODE_POLL_SEC = int(os.getenv('PRICING_MODE_POLL_SEC', '60'))
+PRICING_MODE_HEROKU_MIRROR = os.getenv('PRICING_MODE_HEROKU_MIRROR', 'False') == 'True'
+
+
+class PricingModeService:
+    """
+    Хранит режим цен в app_settings и держит его одинаковым во всех процессах
+
+    Args:
+        dsn: Postgres для app_settings; без него режим меняется только в этом процессе
+        poll_interval: Как часто перечитывать режим, если NOTIFY потерялся
+        heroku_mirror: Дублировать режим в config vars Heroku (перезапускает dyno)
+    """
+
+    def __init__(self, dsn: Optional[str] = None, poll_interval: int = PRICING_MODE_POLL_SEC,
+                 heroku_mirror: bool = PRICING_MODE_HEROKU_MIRROR):
+        self.dsn = dsn or SUPABASE_POSTGRES_URL
+        self.poll_interval = poll_interval
+        self.heroku_mirror = heroku_mirror
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _refresh(self, conn: asyncpg.Connection):
+        value = await conn.fetchval("SELECT value FROM public.app_settings WHERE key = $1", PRICING_MODE_KEY)
+        if value is None:
+            # Режим ещё ни разу не переключали - остаётся режим из окружения
+            return
+        value = json.loads(value)
+        set_pricing_flags(bool(value.get('test_mode')), bool(value.get('one_dollar_prices')))
+
+    def _on_notify(self, conn, pid, channel, payload):
+        if payload == PRICING_MODE_KEY:
+            self._changed.set()
+        elif payload == CONFIG_RELOAD_KEY:
+            self._reload_config()
+
+    def _reload_config(self):
+        # Запросивший процесс уже перечитал конфигурацию, повтор ничего не меняет
+        try:
+            reload_config()
+        except Exception as e:
+            logger.error(f"❌ Не удалось перечитать конфигурацию по NOTIFY: {e}", exc_info=True)
+
+    async def _listen_loop(self):
+        backoff = 1
+        while True:
+            try:
+                conn = await asyncpg.connect(self.dsn)
+                try:
+                    await conn.add_listener(NOTIFY_CHANNEL, self._on_notify)
+                    # После (пере)подключения догоняем изменения, пропущенные без LISTEN
+                    await self._refresh(conn)
+                    backoff = 1
+                    while not conn.is_closed():
+                        try:
+                            await asyncio.wait_for(self._changed.wait(), self.poll_interval)
+                        except asyncio.TimeoutError:
+                            pass
+                        self._changed.clear()
+                        await self._refresh(conn)
+                finally:
+                    await conn.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"⚠️ Нет подписки на режим цен: {e}, повтор через {backoff} сек")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+    async def load(self):
+        """Apply the persisted mode once (startup)"""
+        conn = await asyncpg.connect(self.dsn)
+        try:
+            await self._refresh(conn)
+        finally:
+            await conn.close()
+
+    async def start(self):
+        """Load the persisted mode and follow changes in the running event loop"""
+        try:
+            await self.load()
+        except Exception as e:
+            logger.error(f"❌ Не удалось прочитать режим цен из app_settings: {e}")
+        self._task = asyncio.create_task(self._listen_loop(), name="pricing_mode")
+        logger.info(f"💱 Режим цен: {get_config().pricing_mode_description}, слушаем NOTIFY {NOTIFY_CHANNEL}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _persist(self, test_mode: bool, one_dollar_prices: bool, updated_by: Optional[str]):
+        value = json.dumps({'test_mode': test_mode, 'one_dollar_prices': one_dollar_prices})
+        await self._write_setting(PRICING_MODE_KEY, value, updated_by)
+
+    async def _write_setting(self, key: str, value: str, updated_by: Optional[str]):
+        conn = await asyncpg.connect(self.dsn)
+        try:
+            await conn.execute("""
+                INSERT INTO public.app_settings (key, value, updated_at, updated_by)
+                VALUES ($1, $2::JSONB, NOW(), $3)
+                ON CONFLICT (key) DO UPDATE
+                SET value = EXCLUDED.value,
+                    updated_at = EXCLUDED.updated_at,
+                    updated_by = EXCLUDED.updated_by
+            """, key, value, updated_by)
+        finally:
+            await conn.close()
+
+    async def broadcast_config_reload(self, updated_by: Optional[str] = None) -> bool:
+        """
+        Ask every other process (workers, other dynos) to call reload_config()
+
+        Returns:
+            False if there is no app_settings to notify through
+        """
+        if not self.dsn:
+            logger.warning("⚠️ SUPABASE_POSTGRES_URL не задан, конфигурация перечитана только в этом процессе")
+            return False
+        try:
+            # Сам NOTIFY шлёт триггер на app_settings, значение - только время запроса
+            await self._write_setting(CONFIG_RELOAD_KEY, json.dumps({'requested_at': time.time()}), updated_by)
+            return True
+        except Exception as e:
+            logger.error(f"❌ Не удалось разослать перечитывание конфигурации: {e}", exc_info=True)
+            return False
+
+    async def _mirror_to_heroku(self, test_mode: bool, one_dollar_prices: bool):
+        from heroku_config_manager import get_heroku_client
+        values = {
+            'STRIPE_IS_TEST_MODE_ON': str(test_mode),
+            'USE_ONE_DOLLAR_PRICES': str(one_dollar_prices),
+        }
+        # Один PATCH без предварительного GET
+        if not await get_heroku_client().set_config_vars(values):
+            logger.warning("⚠️ Режим цен не записан в config vars Heroku")
+
+    async def set_mode(self, test_mode: bool, one_dollar_prices: bool,
+                       updated_by: Optional[str] = None) -> Optional[ConfigSnapshot]:
+        """
+        Persist the mode and switch this process to it
+
+        Returns:
+            Новый снимок конфигурации или None, если режим не удалось сохранить
+        """
+        if self.dsn:
+            try:
+                await self._persist(test_mode, one_dollar_prices, updated_by)
+            except Exception as e:
+                # Не переключаемся локально: иначе процессы разойдутся в режимах
+                logger.error(f"❌ Не удалось сохранить режим цен: {e}", exc_info=True)
+                return None
+        else:
+            logger.warning("⚠️ SUPABASE_POSTGRES_URL не задан, режим цен меняется только в этом процессе")
+
+        snapshot = set_pricing_flags(test_mode, one_dollar_prices)
+        logger.info(f"💱 Режим цен сохранён ({updated_by}): {snapshot.pricing_mode_description}")
+        if self.heroku_mirror:
+            await self._mirror_to_heroku(test_mode, one_dollar_prices)
+        return snapshot
+
+
+_service: Optional[PricingModeService] = None
+
+
+def get_pricing_mode_service() -> PricingModeService:
+    global _service
+    if _service is None:
+        _service = PricingModeService()
+    return _service
+
+
+async def start_pricing_mode_sync() -> Optional[PricingModeService]:
+    """
+    Follow app_settings in the current event loop (main.py and worker processes)
+    """
+    service = get_pricing_mode_service()
+    if not service.dsn:
+        logger.info("ℹ️ SUPABASE_POSTGRES_URL не задан, режим цен берётся из окружения")
+        return None
+    if service._task is None:
+        await service.start()
+    return service
+
+
+async def broadcast_config_reload(updated_by: Optional[str] = None) -> bool:
+    return await get_pricing_mode_service().broadcast_config_reload(updated_by)
+
+
+async def toggle_test_mode(updated_by: Optional[str] = None) -> Optional[ConfigSnapshot]:
+    config = get_config()
+    return await get_pricing_mode_service().set_mode(not config.test_mode, config.one_dollar_prices, updated_by)
+
+
+async def toggle_one_dollar_prices(updated_by: Optional[str] = None) -> Optional[ConfigSnapshot]:
+    config = get_config()
+    return await get_pricing_mode_service().set_mode(config.test_mode, not config.one_dollar_prices, updated_by)
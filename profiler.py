@@ -0,0 +1,319 @@
+"""
+Профилирование работающего бота по запросу: сэмплы стеков всех потоков.
+
+Пока профилирование не запрошено, ничего не работает и ничего не
+установлено - ни потока, ни sys.setprofile. На время профиля запускается
+поток, который каждые PROFILE_SAMPLE_INTERVAL_MS снимает стеки всех потоков
+(sys._current_frames): event loop, потоки Flask/gunicorn, QueueListener.
+Так видно и async-обработчики, и синхронные вызовы, которые блокируют loop.
+
+    POST /admin/profile?seconds=30                      202 и id: профиль идёт в фоне
+    GET  /admin/profile/<id>                            collapsed stacks (flamegraph.pl, speedscope)
+    GET  /admin/profile/<id>?format=pstats              файл для pstats / snakeviz
+    GET  /admin/profile/<id>?format=summary             топ функций по cumulative времени
+    POST /admin/profile?seconds=30&telegram=1           файл и сводка придут админам в Telegram
+
+Запрос не ждёт окончания профиля: роутер Heroku обрывает запросы дольше 30 с.
+Пока профиль идёт, GET по id отвечает 202; хранятся последние PROFILE_KEEP_RESULTS.
+
+В админ-панели бота та же кнопка - «🔬 Профилирование». Одновременно идёт
+только один профиль.
+
+Времена в pstats оценочные: число сэмплов, где функция была в стеке
+(cumulative) или на вершине (self), умноженное на интервал; ncalls - число
+таких сэмплов, а не вызовов.
+
+Настройки:
+    PROFILE_SAMPLE_INTERVAL_MS=10
+    PROFILE_DEFAULT_SECONDS=30, PROFILE_MAX_SECONDS=300
+"""
+
+import io
+import os
+import sys
+import time
+import uuid
+import asyncio
+import logging
+import marshal
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '10'))
+PROFILE_DEFAULT_SECONDS = float(os.getenv('PROFILE_DEFAULT_SECONDS', '30'))
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '300'))
+PROFILE_KEEP_RESULTS = int(os.getenv('PROFILE_KEEP_RESULTS', '5'))
+
+TOP_FUNCTIONS = 20
+MAX_DEPTH = 128
+
+# (файл, строка def, функция) - тот же ключ, что у cProfile
+FrameKey = Tuple[str, int, str]
+
+# Вершины стека, на которых поток просто ждёт работы: в сводке не считаются
+IDLE_FRAMES = frozenset({
+    ('selectors.py', 'select'),
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('queue.py', 'get'),
+    ('thread.py', '_worker'),
+    ('socket.py', 'accept'),
+    ('handlers.py', 'dequeue'),
+    ('connection.py', 'poll'),
+    # Поток, который запросил профиль и ждёт его окончания
+    ('profiler.py', '_sample_for'),
+})
+
+
+def _label(key: FrameKey) -> str:
+    # ; - разделитель кадров в collapsed-формате
+    return f"{key[2]} ({os.path.basename(key[0])}:{key[1]})".replace(';', ':')
+
+
+class ProfileResult:
+    """Aggregated samples: (thread name, frames outermost first) -> count"""
+
+    def __init__(self, stacks: Counter, samples: int, duration: float, interval: float):
+        self.stacks = stacks
+        self.samples = samples
+        self.duration = duration
+        self.interval = interval
+
+    def is_idle(self, frames: Tuple[FrameKey, ...]) -> bool:
+        return not frames or (os.path.basename(frames[-1][0]), frames[-1][2]) in IDLE_FRAMES
+
+    def collapsed(self) -> str:
+        """One line per distinct stack: 'thread;outer;...;inner count'"""
+        lines = [
+            ';'.join([thread.replace(';', ':')] + [_label(key) for key in frames]) + f" {count}"
+            for (thread, frames), count in self.stacks.most_common()
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def pstats_bytes(self) -> bytes:
+        """Marshalled stats dict in the format pstats.Stats loads"""
+        stats: Dict[FrameKey, list] = {}
+        callers: Dict[FrameKey, Dict[FrameKey, list]] = {}
+        for (_, frames), count in self.stacks.items():
+            seconds = count * self.interval
+            seen = set()
+            for depth, key in enumerate(frames):
+                entry = stats.setdefault(key, [0, 0, 0.0, 0.0])
+                leaf = depth == len(frames) - 1
+                if leaf:
+                    entry[2] += seconds
+                # Рекурсия: cumulative засчитывается один раз на сэмпл
+                if key not in seen:
+                    seen.add(key)
+                    entry[0] += count
+                    entry[1] += count
+                    entry[3] += seconds
+                if depth:
+                    edge = callers.setdefault(key, {}).setdefault(frames[depth - 1], [0, 0, 0.0, 0.0])
+                    edge[0] += count
+                    edge[1] += count
+                    edge[2] += seconds if leaf else 0.0
+                    edge[3] += seconds
+        return marshal.dumps({
+            key: (cc, nc, tt, ct, {caller: tuple(edge) for caller, edge in callers.get(key, {}).items()})
+            for key, (cc, nc, tt, ct) in stats.items()
+        })
+
+    def top(self, limit: int = TOP_FUNCTIONS) -> List[Dict[str, object]]:
+        """Functions of non-idle samples ranked by cumulative time"""
+        cumulative: Counter = Counter()
+        own: Counter = Counter()
+        active = 0
+        for (_, frames), count in self.stacks.items():
+            if self.is_idle(frames):
+                continue
+            active += count
+            own[frames[-1]] += count
+            for key in set(frames):
+                cumulative[key] += count
+        return [{
+            'function': _label(key),
+            'file': key[0],
+            'cumulative_sec': round(count * self.interval, 3),
+            'cumulative_pct': round(count / active * 100, 1),
+            'self_pct': round(own[key] / active * 100, 1),
+        } for key, count in cumulative.most_common(limit)]
+
+    def active_samples(self) -> int:
+        return sum(count for (_, frames), count in self.stacks.items() if not self.is_idle(frames))
+
+    def summary_text(self, limit: int = TOP_FUNCTIONS) -> str:
+        active = self.active_samples()
+        threads = len({thread for thread, _ in self.stacks})
+        lines = [
+            f"🔬 Профиль за {self.duration:.0f} с: {self.samples} снимков по {self.interval * 1000:g} мс, "
+            f"потоков {threads}, активных сэмплов {active}",
+            "",
+            "  cum%  self%  cum,с  функция",
+        ]
+        for row in self.top(limit):
+            lines.append(f"{row['cumulative_pct']:6.1f} {row['self_pct']:6.1f} {row['cumulative_sec']:6.1f}  "
+                         f"{row['function']}")
+        return '\n'.join(lines)
+
+
+class SamplingProfiler:
+    """Background thread sampling the stacks of every other thread"""
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = 0.0
+
+    def _sample(self, own_ident: int):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            frames = []
+            while frame is not None and len(frames) < MAX_DEPTH:
+                code = frame.f_code
+                frames.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            frames.reverse()
+            self.stacks[(names.get(ident, str(ident)), tuple(frames))] += 1
+        self.samples += 1
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            self._sample(own_ident)
+
+    def start(self):
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> ProfileResult:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        return ProfileResult(self.stacks, self.samples, time.monotonic() - self._started, self.interval)
+
+
+_busy = threading.Lock()
+
+
+def _clamp(seconds: float) -> float:
+    return max(1.0, min(float(seconds), PROFILE_MAX_SECONDS))
+
+
+def profiling_active() -> bool:
+    return _busy.locked()
+
+
+def _sample_for(seconds: float) -> ProfileResult:
+    logger.info(f"🔬 Профилирование всех потоков на {seconds:g} с")
+    profiler = SamplingProfiler()
+    profiler.start()
+    time.sleep(seconds)
+    return profiler.stop()
+
+
+class ProfileJob:
+    """A profile running in the background, fetched later by id"""
+
+    def __init__(self, seconds: float):
+        self.id = uuid.uuid4().hex[:12]
+        self.seconds = seconds
+        self.started_at = time.time()
+        self.result: Optional[ProfileResult] = None
+        self.error: Optional[str] = None
+        self.done = threading.Event()
+
+    def status(self) -> Dict[str, object]:
+        return {
+            'id': self.id,
+            'seconds': self.seconds,
+            'started_at': round(self.started_at, 3),
+            'status': 'error' if self.error else 'done' if self.done.is_set() else 'running',
+            'error': self.error,
+        }
+
+
+# Последние профили по id, старые вытесняются
+_jobs: "OrderedDict[str, ProfileJob]" = OrderedDict()
+
+
+def start_profile(seconds: float = PROFILE_DEFAULT_SECONDS) -> Optional[ProfileJob]:
+    """Start a profile in a background thread and return at once; None if a profile is already running"""
+    if not _busy.acquire(blocking=False):
+        logger.warning("⚠️ Профилирование уже идёт")
+        return None
+    job = ProfileJob(_clamp(seconds))
+
+    def run():
+        try:
+            job.result = _sample_for(job.seconds)
+        except Exception as e:
+            logger.error(f"❌ Ошибка профилирования: {e}", exc_info=True)
+            job.error = str(e)
+        finally:
+            _busy.release()
+            job.done.set()
+
+    _jobs[job.id] = job
+    while len(_jobs) > PROFILE_KEEP_RESULTS:
+        _jobs.popitem(last=False)
+    threading.Thread(target=run, name=f'profile-{job.id}', daemon=True).start()
+    return job
+
+
+def get_profile_job(job_id: str) -> Optional[ProfileJob]:
+    return _jobs.get(job_id)
+
+
+async def profile_for(seconds: float = PROFILE_DEFAULT_SECONDS) -> Optional[ProfileResult]:
+    """Profile inside the event loop: waits with asyncio.sleep so the loop being profiled keeps running"""
+    if not _busy.acquire(blocking=False):
+        logger.warning("⚠️ Профилирование уже идёт")
+        return None
+    try:
+        seconds = _clamp(seconds)
+        logger.info(f"🔬 Профилирование всех потоков на {seconds:g} с")
+        profiler = SamplingProfiler()
+        profiler.start()
+        await asyncio.sleep(seconds)
+        # join потока-сэмплера - не дольше одного интервала
+        return profiler.stop()
+    finally:
+        _busy.release()
+
+
+async def send_profile(bot, chat_id: int, result: ProfileResult):
+    """Collapsed stacks as a document plus the top functions as a message"""
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    document = io.BytesIO(result.collapsed().encode('utf-8'))
+    # Текст сводки - внутри <pre>: выравнивание колонок и имена с < > безопасны только после экранирования
+    summary = result.summary_text(15).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    await bot.send_message(chat_id=chat_id, text=f"<pre>{summary[:3900]}</pre>", parse_mode="HTML")
+    await bot.send_document(
+        chat_id=chat_id,
+        document=document,
+        filename=f"profile-{stamp}.collapsed.txt",
+        caption="Collapsed stacks: flamegraph.pl или speedscope.app",
+    )
+
+
+async def profile_to_chats(bot, chat_ids, seconds: float = PROFILE_DEFAULT_SECONDS) -> bool:
+    """Run a profile inside the loop and send it to every chat; False if one is already running"""
+    result = await profile_for(seconds)
+    if result is None:
+        return False
+    for chat_id in chat_ids:
+        try:
+            await send_profile(bot, chat_id, result)
+        except Exception as e:
+            logger.error(f"❌ Не удалось отправить профиль в чат {chat_id}: {e}")
+    return True
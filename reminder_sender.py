@@ -0,0 +1,388 @@
+"""
+Движок рассылки напоминаний: ограниченный пул воркеров, общий темп под
+лимиты Telegram, обработка RetryAfter, пакетные отметки в Supabase и журнал
+для продолжения прерванной рассылки без повторной отправки.
+
+Журнал хранится в таблице public.reminder_journal (SUPABASE_POSTGRES_URL):
+диск dyno очищается при рестарте. REMINDER_JOURNAL_DIR - файловый журнал
+для локального запуска и бенчмарков; без обоих рассылка не запускается.
+
+    sender = ReminderSender()
+    report = await sender.run(campaign, pages)
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional
+
+import aiohttp
+import asyncpg
+from telegram.error import Forbidden, RetryAfter
+
+from config import SUPABASE_URL, SUPABASE_POSTGRES_URL
+from database_postgres import ADMIN_HEADERS
+
+logger = logging.getLogger(__name__)
+
+# Telegram допускает ~30 сообщений в секунду на бота, оставляем запас
+REMINDER_RATE = float(os.getenv('REMINDER_RATE', '25'))
+REMINDER_CONCURRENCY = int(os.getenv('REMINDER_CONCURRENCY', '8'))
+REMINDER_ACK_BATCH_SIZE = int(os.getenv('REMINDER_ACK_BATCH_SIZE', '100'))
+REMINDER_MAX_RETRIES = int(os.getenv('REMINDER_MAX_RETRIES', '3'))
+REMINDER_JOURNAL_DIR = os.getenv('REMINDER_JOURNAL_DIR')
+
+
+class Campaign:
+    """
+    Описание одной рассылки
+
+    Args:
+        name: Имя рассылки, используется в имени файла журнала
+        table: Таблица Supabase, в которой отмечаем получателей
+        key_column: Колонка-ключ для фильтра in.(...)
+        ack_fields: Поля, которые PATCH выставляет отправленным
+        send: Корутина отправки одному получателю, бросает исключение при ошибке
+        key: Функция, возвращающая ключ получателя
+    """
+
+    def __init__(self, name: str, table: str, key_column: str, ack_fields: Dict[str, Any],
+                 send: Callable[[Any], Awaitable[None]], key: Callable[[Any], Any] = lambda item: item):
+        self.name = name
+        self.table = table
+        self.key_column = key_column
+        self.ack_fields = ack_fields
+        self.send = send
+        self.key = key
+
+
+class SendReport:
+    def __init__(self, campaign: str):
+        self.campaign = campaign
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.blocked = 0
+        self.retries = 0
+        self.acked = 0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def sends_per_second(self) -> float:
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'campaign': self.campaign,
+            'sent': self.sent,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'blocked': self.blocked,
+            'retries': self.retries,
+            'acked': self.acked,
+            'elapsed_sec': round(self.elapsed, 2),
+            'sends_per_sec': round(self.sends_per_second, 2),
+        }
+
+
+class SendJournal:
+    """
+    Журнал рассылки в JSONL: строка "sent" пишется сразу после отправки,
+    "acked" - после того как флаг сохранён в Supabase. Если процесс упал
+    между отправкой и отметкой, при следующем запуске получатель не получит
+    сообщение повторно, а его отметка будет досохранена.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.sent = set()
+        self.acked = set()
+        self._file = None
+
+    async def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # строка могла оборваться при падении процесса
+                target = self.sent if entry.get('state') == 'sent' else self.acked
+                target.add(str(entry.get('key')))
+        logger.info(f"📒 Журнал {self.path}: отправлено {len(self.sent)}, отмечено {len(self.acked)}")
+
+    def pending_acks(self) -> List[str]:
+        return sorted(self.sent - self.acked)
+
+    def is_done(self, key: Any) -> bool:
+        key = str(key)
+        return key in self.sent or key in self.acked
+
+    def _write(self, state: str, keys: Iterable[Any]):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        for key in keys:
+            self._file.write(json.dumps({'key': str(key), 'state': state}) + '\n')
+        self._file.flush()
+
+    async def mark_sent(self, key: Any):
+        self.sent.add(str(key))
+        self._write('sent', [key])
+
+    async def mark_acked(self, keys: List[Any]):
+        self.acked.update(str(key) for key in keys)
+        self._write('acked', keys)
+
+    async def close(self, remove: bool = False):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class PostgresSendJournal(SendJournal):
+    """
+    Тот же журнал в таблице public.reminder_journal: переживает рестарт dyno.
+    Строка вставляется после отправки и получает acked = TRUE после отметки
+    в Supabase; когда всё отмечено, строки рассылки удаляются.
+    """
+
+    def __init__(self, campaign: str, dsn: str):
+        super().__init__(f"public.reminder_journal/{campaign}")
+        self.campaign = campaign
+        self.dsn = dsn
+        self._conn: Optional[asyncpg.Connection] = None
+        # Воркеры пишут параллельно, а соединение выполняет один запрос за раз
+        self._lock = asyncio.Lock()
+
+    async def load(self):
+        self._conn = await asyncpg.connect(self.dsn)
+        rows = await self._conn.fetch(
+            "SELECT recipient_key, acked FROM public.reminder_journal WHERE campaign = $1", self.campaign)
+        for row in rows:
+            self.sent.add(row['recipient_key'])
+            if row['acked']:
+                self.acked.add(row['recipient_key'])
+        logger.info(f"📒 Журнал {self.path}: отправлено {len(self.sent)}, отмечено {len(self.acked)}")
+
+    async def mark_sent(self, key: Any):
+        self.sent.add(str(key))
+        try:
+            async with self._lock:
+                await self._conn.execute("""
+                    INSERT INTO public.reminder_journal (campaign, recipient_key)
+                    VALUES ($1, $2)
+                    ON CONFLICT (campaign, recipient_key) DO NOTHING
+                """, self.campaign, str(key))
+        except Exception as e:
+            logger.error(f"❌ {self.campaign}: не удалось записать {key} в журнал: {e}")
+
+    async def mark_acked(self, keys: List[Any]):
+        self.acked.update(str(key) for key in keys)
+        try:
+            async with self._lock:
+                await self._conn.execute("""
+                    UPDATE public.reminder_journal SET acked = TRUE
+                    WHERE campaign = $1 AND recipient_key = ANY($2::TEXT[])
+                """, self.campaign, [str(key) for key in keys])
+        except Exception as e:
+            logger.error(f"❌ {self.campaign}: не удалось отметить {len(keys)} получателей в журнале: {e}")
+
+    async def close(self, remove: bool = False):
+        if self._conn is None:
+            return
+        try:
+            if remove:
+                async with self._lock:
+                    await self._conn.execute("DELETE FROM public.reminder_journal WHERE campaign = $1", self.campaign)
+        except Exception as e:
+            logger.error(f"❌ {self.campaign}: не удалось очистить журнал: {e}")
+        finally:
+            await self._conn.close()
+            self._conn = None
+
+
+class _Pacer:
+    """Общий для всех воркеров темп отправки + пауза после RetryAfter"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds: float):
+        self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+
+class ReminderSender:
+    def __init__(self, rate: float = REMINDER_RATE, concurrency: int = REMINDER_CONCURRENCY,
+                 ack_batch_size: int = REMINDER_ACK_BATCH_SIZE, max_retries: int = REMINDER_MAX_RETRIES,
+                 journal_dir: Optional[str] = REMINDER_JOURNAL_DIR, supabase_url: Optional[str] = None,
+                 journal_dsn: Optional[str] = None):
+        self.rate = rate
+        self.concurrency = concurrency
+        self.ack_batch_size = ack_batch_size
+        self.max_retries = max_retries
+        self.journal_dir = journal_dir
+        self.supabase_url = supabase_url or SUPABASE_URL
+        self.journal_dsn = journal_dsn or SUPABASE_POSTGRES_URL
+
+    def _journal(self, campaign: Campaign) -> SendJournal:
+        """File journal if REMINDER_JOURNAL_DIR is set, otherwise the Postgres one"""
+        if self.journal_dir:
+            return SendJournal(os.path.join(self.journal_dir, f"reminder_journal_{campaign.name}.jsonl"))
+        if self.journal_dsn:
+            return PostgresSendJournal(campaign.name, self.journal_dsn)
+        # Журнал в текущей папке dyno пропал бы при рестарте вместе с отметками
+        raise RuntimeError("Нет журнала рассылки: задайте SUPABASE_POSTGRES_URL или REMINDER_JOURNAL_DIR")
+
+    async def _flush_acks(self, session: aiohttp.ClientSession, campaign: Campaign,
+                          journal: SendJournal, keys: List[Any], report: SendReport) -> bool:
+        """PATCH table?key=in.(...) for a batch of recipients"""
+        if not keys:
+            return True
+
+        headers = dict(ADMIN_HEADERS)
+        headers["Prefer"] = "return=minimal"
+        key_filter = f"in.({','.join(str(key) for key in keys)})"
+
+        try:
+            async with session.patch(
+                f"{self.supabase_url}/rest/v1/{campaign.table}",
+                headers=headers,
+                params={campaign.key_column: key_filter},
+                json=campaign.ack_fields
+            ) as response:
+                if response.status not in (200, 204):
+                    text = await response.text()
+                    logger.warning(f"⚠️ {campaign.name}: не удалось отметить {len(keys)} получателей: Status {response.status}, Response: {text}")
+                    return False
+        except Exception as e:
+            logger.error(f"❌ {campaign.name}: ошибка при пакетной отметке {len(keys)} получателей: {e}")
+            return False
+
+        await journal.mark_acked(keys)
+        report.acked += len(keys)
+        logger.debug(f"✅ {campaign.name}: отмечено {len(keys)} получателей")
+        return True
+
+    async def _send_one(self, campaign: Campaign, item: Any, pacer: _Pacer, report: SendReport) -> bool:
+        """Send to one recipient, honoring RetryAfter. Returns True if the recipient is done"""
+        key = campaign.key(item)
+        for attempt in range(self.max_retries + 1):
+            await pacer.wait()
+            try:
+                await campaign.send(item)
+                report.sent += 1
+                return True
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                report.retries += 1
+                logger.warning(f"⏳ {campaign.name}: Telegram просит подождать {retry_after} сек")
+                pacer.pause(float(retry_after))
+            except Forbidden as e:
+                # Пользователь заблокировал бота - повторять бессмысленно, отмечаем как обработанного
+                report.blocked += 1
+                logger.info(f"🚫 {campaign.name}: получатель {key} недоступен: {e}")
+                return True
+            except Exception as e:
+                report.failed += 1
+                logger.warning(f"⚠️ {campaign.name}: не удалось отправить получателю {key}: {e}")
+                return False
+
+        report.failed += 1
+        logger.warning(f"⚠️ {campaign.name}: получатель {key} пропущен после {self.max_retries} повторов")
+        return False
+
+    async def run(self, campaign: Campaign, pages: AsyncIterator[List[Any]]) -> SendReport:
+        """
+        Send a campaign to recipients streamed page by page
+
+        Args:
+            campaign: What to send and how to mark recipients in Supabase
+            pages: Async iterator of recipient lists (e.g. iter_unpaid_inactive_users())
+
+        Returns:
+            SendReport with counters and sends/sec
+        """
+        report = SendReport(campaign.name)
+        journal = self._journal(campaign)
+        await journal.load()
+
+        pacer = _Pacer(self.rate)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        pending_acks: List[Any] = []
+        ack_lock = asyncio.Lock()
+        all_acked = True
+
+        async with aiohttp.ClientSession() as session:
+            # Досохраняем отметки, не дошедшие до Supabase в прошлый запуск
+            leftover = journal.pending_acks()
+            for start in range(0, len(leftover), self.ack_batch_size):
+                batch = leftover[start:start + self.ack_batch_size]
+                all_acked = await self._flush_acks(session, campaign, journal, batch, report) and all_acked
+
+            async def flush(force: bool = False):
+                nonlocal all_acked
+                async with ack_lock:
+                    while pending_acks and (force or len(pending_acks) >= self.ack_batch_size):
+                        batch = pending_acks[:self.ack_batch_size]
+                        del pending_acks[:self.ack_batch_size]
+                        if not await self._flush_acks(session, campaign, journal, batch, report):
+                            # Ключи остаются в журнале как "sent" и досохранятся при следующем запуске
+                            all_acked = False
+
+            async def worker():
+                while True:
+                    item = await queue.get()
+                    try:
+                        if item is None:
+                            return
+                        if await self._send_one(campaign, item, pacer, report):
+                            key = campaign.key(item)
+                            await journal.mark_sent(key)
+                            pending_acks.append(key)
+                            if len(pending_acks) >= self.ack_batch_size:
+                                await flush()
+                    finally:
+                        queue.task_done()
+
+            workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+            try:
+                async for page in pages:
+                    for item in page:
+                        if journal.is_done(campaign.key(item)):
+                            report.skipped += 1
+                            continue
+                        await queue.put(item)
+            finally:
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers, return_exceptions=True)
+                await flush(force=True)
+                report.finished_at = time.monotonic()
+                await journal.close(remove=all_acked)
+
+        logger.info(
+            f"📨 {campaign.name}: отправлено {report.sent}, ошибок {report.failed}, "
+            f"заблокировали бота {report.blocked}, пропущено по журналу {report.skipped}, "
+            f"отмечено {report.acked} за {report.elapsed:.1f} сек ({report.sends_per_second:.1f} msg/s)"
+        )
+        return report
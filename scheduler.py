@@ -0,0 +1,203 @@
+"""
+Планировщик фоновых задач внутри event loop основного приложения.
+
+Каждая задача запускается с заданным интервалом и случайным разбросом (jitter).
+Время последнего запуска хранится в public.job_runs, поэтому после рестарта
+dyno задача не запускается раньше срока. Перед запуском берётся Postgres
+advisory lock: если приложение отмасштабировано на несколько dyno, задачу
+выполнит только тот, кто взял блокировку.
+
+Для advisory lock нужен session mode (SUPABASE_POSTGRES_URL через порт 5432,
+а не transaction pooler), как и для migrate.py.
+"""
+
+import os
+import json
+import time
+import socket
+import random
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, List, Optional
+
+import asyncpg
+
+from config import SUPABASE_POSTGRES_URL
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'True') == 'True'
+SCHEDULER_JITTER = float(os.getenv('SCHEDULER_JITTER', '0.1'))
+REMINDER_24H_INTERVAL_MIN = int(os.getenv('REMINDER_24H_INTERVAL_MIN', '60'))
+FOLLOWUP_30D_INTERVAL_MIN = int(os.getenv('FOLLOWUP_30D_INTERVAL_MIN', '360'))
+ROLLUPS_INTERVAL_MIN = int(os.getenv('ROLLUPS_INTERVAL_MIN', '5'))
+
+# Какой процесс запускал задачу - видно в job_runs.run_by
+INSTANCE_NAME = os.getenv('DYNO') or f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Job:
+    """
+    Периодическая задача
+
+    Args:
+        name: Имя задачи (ключ в job_runs и advisory lock)
+        interval: Интервал между запусками
+        func: Корутина без аргументов, её результат сохраняется в job_runs.last_result
+        jitter: Доля интервала для случайного разброса (0.1 = ±10%)
+    """
+
+    def __init__(self, name: str, interval: timedelta, func: Callable[[], Awaitable[Any]],
+                 jitter: float = SCHEDULER_JITTER):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.jitter = jitter
+
+    def next_delay(self, last_run_at: Optional[datetime]) -> float:
+        """Seconds to wait before the next attempt, with jitter"""
+        interval = self.interval.total_seconds()
+        spread = interval * self.jitter
+        if last_run_at is None:
+            # Первый запуск: разносим задачи, чтобы они не стартовали одновременно
+            return random.uniform(0, max(spread, 1.0))
+        elapsed = (datetime.now(timezone.utc) - last_run_at).total_seconds()
+        return max(0.0, max(0.0, interval - elapsed) + random.uniform(-spread, spread))
+
+
+class Scheduler:
+    def __init__(self, jobs: List[Job], dsn: Optional[str] = None):
+        self.jobs = jobs
+        self.dsn = dsn or SUPABASE_POSTGRES_URL
+        self._tasks: List[asyncio.Task] = []
+
+    async def _get_last_run(self, conn: asyncpg.Connection, job: Job) -> Optional[datetime]:
+        return await conn.fetchval("SELECT last_run_at FROM public.job_runs WHERE job_name = $1", job.name)
+
+    async def _record_run(self, conn: asyncpg.Connection, job: Job, status: str, result: Any, duration_ms: int):
+        await conn.execute("""
+            INSERT INTO public.job_runs (job_name, last_run_at, last_status, last_result, last_duration_ms, run_by)
+            VALUES ($1, NOW(), $2, $3::JSONB, $4, $5)
+            ON CONFLICT (job_name) DO UPDATE
+            SET last_run_at = EXCLUDED.last_run_at,
+                last_status = EXCLUDED.last_status,
+                last_result = EXCLUDED.last_result,
+                last_duration_ms = EXCLUDED.last_duration_ms,
+                run_by = EXCLUDED.run_by
+        """, job.name, status, json.dumps(result, default=str), duration_ms, INSTANCE_NAME)
+
+    async def run_once(self, job: Job) -> Optional[datetime]:
+        """
+        Run the job if this instance wins the advisory lock and the job is due
+
+        Returns:
+            last_run_at after the attempt (ours or another instance's)
+        """
+        conn = await asyncpg.connect(self.dsn)
+        try:
+            locked = await conn.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", f"job:{job.name}")
+            if not locked:
+                # Не опрашиваем блокировку в цикле: следующая попытка через полный интервал
+                logger.info(f"⏭️ Задача {job.name} уже выполняется на другом инстансе")
+                return datetime.now(timezone.utc)
+
+            try:
+                # Под блокировкой перечитываем watermark: другой инстанс мог только что закончить
+                last_run_at = await self._get_last_run(conn, job)
+                if last_run_at and datetime.now(timezone.utc) - last_run_at < job.interval * (1 - job.jitter):
+                    logger.debug(f"⏭️ Задача {job.name} недавно выполнялась ({last_run_at})")
+                    return last_run_at
+
+                logger.info(f"🕐 Запуск задачи {job.name}")
+                started = time.monotonic()
+                try:
+                    result = await job.func()
+                    status = 'ok'
+                except Exception as e:
+                    logger.error(f"❌ Задача {job.name} завершилась с ошибкой: {e}", exc_info=True)
+                    result = {'error': str(e)}
+                    status = 'error'
+                duration_ms = int((time.monotonic() - started) * 1000)
+
+                await self._record_run(conn, job, status, result, duration_ms)
+                logger.info(f"✅ Задача {job.name} завершена ({status}) за {duration_ms} мс")
+                return await self._get_last_run(conn, job)
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock(hashtext($1))", f"job:{job.name}")
+        finally:
+            await conn.close()
+
+    async def _job_loop(self, job: Job):
+        last_run_at = None
+        try:
+            conn = await asyncpg.connect(self.dsn)
+            try:
+                last_run_at = await self._get_last_run(conn, job)
+            finally:
+                await conn.close()
+        except Exception as e:
+            logger.error(f"❌ Не удалось прочитать job_runs для {job.name}: {e}")
+
+        while True:
+            delay = job.next_delay(last_run_at)
+            logger.debug(f"🕐 Задача {job.name}: следующий запуск через {delay:.0f} сек")
+            await asyncio.sleep(delay)
+            try:
+                last_run_at = await self.run_once(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Нет связи с базой - пробуем снова через интервал
+                logger.error(f"❌ Ошибка планировщика для задачи {job.name}: {e}", exc_info=True)
+                last_run_at = datetime.now(timezone.utc)
+
+    def start(self):
+        """Start job loops in the running event loop"""
+        for job in self.jobs:
+            self._tasks.append(asyncio.create_task(self._job_loop(job), name=f"job:{job.name}"))
+        logger.info(f"🗓️ Планировщик запущен: {[job.name for job in self.jobs]}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+def build_default_jobs() -> List[Job]:
+    from reminder_bot import run_unpaid_24h_reminders, run_30d_followups
+    from database_postgres import refresh_rollups
+
+    jobs = []
+    if REMINDER_24H_INTERVAL_MIN > 0:
+        jobs.append(Job('reminders_24h', timedelta(minutes=REMINDER_24H_INTERVAL_MIN), run_unpaid_24h_reminders))
+    if FOLLOWUP_30D_INTERVAL_MIN > 0:
+        jobs.append(Job('followup_30d', timedelta(minutes=FOLLOWUP_30D_INTERVAL_MIN), run_30d_followups))
+    if ROLLUPS_INTERVAL_MIN > 0:
+        jobs.append(Job('refresh_rollups', timedelta(minutes=ROLLUPS_INTERVAL_MIN),
+                        lambda: asyncio.to_thread(refresh_rollups)))
+    return jobs
+
+
+_scheduler: Optional[Scheduler] = None
+
+
+async def start_scheduler() -> Optional[Scheduler]:
+    """
+    Start the default jobs in the current event loop (called from main.py)
+    """
+    global _scheduler
+    if not SCHEDULER_ENABLED:
+        logger.info("ℹ️ Планировщик отключён (SCHEDULER_ENABLED != True)")
+        return None
+    if not SUPABASE_POSTGRES_URL:
+        logger.error("❌ SUPABASE_POSTGRES_URL не задан, планировщик не запущен")
+        return None
+    if _scheduler is not None:
+        return _scheduler
+
+    _scheduler = Scheduler(build_default_jobs())
+    _scheduler.start()
+    return _scheduler
+
@@ -0,0 +1,262 @@
+"""
+Реестр экранов бота: тексты и клавиатуры собираются один раз при старте.
+
+Для каждого режима цен (test / live_one_dollar / live_real) и для админа
+отдельно заранее строятся неизменяемые InlineKeyboardMarkup, поэтому
+обработчик кнопки только выбирает готовый экран. Единственная динамическая
+часть - ссылка на Stripe Checkout, она подставляется в render().
+
+    screen = get_screen('plan_30')
+    await bot.send_message(chat_id, screen.text, reply_markup=screen.render(url), parse_mode=screen.parse_mode)
+"""
+
+import logging
+from typing import Dict, Optional, Sequence, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import get_config, on_config_reload
+
+logger = logging.getLogger(__name__)
+
+# Режимы цен - те же ключи, что в config.get_all_price_ids()
+PRICING_MODES = ('test', 'live_one_dollar', 'live_real')
+
+CHECKOUT_BUTTON_TEXT = "🇪🇺🇺🇦🇧🇾 Оплата | Европа, Украина, Белорусь"
+
+# Место кнопки оплаты Stripe в шаблоне клавиатуры
+CHECKOUT = None
+
+
+class Screen:
+    """
+    Готовый экран: текст, parse_mode и клавиатура
+
+    Args:
+        text: Текст сообщения
+        rows: Ряды кнопок; CHECKOUT в ряду - место ссылки на оплату
+        parse_mode: HTML / Markdown / None
+        checkout_plan: План ('30' / '500') для ссылки на оплату
+    """
+
+    __slots__ = ('name', 'text', 'parse_mode', 'checkout_plan', '_rows', 'reply_markup')
+
+    def __init__(self, name: str, text: str, rows: Sequence[Sequence[Optional[InlineKeyboardButton]]],
+                 parse_mode: Optional[str] = None, checkout_plan: Optional[str] = None):
+        self.name = name
+        self.text = text
+        self.parse_mode = parse_mode
+        self.checkout_plan = checkout_plan
+        self._rows: Tuple[Tuple[Optional[InlineKeyboardButton], ...], ...] = tuple(tuple(row) for row in rows)
+        # Экран без ссылки на оплату полностью статичен
+        self.reply_markup = None if checkout_plan else InlineKeyboardMarkup(self._rows)
+
+    def render(self, checkout_url: Optional[str] = None) -> InlineKeyboardMarkup:
+        """Keyboard of the screen, with the user's Stripe Checkout link if it has one"""
+        if self.reply_markup is not None:
+            return self.reply_markup
+        checkout_button = InlineKeyboardButton(CHECKOUT_BUTTON_TEXT, url=checkout_url)
+        return InlineKeyboardMarkup(tuple(
+            tuple(checkout_button if button is CHECKOUT else button for button in row)
+            for row in self._rows
+        ))
+
+
+def current_pricing_mode() -> str:
+    return get_config().pricing_mode
+
+
+def _button(text: str, callback_data: str) -> InlineKeyboardButton:
+    return InlineKeyboardButton(text, callback_data=callback_data)
+
+
+def _manager_row():
+    return (InlineKeyboardButton("Связаться с менеджером", url=get_config().support_link),)
+
+
+START_TEXT = (
+    "👋 Салют, мои вкусные!\n"
+    "Я — бот Стаса Голдман, я отведу тебя в мир стройности и эстетики🙌🏽\n\n"
+    "Хочешь похудеть без жёстких диет, но с удовольствием и результатом?\n"
+    "У нас есть план питания, который подойдёт именно тебе!\n\n👇 Выбери, что тебе ближе"
+)
+
+PLAN_30_PRICE_TEXTS = {
+    'test': "<b>🧪 ТЕСТОВЫЙ РЕЖИМ - Обычная цена: $149. Сейчас — $29 для первых 100 клиентов.</b>\n\n",
+    'live_one_dollar': "<b>🔥 ТЕСТ $1 - Обычная цена: $149. Сейчас — $1 для тестирования функций.</b>\n\n",
+    'live_real': "<b>Обычная цена: $149. Сейчас — $29 для первых 100 клиентов.</b>\n\n",
+}
+
+PLAN_30_DESCRIPTION = (
+    "План питания на 30 дней под все ваши потребности + курс из 5 модулей по похудению.\n"
+    "Без воды, без мотивации — только конкретика. Всё просто, понятно и самостоятельно."
+)
+
+PLAN_500_PRICE_TEXTS = {
+    'test': "🧪 ТЕСТОВЫЙ РЕЖИМ - $490 — с личным сопровождением Стаса",
+    'live_one_dollar': "🔥 ТЕСТ $1 - $1 для тестирования — сопровождение Стаса",
+    'live_real': "$490 — с личным сопровождением Стаса",
+}
+
+
+def _plan_500_text(price_text: str) -> str:
+    return (
+        "<b>«Плечом к плечу»</b>\n\n"
+        f"{price_text}\n\n"
+        "Индивидуальный план питания от Стаса Голдман — под твою цель, предпочтения и здоровье.\n"
+        "Топовый вариант для максимального эффекта.\n\n"
+        "В эту сумму входит:\n"
+        "• Первая консультация\n"
+        "• Индивидуальный рацион с учётом ваших вкусов и пожеланий\n"
+        "• 4 созвона (один раз в неделю) со Стасом\n"
+        "• Внесение правок в меню\n"
+        "• Личная поддержка и мотивация на всём пути."
+    )
+
+
+MORE_ABOUT_PLAN_30_TEXT = (
+    "42 плана создано. 97% людей сказали: 'Это лучше, чем диета\n\n— Составляется по 30 вопросам (анкета)\n— Учитывает всё: вес, рост, цели, болезни (щитовидка, диабет, гастрит, давление и др.), аллергию, режим, вкусы, бюджет, стресс и даже город и ваши  магазины+цены.\n— Меню адаптировано под ваш день: готовка на 15–30 минут, без сложных продуктов\n— Можно оставить кофе, хлеб, сладкое — не убираем то, что вы любите\n— Список покупок + КБЖУ + недельный бюджет — всё готово  🙌\n\n📘 2. Курс из 5 модулей\n— Только суть: физиология, дефицит, частые ошибки, тарелка, самоконтроль\n— Без мотивации и болтовни. Всё, что должна знать женщина, чтобы понять, как худеет её тело\n— Можно пройти за пару вечеров, применять — сразу\n\n💸 И всё это — за $29\n(у других такие продукты стоят десятки тысяч, как консультации и курсы)\nА у нас — как поход в МакДак 🍔 но результат пожизненный!"
+)
+
+RUSSIA_PAYMENT_30_TEXT = "29$ в рублях получается 2400руб.\n\nПосле оплаты , я вам вышлю анкету, её нужно будет как можно более подробно заполнить.\nИсходя из ваших ответов, будет составлен рацион.\n\n🇷🇺Реквизиты:\n\nНомер карты Тинькофф: 5536913810318853\n\nЛюбовь М\n\n<b>После оплаты, пожалуйста, отправьте скриншот успешной оплаты нашему менеджеру.</b>"
+
+RUSSIA_PAYMENT_500_TEXT = "490$ в рублях получается 38500руб.\n\nПосле оплаты с вами лично свяжется Стас и вы назначите первую встречу.\n\n🇷🇺Реквизиты:\n\nНомер карты Тинькофф: 5536913810318853\n\nЛюбовь М\n\n<b>После оплаты, пожалуйста, отправьте отправьте скриншот успешной оплаты нашему менеджеру.</b>"
+
+ADMIN_STATUS_TEXTS = {
+    'test': "🧪 *ТЕСТОВЫЙ РЕЖИМ*\n• Без реальных денег\n• Тестовые карты Stripe\n• Файлы отправляются как обычно",
+    'live_one_dollar': "🔥 *ЛАЙВ $1 ТЕСТ*\n• Реальные деньги ($1)\n• Тестирование функционала\n• Все файлы и уведомления работают",
+    'live_real': "💰 *БОЕВОЙ РЕЖИМ*\n• Реальные цены ($29/$490)\n• Продажи клиентам\n• Полный функционал",
+}
+
+
+def _start_screen(admin: bool) -> Screen:
+    rows = [
+        [_button("План питания за 29$", "plan_30")],
+        [_button("Личное ведение за 490$", "plan_500")],
+        _manager_row(),
+    ]
+    if admin:
+        rows.append([_button("⚙️ Админ панель", "admin")])
+    return Screen('start', START_TEXT, rows)
+
+
+def _plan_30_rows(back_callback: str):
+    return [
+        [_button("Подробнее", 'more_about_plan_30'), CHECKOUT, _button("🇷🇺 Оплата | Россия", 'PAYMENT_RUSSIA_30')],
+        _manager_row(),
+        [_button("Назад", back_callback)],
+    ]
+
+
+def _plan_500_rows():
+    return [
+        [CHECKOUT, _button("🇷🇺 Оплата | Россия", 'PAYMENT_RUSSIA_500')],
+        _manager_row(),
+        [_button("Назад", "back_to_start_from_plan_500")],
+    ]
+
+
+def _compile_mode(mode: str) -> Dict[str, Screen]:
+    """Screens that depend on the pricing mode or are shared by all modes"""
+    return {
+        'plan_30': Screen(
+            'plan_30', PLAN_30_PRICE_TEXTS[mode] + PLAN_30_DESCRIPTION,
+            _plan_30_rows("back_to_start_from_plan_30"), parse_mode="HTML", checkout_plan='30'
+        ),
+        # Возврат к плану из оплаты по России и из "Подробнее" показывает прежний текст без режима
+        'plan_30_back': Screen(
+            'plan_30_back',
+            "<b>Обычная цена: $149. Сейчас — $30 для первых 100 клиентов.</b>\n\n" + PLAN_30_DESCRIPTION,
+            _plan_30_rows("back_to_start_from_plan_30"), parse_mode="HTML", checkout_plan='30'
+        ),
+        'more_about_plan_30': Screen(
+            'more_about_plan_30', MORE_ABOUT_PLAN_30_TEXT,
+            [
+                [CHECKOUT, _button("🇷🇺 Оплата | Россия", 'PAYMENT_RUSSIA_30')],
+                _manager_row(),
+                [_button("Назад", "back_to_plan_30_from_details")],
+            ],
+            parse_mode='Markdown', checkout_plan='30'
+        ),
+        'plan_500': Screen(
+            'plan_500', _plan_500_text(PLAN_500_PRICE_TEXTS[mode]),
+            _plan_500_rows(), parse_mode="HTML", checkout_plan='500'
+        ),
+        'plan_500_back': Screen(
+            'plan_500_back', _plan_500_text(PLAN_500_PRICE_TEXTS['live_real']),
+            _plan_500_rows(), parse_mode="HTML", checkout_plan='500'
+        ),
+        'russia_payment_30': Screen(
+            'russia_payment_30', RUSSIA_PAYMENT_30_TEXT,
+            [_manager_row(), [_button("Назад", "back_to_plan_30_from_russia_payment")]],
+            parse_mode="HTML"
+        ),
+        'russia_payment_500': Screen(
+            'russia_payment_500', RUSSIA_PAYMENT_500_TEXT,
+            [_manager_row(), [_button("Назад", "back_to_plan_500_from_russia_payment")]],
+            parse_mode="HTML"
+        ),
+        'admin_panel': Screen(
+            'admin_panel',
+            f"*Админ панель*\n\n{ADMIN_STATUS_TEXTS[mode]}\n\n"
+            "Здесь вы можете просмотреть общую статистику по активности пользователей.\n"
+            "• *Статистика кнопок* — показывает, сколько раз и какие кнопки нажимали все пользователи, что помогает анализировать их поведение и улучшать работу бота.\n"
+            "• *Профилирование* — снимает стеки всех потоков бота и присылает сюда файл и самые дорогие функции.",
+            [
+                [_button("📊 Общая статистика кнопок", 'admin__stats')],
+                [_button("⚙️ Тестовый режим для Stripe", 'admin__test_mode')],
+                [_button("💰 Переключение лайв цен", 'admin__live_prices')],
+                [_button("🔬 Профилирование", 'admin__profile')],
+                [_button("Назад", "to_start_from_admin_panel")],
+            ],
+            parse_mode="Markdown"
+        ),
+    }
+
+
+class ScreenRegistry:
+    """Все экраны по (режим цен, админ/не админ), собранные заранее"""
+
+    def __init__(self, admin_ids: Optional[set] = None):
+        self.admin_ids = get_config().admin_ids if admin_ids is None else frozenset(admin_ids)
+        self._screens: Dict[Tuple[str, bool], Dict[str, Screen]] = {}
+        for mode in PRICING_MODES:
+            shared = _compile_mode(mode)
+            for admin in (False, True):
+                self._screens[(mode, admin)] = {**shared, 'start': _start_screen(admin)}
+        logger.info(f"🖼️ Экраны собраны: {len(shared) + 1} x {len(self._screens)} вариантов")
+
+    def is_admin(self, user_id: int) -> bool:
+        return user_id in self.admin_ids
+
+    def get(self, name: str, user_id: Optional[int] = None, mode: Optional[str] = None) -> Screen:
+        """
+        Screen for the current pricing mode
+
+        Args:
+            name: Имя экрана ('start', 'plan_30', ...)
+            user_id: Пользователь - для экранов, которые отличаются у админов
+            mode: Режим цен, по умолчанию текущий
+        """
+        return self._screens[(mode or current_pricing_mode(), user_id in self.admin_ids)][name]
+
+
+_registry: Optional[ScreenRegistry] = None
+
+
+def get_screen_registry() -> ScreenRegistry:
+    global _registry
+    if _registry is None:
+        _registry = ScreenRegistry()
+    return _registry
+
+
+@on_config_reload
+def _reset_registry(snapshot):
+    # Админы и ссылка менеджера зашиты в готовые экраны - пересобираем при следующем обращении
+    global _registry
+    _registry = None
+
+
+def get_screen(name: str, user_id: Optional[int] = None, mode: Optional[str] = None) -> Screen:
+    return get_screen_registry().get(name, user_id, mode)
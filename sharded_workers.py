@@ -0,0 +1,288 @@
+"""
+Многопроцессный режим обработки Telegram обновлений.
+
+При WORKER_PROCESSES > 1 веб-процесс (Flask/gunicorn) только принимает
+вебхук и по хешу chat_id отдаёт обновление одному из N процессов-воркеров.
+У каждого воркера свой event loop и свой telegram_app, поэтому обработка
+не делит один GIL. Все обновления одного чата всегда попадают в один и тот
+же воркер и обрабатываются строго по очереди, так что порядок сообщений
+пользователя сохраняется, а состояние в памяти (state_store memory://,
+аналитические сессии) естественно разбито по воркерам.
+
+Stripe вебхуки, планировщик и служебные эндпоинты остаются в веб-процессе.
+"""
+
+import os
+import json
+import queue
+import asyncio
+import logging
+import threading
+import multiprocessing
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', '1'))
+WORKER_QUEUE_SIZE = int(os.getenv('WORKER_QUEUE_SIZE', '10000'))
+# Сколько обновлений разных чатов воркер обрабатывает одновременно
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', '64'))
+# Сколько обновлений воркер держит у себя (в обработке и в очередях чатов),
+# прежде чем перестать читать из очереди веб-процесса
+WORKER_MAX_PENDING = int(os.getenv('WORKER_MAX_PENDING', '1000'))
+
+# Где в обновлении лежит чат или пользователь, в порядке приоритета
+_CHAT_PATHS = (
+    ('message', 'chat', 'id'),
+    ('edited_message', 'chat', 'id'),
+    ('callback_query', 'message', 'chat', 'id'),
+    ('callback_query', 'from', 'id'),
+    ('my_chat_member', 'chat', 'id'),
+    ('chat_member', 'chat', 'id'),
+    ('chat_join_request', 'chat', 'id'),
+    ('channel_post', 'chat', 'id'),
+    ('edited_channel_post', 'chat', 'id'),
+    ('inline_query', 'from', 'id'),
+    ('chosen_inline_result', 'from', 'id'),
+    ('pre_checkout_query', 'from', 'id'),
+    ('shipping_query', 'from', 'id'),
+    ('poll_answer', 'user', 'id'),
+)
+
+
+def update_chat_id(data: Dict[str, Any]) -> Optional[int]:
+    """
+    Chat id of a raw Telegram update without building telegram.Update
+
+    Returns:
+        Chat (or user) id, None for updates without one (e.g. poll)
+    """
+    for path in _CHAT_PATHS:
+        node = data.get(path[0])
+        if node is None:
+            continue
+        for key in path[1:]:
+            node = node.get(key) if isinstance(node, dict) else None
+            if node is None:
+                break
+        if node is not None:
+            return int(node)
+    return None
+
+
+def shard_for(chat_id: Optional[int], shards: int) -> int:
+    if chat_id is None or shards <= 1:
+        return 0
+    return abs(chat_id) % shards
+
+
+class ChatSerialExecutor:
+    """
+    Runs update handlers concurrently across chats and strictly in order within
+    a chat: each chat has a FIFO lock and tasks try to take it in submit order.
+
+    Слот обработки берётся уже под блокировкой чата: обновления, которые ждут
+    свой чат, не занимают слоты и не задерживают другие чаты.
+
+    Args:
+        concurrency: Сколько обновлений обрабатывается одновременно
+        max_pending: Сколько обновлений может ждать и обрабатываться всего
+    """
+
+    def __init__(self, concurrency: int = WORKER_CONCURRENCY, max_pending: int = WORKER_MAX_PENDING):
+        self._chat_locks: Dict[Optional[int], asyncio.Lock] = {}
+        self._chat_waiters: Dict[Optional[int], int] = {}
+        self._slots = asyncio.Semaphore(concurrency)
+        self.max_pending = max(max_pending, concurrency)
+        self.pending = 0
+        self._room = asyncio.Event()
+        self._tasks = set()
+        self.handled = 0
+
+    def _schedule(self, chat_id: Optional[int], handle, args):
+        self.pending += 1
+        if chat_id not in self._chat_locks:
+            self._chat_locks[chat_id] = asyncio.Lock()
+            self._chat_waiters[chat_id] = 0
+        self._chat_waiters[chat_id] += 1
+        task = asyncio.create_task(self._run(chat_id, handle, args))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def submit(self, chat_id: Optional[int], handle: Callable[..., Awaitable[None]], *args):
+        """Schedule handle(*args); waits only while max_pending updates are already held"""
+        while self.pending >= self.max_pending:
+            self._room.clear()
+            await self._room.wait()
+        self._schedule(chat_id, handle, args)
+
+    def try_submit(self, chat_id: Optional[int], handle: Callable[..., Awaitable[None]], *args) -> bool:
+        """Same as submit without waiting: False if max_pending updates are already held (call in the loop)"""
+        if self.pending >= self.max_pending:
+            return False
+        self._schedule(chat_id, handle, args)
+        return True
+
+    async def _run(self, chat_id: Optional[int], handle, args):
+        try:
+            async with self._chat_locks[chat_id]:
+                async with self._slots:
+                    try:
+                        await handle(*args)
+                    except Exception as e:
+                        logger.error(f"Error processing update in worker: {e}", exc_info=True)
+                    self.handled += 1
+        finally:
+            self.pending -= 1
+            self._room.set()
+            self._chat_waiters[chat_id] -= 1
+            if not self._chat_waiters[chat_id]:
+                # Чат без ожидающих обновлений - освобождаем его блокировку
+                del self._chat_waiters[chat_id]
+                del self._chat_locks[chat_id]
+
+    async def drain(self):
+        """Wait until every submitted update is handled"""
+        while True:
+            pending = [task for task in self._tasks if not task.done()]
+            if not pending:
+                return
+            await asyncio.wait(pending)
+
+
+async def consume_updates(update_queue, handle: Callable[[Dict[str, Any]], Awaitable[None]],
+                          concurrency: int = WORKER_CONCURRENCY) -> int:
+    """
+    Read raw updates from a multiprocessing queue and handle them through
+    ChatSerialExecutor until the None sentinel is received.
+
+    Returns:
+        Number of handled updates
+    """
+    loop = asyncio.get_running_loop()
+    executor = ChatSerialExecutor(concurrency)
+
+    while True:
+        raw = await loop.run_in_executor(None, update_queue.get)
+        if raw is None:
+            break
+        data = json.loads(raw)
+        await executor.submit(update_chat_id(data), handle, data)
+
+    await executor.drain()
+    return executor.handled
+
+
+def run_telegram_worker(index: int, update_queue):
+    """Process entry point: own event loop and telegram_app, handlers from telegram_bot"""
+    os.environ['WORKER_INDEX'] = str(index)
+
+    from logging_setup import setup_logging
+    from tracing import setup_tracing
+    setup_logging(tag=f"w{index}")
+    setup_tracing(tag=f"w{index}")
+
+    async def main():
+        from telegram_bot import telegram_app, process_telegram_update
+        from pricing_mode import start_pricing_mode_sync
+        from loop_monitor import start_loop_monitor
+
+        await start_loop_monitor(f"w{index}")
+        await telegram_app.initialize()
+        await telegram_app.start()
+        # Режим цен, переключённый из другого процесса, приходит через NOTIFY
+        await start_pricing_mode_sync()
+        logger.info(f"🚀 Воркер {index} (pid {os.getpid()}) запущен")
+
+        try:
+            await consume_updates(update_queue, process_telegram_update)
+        finally:
+            await telegram_app.stop()
+            await telegram_app.shutdown()
+
+    asyncio.run(main())
+
+
+class ShardedUpdateDispatcher:
+    """
+    Starts worker processes and routes raw updates to them by chat id
+
+    Args:
+        processes: Number of worker processes
+        target: Worker entry point, called as target(index, queue)
+    """
+
+    def __init__(self, processes: int = WORKER_PROCESSES, target: Callable = run_telegram_worker,
+                 queue_size: int = WORKER_QUEUE_SIZE):
+        self.processes = processes
+        self.target = target
+        self.queue_size = queue_size
+        # spawn: воркеры не наследуют потоки и event loop веб-процесса
+        self._context = multiprocessing.get_context('spawn')
+        self.queues: List[Any] = []
+        self.workers: List[multiprocessing.Process] = []
+        self.restarts = 0
+        self._extra_args = ()
+        self._respawn_lock = threading.Lock()
+
+    def _spawn(self, index: int):
+        update_queue = self._context.Queue(maxsize=self.queue_size)
+        process = self._context.Process(
+            target=self.target, args=(index, update_queue, *self._extra_args),
+            name=f"telegram-worker-{index}", daemon=True
+        )
+        process.start()
+        return update_queue, process
+
+    def start(self, *extra_args):
+        self._extra_args = extra_args
+        for index in range(self.processes):
+            update_queue, process = self._spawn(index)
+            self.queues.append(update_queue)
+            self.workers.append(process)
+        logger.info(f"🧵 Запущено воркеров для обновлений: {self.processes}")
+
+    def _ensure_alive(self, shard: int) -> bool:
+        """Restart a dead worker; False if it could not be started"""
+        with self._respawn_lock:
+            process = self.workers[shard]
+            if process.is_alive():
+                return True
+            logger.error(f"❌ Воркер {shard} (pid {process.pid}) завершился с кодом {process.exitcode}, перезапускаем")
+            # Новая очередь: умерший процесс мог оставить занятой блокировку чтения старой.
+            # Обновления, которые он не успел забрать, теряются
+            try:
+                self.queues[shard], self.workers[shard] = self._spawn(shard)
+            except Exception as e:
+                logger.error(f"❌ Не удалось перезапустить воркер {shard}: {e}", exc_info=True)
+                return False
+            self.restarts += 1
+            return True
+
+    def dispatch(self, raw: bytes, chat_id: Optional[int] = None) -> bool:
+        """
+        Queue a raw update (JSON bytes) to its chat's worker
+
+        Returns:
+            False if the worker queue is full or the worker is down (Telegram will retry the webhook)
+        """
+        if chat_id is None:
+            chat_id = update_chat_id(json.loads(raw))
+        shard = shard_for(chat_id, self.processes)
+        if not self.workers[shard].is_alive() and not self._ensure_alive(shard):
+            return False
+        try:
+            self.queues[shard].put_nowait(raw)
+            return True
+        except queue.Full:
+            logger.error(f"❌ Очередь воркера {shard} переполнена, обновление чата {chat_id} отклонено")
+            return False
+
+    def stop(self, timeout: float = 30.0):
+        for update_queue in self.queues:
+            update_queue.put(None)
+        for process in self.workers:
+            process.join(timeout=timeout)
+            if process.is_alive():
+                process.terminate()
+        self.queues, self.workers = [], []
@@ -0,0 +1,238 @@
+"""
+Хранилище состояний диалога (оплата из России, ID стартового видео и т.п.).
+
+Бэкенд выбирается переменной STATE_STORE_URL:
+    memory://                       - в памяти процесса, TTL + LRU (по умолчанию)
+    sqlite:///state.db              - общий файл для нескольких воркеров на одном dyno
+                                      (sqlite:////tmp/state.db - абсолютный путь)
+    redis://host:6379/0             - общий Redis (нужен пакет redis)
+
+Ключи компактные: "<код пространства>:<user_id>", значения - JSON.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from tracing import traced
+
+logger = logging.getLogger(__name__)
+
+STATE_STORE_URL = os.getenv('STATE_STORE_URL', 'memory://')
+STATE_STORE_MAX_ENTRIES = int(os.getenv('STATE_STORE_MAX_ENTRIES', '50000'))
+
+# Пространства ключей и их TTL по умолчанию
+USER_STATE = 's'
+START_VIDEO = 'v'
+# file_id загруженных в Telegram файлов: повторная отправка без загрузки, без TTL
+FILE_ID = 'f'
+
+DEFAULT_TTLS = {
+    # Состояние оплаты из России живёт неделю: дольше пользователь не возвращается к оплате
+    USER_STATE: int(os.getenv('USER_STATE_TTL_SEC', str(7 * 24 * 3600))),
+    # Бот может удалить своё сообщение только в течение 48 часов
+    START_VIDEO: 48 * 3600,
+}
+
+
+def _make_key(namespace: str, key: Any) -> str:
+    return f"{namespace}:{key}"
+
+
+class StateStore:
+    """Базовый интерфейс хранилища"""
+
+    async def get(self, namespace: str, key: Any) -> Optional[Any]:
+        raise NotImplementedError
+
+    async def set(self, namespace: str, key: Any, value: Any, ttl: Optional[int] = None):
+        raise NotImplementedError
+
+    async def pop(self, namespace: str, key: Any) -> Optional[Any]:
+        raise NotImplementedError
+
+    async def size(self) -> int:
+        """Number of stored entries (for /admin/memory)"""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    @staticmethod
+    def _ttl(namespace: str, ttl: Optional[int]) -> Optional[int]:
+        return ttl if ttl is not None else DEFAULT_TTLS.get(namespace)
+
+
+class MemoryStateStore(StateStore):
+    """Словарь в памяти с TTL и вытеснением самых старых записей (LRU)"""
+
+    def __init__(self, max_entries: int = STATE_STORE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    async def get(self, namespace: str, key: Any) -> Optional[Any]:
+        full_key = _make_key(namespace, key)
+        item = self._data.get(full_key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[full_key]
+            return None
+        self._data.move_to_end(full_key)
+        return value
+
+    async def set(self, namespace: str, key: Any, value: Any, ttl: Optional[int] = None):
+        full_key = _make_key(namespace, key)
+        ttl = self._ttl(namespace, ttl)
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._data[full_key] = (value, expires_at)
+        self._data.move_to_end(full_key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    async def pop(self, namespace: str, key: Any) -> Optional[Any]:
+        value = await self.get(namespace, key)
+        self._data.pop(_make_key(namespace, key), None)
+        return value
+
+    async def size(self) -> int:
+        return len(self._data)
+
+
+class SQLiteStateStore(StateStore):
+    """
+    SQLite файл, общий для воркеров на одном хосте. Запросы выполняются
+    синхронно: это локальные операции по первичному ключу, доли миллисекунды.
+    """
+
+    # Чистим просроченные записи раз в N записей, а не на каждой
+    PURGE_EVERY = 500
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL
+            ) WITHOUT ROWID
+        """)
+
+    async def get(self, namespace: str, key: Any) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (_make_key(namespace, key), time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def set(self, namespace: str, key: Any, value: Any, ttl: Optional[int] = None):
+        ttl = self._ttl(namespace, ttl)
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+                (_make_key(namespace, key), json.dumps(value), expires_at)
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._conn.execute("DELETE FROM state WHERE expires_at <= ?", (time.time(),))
+
+    async def pop(self, namespace: str, key: Any) -> Optional[Any]:
+        full_key = _make_key(namespace, key)
+        with self._lock:
+            row = self._conn.execute(
+                "DELETE FROM state WHERE key = ? RETURNING value, expires_at", (full_key,)
+            ).fetchone()
+        if not row or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return json.loads(row[0])
+
+    async def size(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM state WHERE expires_at IS NULL OR expires_at > ?", (time.time(),)
+            ).fetchone()[0]
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisStateStore(StateStore):
+    """Redis (или совместимый сервер): общий для всех dyno и воркеров"""
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError as e:
+            raise RuntimeError("Для STATE_STORE_URL=redis://... нужен пакет redis") from e
+        self._redis = redis_asyncio.from_url(url, decode_responses=True)
+
+    @traced('redis.get')
+    async def get(self, namespace: str, key: Any) -> Optional[Any]:
+        value = await self._redis.get(_make_key(namespace, key))
+        return json.loads(value) if value is not None else None
+
+    @traced('redis.set')
+    async def set(self, namespace: str, key: Any, value: Any, ttl: Optional[int] = None):
+        await self._redis.set(_make_key(namespace, key), json.dumps(value), ex=self._ttl(namespace, ttl))
+
+    @traced('redis.getdel')
+    async def pop(self, namespace: str, key: Any) -> Optional[Any]:
+        value = await self._redis.getdel(_make_key(namespace, key))
+        return json.loads(value) if value is not None else None
+
+    async def size(self) -> int:
+        # DBSIZE считает все ключи базы: отдельная база Redis под состояния - точное число
+        return await self._redis.dbsize()
+
+    async def close(self):
+        await self._redis.close()
+
+
+def create_state_store(url: str = STATE_STORE_URL) -> StateStore:
+    """
+    Create a store for the given URL, falling back to memory on errors
+
+    Args:
+        url: memory://, sqlite:///path or redis://...
+    """
+    try:
+        if url.startswith('sqlite:///'):
+            # Как в SQLAlchemy: sqlite:///state.db - относительный путь, sqlite:////tmp/state.db - абсолютный
+            store = SQLiteStateStore(url[len('sqlite:///'):] or 'state.db')
+        elif url.startswith(('redis://', 'rediss://', 'unix://')):
+            store = RedisStateStore(url)
+        else:
+            store = MemoryStateStore()
+    except Exception as e:
+        logger.error(f"❌ Не удалось открыть хранилище состояний {url}: {e}. Используем память процесса")
+        store = MemoryStateStore()
+
+    logger.info(f"🗄️ Хранилище состояний: {type(store).__name__}")
+    return store
+
+
+_state_store: Optional[StateStore] = None
+
+
+def get_state_store() -> StateStore:
+    global _state_store
+    if _state_store is None:
+        _state_store = create_state_store()
+    return _state_store
@@ -8,11 +8,16 @@ import nest_asyncio
 import logging
 import pytz
 from database_postgres import log_payment
-from config import get_admin_ids
+from config import get_admin_ids, get_config
 from bot_instance import bot, telegram_app
+import metrics
+from tracing import annotate, span, traced
 
 logger = logging.getLogger(__name__)
 
+STRIPE_SECONDS = metrics.histogram('stripe_request_seconds', 'Вызовы Stripe API', ['call', 'outcome'])
+STRIPE_WEBHOOK_EVENTS = metrics.counter('stripe_webhook_events_total', 'Вебхуки Stripe по типу события', ['type'])
+
 def get_checkout_session_url(user, plan:str):
     """ plan have to be either 30 or 500 in str 
     Note: Plan identifiers remain '30' and '500' for internal consistency,
@@ -23,10 +28,10 @@ def get_checkout_session_url(user, plan:str):
     logger.info(f"=== CREATING CHECKOUT SESSION ===")
     logger.info(f"User ID: {user.id}, Plan: {plan}")
     
-    if plan == '30':
-        price_id = PRICE_ID_30
-    elif plan == '500':
-        price_id = PRICE_ID_500
+    # Price ID и ключ API берём из одного снимка: режим могут переключить посреди вызова
+    config = get_config()
+    if plan in ('30', '500'):
+        price_id = config.price_id_for(plan)
     else:
         logger.error(f"Invalid plan type: {plan}")
         raise ValueError('При вызове функции по возвращении ссылки вы выбрали не план "30" и не план "500"')
@@ -44,17 +49,19 @@ def get_checkout_session_url(user, plan:str):
     }
     logger.info(f"Session metadata: {metadata}")
     
-    checkout_session = stripe.checkout.Session.create(
-        payment_method_types=["card"],
-        line_items=[{
-            "price": price_id,  # Price ID from environment variables
-            "quantity": 1,
-        }],
-        mode="payment",
-        success_url='https://t.me/minys40kg_start_bot',
-        cancel_url='https://t.me/minys40kg_start_bot',
-        metadata=metadata
-    )
+    with STRIPE_SECONDS.time('checkout.Session.create'), span('stripe.checkout.Session.create', plan=plan):
+        checkout_session = stripe.checkout.Session.create(
+            api_key=config.stripe_api_key,
+            payment_method_types=["card"],
+            line_items=[{
+                "price": price_id,  # Price ID from environment variables
+                "quantity": 1,
+            }],
+            mode="payment",
+            success_url='https://t.me/minys40kg_start_bot',
+            cancel_url='https://t.me/minys40kg_start_bot',
+            metadata=metadata
+        )
     
     logger.info(f"✅ Created checkout session: {checkout_session.id}")
     return checkout_session.url
@@ -94,6 +101,7 @@ def get_checkout_session_url(user, plan:str):
 )  """
 
 
+@traced()
 async def send_files_async(user_id, plan_type):
     from telegram_bot import send_file_to_user
     """Helper function to send files asynchronously"""
@@ -101,12 +109,7 @@ async def send_files_async(user_id, plan_type):
     files_start_time = time.time()
     
     try:
-        logger.info("📂 ==========================================")
-        logger.info("📂 SEND_FILES_ASYNC STARTED")
-        logger.info("📂 ==========================================")
-        logger.info(f"👤 User ID: {user_id} (type: {type(user_id)})")
-        logger.info(f"📦 Plan type: {plan_type} (type: {type(plan_type)})")
-        logger.info(f"⏰ Start time: {time.strftime('%Y-%m-%d %H:%M:%S')}")
+        logger.info("📂 send_files_async: user %s, plan %s", user_id, plan_type)
         
         # Validate inputs
         if not user_id:
@@ -117,17 +120,9 @@ async def send_files_async(user_id, plan_type):
             logger.error("❌ No plan_type provided to send_files_async")
             return False
         
-        logger.info(f"📞 Calling send_file_to_user function...")
-        file_send_start = time.time()
-        
         await send_file_to_user(user_id, plan_type)
         
-        file_send_duration = time.time() - file_send_start
-        total_duration = time.time() - files_start_time
-        
-        logger.info(f"⏱️ File sending took: {file_send_duration:.2f} seconds")
-        logger.info(f"⏱️ Total send_files_async duration: {total_duration:.2f} seconds")
-        logger.info(f"✅ send_file_to_user completed successfully for user {user_id} plan {plan_type}")
+        logger.info("✅ Файлы отправлены: user %s, plan %s, %.2f сек", user_id, plan_type, time.time() - files_start_time)
         return True
     except Exception as e:
         error_duration = time.time() - files_start_time
@@ -136,43 +131,52 @@ async def send_files_async(user_id, plan_type):
         return False
 
 
+def _api_key_for_session(session):
+    """Stripe key of the mode the session was created in, not the current one"""
+    config = get_config()
+    livemode = session.get('livemode')
+    if livemode is None:
+        return config.stripe_api_key
+    return config.stripe_keys['live' if livemode else 'test']['api_key'] or config.stripe_api_key
+
+
+def construct_stripe_event(payload, sig_header, config):
+    """
+    Verify the webhook signature with the active mode's secret, then the other one's
+
+    После переключения режима на лету Stripe ещё какое-то время присылает
+    события от сессий прежнего режима, подписанные его секретом.
+    """
+    secrets = config.webhook_secrets()
+    if not secrets:
+        raise stripe.error.SignatureVerificationError("No webhook secret configured", sig_header)
+    for secret in secrets[:-1]:
+        try:
+            return stripe.Webhook.construct_event(payload, sig_header, secret)
+        except stripe.error.SignatureVerificationError:
+            continue
+    return stripe.Webhook.construct_event(payload, sig_header, secrets[-1])
+
+
 def get_plan_type_from_price_id(price_id):
     """Determine plan type from Price ID by checking against all possible config vars"""
-    from config import get_all_price_ids, get_current_pricing_mode, is_test_mode, is_using_one_dollar_prices
+    config = get_config()
     
     logger.info(f"=== PRICE ID DETERMINATION ===")
     logger.info(f"Received price_id: {price_id}")
-    logger.info(f"Current pricing mode: {get_current_pricing_mode()}")
-    logger.info(f"Is test mode: {is_test_mode()}")
-    logger.info(f"Is using one dollar prices: {is_using_one_dollar_prices()}")
-    
-    all_prices = get_all_price_ids()
-    logger.info(f"All available price IDs: {all_prices}")
-    
-    # Check in all possible price ID combinations
-    for mode in ['test', 'live_real', 'live_one_dollar']:
-        logger.info(f"Checking mode '{mode}': 30={all_prices[mode]['30']}, 500={all_prices[mode]['500']}")
-        if all_prices[mode]['30'] == price_id:
-            logger.info(f"✅ MATCH FOUND: Price ID {price_id} matches plan '30' in mode '{mode}'")
-            return '30'
-        elif all_prices[mode]['500'] == price_id:
-            logger.info(f"✅ MATCH FOUND: Price ID {price_id} matches plan '500' in mode '{mode}'")
-            return '500'
+    logger.info(f"Current pricing mode: {config.pricing_mode_description}")
     
-    # Check current Price IDs as well (for extra safety)
-    current_prices = all_prices.get('current', {})
-    logger.info(f"Also checking current prices: 30={current_prices.get('30')}, 500={current_prices.get('500')}")
-    if current_prices.get('30') == price_id:
-        logger.info(f"✅ MATCH FOUND: Price ID {price_id} matches CURRENT plan '30'")
-        return '30'
-    elif current_prices.get('500') == price_id:
-        logger.info(f"✅ MATCH FOUND: Price ID {price_id} matches CURRENT plan '500'")
-        return '500'
+    # Индекс Price ID -> план по всем режимам собран заранее в снимке конфигурации
+    plan_type = config.plan_by_price_id.get(price_id)
+    if plan_type:
+        logger.info(f"✅ MATCH FOUND: Price ID {price_id} matches plan '{plan_type}'")
+        return plan_type
     
     logger.warning(f"❌ NO MATCH: Unknown price_id: {price_id}, defaulting to '30'")
     logger.warning(f"This may cause files not to be sent properly!")
     return '30'
 
+@traced()
 async def get_price_id_from_session(session):
     """Extract Price ID from Stripe session"""
     try:
@@ -195,12 +199,14 @@ async def get_price_id_from_session(session):
         session_id = session.get('id')
         if session_id:
             logger.info(f"Fallback: Retrieving session details from Stripe API for session: {session_id}")
-            stripe_session = stripe.checkout.Session.retrieve(
-                session_id,
-                expand=['line_items', 'line_items.data.price']
-            )
+            with STRIPE_SECONDS.time('checkout.Session.retrieve'), span('stripe.checkout.Session.retrieve'):
+                stripe_session = stripe.checkout.Session.retrieve(
+                    session_id,
+                    expand=['line_items', 'line_items.data.price'],
+                    api_key=_api_key_for_session(session)
+                )
             
-            logger.info(f"Retrieved session from Stripe API: {stripe_session}")
+            logger.debug("Retrieved session from Stripe API: %s", stripe_session)
             
             if stripe_session.line_items and len(stripe_session.line_items.data) > 0:
                 price_id = stripe_session.line_items.data[0].price.id
@@ -214,16 +220,13 @@ async def get_price_id_from_session(session):
         logger.error(f"Error getting price_id from session: {e}", exc_info=True)
         return None
 
+@traced()
 async def process_payment_async(session):
     """Process payment and send files asynchronously"""
     import time
     async_start_time = time.time()
     
     try:
-        logger.info("💎 ==========================================")
-        logger.info("💎 PROCESS_PAYMENT_ASYNC STARTED")
-        logger.info("💎 ==========================================")
-        
         # Extract basic session information
         session_id = session.get('id', 'unknown')
         customer_email = session.get('customer_details', {}).get('email', '')
@@ -231,28 +234,20 @@ async def process_payment_async(session):
         currency = session.get('currency', 'USD').upper()
         payment_status = session.get('payment_status', 'unknown')
         
-        logger.info(f"💳 Session ID: {session_id}")
-        logger.info(f"📧 Customer email: {customer_email}")
-        logger.info(f"💰 Amount: {amount} {currency} (cents: {session.get('amount_total', 0)})")
-        logger.info(f"📊 Payment status: {payment_status}")
-        logger.info(f"🏦 Currency: {currency}")
-        logger.info(f"🏗️ Session keys: {list(session.keys())}")
+        logger.info("💎 process_payment_async: session %s, %s %s, status %s",
+                    session_id, amount, currency, payment_status)
         
-        # Debug: log the full session object
-        logger.debug(f"Full session object: {session}")
+        # Debug: log the full session object (лениво - только при DEBUG)
+        logger.debug("Full session object: %s", session)
         
         # Get metadata and custom fields from the session
         metadata = session.get('metadata', {})
         custom_fields = session.get('custom_fields', [])
         
         # Log all available data for debugging
-        logger.info(f"📝 Metadata keys: {list(metadata.keys()) if metadata else 'None'}")
-        logger.info(f"📝 Metadata: {metadata}")
-        logger.info(f"📋 Custom fields count: {len(custom_fields)}")
-        logger.info(f"📋 Custom fields: {custom_fields}")
+        logger.debug("📝 Metadata: %s, custom fields: %s", metadata, custom_fields)
         
         # Get Price ID from session to determine plan type
-        logger.info("🔍 ========== PRICE ID EXTRACTION ==========")
         price_id_start_time = time.time()
         price_id = await get_price_id_from_session(session)
         price_id_duration = time.time() - price_id_start_time
@@ -260,7 +255,6 @@ async def process_payment_async(session):
         logger.info(f"🏷️ Extracted price_id: {price_id}")
         
         # Determine plan type based on Price ID
-        logger.info("🧮 ========== PLAN TYPE DETERMINATION ==========")
         if price_id:
             plan_determination_start = time.time()
             plan_type = get_plan_type_from_price_id(price_id)
@@ -282,9 +276,7 @@ async def process_payment_async(session):
             else:
                 # Last resort: determine by amount
                 # For $1 prices, we need to check metadata more carefully
-                from config import is_using_one_dollar_prices
-                
-                if is_using_one_dollar_prices():
+                if get_config().one_dollar_prices:
                     # In $1 mode, both plans cost $1, so we can't determine by amount
                     # But we can try to get it from the original metadata or other hints
                     logger.warning(f"In $1 mode with amount ${amount}, cannot determine plan by amount alone")
@@ -376,6 +368,8 @@ async def process_payment_async(session):
         payment_id = session.get('id', 'unknown')
         
         logger.info(f"Payment details - User ID: {user_id}, Amount: {amount} {currency}, Status: {payment_status}")
+        # По user_id цепочку платежа находит GET /admin/traces?user_id=...
+        annotate(user_id=user_id, plan_type=plan_type, session_id=payment_id, status=payment_status)
         
         # Log the payment attempt to the database
         try:
@@ -567,36 +561,20 @@ async def process_payment_async(session):
                         logger.error(f"Failed to send admin notification: {str(e)}", exc_info=True)
                 
                 # Send files to the user
-                logger.info("📤 ========== SENDING FILES ==========")
-                logger.info(f"👤 User ID: {user_id}")
-                logger.info(f"📦 Plan Type: {plan_type}")
-                logger.info(f"🏷️ Price ID used: {price_id}")
-                logger.info(f"💰 Payment amount: {amount} {currency}")
-                
-                files_start_time = time.time()
+                logger.info("📤 Отправка файлов: user %s, plan %s, price %s, %s %s",
+                            user_id, plan_type, price_id, amount, currency)
                 success = await send_files_async(user_id, plan_type)
-                files_duration = time.time() - files_start_time
-                
-                logger.info(f"⏱️ File sending process took: {files_duration:.2f} seconds")
                 
                 if success:
-                    logger.info(f"✅ Successfully sent files to user {user_id} for plan {plan_type}")
-                    
-                    # Log final summary
-                    total_processing_time = time.time() - async_start_time
-                    logger.info("🎉 ========== PAYMENT PROCESSING COMPLETED ==========")
-                    logger.info(f"⏱️ Total processing time: {total_processing_time:.2f} seconds")
-                    logger.info(f"✅ Final result: SUCCESS")
+                    logger.info("🎉 Платёж обработан: user %s, plan %s, %.2f сек",
+                                user_id, plan_type, time.time() - async_start_time)
                     
                     return {"status": "success", "message": f"Successfully processed payment and sent files to user {user_id}"}
                 else:
                     error_msg = f"❌ Failed to send files to user {user_id} for plan {plan_type}"
                     logger.error(error_msg)
                     
-                    total_processing_time = time.time() - async_start_time
-                    logger.error("💥 ========== PAYMENT PROCESSING FAILED ==========")
-                    logger.error(f"⏱️ Total processing time: {total_processing_time:.2f} seconds")
-                    logger.error(f"❌ Final result: FAILURE (file sending)")
+                    logger.error("💥 Платёж не обработан (отправка файлов) за %.2f сек", time.time() - async_start_time)
                     
                     return {"status": "error", "message": error_msg}
                     
@@ -615,32 +593,23 @@ async def process_payment_async(session):
         return {"status": "error", "message": error_msg}
 
            
+@traced()
 def handle_successful_payment(session):
     """Handle successful Stripe payment"""
     import time
     handler_start_time = time.time()
     
     try:
-        logger.info("🚀 ==========================================")
-        logger.info("🚀 HANDLE_SUCCESSFUL_PAYMENT STARTED")
-        logger.info("🚀 ==========================================")
-        logger.info(f"📋 Session ID: {session.get('id', 'unknown')}")
+        logger.info("🚀 handle_successful_payment: session %s", session.get('id', 'unknown'))
         
         # Create a new event loop for this thread
-        logger.info("🔄 Creating new event loop for payment processing")
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         
         try:
             # Run the async function and get the result
-            logger.info("⚡ Starting async payment processing")
-            async_start_time = time.time()
             result = loop.run_until_complete(process_payment_async(session))
-            async_duration = time.time() - async_start_time
-            logger.info(f"⏱️ Async processing completed in {async_duration:.2f} seconds")
-            
-            handler_duration = time.time() - handler_start_time
-            logger.info(f"⏱️ Total handler duration: {handler_duration:.2f} seconds")
+            logger.info("⏱️ handle_successful_payment: %.2f сек", time.time() - handler_start_time)
             
             return result
             
@@ -694,54 +663,33 @@ def handle_failed_payment(session):
 
     asyncio.run(send_failure_message())
 
+@traced()
 def stripe_webhook():
     import time
     webhook_start_time = time.time()
     
     try:
-        logger.info("🔄 ===============================================")
-        logger.info("🔄 STRIPE WEBHOOK PROCESSING STARTED")
-        logger.info("🔄 ===============================================")
-        logger.info(f"🔧 Current config - Test mode: {STRIPE_IS_TEST_MODE_ON}, Use $1: {USE_ONE_DOLLAR_PRICES}")
-        logger.info(f"🔧 Stripe API key starts with: {STRIPE_API_KEY[:7]}...")
-        logger.info(f"🔧 Webhook secret starts with: {STRIPE_WEBHOOK_SECRET[:7]}...")
+        config = get_config()
+        logger.info("🔄 Stripe webhook: test mode %s, $1 prices %s", config.test_mode, config.one_dollar_prices)
         
         payload = request.get_data(as_text=True)
         sig_header = request.headers.get('stripe-signature')
         
-        logger.info(f"📡 Payload length: {len(payload)} characters")
-        logger.info(f"🔐 Signature header: {sig_header[:50]}..." if sig_header else "❌ No signature header")
-        logger.info(f"🔑 Webhook secret configured: {bool(STRIPE_WEBHOOK_SECRET)}")
-        
-        # Log first 200 chars of payload for debugging (remove sensitive data first)
-        safe_payload = payload[:200].replace('"card"', '"[CARD]"').replace('"payment_method"', '"[PM]"')
-        logger.info(f"📄 Payload preview: {safe_payload}...")
+        logger.debug("📡 Payload length: %d, signature header: %s", len(payload), bool(sig_header))
 
         try:
-            event = stripe.Webhook.construct_event(
-                payload, sig_header, STRIPE_WEBHOOK_SECRET
-            )
-            logger.info(f"✅ Webhook signature verification successful")
-            logger.info(f"📋 Event type: {event['type']}")
-            logger.info(f"🆔 Event ID: {event.get('id', 'unknown')}")
-            logger.info(f"⏰ Event created timestamp: {event.get('created', 'unknown')}")
-            logger.info(f"🔍 Event livemode: {event.get('livemode', 'unknown')}")
+            # Локальная проверка подписи, без сети; ошибки здесь - чужие или устаревшие секреты
+            with STRIPE_SECONDS.time('Webhook.construct_event'):
+                event = construct_stripe_event(payload, sig_header, config)
+            logger.info("✅ Stripe event %s: %s (livemode %s)",
+                        event.get('id', 'unknown'), event['type'], event.get('livemode', 'unknown'))
+            STRIPE_WEBHOOK_EVENTS.labels(event['type']).inc()
+            annotate(event_id=event.get('id'), event_type=event['type'], livemode=event.get('livemode'))
             
             # Handle the event
             if event['type'] == 'checkout.session.completed':
-                logger.info("🎯 Processing checkout.session.completed event")
                 session = event['data']['object']
-                session_id = session.get('id', 'unknown')
-                logger.info(f"💰 Processing checkout session: {session_id}")
-                logger.info(f"💰 Session status: {session.get('payment_status', 'unknown')}")
-                logger.info(f"💰 Session mode: {session.get('mode', 'unknown')}")
-                logger.info(f"💰 Customer email: {session.get('customer_details', {}).get('email', 'not provided')}")
-                
-                payment_start_time = time.time()
                 result = handle_successful_payment(session)
-                payment_duration = time.time() - payment_start_time
-                
-                logger.info(f"⏱️ Payment processing took: {payment_duration:.2f} seconds")
                 
                 if result and result.get('status') == 'error':
                     logger.error(f"❌ Payment processing failed: {result.get('message', 'Unknown error')}")
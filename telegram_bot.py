@@ -1,32 +1,46 @@
 import os
-import uuid
+import time
 import asyncio
 from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, Message
 from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
-from flask import session as flask_session
 from config import *
-from config import get_admin_ids
-from database_postgres import log_user_action
+from database_postgres import log_user_action, fetch_from_supabase
 # from handlers.admin_handlers import get_admin_handlers  # No longer needed
 from telegram.request import HTTPXRequest
 import logging
-import aiohttp
 import asyncpg
 from collections import Counter
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import pytz
 from typing import List, Dict, Any
-from stripe_handlers import get_checkout_session_url
 from bot_instance import bot, telegram_app
-from heroku_config_manager import get_current_stripe_mode, toggle_stripe_mode, set_stripe_mode
+from state_store import get_state_store, USER_STATE
+from analytics_sessions import get_session_id
+from pricing_mode import toggle_test_mode, toggle_one_dollar_prices
+from heroku_config_manager import get_heroku_client
+from callback_router import CallbackRouter
+from screens import get_screen_registry
+from navigation import send_start_screen, show_screen, show_start
+from polling_runner import webhook_stats
+import metrics
+from tracing import span, traced
+from profiler import PROFILE_DEFAULT_SECONDS, profile_to_chats, profiling_active
 
 logger = logging.getLogger(__name__)
 
-# Словарь для отслеживания состояний пользователей
-user_states = {}
+# Состояния пользователей и ID сообщений с видео start.mp4 живут в хранилище состояний
+# (STATE_STORE_URL): с общим бэкендом их видят все воркеры, записи истекают по TTL
+state_store = get_state_store()
 
-# Словарь для отслеживания ID сообщений с видео start.mp4 для каждого пользователя
-user_video_message_ids = {}
+# Начало периода для счётчиков кликов "за всё время" в статистике админки
+STATS_ALL_TIME_START = '-infinity'
+
+UPDATE_SECONDS = metrics.histogram(
+    'telegram_update_seconds', 'Обработка обновления Telegram по типу и маршруту', ['type', 'route', 'outcome']
+)
+FILE_DELIVERY_SECONDS = metrics.histogram(
+    'file_delivery_seconds', 'Отправка одного материала после оплаты', ['plan', 'item', 'outcome']
+)
 
 # Константы состояний
 STATE_RUSSIA_PAYMENT_30 = "russia_payment_30"
@@ -64,6 +78,7 @@ def format_relative_time(payment_time: datetime) -> str:
         else:
             return f"{days} дней назад в {payment_time.strftime('%H:%M')}"
 
+@traced()
 async def get_premium_users() -> List[Dict[str, Any]]:
     """Fetch users who purchased the $490 plan"""
     try:
@@ -111,41 +126,12 @@ async def get_premium_users() -> List[Dict[str, Any]]:
         return []
 
 async def handle_admin_panel(query, user, bot):
-    from config import is_test_mode, is_using_one_dollar_prices
-    
-    admin_ids = [int(i.strip()) for i in ADMIN_IDS.split(',') if i.strip().isdigit()]
-
-    if user.id not in admin_ids:
+    if not get_screen_registry().is_admin(user.id):
         await query.answer("🚫 Нет доступа!", show_alert=True)
         return
 
-    await query.message.delete()
-
-    # Get current pricing state for display with detailed info
-    if is_test_mode():
-        status_text = "🧪 *ТЕСТОВЫЙ РЕЖИМ*\n• Без реальных денег\n• Тестовые карты Stripe\n• Файлы отправляются как обычно"
-    elif is_using_one_dollar_prices():
-        status_text = "🔥 *ЛАЙВ $1 ТЕСТ*\n• Реальные деньги ($1)\n• Тестирование функционала\n• Все файлы и уведомления работают"
-    else:
-        status_text = "💰 *БОЕВОЙ РЕЖИМ*\n• Реальные цены ($29/$490)\n• Продажи клиентам\n• Полный функционал"
-
-    keyboard = [
-        [InlineKeyboardButton("📊 Общая статистика кнопок", callback_data='admin__stats')],
-        [InlineKeyboardButton("⚙️ Тестовый режим для Stripe", callback_data='admin__test_mode')],
-        [InlineKeyboardButton("💰 Переключение лайв цен", callback_data='admin__live_prices')],
-        [InlineKeyboardButton("Назад", callback_data="to_start_from_admin_panel")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await bot.send_message(
-        chat_id=query.message.chat_id,
-        text=(f"*Админ панель*\n\n{status_text}\n\n"
-              "Здесь вы можете просмотреть общую статистику по активности пользователей.\n"
-              "• *Статистика кнопок* — показывает, сколько раз и какие кнопки нажимали все пользователи, что помогает анализировать их поведение и улучшать работу бота."
-        ),
-        reply_markup=reply_markup,
-        parse_mode="Markdown"
-    )
+    # Текст со статусом текущего режима цен собран заранее
+    await show_screen(query, user, 'admin_panel')
 
 async def show_premium_users_page(query, premium_users: List[Dict[str, Any]], page: int, users_per_page: int, total_pages: int):
     """Display a page of premium users with pagination"""
@@ -247,9 +233,19 @@ async def handle_admin_users(query, bot):
         )
         
         
+def heroku_mirror_line(var_name: str) -> str:
+    """Value of the Heroku config var from cache; never waits for the Heroku API"""
+    client = get_heroku_client()
+    if not client.configured:
+        return ""
+    config_vars = client.cached_config_vars()
+    value = config_vars.get(var_name) if config_vars is not None else "загружается..."
+    return f"☁️ <b>Heroku {var_name}:</b> {value}\n\n"
+
 async def handle_admin_stripe_test_mode(query, bot):
     """Обработчик для управления режимом Stripe"""
-    current_mode = get_current_stripe_mode()
+    # Режим, который действует в процессе прямо сейчас
+    current_mode = "TEST" if get_config().test_mode else "LIVE"
     
     keyboard = [
         [
@@ -267,6 +263,7 @@ async def handle_admin_stripe_test_mode(query, bot):
     message = (
         f'⚙️ <b>Управление режимом Stripe</b>\n\n'
         f'<b>Текущий режим:</b> {status_icon} {current_mode}.\n\n'
+        f"{heroku_mirror_line('STRIPE_IS_TEST_MODE_ON')}"
         f"🟡 <b>TEST режим:</b>\n"
         f"• Безопасные тестовые платежи.\n"
         f"• Деньги не списываются с карт.\n"
@@ -290,7 +287,7 @@ async def handle_admin_stripe_test_mode(query, bot):
         f"🔐 CVC: <code>123</code>\n"
         f"👤 Имя: <code>Test Decline</code>\n"
         f"📧 Email: <code>decline@example.com</code>\n\n"
-        f"⚠️ Изменение режима потребует перезагрузки приложения (~30 сек)"
+        f"ℹ️ Режим переключается сразу, без перезагрузки приложения"
     )
     
     try:
@@ -307,13 +304,11 @@ async def handle_stripe_mode_actions(query, bot):
     """Обработчик действий с режимом Stripe"""
     try:
         if query.data == 'admin__toggle_stripe_mode':
-            success, new_mode = toggle_stripe_mode()
+            snapshot = await toggle_test_mode(str(query.from_user.id))
             
-            if success:
-                await query.answer(
-                    f"✅ Режим изменён на {new_mode}!\nПриложение перезагружается...", 
-                    show_alert=True
-                )
+            if snapshot is not None:
+                new_mode = "TEST" if snapshot.test_mode else "LIVE"
+                await query.answer(f"✅ Режим изменён на {new_mode}!", show_alert=True)
                 # Обновляем интерфейс
                 await handle_admin_stripe_test_mode(query, bot)
             else:
@@ -329,10 +324,6 @@ async def handle_stripe_mode_actions(query, bot):
 
 async def handle_admin_live_prices(query, bot):
     """Обработчик для переключения лайв цен между $1 и реальными ценами"""
-    from config import is_test_mode, is_using_one_dollar_prices
-    import requests
-    import os
-    
     # Проверяем, что мы в лайв режиме
     if is_test_mode():
         await query.answer("❌ Эта функция доступна только в лайв режиме!", show_alert=True)
@@ -364,6 +355,7 @@ async def handle_admin_live_prices(query, bot):
     message = (
         f'💰 <b>Управление лайв ценами</b>\n\n'
         f'<b>Текущий режим:</b> {current_icon} {current_text}\n\n'
+        f"{heroku_mirror_line('USE_ONE_DOLLAR_PRICES')}"
         f"🔥 <b>Лайв $1 цены:</b>\n"
         f"• Используются реальные Stripe ссылки\n"
         f"• Цена товаров: $1 за оба плана\n"
@@ -375,7 +367,7 @@ async def handle_admin_live_prices(query, bot):
         f"• Для работы с клиентами\n"
         f"• Боевой режим продаж\n\n"
         f"При переключении будут использоваться {next_text}.\n\n"
-        f"⚠️ Изменение цен потребует перезагрузки приложения (~30 сек)"
+        f"ℹ️ Цены переключаются сразу, без перезагрузки приложения"
     )
     
     try:
@@ -390,48 +382,20 @@ async def handle_admin_live_prices(query, bot):
 
 async def handle_live_prices_actions(query, bot):
     """Обработчик действий с лайв ценами"""
-    from config import is_using_one_dollar_prices, is_test_mode
-    import requests
-    import os
-    
     try:
         if query.data == 'admin__toggle_live_prices':
             # Проверяем, что мы в лайв режиме
             if is_test_mode():
                 await query.answer("❌ Эта функция доступна только в лайв режиме!", show_alert=True)
                 return
-                
-            # Get current setting and toggle it
-            current_dollar_mode = is_using_one_dollar_prices()
-            new_dollar_mode = not current_dollar_mode
             
-            # Update Heroku config var
-            heroku_app_name = os.getenv('HEROKU_APP_NAME')
-            heroku_api_key = os.getenv('HEROKU_API_KEY')
-            
-            if not heroku_app_name or not heroku_api_key:
-                await query.answer("❌ Heroku credentials not configured!", show_alert=True)
+            snapshot = await toggle_one_dollar_prices(str(query.from_user.id))
+            if snapshot is None:
+                await query.answer("❌ Ошибка при переключении цен!", show_alert=True)
                 return
             
-            url = f"https://api.heroku.com/apps/{heroku_app_name}/config-vars"
-            headers = {
-                "Authorization": f"Bearer {heroku_api_key}",
-                "Content-Type": "application/json",
-                "Accept": "application/vnd.heroku+json; version=3"
-            }
-            
-            data = {
-                "USE_ONE_DOLLAR_PRICES": str(new_dollar_mode)
-            }
-            
-            response = requests.patch(url, json=data, headers=headers)
-            response.raise_for_status()
-            
-            price_text = "$1" if new_dollar_mode else "реальные ($29/$490)"
-            await query.answer(
-                f"✅ Цены переключены на {price_text}!\nПриложение перезагружается...", 
-                show_alert=True
-            )
+            price_text = "$1" if snapshot.one_dollar_prices else "реальные ($29/$490)"
+            await query.answer(f"✅ Цены переключены на {price_text}!", show_alert=True)
             # Обновляем интерфейс
             await handle_admin_live_prices(query, bot)
                                       
@@ -443,51 +407,18 @@ async def handle_live_prices_actions(query, bot):
         logger.error(f"Error in handle_live_prices_actions: {e}")
         await query.answer("❌ Ошибка при переключении цен!", show_alert=True)
 
-# Общая статистика кнопок
-async def fetch_from_supabase(endpoint: str, params: dict = None):
-    # Use SUPABASE_SERVICE_ROLE instead of SUPABASE_SERVICE_KEY
-    service_key = os.getenv('SUPABASE_SERVICE_ROLE', '')
-    if not service_key:
-        logger.error("SUPABASE_SERVICE_ROLE environment variable is not set")
-        raise ValueError("SUPABASE_SERVICE_ROLE is not configured")
-
-    headers = {
-        "apikey": service_key,
-        "Authorization": f"Bearer {service_key}",
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
-    
-    # Rest of the function remains the same...
-    headers = {k: v for k, v in headers.items() if v is not None}
-    params = params or {}
-    
-    clean_params = {}
-    for key, value in params.items():
-        if value is not None:
-            clean_params[key] = value
-
-    try:
-        async with aiohttp.ClientSession() as session:
-            url = f"{SUPABASE_URL}/rest/v1/{endpoint}"
-            logger.info(f"Making request to: {url}")
-            logger.info(f"Headers: {headers}")
-            logger.info(f"Params: {clean_params}")
-            
-            async with session.get(
-                url,
-                headers=headers,
-                params=clean_params,
-                timeout=aiohttp.ClientTimeout(total=10)
-            ) as resp:
-                if resp.status != 200:
-                    text = await resp.text()
-                    logger.error(f"Supabase API error: {resp.status} - {text}")
-                    raise Exception(f"Supabase API error: {resp.status} - {text}")
-                return await resp.json()
-    except Exception as e:
-        logger.error(f"Error in fetch_from_supabase: {str(e)}", exc_info=True)
-        raise
+async def handle_admin_profile(query, user, bot):
+    """Profile the whole process for PROFILE_DEFAULT_SECONDS and send the result to this admin"""
+    if not get_screen_registry().is_admin(user.id):
+        await query.answer("🚫 Нет доступа!", show_alert=True)
+        return
+    if profiling_active():
+        await query.answer("⏳ Профилирование уже идёт", show_alert=True)
+        return
+    await query.answer(f"🔬 Профилирую {PROFILE_DEFAULT_SECONDS:g} с, пришлю файл сюда", show_alert=True)
+    # Ждём через asyncio.sleep: loop продолжает обрабатывать обновления и попадает в профиль
+    if not await profile_to_chats(bot, [user.id], PROFILE_DEFAULT_SECONDS):
+        await bot.send_message(chat_id=user.id, text="⏳ Профилирование уже идёт, попробуйте позже")
 
 # Общая статистика кнопок
 async def get_button_stats():
@@ -496,27 +427,29 @@ async def get_button_stats():
             logger.error("Missing Supabase configuration")
             return "❌ Ошибка конфигурации: отсутствуют настройки Supabase"
 
-        rows = await fetch_from_supabase("user_actions", {"select": "action"})
-        if not rows:
+        # Счётчики за всё время считает RPC по rollup user_actions_hourly (+ строки новее watermark),
+        # поэтому экран не выкачивает историю кликов и не замедляется с её ростом
+        action_counts = await fetch_from_supabase(
+            "rpc/get_action_counts",
+            {"start_date": STATS_ALL_TIME_START, "end_date": datetime.now(timezone.utc).isoformat()}
+        )
+        if not action_counts:
             return "ℹ️ Нет данных о кликах"
 
-        actions = []
         admin_actions = {
             'button_click_admin', 'button_click_admin_users', 'button_click_admin_payments',
             'button_click_admin_funnel', 'button_click_admin_refresh', 'button_click_admin_stats',
             'button_click_admin_analytics', 'button_click_admin__stats', 'button_click_admin__users'
         }
 
-        for row in rows:
-            action = row.get("action")
-            if action and action not in admin_actions:
-                actions.append(str(action))
-
-        if not actions:
+        stats = Counter({
+            action: count for action, count in action_counts.items()
+            if action and count and action not in admin_actions
+        })
+        if not stats:
             return "ℹ️ Нет данных о кликах"
 
-        total_clicks = len(actions)
-        stats = Counter(actions)
+        total_clicks = sum(stats.values())
 
         # Категории и действия
         categories = {
@@ -586,14 +519,12 @@ async def get_button_stats():
 
         # Подсчёт уникальных пользователей за последний месяц
         try:
-            one_month_ago = (datetime.utcnow() - timedelta(days=30)).isoformat()
-            params = {
-                "select": "user_id",
-                "timestamp": f"gte.{one_month_ago}"
-            }
-            user_actions = await fetch_from_supabase("user_actions", params)
-            unique_users = set(action['user_id'] for action in user_actions if 'user_id' in action and action['user_id'])
-            result += f"\n<b>Уникальных пользователей за месяц:</b> {len(unique_users)}"
+            now = datetime.now(timezone.utc)
+            unique_users = await fetch_from_supabase(
+                "rpc/get_unique_users",
+                {"start_date": (now - timedelta(days=30)).isoformat(), "end_date": now.isoformat()}
+            )
+            result += f"\n<b>Уникальных пользователей за месяц:</b> {unique_users or 0}"
         except Exception as e:
             logger.error(f"Error getting unique users count: {e}")
             result += "\n⚠️ Не удалось загрузить данные об уникальных пользователях"
@@ -662,35 +593,14 @@ def patched_get_bot(self):
 
 Message.get_bot = patched_get_bot
 
-def generate_session_id():
-    return str(uuid.uuid4())
-
-async def delete_start_video_if_exists(user_id, chat_id):
-    """Удаляет видео start.mp4 для пользователя, если оно существует"""
-    if user_id in user_video_message_ids:
-        video_message_id = user_video_message_ids[user_id]
-        try:
-            await bot.delete_message(chat_id=chat_id, message_id=video_message_id)
-            logger.info(f"Видео start.mp4 удалено для пользователя {user_id}")
-        except Exception as e:
-            # Видео могло быть уже удалено или не существует
-            logger.debug(f"Не удалось удалить видео start.mp4 для пользователя {user_id}: {e}")
-        finally:
-            # Удаляем из словаря в любом случае
-            del user_video_message_ids[user_id]
-
+@traced()
 async def send_file_to_user(user_id, plan_type):
     """Отправляем разный набор файлов и сообщение в зависимости от плана"""
     import time
     send_start_time = time.time()
     
     try:
-        logger.info("📨 ==========================================")
-        logger.info("📨 SEND_FILE_TO_USER STARTED")
-        logger.info("📨 ==========================================")
-        logger.info(f"👤 User ID: {user_id} (type: {type(user_id)})")
-        logger.info(f"📦 Plan Type: '{plan_type}' (type: {type(plan_type)})")
-        logger.info(f"⏰ Start time: {time.strftime('%Y-%m-%d %H:%M:%S')}")
+        logger.info("📨 send_file_to_user: user %s, plan %r", user_id, plan_type)
         
         # Validate inputs
         if not user_id:
@@ -704,13 +614,11 @@ async def send_file_to_user(user_id, plan_type):
         # Ensure user_id is integer
         try:
             user_id = int(user_id)
-            logger.info(f"✅ Converted user_id to integer: {user_id}")
         except (ValueError, TypeError) as e:
             logger.error(f"❌ Cannot convert user_id to integer: {e}")
             return
         
         if plan_type == "30":
-            logger.info("📦 ========== PROCESSING PLAN 30 ==========")
             plan_30_start = time.time()
             # Убрали приветственное сообщение отсюда, так как оно отправляется после course.mp4
             
@@ -733,7 +641,7 @@ async def send_file_to_user(user_id, plan_type):
             # Получаем все файлы в папке (исключаем видеофайлы, которые отправляются отдельно)
             try:
                 all_files = [f for f in os.listdir(folder_path) if os.path.isfile(os.path.join(folder_path, f)) and f not in ["course.mp4", "start.mp4"]]
-                logger.info(f"Все файлы в папке {folder_path}: {all_files}")
+                logger.debug("Все файлы в папке %s: %s", folder_path, all_files)
             except Exception as e:
                 logger.error(f"Ошибка при получении списка файлов в {folder_path}: {e}", exc_info=True)
                 all_files = []
@@ -742,25 +650,26 @@ async def send_file_to_user(user_id, plan_type):
             course_video_path = os.path.join(folder_path, "course.mp4")
             if os.path.exists(course_video_path):
                 try:
-                    with open(course_video_path, "rb") as video_obj:
+                    with FILE_DELIVERY_SECONDS.time(plan_type, 'course.mp4'), open(course_video_path, "rb") as video_obj:
                         await telegram_app.bot.send_video(
                             chat_id=user_id, 
                             video=video_obj,
                             supports_streaming=True
                         )
-                    logger.info(f"Видео course.mp4 успешно отправлено пользователю {user_id}")
+                    logger.info("Видео course.mp4 успешно отправлено пользователю %s", user_id)
                     
                     # Задержка 300мс
                     await asyncio.sleep(0.3)
                     
                     # Отправляем приветственное сообщение с course видео
-                    await telegram_app.bot.send_message(
-                        chat_id=user_id,
-                        text="🎉 <b>Поздравляем с успешной оплатой!</b>\n\n"
-                             "📚 Ваши материалы готовы к изучению!\n"
-                             "💪 Начинайте свой путь к идеальной фигуре прямо сейчас!",
-                        parse_mode='HTML'
-                    )
+                    with FILE_DELIVERY_SECONDS.time(plan_type, 'welcome_message'):
+                        await telegram_app.bot.send_message(
+                            chat_id=user_id,
+                            text="🎉 <b>Поздравляем с успешной оплатой!</b>\n\n"
+                                 "📚 Ваши материалы готовы к изучению!\n"
+                                 "💪 Начинайте свой путь к идеальной фигуре прямо сейчас!",
+                            parse_mode='HTML'
+                        )
                     
                     await asyncio.sleep(1.0)
                 except Exception as e:
@@ -780,12 +689,13 @@ async def send_file_to_user(user_id, plan_type):
                 if matching_file:
                     file_path = os.path.join(folder_path, matching_file)
                     try:
-                        with open(file_path, "rb") as file_obj:
+                        # Метка - название модуля из file_order, а не имя файла: набор значений фиксирован
+                        with FILE_DELIVERY_SECONDS.time(plan_type, expected_name), open(file_path, "rb") as file_obj:
                             await telegram_app.bot.send_document(
                                 chat_id=user_id, 
                                 document=file_obj
                             )
-                        logger.info(f"Файл {matching_file} ('{expected_name}') успешно отправлен пользователю {user_id}")
+                        logger.info("Файл %s (%r) успешно отправлен пользователю %s", matching_file, expected_name, user_id)
                         # Увеличенная задержка для гарантии порядка
                         await asyncio.sleep(1.0)
                     except Exception as e:
@@ -803,40 +713,35 @@ async def send_file_to_user(user_id, plan_type):
                         pass
                 
             try:
-                await telegram_app.bot.send_message(
-                    chat_id=user_id, 
-                    text="👉[Заполнить анкету](https://docs.google.com/forms/d/e/1FAIpQLSeBMSz4nofrh_pUzcexSMaPC3pzQXwf5ADTXxNEQB9j3pijeQ/viewform)👈",
-                    parse_mode='Markdown'
-                )
+                with FILE_DELIVERY_SECONDS.time(plan_type, 'form_link'):
+                    await telegram_app.bot.send_message(
+                        chat_id=user_id, 
+                        text="👉[Заполнить анкету](https://docs.google.com/forms/d/e/1FAIpQLSeBMSz4nofrh_pUzcexSMaPC3pzQXwf5ADTXxNEQB9j3pijeQ/viewform)👈",
+                        parse_mode='Markdown'
+                    )
             except Exception as e:
                 logger.error(f"Ошибка при отправке ссылки на анкету пользователю {user_id}: {e}", exc_info=True)
                 
         else:
-            logger.info("💎 ========== PROCESSING PLAN 500 ==========")
             plan_500_start = time.time()
-            logger.info(f"💎 Processing plan 500 (or other plan) for user {user_id}")
             try:
                 message_start = time.time()
-                await telegram_app.bot.send_message(
-                    chat_id=user_id, 
-                    text="Супер! Оплата прошла успешно ✅\n\nВ ближайшее время с вами лично свяжется Стас — вы договоритесь об удобном времени для первой консультации. После этого начнётся полное сопровождение: индивидуальный рацион, поддержка, правки, созвоны.\n\nСпасибо за доверие — теперь вы не одни в этом пути 💪",
-                    parse_mode='Markdown'
-                )
-                message_duration = time.time() - message_start
-                plan_500_duration = time.time() - plan_500_start
-                logger.info(f"⏱️ Plan 500 message sent in {message_duration:.2f} seconds")
-                logger.info(f"⏱️ Total plan 500 processing: {plan_500_duration:.2f} seconds")
-                logger.info(f"✅ Successfully sent plan 500 message to user {user_id}")
+                with FILE_DELIVERY_SECONDS.time(plan_type, 'plan_500_message'):
+                    await telegram_app.bot.send_message(
+                        chat_id=user_id, 
+                        text="Супер! Оплата прошла успешно ✅\n\nВ ближайшее время с вами лично свяжется Стас — вы договоритесь об удобном времени для первой консультации. После этого начнётся полное сопровождение: индивидуальный рацион, поддержка, правки, созвоны.\n\nСпасибо за доверие — теперь вы не одни в этом пути 💪",
+                        parse_mode='Markdown'
+                    )
+                logger.info("✅ Сообщение плана 500 отправлено пользователю %s за %.2f сек",
+                            user_id, time.time() - message_start)
             except Exception as e:
                 error_duration = time.time() - plan_500_start
                 logger.error(f"⏱️ Plan 500 error after {error_duration:.2f} seconds")
                 logger.error(f"❌ Ошибка при отправке сообщения для плана 500 пользователю {user_id}: {e}", exc_info=True)
         
         # Log completion
-        total_duration = time.time() - send_start_time
-        logger.info(f"⏱️ TOTAL send_file_to_user duration: {total_duration:.2f} seconds")
-        logger.info(f"✅ send_file_to_user completed for user {user_id} plan {plan_type}")
-        logger.info("📨 ========== SEND_FILE_TO_USER COMPLETED ==========")
+        logger.info("✅ send_file_to_user завершён: user %s, plan %s, %.2f сек",
+                    user_id, plan_type, time.time() - send_start_time)
                 
     except Exception as e:
         error_duration = time.time() - send_start_time
@@ -844,73 +749,130 @@ async def send_file_to_user(user_id, plan_type):
         logger.error(f"❌ Критическая ошибка в send_file_to_user: {e}", exc_info=True)
         raise
 
+def update_labels(update: Update) -> tuple:
+    """(type, route) for metrics: route is the callback handler's name, 'command'/'text'/'media' for messages"""
+    update_type = next((str(t) for t in Update.ALL_TYPES if getattr(update, t, None) is not None), 'unknown')
+    route = ''
+    if update.callback_query is not None:
+        handler, _ = callback_router.resolve(update.callback_query.data or '')
+        route = handler.__name__ if handler is not None else 'unknown'
+    elif update.message is not None:
+        text = update.message.text or ''
+        route = 'command' if text.startswith('/') else 'text' if text else 'media'
+    return update_type, route
+
+async def process_update(update: Update):
+    """telegram_app.process_update with latency per update type and route, as the root span of a trace"""
+    update_type, route = update_labels(update)
+    user = update.effective_user
+    with UPDATE_SECONDS.time(update_type, route), span(
+        'telegram_update', update_id=update.update_id, type=update_type, route=route,
+        user_id=user.id if user else None
+    ):
+        await telegram_app.process_update(update)
+
 async def process_telegram_update(data):
+    started = time.perf_counter()
     try:
         update = Update.de_json(data, bot)
-        logger.info(f"Received update: {update}")
-        await telegram_app.process_update(update)
+        # Лениво: repr всего Update собирается только при включённом DEBUG
+        logger.debug("Received update: %s", update)
+        await process_update(update)
     except Exception as e:
         logger.error(f"Error processing update: {e}", exc_info=True)
+    finally:
+        webhook_stats.record(1, time.perf_counter() - started)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if 'session_id' not in flask_session:
-        flask_session['session_id'] = generate_session_id()
-        flask_session.permanent = True
-
-    keyboard = [
-        [InlineKeyboardButton("План питания за 29$", callback_data="plan_30")],
-        [InlineKeyboardButton("Личное ведение за 490$", callback_data="plan_500")],
-        [InlineKeyboardButton("Связаться с менеджером", url=SUPPORT_LINK)],
-    ]
-    
-    user_id = update.effective_user.id
-    admin_ids = get_admin_ids()
-    
-    for admin_id in admin_ids:
-        try:
-            if str(user_id) == str(admin_id):
-                keyboard.append([InlineKeyboardButton("⚙️ Админ панель", callback_data="admin")])
-            else:
-                pass
-        except Exception as e:
-                    # Handle common Telegram errors gracefully
-                    if "Chat not found" in str(e) or "Forbidden" in str(e):
-                        logger.warning(f"Admin {admin_id} is unreachable (blocked bot or deleted chat): {e}")
-                    else:
-                        logger.error(f"Failed to send admin notification to {admin_id}: {e}", exc_info=True)
-        
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    await get_session_id(update.effective_user.id)
 
     try:
-        # Удаляем старое видео, если оно существует
-        await delete_start_video_if_exists(user_id, update.message.chat_id)
-        
-        # Отправляем видео БЕЗ caption
-        with open("files_30/start.mp4", "rb") as video:
-            video_message = await update.message.reply_video(
-                video=video,
-                supports_streaming=True
-            )
-            # Сохраняем ID сообщения с видео
-            user_video_message_ids[user_id] = video_message.message_id
-        
-        # Задержка 300мс
-        await asyncio.sleep(0.3)
-        
-        # Отправляем текст отдельным сообщением
-        await update.message.reply_text(
-            text=(
-                "👋 Салют, мои вкусные!\n"
-                "Я — бот Стаса Голдман, я отведу тебя в мир стройности и эстетики🙌🏽\n\n"
-                "Хочешь похудеть без жёстких диет, но с удовольствием и результатом?\n"
-                "У нас есть план питания, который подойдёт именно тебе!\n\n👇 Выбери, что тебе ближе"
-            ),
-            reply_markup=reply_markup
-        )
-
+        await send_start_screen(update.message.chat_id, update.effective_user.id)
     except Exception as e:
         logger.error(f"Error sending start message: {e}", exc_info=True)
                 
+# --- Маршруты инлайн-кнопок ---
+callback_router = CallbackRouter()
+
+@callback_router.exact('plan_30', 'plan_500')
+async def on_plan(query, user, arg):
+    await show_screen(query, user, query.data)
+
+@callback_router.exact('PAYMENT_RUSSIA_30', 'PAYMENT_RUSSIA_500')
+async def on_russia_payment(query, user, arg):
+    # Устанавливаем состояние пользователя
+    plan = query.data.rsplit('_', 1)[-1]
+    state = STATE_RUSSIA_PAYMENT_30 if plan == '30' else STATE_RUSSIA_PAYMENT_500
+    await state_store.set(USER_STATE, user.id, state)
+
+    await show_screen(query, user, f'russia_payment_{plan}')
+
+@callback_router.exact('more_about_plan_30')
+async def on_more_about_plan_30(query, user, arg):
+    await show_screen(query, user, 'more_about_plan_30')
+
+@callback_router.exact('back_to_start_from_plan_30', 'back_to_start_from_plan_500', 'to_start_from_admin_panel')
+async def on_back_to_start(query, user, arg):
+    try:
+        await show_start(query, user)
+    except Exception as e:
+        logger.error(f"Error sending start message: {e}", exc_info=True)
+
+@callback_router.exact('back_to_plan_30_from_russia_payment', 'back_to_plan_500_from_russia_payment')
+async def on_back_from_russia_payment(query, user, arg):
+    # Сбрасываем состояние пользователя
+    await state_store.pop(USER_STATE, user.id)
+    name = 'plan_30_back' if query.data == 'back_to_plan_30_from_russia_payment' else 'plan_500_back'
+    await show_screen(query, user, name)
+
+@callback_router.exact('back_to_plan_30_from_details')
+async def on_back_from_details(query, user, arg):
+    await show_screen(query, user, 'plan_30_back')
+
+@callback_router.exact('admin')
+async def on_admin(query, user, arg):
+    await handle_admin_panel(query, user, bot)
+
+@callback_router.exact('admin__stats')
+async def on_admin_stats(query, user, arg):
+    await handle_admin_stats(query)
+
+@callback_router.exact('admin__test_mode')
+async def on_admin_test_mode(query, user, arg):
+    await handle_admin_stripe_test_mode(query, bot)
+
+@callback_router.exact('admin__toggle_stripe_mode', 'admin__refresh_stripe_status')
+async def on_stripe_mode_action(query, user, arg):
+    await handle_stripe_mode_actions(query, bot)
+
+@callback_router.exact('admin__live_prices')
+async def on_admin_live_prices(query, user, arg):
+    await handle_admin_live_prices(query, bot)
+
+@callback_router.exact('admin__toggle_live_prices', 'admin__refresh_live_prices')
+async def on_live_prices_action(query, user, arg):
+    await handle_live_prices_actions(query, bot)
+
+@callback_router.exact('admin__profile')
+async def on_admin_profile(query, user, arg):
+    await handle_admin_profile(query, user, bot)
+
+@callback_router.prefix('premium_users_page_')
+async def on_premium_users_page(query, user, arg):
+    try:
+        page = int(arg)
+        premium_users = await get_premium_users()
+        users_per_page = 10
+        total_pages = (len(premium_users) + users_per_page - 1) // users_per_page
+
+        if 0 <= page < total_pages:
+            await show_premium_users_page(query, premium_users, page, users_per_page, total_pages)
+        else:
+            await query.answer("Неверный номер страницы.", show_alert=True)
+    except Exception as e:
+        logger.error(f"Error handling premium users pagination: {str(e)}", exc_info=True)
+        await query.answer("Произошла ошибка при загрузке страницы.", show_alert=True)
+
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle button callbacks with enhanced tracking"""
     query = update.callback_query
@@ -918,12 +880,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     
-    # Initialize or get session ID
-    if 'session_id' not in flask_session:
-        flask_session['session_id'] = str(uuid.uuid4())
-        flask_session.permanent = True
-    
-    session_id = flask_session['session_id']
+    # Analytics session: new one after an inactivity gap
+    session_id = await get_session_id(user.id)
     
     # Log the button click
     log_user_action(
@@ -941,476 +899,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     
     try:
-        if query.data == "plan_500":
-            from config import is_test_mode, is_using_one_dollar_prices
-            
-            # Удаляем видео start.mp4, если оно существует
-            await delete_start_video_if_exists(user.id, query.message.chat_id)
-            
-            await query.message.delete()
-
-            # Dynamic pricing text based on current mode
-            if is_test_mode():
-                plan_price_text = "🧪 ТЕСТОВЫЙ РЕЖИМ - $490 — с личным сопровождением Стаса"
-            elif is_using_one_dollar_prices():
-                plan_price_text = "🔥 ТЕСТ $1 - $1 для тестирования — сопровождение Стаса"
-            else:
-                plan_price_text = "$490 — с личным сопровождением Стаса"
-
-            keyboard = [
-                [
-                    InlineKeyboardButton(
-                        "🇪🇺🇺🇦🇧🇾 Оплата | Европа, Украина, Белорусь",
-                        url=get_checkout_session_url(user, '500')
-                    ),
-                    InlineKeyboardButton(
-                        "🇷🇺 Оплата | Россия",
-                        callback_data='PAYMENT_RUSSIA_500'
-                    )],
-                [
-                    InlineKeyboardButton("Связаться с менеджером", url=SUPPORT_LINK)],
-                [
-                    InlineKeyboardButton("Назад", callback_data="back_to_start_from_plan_500")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            await bot.send_message(
-                chat_id=query.message.chat_id,
-                text=(
-                    "<b>«Плечом к плечу»</b>\n\n"
-                    f"{plan_price_text}\n\n"
-                    "Индивидуальный план питания от Стаса Голдман — под твою цель, предпочтения и здоровье.\n"
-                    "Топовый вариант для максимального эффекта.\n\n"
-                    "В эту сумму входит:\n"
-                    "• Первая консультация\n"
-                    "• Индивидуальный рацион с учётом ваших вкусов и пожеланий\n"
-                    "• 4 созвона (один раз в неделю) со Стасом\n"
-                    "• Внесение правок в меню\n"
-                    "• Личная поддержка и мотивация на всём пути."
-                ),
-                reply_markup=reply_markup,
-                parse_mode="HTML"
-            )
-        elif query.data in ['admin__toggle_stripe_mode', 'admin__refresh_stripe_status']:
-            await handle_stripe_mode_actions(query, bot)
-            
-        elif query.data in ['admin__toggle_live_prices', 'admin__refresh_live_prices']:
-            await handle_live_prices_actions(query, bot)
-    
-        elif query.data == "plan_30":
-            from config import is_test_mode, is_using_one_dollar_prices
-            
-            # Удаляем видео start.mp4, если оно существует
-            await delete_start_video_if_exists(user.id, query.message.chat_id)
-            
-            await query.message.delete()
-
-            # Dynamic pricing text based on current mode
-            if is_test_mode():
-                price_text = "<b>🧪 ТЕСТОВЫЙ РЕЖИМ - Обычная цена: $149. Сейчас — $29 для первых 100 клиентов.</b>\n\n"
-            elif is_using_one_dollar_prices():
-                price_text = "<b>🔥 ТЕСТ $1 - Обычная цена: $149. Сейчас — $1 для тестирования функций.</b>\n\n"
-            else:
-                price_text = "<b>Обычная цена: $149. Сейчас — $29 для первых 100 клиентов.</b>\n\n"
-
-            keyboard = [
-                [
-                    InlineKeyboardButton("Подробнее", callback_data='more_about_plan_30'),
-                    InlineKeyboardButton(
-                        "🇪🇺🇺🇦🇧🇾 Оплата | Европа, Украина, Белорусь",
-                        url=get_checkout_session_url(user, '30')
-                    ),
-                    InlineKeyboardButton(
-                        "🇷🇺 Оплата | Россия",
-                        callback_data='PAYMENT_RUSSIA_30'
-                    )], 
-                [
-                    InlineKeyboardButton("Связаться с менеджером", url=SUPPORT_LINK)
-                    ],
-                [InlineKeyboardButton("Назад", callback_data="back_to_start_from_plan_30")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            await bot.send_message(
-                chat_id=query.message.chat_id,
-                text=(
-                    price_text +
-                    "План питания на 30 дней под все ваши потребности + курс из 5 модулей по похудению.\n"
-                    "Без воды, без мотивации — только конкретика. Всё просто, понятно и самостоятельно."
-                ),
-                reply_markup=reply_markup,
-                parse_mode="HTML"
-            )
-                   
-        elif query.data == "PAYMENT_RUSSIA_30":
-            # Удаляем видео start.mp4, если оно существует
-            await delete_start_video_if_exists(user.id, query.message.chat_id)
-            
-            # Устанавливаем состояние пользователя
-            user_states[user.id] = STATE_RUSSIA_PAYMENT_30
-            
-            # Show payment method selection
-            keyboard = [
-                [
-                    InlineKeyboardButton("Связаться с менеджером", url=SUPPORT_LINK)
-                    ],
-                [
-                    InlineKeyboardButton("Назад", callback_data="back_to_plan_30_from_russia_payment")
-                    ]
-            ]
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                text="29$ в рублях получается 2400руб.\n\nПосле оплаты , я вам вышлю анкету, её нужно будет как можно более подробно заполнить.\nИсходя из ваших ответов, будет составлен рацион.\n\n🇷🇺Реквизиты:\n\nНомер карты Тинькофф: 5536913810318853\n\nЛюбовь М\n\n<b>После оплаты, пожалуйста, отправьте скриншот успешной оплаты нашему менеджеру.</b>",
-                reply_markup=reply_markup,
-                parse_mode="HTML"
-            )
-        
-        elif query.data == "PAYMENT_RUSSIA_500":
-            # Удаляем видео start.mp4, если оно существует
-            await delete_start_video_if_exists(user.id, query.message.chat_id)
-            
-            # Устанавливаем состояние пользователя
-            user_states[user.id] = STATE_RUSSIA_PAYMENT_500
-            
-            # Show payment method selection
-            keyboard = [
-                [
-                    InlineKeyboardButton("Связаться с менеджером", url=SUPPORT_LINK)
-                    ],
-                [
-                    InlineKeyboardButton("Назад", callback_data="back_to_plan_500_from_russia_payment")
-                    ]
-            ]
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                text="490$ в рублях получается 38500руб.\n\nПосле оплаты с вами лично свяжется Стас и вы назначите первую встречу.\n\n🇷🇺Реквизиты:\n\nНомер карты Тинькофф: 5536913810318853\n\nЛюбовь М\n\n<b>После оплаты, пожалуйста, отправьте отправьте скриншот успешной оплаты нашему менеджеру.</b>",
-                reply_markup=reply_markup,
-                parse_mode="HTML"
-            )
-
-        elif query.data == 'more_about_plan_30':
-            # Удаляем видео start.mp4, если оно существует
-            await delete_start_video_if_exists(user.id, query.message.chat_id)
-            
-            keyboard = [
-                [
-                    InlineKeyboardButton("🇪🇺🇺🇦🇧🇾 Оплата | Европа, Украина, Белорусь", url=get_checkout_session_url(user, '30')),InlineKeyboardButton("🇷🇺 Оплата | Россия", callback_data='PAYMENT_RUSSIA_30'), ],
-                [
-                    InlineKeyboardButton("Связаться с менеджером", url=SUPPORT_LINK),
-                    ],
-                [
-                    InlineKeyboardButton("Назад", callback_data="back_to_plan_30_from_details"),
-                    ],
-            ]
-
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            message = (
-                "42 плана создано. 97% людей сказали: 'Это лучше, чем диета\n\n— Составляется по 30 вопросам (анкета)\n— Учитывает всё: вес, рост, цели, болезни (щитовидка, диабет, гастрит, давление и др.), аллергию, режим, вкусы, бюджет, стресс и даже город и ваши  магазины+цены.\n— Меню адаптировано под ваш день: готовка на 15–30 минут, без сложных продуктов\n— Можно оставить кофе, хлеб, сладкое — не убираем то, что вы любите\n— Список покупок + КБЖУ + недельный бюджет — всё готово  🙌\n\n📘 2. Курс из 5 модулей\n— Только суть: физиология, дефицит, частые ошибки, тарелка, самоконтроль\n— Без мотивации и болтовни. Всё, что должна знать женщина, чтобы понять, как худеет её тело\n— Можно пройти за пару вечеров, применять — сразу\n\n💸 И всё это — за $29\n(у других такие продукты стоят десятки тысяч, как консультации и курсы)\nА у нас — как поход в МакДак 🍔 но результат пожизненный!"
-            )
-            
-            await query.edit_message_text(
-                text=message,
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-        
-        elif query.data == "back_to_start_from_plan_30":
-
-            await query.message.delete()
-
-            keyboard = [
-                [InlineKeyboardButton("План питания за 29$", callback_data="plan_30")],
-                [InlineKeyboardButton("Личное ведение за 490$", callback_data="plan_500")],
-                [InlineKeyboardButton("Связаться с менеджером", url=SUPPORT_LINK)],
-            ]
-
-            
-            user_id = update.effective_user.id
-            admin_ids = get_admin_ids()
-            
-            for admin_id in admin_ids:
-                try:
-                    if str(user_id) == str(admin_id):
-                        keyboard.append([InlineKeyboardButton("⚙️ Админ панель", callback_data="admin")])
-                    else:
-                        pass
-                except Exception as e:
-                            # Handle common Telegram errors gracefully
-                    if "Chat not found" in str(e) or "Forbidden" in str(e):
-                        logger.warning(f"Admin {admin_id} is unreachable (blocked bot or deleted chat): {e}")
-                    else:
-                        logger.error(f"Failed to send admin notification to {admin_id}: {e}", exc_info=True)
-
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            # Удаляем старое видео, если оно существует
-            await delete_start_video_if_exists(user_id, query.message.chat_id)
-
-            # Отправляем видео БЕЗ caption
-            with open("files_30/start.mp4", "rb") as video:
-                video_message = await bot.send_video(
-                    chat_id=query.message.chat_id,
-                    video=video,
-                    supports_streaming=True
-                )
-                # Сохраняем ID сообщения с видео
-                user_video_message_ids[user_id] = video_message.message_id
-            
-            # Задержка 300мс
-            await asyncio.sleep(0.3)
-            
-            # Отправляем текст отдельно
-            await bot.send_message(
-                chat_id=query.message.chat_id,
-                text=(
-                    "👋 Салют, мои вкусные!\n"
-                    "Я — бот Стаса Голдман, я отведу тебя в мир стройности и эстетики🙌🏽\n\n"
-                    "Хочешь похудеть без жёстких диет, но с удовольствием и результатом?\n"
-                    "У нас есть план питания, который подойдёт именно тебе!\n\n"
-                    "👇 Выбери, что тебе ближе"
-                ),
-                reply_markup=reply_markup
-            )
-                
-                
-
-        elif query.data == "back_to_start_from_plan_500":
-
-            await query.message.delete()
-
-            keyboard = [
-                [InlineKeyboardButton("План питания за 29$", callback_data="plan_30")],
-                [InlineKeyboardButton("Личное ведение за 490$", callback_data="plan_500")],
-                [InlineKeyboardButton("Связаться с менеджером", url=SUPPORT_LINK)],
-            ]
-
-            user_id = update.effective_user.id
-            admin_ids = get_admin_ids()
-            
-            for admin_id in admin_ids:
-                try:
-                    if str(user_id) == str(admin_id):
-                        keyboard.append([InlineKeyboardButton("⚙️ Админ панель", callback_data="admin")])
-                    else:
-                        pass
-                except Exception as e:
-                            # Handle common Telegram errors gracefully
-                    if "Chat not found" in str(e) or "Forbidden" in str(e):
-                        logger.warning(f"Admin {admin_id} is unreachable (blocked bot or deleted chat): {e}")
-                    else:
-                        logger.error(f"Failed to send admin notification to {admin_id}: {e}", exc_info=True)
-
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            # Удаляем старое видео, если оно существует
-            await delete_start_video_if_exists(user_id, query.message.chat_id)
-
-            # Отправляем видео БЕЗ caption
-            with open("files_30/start.mp4", "rb") as video:
-                video_message = await bot.send_video(
-                    chat_id=query.message.chat_id,
-                    video=video,
-                    supports_streaming=True
-                )
-                # Сохраняем ID сообщения с видео
-                user_video_message_ids[user_id] = video_message.message_id
-            
-            # Задержка 300мс
-            await asyncio.sleep(0.3)
-            
-            # Отправляем текст отдельно
-            await bot.send_message(
-                chat_id=query.message.chat_id,
-                text=(
-                    "👋 Салют, мои вкусные!\n"
-                    "Я — бот Стаса Голдман, я отведу тебя в мир стройности и эстетики🙌🏽\n\n"
-                    "Хочешь похудеть без жёстких диет, но с удовольствием и результатом?\n"
-                    "У нас есть план питания, который подойдёт именно тебе!\n\n"
-                    "👇 Выбери, что тебе ближе"
-                ),
-                reply_markup=reply_markup
-            )
-                
-                
-
-        elif query.data == "back_to_plan_30_from_russia_payment":
-            # Сбрасываем состояние пользователя
-            user_states.pop(user.id, None)
-            
-            keyboard = [
-                [
-                    InlineKeyboardButton("Подробнее", callback_data='more_about_plan_30'),
-                    InlineKeyboardButton("🇪🇺🇺🇦🇧🇾 Оплата | Европа, Украина, Белорусь", url=get_checkout_session_url(user, '30')),
-                    InlineKeyboardButton("🇷🇺 Оплата | Россия", callback_data='PAYMENT_RUSSIA_30')
-                ],
-                [InlineKeyboardButton("Связаться с менеджером", url=SUPPORT_LINK)],
-                [InlineKeyboardButton("Назад", callback_data="back_to_start_from_plan_30")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            await query.message.delete()
-            await bot.send_message(
-                chat_id=query.message.chat_id,
-                text=(
-                    "<b>Обычная цена: $149. Сейчас — $30 для первых 100 клиентов.</b>\n\n"
-                    "План питания на 30 дней под все ваши потребности + курс из 5 модулей по похудению.\n"
-                    "Без воды, без мотивации — только конкретика. Всё просто, понятно и самостоятельно."
-                ),
-                reply_markup=reply_markup,
-                parse_mode="HTML"
-            )
-
-        elif query.data == "back_to_plan_30_from_details":
-
-            keyboard = [
-                [
-                    InlineKeyboardButton("Подробнее", callback_data='more_about_plan_30'),
-                    InlineKeyboardButton("🇪🇺🇺🇦🇧🇾 Оплата | Европа, Украина, Белорусь", url=get_checkout_session_url(user, '30')),
-                    InlineKeyboardButton("🇷🇺 Оплата | Россия", callback_data='PAYMENT_RUSSIA_30')
-                ],
-                [InlineKeyboardButton("Связаться с менеджером", url=SUPPORT_LINK)],
-                [InlineKeyboardButton("Назад", callback_data="back_to_start_from_plan_30")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            await query.message.delete()
-            await bot.send_message(
-                chat_id=query.message.chat_id,
-                text=(
-                    "<b>Обычная цена: $149. Сейчас — $30 для первых 100 клиентов.</b>\n\n"
-                    "План питания на 30 дней под все ваши потребности + курс из 5 модулей по похудению.\n"
-                    "Без воды, без мотивации — только конкретика. Всё просто, понятно и самостоятельно."
-                ),
-                reply_markup=reply_markup,
-                parse_mode="HTML"
-            )
-
-        elif query.data == "back_to_plan_500_from_russia_payment":
-            # Сбрасываем состояние пользователя
-            user_states.pop(user.id, None)
-            
-            keyboard = [
-                [
-                    InlineKeyboardButton("🇪🇺🇺🇦🇧🇾 Оплата | Европа, Украина, Белорусь", url=get_checkout_session_url(user, '500')),
-                    InlineKeyboardButton("🇷🇺 Оплата | Россия", callback_data='PAYMENT_RUSSIA_500')
-                ],
-                [InlineKeyboardButton("Связаться с менеджером", url=SUPPORT_LINK)],
-                [InlineKeyboardButton("Назад", callback_data="back_to_start_from_plan_500")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            await query.message.delete()
-            await bot.send_message(
-                chat_id=query.message.chat_id,
-                text=(
-                    "<b>«Плечом к плечу»</b>\n\n"
-                    "$490 — с личным сопровождением Стаса\n\n"
-                    "Индивидуальный план питания от Стаса Голдман — под твою цель, предпочтения и здоровье.\n"
-                    "Топовый вариант для максимального эффекта.\n\n"
-                    "В эту сумму входит:\n"
-                    "• Первая консультация\n"
-                    "• Индивидуальный рацион с учётом ваших вкусов и пожеланий\n"
-                    "• 4 созвона (один раз в неделю) со Стасом\n"
-                    "• Внесение правок в меню\n"
-                    "• Личная поддержка и мотивация на всём пути."
-                ),
-                reply_markup=reply_markup,
-                parse_mode="HTML"
-            )
-            
-        elif query.data == 'to_start_from_admin_panel':
-            if 'session_id' not in flask_session:
-                flask_session['session_id'] = generate_session_id()
-                flask_session.permanent = True
-
-            keyboard = [
-                [InlineKeyboardButton("План питания за 29$", callback_data="plan_30")],
-                [InlineKeyboardButton("Личное ведение за 490$", callback_data="plan_500")],
-                [InlineKeyboardButton("Связаться с менеджером", url=SUPPORT_LINK)],
-            ]
-
-            user_id = update.effective_user.id
-            admin_ids = get_admin_ids()
-            
-            for admin_id in admin_ids:
-                try:
-                    if str(user_id) == str(admin_id):
-                        keyboard.append([InlineKeyboardButton("⚙️ Админ панель", callback_data="admin")])
-                    else:
-                        pass
-                except Exception as e:
-                            # Handle common Telegram errors gracefully
-                    if "Chat not found" in str(e) or "Forbidden" in str(e):
-                        logger.warning(f"Admin {admin_id} is unreachable (blocked bot or deleted chat): {e}")
-                    else:
-                        logger.error(f"Failed to send admin notification to {admin_id}: {e}", exc_info=True)
-
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            await query.message.delete()
-
-            try:
-                # Удаляем старое видео, если оно существует
-                await delete_start_video_if_exists(user_id, query.message.chat_id)
-                
-                # Отправляем видео БЕЗ caption
-                with open("files_30/start.mp4", "rb") as video:
-                    video_message = await bot.send_video(
-                        chat_id=query.message.chat_id,
-                        video=video,
-                        supports_streaming=True
-                    )
-                    # Сохраняем ID сообщения с видео
-                    user_video_message_ids[user_id] = video_message.message_id
-                
-                # Задержка 300мс
-                await asyncio.sleep(0.3)
-                
-                # Отправляем текст отдельно
-                await bot.send_message(
-                    chat_id=query.message.chat_id,
-                    text=(
-                        "👋 Салют, мои вкусные!\n"
-                        "Я — бот Стаса Голдман, я отведу тебя в мир стройности и эстетики🙌🏽\n\n"
-                        "Хочешь похудеть без жёстких диет, но с удовольствием и результатом?\n"
-                        "У нас есть план питания, который подойдёт именно тебе!\n\n👇 Выбери, что тебе ближе"
-                    ),
-                    reply_markup=reply_markup
-                )
-            except Exception as e:
-                logger.error(f"Error sending start message: {e}", exc_info=True)
-                
-        elif query.data == 'admin':
-            await handle_admin_panel(query, user, bot)
-            
-        elif query.data.startswith('premium_users_page_'):
-            try:
-                page = int(query.data.split('_')[-1])
-                premium_users = await get_premium_users()
-                users_per_page = 10
-                total_pages = (len(premium_users) + users_per_page - 1) // users_per_page
-                
-                if 0 <= page < total_pages:
-                    await show_premium_users_page(query, premium_users, page, users_per_page, total_pages)
-                else:
-                    await query.answer("Неверный номер страницы.", show_alert=True)
-            except Exception as e:
-                logger.error(f"Error handling premium users pagination: {str(e)}", exc_info=True)
-                await query.answer("Произошла ошибка при загрузке страницы.", show_alert=True)
-
-        elif query.data == 'admin__stats':
-            await handle_admin_stats(query)
-            
-        elif query.data == 'admin__test_mode':
-            await handle_admin_stripe_test_mode(query, bot)
-
-        elif query.data == 'admin__live_prices':
-            await handle_admin_live_prices(query, bot)
+        await callback_router.dispatch(query.data, query, user)
     except Exception as e:
         logger.error(f"Error handling button callback '{query.data}' for user {user.id}: {e}", exc_info=True)
 
@@ -1421,11 +910,12 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     
     # Проверяем, находится ли пользователь в состоянии оплаты России
-    if user_id in user_states:
-        current_state = user_states[user_id]
+    current_state = await state_store.get(USER_STATE, user_id)
+    if current_state:
         
+        support_link = get_config().support_link
         # Создаем кнопку "Связаться с менеджером" 
-        keyboard = [[InlineKeyboardButton("Связаться с менеджером", url=SUPPORT_LINK)]]
+        keyboard = [[InlineKeyboardButton("Связаться с менеджером", url=support_link)]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         if current_state in [STATE_RUSSIA_PAYMENT_30, STATE_RUSSIA_PAYMENT_500]:
@@ -1437,7 +927,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
             # Создаем клавиатуру с кнопками "Менеджер" и "Назад"
             keyboard = [
-                [InlineKeyboardButton("Связаться с менеджером", url=SUPPORT_LINK)],
+                [InlineKeyboardButton("Связаться с менеджером", url=support_link)],
                 [InlineKeyboardButton("Назад", callback_data=back_callback)]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1447,7 +937,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 # Текстовое сообщение
                 await update.message.reply_text(
                     "Спасибо за ваше сообщение! Пожалуйста, отправьте скриншот успешной оплаты нашему менеджеру для подтверждения.",
-                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Связаться с менеджером", url=SUPPORT_LINK)], [InlineKeyboardButton("Назад", callback_data=back_callback)]]),
+                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Связаться с менеджером", url=support_link)], [InlineKeyboardButton("Назад", callback_data=back_callback)]]),
                     parse_mode="HTML"
                 )
                 
@@ -1455,17 +945,13 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 # Медиа-сообщение (фото, видео, документ)
                 await update.message.reply_text(
                     "Спасибо за ваш файл! Но нужно отправить его именно нашему менеджеру, иначе вы не сможете получить ваши файлы. Пожалуйста, свяжитесь с менеджером нажав на кнопку под этим сообщением и отправьте скриншот вашего чека ему.",
-                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Связаться с менеджером", url=SUPPORT_LINK)], [InlineKeyboardButton("Назад", callback_data=back_callback)]]),
+                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Связаться с менеджером", url=support_link)], [InlineKeyboardButton("Назад", callback_data=back_callback)]]),
                     parse_mode="HTML"
                 )
                 
             
             # Логируем действие пользователя
-            if 'session_id' not in flask_session:
-                flask_session['session_id'] = str(uuid.uuid4())
-                flask_session.permanent = True
-            
-            session_id = flask_session['session_id']
+            session_id = await get_session_id(user.id)
             action_type = "text_message" if update.message.text and not (update.message.photo or update.message.video or update.message.document) else "media_message"
             
             log_user_action(
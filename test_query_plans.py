@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Проверка планов запросов: горячие запросы и RPC функции должны использовать индексы.
+
+Создаёт одноразовую базу на локальном Postgres (TEST_POSTGRES_URL), накатывает
+минимальную схему таблиц, миграции и rpc_functions.sql, заполняет таблицы
+миллионом строк и через EXPLAIN проверяет, что по большим таблицам нет Seq Scan.
+
+    TEST_POSTGRES_URL=postgresql://postgres@localhost/postgres python test_query_plans.py
+"""
+
+import os
+import re
+import sys
+import json
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+import asyncpg
+
+from migrate import apply_migrations
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TEST_POSTGRES_URL = os.getenv('TEST_POSTGRES_URL', 'postgresql://postgres@localhost/postgres')
+SEED_ROWS = int(os.getenv('QUERY_PLAN_ROWS', '1000000'))
+
+SEEDED_TABLES = {'users', 'user_actions', 'payments'}
+ROLLUP_TABLES = {'user_actions_hourly', 'user_action_users_daily', 'payments_daily'}
+INDEX_NODE_TYPES = {'Index Scan', 'Index Only Scan', 'Bitmap Index Scan'}
+# Узлы, которые читают таблицу через индекс (Bitmap Index Scan знает только индекс)
+INDEXED_RELATION_NODE_TYPES = {'Index Scan', 'Index Only Scan', 'Bitmap Heap Scan'}
+
+# Минимальная схема: только колонки, которые использует бот (таблицы живут в Supabase)
+BASE_SCHEMA = """
+CREATE TABLE public.users (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    email TEXT,
+    plan TEXT,
+    payment_status TEXT,
+    is_admin BOOLEAN DEFAULT FALSE,
+    did_user_get_notification_after_24h_without_payment BOOLEAN DEFAULT FALSE,
+    first_seen TIMESTAMPTZ,
+    last_activity TIMESTAMPTZ,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TABLE public.user_actions (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT,
+    username TEXT,
+    action TEXT,
+    action_type TEXT,
+    session_id TEXT,
+    metadata JSONB,
+    "timestamp" TIMESTAMPTZ
+);
+
+CREATE TABLE public.payments (
+    id BIGSERIAL PRIMARY KEY,
+    telegram_user_id TEXT,
+    user_id TEXT,
+    username TEXT,
+    email TEXT,
+    amount NUMERIC,
+    currency TEXT,
+    status TEXT,
+    payment_method TEXT,
+    payment_type TEXT,
+    plan_id TEXT,
+    payment_id TEXT,
+    metadata JSONB,
+    is_test_mode BOOLEAN DEFAULT FALSE,
+    notified_after_30d BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMPTZ
+);
+"""
+
+# Данные размазаны по ~3 годам, как у живого бота с историей
+SEED_SQL = """
+INSERT INTO public.users (user_id, username, payment_status, plan,
+                          did_user_get_notification_after_24h_without_payment,
+                          first_seen, last_activity, created_at)
+SELECT
+    100000000 + g,
+    'user_' || g,
+    CASE WHEN g % 20 = 0 THEN 'paid' ELSE 'unpaid' END,
+    CASE WHEN g % 20 = 0 THEN '30' END,
+    g % 50 <> 0,
+    NOW() - (g % 1095) * INTERVAL '1 day',
+    NOW() - (g % 1095) * INTERVAL '1 day' + (g % 24) * INTERVAL '1 hour',
+    NOW() - (g % 1095) * INTERVAL '1 day'
+FROM generate_series(1, $1) AS g;
+
+INSERT INTO public.user_actions (user_id, action, action_type, session_id, metadata, "timestamp")
+SELECT
+    100000000 + (g::BIGINT * 7919) % $1,
+    (ARRAY['start_bot', 'view_plans', 'button_click_plan_30', 'button_click_plan_500',
+           'button_click_back_to_start_from_plan_30', 'start_checkout',
+           'complete_payment', 'activate_plan'])[1 + g % 8],
+    (ARRAY['button_click', 'message', 'payment'])[1 + g % 3],
+    md5(g::TEXT),
+    '{}'::JSONB,
+    NOW() - (g % 1576800) * INTERVAL '1 minute'
+FROM generate_series(1, $1) AS g;
+
+INSERT INTO public.payments (telegram_user_id, user_id, email, amount, currency, status,
+                             payment_method, payment_type, plan_id, payment_id, metadata, created_at)
+SELECT
+    (100000000 + g)::TEXT,
+    (100000000 + g)::TEXT,
+    'user' || g || '@example.com',
+    CASE WHEN g % 10 = 0 THEN 490 ELSE 29 END,
+    CASE WHEN g % 7 = 0 THEN 'EUR' ELSE 'USD' END,
+    (ARRAY['completed', 'paid', 'failed', 'refunded'])[1 + g % 4],
+    'card',
+    'stripe',
+    CASE WHEN g % 10 = 0 THEN '500' ELSE '30' END,
+    'cs_test_' || g,
+    jsonb_build_object('plan', CASE WHEN g % 10 = 0 THEN 'premium' ELSE 'basic' END),
+    NOW() - (g % 1576800) * INTERVAL '1 minute'
+FROM generate_series(1, $1) AS g;
+
+ANALYZE public.users;
+ANALYZE public.user_actions;
+ANALYZE public.payments;
+
+SELECT public.refresh_rollups();
+
+ANALYZE public.user_actions_hourly;
+ANALYZE public.user_action_users_daily;
+ANALYZE public.payments_daily;
+"""
+
+# (описание, запрос, параметры, таблица, на которой ожидаем индекс)
+HOT_QUERIES = [
+    (
+        "users?user_id=eq.X",
+        "SELECT * FROM public.users WHERE user_id = $1",
+        [100000042],
+        'users',
+    ),
+    (
+        "неоплатившие, активные за сутки",
+        "SELECT user_id FROM public.users WHERE payment_status = 'unpaid' AND last_activity >= $1",
+        ['cutoff_1d'],
+        'users',
+    ),
+    (
+        "страница неоплативших без уведомления (reminder_bot)",
+        "SELECT user_id FROM public.users"
+        " WHERE payment_status = 'unpaid'"
+        " AND did_user_get_notification_after_24h_without_payment IS NOT TRUE"
+        " AND last_activity < $1 AND user_id > $2"
+        " ORDER BY user_id LIMIT 1000",
+        ['cutoff_1d', 0],
+        'users',
+    ),
+    (
+        "user_actions за 30 дней (get_button_stats)",
+        'SELECT user_id FROM public.user_actions WHERE "timestamp" >= $1',
+        ['cutoff_30d'],
+        'user_actions',
+    ),
+    (
+        "user_actions по action за 30 дней",
+        'SELECT COUNT(*) FROM public.user_actions WHERE action = $1 AND "timestamp" >= $2',
+        ['start_bot', 'cutoff_30d'],
+        'user_actions',
+    ),
+    (
+        "user_actions пользователя (get_user_actions)",
+        'SELECT * FROM public.user_actions WHERE user_id = $1 ORDER BY "timestamp" DESC LIMIT 100',
+        [100000042],
+        'user_actions',
+    ),
+    (
+        "payments по status + created_at",
+        "SELECT amount FROM public.payments WHERE status = 'completed' AND created_at BETWEEN $1 AND $2",
+        ['cutoff_30d', 'now'],
+        'payments',
+    ),
+]
+
+# (RPC функция, аргументы, что должно быть в плане: rollup таблица или индекс);
+# get_user_statistics намеренно считает всех пользователей
+RPC_CALLS = [
+    ('get_payment_summary', ['cutoff_30d', 'now'], 'payments_daily'),
+    ('get_payment_methods_distribution', ['cutoff_30d', 'now'], 'idx_payments_created_at'),
+    ('get_monthly_revenue', [], 'payments_daily'),
+    ('get_action_counts', ['cutoff_1d', 'now'], 'user_actions_hourly'),
+    ('get_action_counts', ['all_time', 'now'], 'user_actions_hourly'),
+    ('get_unique_users', ['cutoff_30d', 'now'], 'user_action_users_daily'),
+    ('get_conversion_funnel', [], 'user_action_users_daily'),
+    ('get_user_engagement', [30], 'idx_user_actions_timestamp'),
+    ('get_payments_for_30d_followup', ['cutoff_30d', None, 500], 'idx_payments_30d_followup_pending'),
+]
+
+_IDENTIFIER_OR_LITERAL = r"'(?:[^']|'')*'|\b{name}\b"
+
+
+def _resolve_params(params):
+    now = datetime.now(timezone.utc)
+    named = {
+        'now': now,
+        'cutoff_1d': now - timedelta(days=1),
+        'cutoff_30d': now - timedelta(days=30),
+        'all_time': datetime(1970, 1, 1, tzinfo=timezone.utc),
+    }
+    return [named.get(p, p) if isinstance(p, str) else p for p in params]
+
+
+def _walk_plan(node, found):
+    found.append((node.get('Node Type'), node.get('Relation Name'), node.get('Index Name')))
+    for child in node.get('Plans', []):
+        _walk_plan(child, found)
+    return found
+
+
+def _check_plan(description, plan_json, expected):
+    """
+    No Seq Scan on the seeded tables, and `expected` is read the intended way
+
+    expected - таблица, которую читают через индекс, имя самого индекса или
+    rollup таблица (она маленькая, Seq Scan по ней допустим).
+    """
+    plan = json.loads(plan_json) if isinstance(plan_json, str) else plan_json
+    nodes = _walk_plan(plan[0]['Plan'], [])
+
+    seq_scans = [rel for node_type, rel, _ in nodes if node_type == 'Seq Scan' and rel in SEEDED_TABLES]
+    used = set()
+    for node_type, rel, index in nodes:
+        if index:
+            used.add(index)
+        if rel in ROLLUP_TABLES or (rel and node_type in INDEXED_RELATION_NODE_TYPES):
+            used.add(rel)
+
+    if expected and expected not in used:
+        logger.error(f"❌ {description}: в плане нет {expected} (есть {sorted(used)}). План: {nodes}")
+        return False
+    if seq_scans:
+        logger.error(f"❌ {description}: Seq Scan по {seq_scans}. План: {nodes}")
+        return False
+
+    logger.info(f"✅ {description}: {[n for n in nodes if n[0] in INDEX_NODE_TYPES or n[1]]}")
+    return True
+
+
+def _substitute_args(body: str, arg_names) -> str:
+    """Replace function argument names with $n placeholders, skipping string literals"""
+    for position, name in enumerate(arg_names or [], start=1):
+        pattern = re.compile(_IDENTIFIER_OR_LITERAL.format(name=re.escape(name)))
+        body = pattern.sub(lambda m: m.group(0) if m.group(0).startswith("'") else f"${position}", body)
+    return body.strip().rstrip(';')
+
+
+async def explain_rpc(conn, function_name, args):
+    """EXPLAIN the body of a SQL RPC function with concrete arguments"""
+    row = await conn.fetchrow("""
+        SELECT p.prosrc, p.proargnames, p.proargmodes::TEXT[] AS proargmodes,
+               ARRAY(SELECT format_type(t, NULL) FROM unnest(p.proargtypes) AS t) AS arg_types
+        FROM pg_proc p
+        JOIN pg_namespace n ON n.oid = p.pronamespace
+        WHERE n.nspname = 'public' AND p.proname = $1
+    """, function_name)
+
+    # RETURNS TABLE колонки тоже лежат в proargnames, подставляем только входные аргументы
+    arg_names = row['proargnames'] or []
+    arg_modes = row['proargmodes'] or ['i'] * len(arg_names)
+    input_names = [name for name, mode in zip(arg_names, arg_modes) if mode in ('i', 'b', 'v')]
+
+    body = _substitute_args(row['prosrc'], input_names)
+    arg_types = list(row['arg_types'])
+    statement_name = f"plan_{function_name}"
+
+    types_sql = f"({', '.join(arg_types)})" if arg_types else ''
+    await conn.execute(f"PREPARE {statement_name}{types_sql} AS {body}")
+    try:
+        literals = []
+        for value, type_name in zip(args, arg_types):
+            if value is None:
+                literals.append(f"NULL::{type_name}")
+                continue
+            literals.append(f"{await conn.fetchval('SELECT quote_literal($1::TEXT)', str(value))}::{type_name}")
+        execute_args = f"({', '.join(literals)})" if literals else ''
+        return await conn.fetchval(f"EXPLAIN (FORMAT JSON) EXECUTE {statement_name}{execute_args}")
+    finally:
+        await conn.execute(f"DEALLOCATE {statement_name}")
+
+
+async def run_checks(database: str) -> bool:
+    conn = await asyncpg.connect(TEST_POSTGRES_URL, database=database)
+    try:
+        await conn.execute(BASE_SCHEMA)
+        applied = await apply_migrations(conn)
+        logger.info(f"📦 Миграции применены: {applied}")
+
+        logger.info(f"🌱 Заполняем таблицы: {SEED_ROWS} строк в каждой")
+        for statement in SEED_SQL.split(';'):
+            if not statement.strip():
+                continue
+            if '$1' in statement:
+                await conn.execute(statement, SEED_ROWS)
+            else:
+                await conn.execute(statement)
+
+        ok = True
+        for description, query, params, expected_table in HOT_QUERIES:
+            plan = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *_resolve_params(params))
+            ok = _check_plan(description, plan, expected_table) and ok
+
+        for function_name, args, expected in RPC_CALLS:
+            plan = await explain_rpc(conn, function_name, _resolve_params(args))
+            ok = _check_plan(f"rpc {function_name}({', '.join(map(str, args))})", plan, expected) and ok
+
+        return ok
+    finally:
+        await conn.close()
+
+
+async def main() -> bool:
+    database = f"query_plan_test_{os.getpid()}"
+    admin_conn = await asyncpg.connect(TEST_POSTGRES_URL)
+    try:
+        await admin_conn.execute(f'CREATE DATABASE "{database}"')
+    finally:
+        await admin_conn.close()
+
+    try:
+        return await run_checks(database)
+    finally:
+        admin_conn = await asyncpg.connect(TEST_POSTGRES_URL)
+        try:
+            await admin_conn.execute(f'DROP DATABASE IF EXISTS "{database}" WITH (FORCE)')
+        finally:
+            await admin_conn.close()
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    print("Все планы используют индексы" if success else "Есть запросы без индексов")
+    sys.exit(0 if success else 1)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Проверка обезличивания traffic_capture.py: в записанном checkout.session.completed
+не должно остаться ни исходного Telegram ID, ни имени пользователя - ни в
+metadata, ни в полях формы (custom_fields), которые stripe_handlers читает первыми.
+
+    python test_traffic_capture.py
+"""
+
+import sys
+import json
+import gzip
+import logging
+import tempfile
+
+from traffic_capture import Anonymizer, TrafficRecorder
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+USER_ID = 123456789
+USERNAME = 'realname'
+EMAIL = 'buyer@gmail.com'
+
+
+def checkout_completed_event():
+    return {
+        'id': 'evt_1',
+        'type': 'checkout.session.completed',
+        'data': {'object': {
+            'id': 'cs_test_1',
+            'amount_total': 2900,
+            'customer_details': {'email': EMAIL, 'name': 'Real Name'},
+            'metadata': {'telegram_user_id': str(USER_ID), 'username': USERNAME},
+            'custom_fields': [
+                {'key': 'yourtelegramid', 'type': 'text', 'text': {'value': str(USER_ID)}},
+                {'key': 'myidbot', 'type': 'numeric', 'numeric': {'value': str(USER_ID)}},
+                {'key': 'username', 'type': 'text', 'text': {'value': f'@{USERNAME}'}},
+            ],
+        }},
+    }
+
+
+def check_scrub() -> bool:
+    anonymizer = Anonymizer(b'test-secret')
+    scrubbed = anonymizer.scrub(checkout_completed_event())
+    session = scrubbed['data']['object']
+    pseudonym = str(anonymizer.user_id(USER_ID))
+    name = anonymizer.text('user', USERNAME)
+
+    ok = True
+    for field in session['custom_fields']:
+        value = (field.get('text') or field.get('numeric'))['value']
+        expected = name if field['key'] == 'username' else pseudonym
+        if value != expected:
+            logger.error(f"❌ custom_fields[{field['key']}] = {value!r}, ожидался псевдоним {expected!r}")
+            ok = False
+    if session['metadata'] != {'telegram_user_id': pseudonym, 'username': name}:
+        logger.error(f"❌ metadata не совпадает с псевдонимами полей формы: {session['metadata']}")
+        ok = False
+    return ok
+
+
+def check_capture_file() -> bool:
+    with tempfile.TemporaryDirectory() as directory:
+        path = f"{directory}/capture.jsonl.gz"
+        recorder = TrafficRecorder(path, b'test-secret', 10 * 1024 * 1024)
+        recorder.record('stripe_webhook', json.dumps(checkout_completed_event()).encode())
+        recorder.stop()
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            captured = f.read()
+
+    ok = True
+    for original in (str(USER_ID), USERNAME, EMAIL):
+        if original in captured:
+            logger.error(f"❌ В записи осталось исходное значение {original!r}")
+            ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    success = check_scrub() & check_capture_file()
+    print("Запись не содержит исходных ID и имён" if success else "Запись содержит персональные данные")
+    sys.exit(0 if success else 1)
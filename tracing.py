@@ -0,0 +1,304 @@
+"""
+Трассировка обработки обновления или платежа: одна цепочка = один trace_id.
+
+Текущий span хранится в contextvar, поэтому trace_id сам доходит до всех
+await внутри задачи (и до задач, созданных из неё), в том числе через
+run_until_complete в потоке Flask. Каждый завершённый span - одна строка
+JSON в TRACE_FILE (с ротацией); запись идёт через очередь, как и логи.
+
+    @traced()
+    async def log_payment(...): ...
+
+    with span('stripe.checkout.Session.retrieve', session_id=session_id):
+        ...
+
+    annotate(user_id=user_id, plan_type=plan_type)   # атрибуты текущего span
+
+Корневые span'ы - telegram_update (вебхук, polling, воркеры) и
+stripe_webhook. Листья - каждый вызов Bot API, Supabase REST, Stripe и
+Redis. Найти цепочку покупателя: GET /admin/traces?user_id=<id>, водопад:
+GET /admin/traces/<trace_id> (нужен ADMIN_API_TOKEN).
+
+Настройки:
+    TRACE_FILE=traces.jsonl       пустое значение выключает запись
+    TRACE_FILE_MAX_MB=10, TRACE_FILE_BACKUPS=3
+"""
+
+import os
+import glob
+import json
+import time
+import queue
+import atexit
+import asyncio
+import logging
+import functools
+import contextvars
+from logging.handlers import QueueListener, RotatingFileHandler
+from typing import Any, Dict, List, Optional
+
+from logging_setup import DeferredQueueHandler, LazyJson
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILE = os.getenv('TRACE_FILE', 'traces.jsonl')
+TRACE_FILE_MAX_MB = int(os.getenv('TRACE_FILE_MAX_MB', '10'))
+TRACE_FILE_BACKUPS = int(os.getenv('TRACE_FILE_BACKUPS', '3'))
+
+WATERFALL_WIDTH = 40
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar('current_span', default=None)
+
+# Отдельный логгер без propagate: span'ы не попадают в stdout
+_writer = logging.getLogger('tracing.spans')
+_writer.propagate = False
+_listener: Optional[QueueListener] = None
+
+
+def _new_id(size: int) -> str:
+    return os.urandom(size).hex()
+
+
+class Span:
+    """
+    One timed step of a trace
+
+    Как контекстный менеджер становится текущим span (родителем для вложенных);
+    без with - лист, который закрывается вызовом end() (хуки aiohttp).
+    """
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'attrs', 'start', '_t0', '_token', '_ended')
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, **attrs):
+        self.trace_id = parent.trace_id if parent is not None else _new_id(8)
+        self.span_id = _new_id(4)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.name = name
+        self.attrs: Dict[str, Any] = attrs
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self._token = None
+        self._ended = False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def end(self, error: Optional[BaseException] = None):
+        if self._ended:
+            return
+        self._ended = True
+        duration_ms = (time.perf_counter() - self._t0) * 1000
+        if _listener is None:
+            # setup_tracing() не вызывали (скрипты, бенчмарки) - span'ы никуда не пишутся
+            return
+        record = {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': round(self.start, 6),
+            'duration_ms': round(duration_ms, 3),
+            'status': 'error' if error is not None else 'ok',
+            'attrs': self.attrs,
+        }
+        if error is not None:
+            record['error'] = f"{type(error).__name__}: {error}"[:300]
+        # json.dumps выполнит поток QueueListener
+        _writer.info('%s', LazyJson(record))
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        self.end(exc)
+        return False
+
+
+def span(name: str, **attrs) -> Span:
+    """Child of the current span, or the root of a new trace"""
+    return Span(name, _current_span.get(), **attrs)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    current = _current_span.get()
+    return current.trace_id if current is not None else None
+
+
+def annotate(**attrs):
+    """Add attributes to the current span (no-op outside a trace)"""
+    current = _current_span.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def traced(name: Optional[str] = None):
+    """Decorator: run the sync or async function inside a span named after it"""
+    def decorator(func):
+        span_name = name or func.__name__
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _process_trace_file(tag: Optional[str]) -> str:
+    # У каждого воркера свой файл: RotatingFileHandler не умеет ротацию из нескольких процессов
+    if not tag:
+        return TRACE_FILE
+    root, ext = os.path.splitext(TRACE_FILE)
+    return f"{root}.{tag}{ext}"
+
+
+def setup_tracing(tag: Optional[str] = None) -> bool:
+    """Start the span writer for this process (idempotent); False if TRACE_FILE is empty"""
+    global _listener
+    if _listener is not None:
+        return True
+    if not TRACE_FILE:
+        return False
+    path = _process_trace_file(tag)
+    handler = RotatingFileHandler(path, maxBytes=TRACE_FILE_MAX_MB * 1024 * 1024,
+                                  backupCount=TRACE_FILE_BACKUPS, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    span_queue = queue.SimpleQueue()
+    _writer.handlers[:] = [DeferredQueueHandler(span_queue)]
+    _writer.setLevel(logging.INFO)
+    _listener = QueueListener(span_queue, handler)
+    _listener.start()
+    atexit.register(stop_tracing)
+    logger.info(f"🧵 Трассировка пишется в {path}")
+    return True
+
+
+def stop_tracing():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _trace_files() -> List[str]:
+    """Trace files of all processes, rotated ones included"""
+    if not TRACE_FILE:
+        return []
+    root, ext = os.path.splitext(TRACE_FILE)
+    return sorted(glob.glob(f"{glob.escape(root)}*{ext}*"))
+
+
+def _iter_spans(needle: Optional[str] = None):
+    for path in _trace_files():
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    # Дешёвый отсев по подстроке до json.loads
+                    if needle is not None and needle not in line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except OSError as e:
+            logger.warning(f"⚠️ Не удалось прочитать {path}: {e}")
+
+
+def load_trace(trace_id: str) -> List[Dict[str, Any]]:
+    """All spans of one trace, ordered by start time"""
+    spans = [s for s in _iter_spans(f'"{trace_id}"') if s.get('trace_id') == trace_id]
+    return sorted(spans, key=lambda s: s['start'])
+
+
+def find_traces(limit: int = 20, **attrs) -> List[Dict[str, Any]]:
+    """
+    Latest traces, newest first; attrs filter by span attributes
+
+    find_traces(user_id='123') - все цепочки, в которых хоть один span
+    помечен этим user_id (обновления пользователя и его платежи).
+    """
+    wanted = {key: str(value) for key, value in attrs.items()}
+    needle = next(iter(wanted.values()), None)
+    matched = set()
+    roots: Dict[str, Dict[str, Any]] = {}
+    for s in _iter_spans(needle):
+        if wanted and all(str(s.get('attrs', {}).get(k)) == v for k, v in wanted.items()):
+            matched.add(s['trace_id'])
+        if s.get('parent_id') is None:
+            roots[s['trace_id']] = s
+    if wanted:
+        # Корень мог не пройти отсев по подстроке - дочитываем корни найденных цепочек
+        missing = matched - roots.keys()
+        for s in _iter_spans('"parent_id": null'):
+            if s['trace_id'] in missing:
+                roots[s['trace_id']] = s
+        roots = {trace_id: root for trace_id, root in roots.items() if trace_id in matched}
+    latest = sorted(roots.values(), key=lambda s: s['start'], reverse=True)[:limit]
+    return [{
+        'trace_id': root['trace_id'],
+        'name': root['name'],
+        'start': root['start'],
+        'duration_ms': root['duration_ms'],
+        'status': root['status'],
+        'attrs': root.get('attrs', {}),
+    } for root in latest]
+
+
+def render_waterfall(spans: List[Dict[str, Any]], width: int = WATERFALL_WIDTH) -> str:
+    """Text waterfall: offset, duration and a bar per span, indented by depth"""
+    if not spans:
+        return "Трасса не найдена\n"
+    by_id = {s['span_id']: s for s in spans}
+
+    def depth(s) -> int:
+        level = 0
+        while s.get('parent_id') in by_id and level < 50:
+            s = by_id[s['parent_id']]
+            level += 1
+        return level
+
+    begin = min(s['start'] for s in spans)
+    end = max(s['start'] + s['duration_ms'] / 1000 for s in spans)
+    total_ms = max((end - begin) * 1000, 0.001)
+    first = spans[0]
+    lines = [
+        f"trace {first['trace_id']}  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(begin))}  "
+        f"{total_ms:.1f} ms, {len(spans)} spans",
+        "",
+    ]
+    # Дочерние span'ы идут сразу под родителем
+    children: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    for s in spans:
+        parent = s.get('parent_id') if s.get('parent_id') in by_id else None
+        children.setdefault(parent, []).append(s)
+    ordered = []
+    stack = list(reversed(children.get(None, [])))
+    while stack:
+        s = stack.pop()
+        ordered.append(s)
+        stack.extend(reversed(children.get(s['span_id'], [])))
+
+    for s in ordered:
+        offset_ms = (s['start'] - begin) * 1000
+        left = min(int(offset_ms / total_ms * width), width - 1)
+        size = max(1, round(s['duration_ms'] / total_ms * width))
+        bar = ' ' * left + '█' * min(size, width - left)
+        attrs = ' '.join(f"{k}={v}" for k, v in s.get('attrs', {}).items())
+        error = f"  ❌ {s['error']}" if s.get('status') == 'error' else ''
+        lines.append(
+            f"{offset_ms:9.1f} {s['duration_ms']:9.1f} ms |{bar:<{width}}| "
+            f"{'  ' * depth(s)}{s['name']} {attrs}{error}".rstrip()
+        )
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,258 @@
+"""
+Запись входящих вебхуков для нагрузочного теста на реальном трафике.
+
+Включается явно: TRAFFIC_CAPTURE=true при старте или POST /admin/capture/start
+(ADMIN_API_TOKEN). Маршруты /webhook и /stripe_webhook только кладут сырое
+тело в очередь; разбор, обезличивание и запись в gzip JSONL делает отдельный
+поток. Одна строка - один запрос:
+
+    {"t": 1760000000.123, "route": "webhook", "body": {...}}
+
+Обезличивание согласованное: один и тот же user_id (или имя, email) везде
+заменяется одним и тем же псевдонимом (HMAC от TRAFFIC_CAPTURE_SECRET), поэтому
+в записи сохраняются цепочки кликов одного пользователя, а from.id и chat.id
+личного чата по-прежнему совпадают. Telegram ID и имя, введённые покупателем
+в поля формы Stripe Checkout (custom_fields), заменяются теми же псевдонимами
+по соседнему key. Тексты, callback_data и file_id остаются
+как есть, email внутри текста заменяется.
+
+Воспроизвести запись: python -m benchmarks.replay capture.jsonl.gz --target http://127.0.0.1:5000
+
+Настройки:
+    TRAFFIC_CAPTURE=false                 писать с момента старта
+    TRAFFIC_CAPTURE_FILE=capture.jsonl.gz
+    TRAFFIC_CAPTURE_SECRET                ключ псевдонимов; без него - случайный на процесс
+    TRAFFIC_CAPTURE_MAX_MB=100            запись останавливается, когда файл дорос до лимита
+"""
+
+import os
+import re
+import gzip
+import hmac
+import json
+import time
+import queue
+import atexit
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+TRAFFIC_CAPTURE = os.getenv('TRAFFIC_CAPTURE', 'false').lower() == 'true'
+TRAFFIC_CAPTURE_FILE = os.getenv('TRAFFIC_CAPTURE_FILE', 'capture.jsonl.gz')
+TRAFFIC_CAPTURE_SECRET = os.getenv('TRAFFIC_CAPTURE_SECRET')
+TRAFFIC_CAPTURE_MAX_MB = float(os.getenv('TRAFFIC_CAPTURE_MAX_MB', '100'))
+
+# Числовые id пользователей и чатов Telegram (у callback_query и Stripe id - строки, они не трогаются)
+ID_KEYS = frozenset({'id', 'user_id', 'chat_id'})
+# Те же id, записанные строкой (metadata сессии Stripe)
+STRING_ID_KEYS = frozenset({'telegram_user_id'})
+USERNAME_KEYS = frozenset({'username', 'telegram_username'})
+# Поля формы Stripe Checkout (custom_fields): значение лежит в text.value / numeric.value,
+# что это за поле - видно только по соседнему key (см. stripe_handlers.handle_successful_payment)
+CUSTOM_FIELD_ID_KEYS = frozenset({'myidbot', 'telegram_user_id', 'yourtelegramid', 'yourtelegramidmyidbot'})
+CUSTOM_FIELD_USERNAME_KEYS = frozenset({'username'})
+NAME_KEYS = frozenset({'first_name', 'last_name', 'title', 'name'})
+EMAIL_KEYS = frozenset({'email', 'customer_email', 'receipt_email'})
+PHONE_KEYS = frozenset({'phone', 'phone_number'})
+ADDRESS_KEYS = frozenset({'line1', 'line2', 'city', 'postal_code', 'state'})
+
+EMAIL_RE = re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+')
+
+_STOP = object()
+
+
+class Anonymizer:
+    """Consistent HMAC pseudonyms for ids, names, emails and phones"""
+
+    def __init__(self, secret: bytes):
+        self.secret = secret
+
+    def _digest(self, kind: str, value: Any) -> bytes:
+        return hmac.new(self.secret, f"{kind}:{value}".encode(), hashlib.sha256).digest()
+
+    def user_id(self, value: int) -> int:
+        # Знак сохраняется: у групп и каналов id отрицательные
+        pseudonym = int.from_bytes(self._digest('id', abs(value))[:6], 'big') % 9_000_000_000 + 1_000_000_000
+        return -pseudonym if value < 0 else pseudonym
+
+    def text(self, kind: str, value: str) -> str:
+        return f"{kind}_{self._digest(kind, value).hex()[:10]}"
+
+    def email(self, value: str) -> str:
+        return f"{self._digest('email', value.lower()).hex()[:12]}@example.com"
+
+    def phone(self, value: str) -> str:
+        return '+1555' + str(int.from_bytes(self._digest('phone', value)[:4], 'big'))[:7].zfill(7)
+
+    def custom_field_value(self, field_key: str, value: Any) -> Any:
+        """Pseudonym for the value a buyer typed into a Stripe Checkout custom field"""
+        if value is None or isinstance(value, bool) or not str(value).strip():
+            return value
+        value = str(value).strip()
+        if field_key in CUSTOM_FIELD_ID_KEYS:
+            return str(self.user_id(int(value))) if value.isdigit() else self.text('id', value)
+        # Имя без @, чтобы псевдоним совпадал с from.username тех же обновлений
+        return self.text('user', value.lstrip('@'))
+
+    def _scrub_custom_field(self, field: Dict[str, Any]) -> Dict[str, Any]:
+        field_key = str(field.get('key', '')).lower()
+        scrubbed = {k: self.scrub(v, k) for k, v in field.items()}
+        if field_key in CUSTOM_FIELD_ID_KEYS or field_key in CUSTOM_FIELD_USERNAME_KEYS:
+            for kind in ('text', 'numeric', 'dropdown'):
+                if isinstance(field.get(kind), dict) and 'value' in field[kind]:
+                    scrubbed[kind] = {**scrubbed[kind],
+                                      'value': self.custom_field_value(field_key, field[kind]['value'])}
+        return scrubbed
+
+    def scrub(self, value: Any, key: Optional[str] = None) -> Any:
+        """Copy of a decoded JSON payload with personal data replaced"""
+        if isinstance(value, dict):
+            return {k: self.scrub(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            if key == 'custom_fields':
+                return [self._scrub_custom_field(item) if isinstance(item, dict) else self.scrub(item)
+                        for item in value]
+            return [self.scrub(item) for item in value]
+        if isinstance(value, bool) or value is None:
+            return value
+        if isinstance(value, int):
+            return self.user_id(value) if key in ID_KEYS else value
+        if not isinstance(value, str):
+            return value
+        if key in STRING_ID_KEYS and value.lstrip('-').isdigit():
+            return str(self.user_id(int(value)))
+        if key in USERNAME_KEYS:
+            return self.text('user', value)
+        if key in NAME_KEYS:
+            return self.text('name', value)
+        if key in EMAIL_KEYS:
+            return self.email(value)
+        if key in PHONE_KEYS:
+            return self.phone(value)
+        if key in ADDRESS_KEYS:
+            return self.text('addr', value)
+        if '@' in value:
+            return EMAIL_RE.sub(lambda match: self.email(match.group(0)), value)
+        return value
+
+
+class TrafficRecorder:
+    """Background writer: the request thread only enqueues raw bytes"""
+
+    def __init__(self, path: str, secret: bytes, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.anonymizer = Anonymizer(secret)
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.recorded = 0
+        self.skipped = 0
+        self.started_at = time.time()
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+        self._thread = threading.Thread(target=self._run, name='traffic-capture', daemon=True)
+        self._thread.start()
+
+    def record(self, route: str, body: bytes):
+        self.queue.put((time.time(), route, body))
+
+    def _write(self, received: float, route: str, body: bytes):
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            self.skipped += 1
+            return
+        line = json.dumps({'t': round(received, 6), 'route': route, 'body': self.anonymizer.scrub(payload)},
+                          ensure_ascii=False)
+        self._file.write(line + '\n')
+        self.recorded += 1
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            try:
+                self._write(*item)
+                if self.queue.empty():
+                    # Сбрасываем сжатый поток, когда очередь опустела: файл читается и во время записи
+                    self._file.flush()
+                    if os.path.getsize(self.path) >= self.max_bytes:
+                        logger.warning(f"⚠️ Запись трафика остановлена: {self.path} достиг "
+                                       f"{TRAFFIC_CAPTURE_MAX_MB:g} МБ")
+                        break
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи трафика: {e}")
+        self._file.close()
+        _detach(self)
+
+    def stop(self):
+        self.queue.put(_STOP)
+        self._thread.join(timeout=10)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'active': True,
+            'file': self.path,
+            'recorded': self.recorded,
+            'skipped': self.skipped,
+            'pending': self.queue.qsize(),
+            'started_at': round(self.started_at, 3),
+        }
+
+
+_recorder: Optional[TrafficRecorder] = None
+_lock = threading.Lock()
+
+
+def _detach(recorder: TrafficRecorder):
+    global _recorder
+    with _lock:
+        if _recorder is recorder:
+            _recorder = None
+
+
+def capture_request(route: str, body: bytes):
+    """Called from the webhook routes; a single attribute check when capture is off"""
+    recorder = _recorder
+    if recorder is not None:
+        recorder.record(route, body)
+
+
+def start_capture() -> Dict[str, Any]:
+    """Start recording to TRAFFIC_CAPTURE_FILE (appends; idempotent)"""
+    global _recorder
+    with _lock:
+        if _recorder is None:
+            # Без TRAFFIC_CAPTURE_SECRET псевдонимы согласованы только в пределах процесса
+            secret = TRAFFIC_CAPTURE_SECRET.encode() if TRAFFIC_CAPTURE_SECRET else os.urandom(32)
+            _recorder = TrafficRecorder(TRAFFIC_CAPTURE_FILE, secret, int(TRAFFIC_CAPTURE_MAX_MB * 1024 * 1024))
+            logger.info(f"🎙 Запись входящих вебхуков в {TRAFFIC_CAPTURE_FILE}")
+        return _recorder.stats()
+
+
+def stop_capture() -> Dict[str, Any]:
+    """Flush and close the capture file"""
+    with _lock:
+        recorder = _recorder
+    if recorder is None:
+        return capture_stats()
+    recorder.stop()
+    stats = recorder.stats()
+    stats['active'] = False
+    logger.info(f"🎙 Запись трафика остановлена: {stats['recorded']} запросов в {stats['file']}")
+    return stats
+
+
+def capture_stats() -> Dict[str, Any]:
+    recorder = _recorder
+    if recorder is None:
+        return {'active': False, 'file': TRAFFIC_CAPTURE_FILE}
+    return recorder.stats()
+
+
+atexit.register(stop_capture)
+
+if TRAFFIC_CAPTURE:
+    start_capture()